@@ -6,6 +6,7 @@
 // author: Michael Cohen <scudette@gmail.com>
 
 
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 
 // Number of bits used to hold type info in a proto tag.
@@ -98,7 +99,7 @@ int varint_decode(unsigned PY_LONG_LONG *result,
     }
 
     shift += 7;
-  } while (shift < 64);
+  }
 
   // Error decoding varint - buffer too short.
   return 0;
@@ -114,7 +115,12 @@ PyObject *py_varint_decode(PyObject *self, PyObject *args) {
   if (!PyArg_ParseTuple(args, "s#n", &buffer, &length, &pos))
     return NULL;
 
-  if (varint_decode(&result, buffer+pos, length, &length)) {
+  if (pos < 0 || pos > length) {
+    PyErr_SetString(PyExc_IndexError, "Position out of range.");
+    return NULL;
+  }
+
+  if (varint_decode(&result, buffer+pos, length - pos, &length)) {
     return Py_BuildValue("Kn", result, pos + length);
   }
 
@@ -123,17 +129,103 @@ PyObject *py_varint_decode(PyObject *self, PyObject *args) {
 }
 
 
+// Interned method and attribute names used when calling back into Python.
+static PyObject *str_get = NULL;
+static PyObject *str_get_raw_data = NULL;
+static PyObject *str_set_raw_data = NULL;
+static PyObject *str_name = NULL;
+static PyObject *str_type_infos_by_encoded_tag = NULL;
+static PyObject *str_set_default_on_access = NULL;
+static PyObject *str_wrapped_list = NULL;
+static PyObject *str_is_dirty = NULL;
+static PyObject *str_convert_to_wire_format = NULL;
+static PyObject *empty_string = NULL;
+
+
+// Splits the next field off the buffer. On success returns a new reference to
+// a tuple (encoded_tag, encoded_length, wire_format) and advances buffer and
+// length past the field. Returns NULL and sets an exception if the buffer does
+// not start with a valid field.
+static PyObject *split_next(const char **buffer, Py_ssize_t *length) {
+  const char *data = NULL;
+  Py_ssize_t remaining = *length;
+  Py_ssize_t tag_length = 0;
+  Py_ssize_t prefix_length = 0;
+  Py_ssize_t data_length = 0;
+  unsigned PY_LONG_LONG tag;
+  unsigned PY_LONG_LONG value;
+  PyObject *result = NULL;
+
+  // Read the tag off the buffer.
+  if (!varint_decode(&tag, *buffer, remaining, &tag_length)) {
+    PyErr_SetString(PyExc_ValueError, "Invalid tag");
+    return NULL;
+  }
+
+  data = *buffer + tag_length;
+  remaining -= tag_length;
+
+  // Handle the tag depending on its type.
+  switch (tag & TAG_TYPE_MASK) {
+    case WIRETYPE_VARINT:
+      if (!varint_decode(&value, data, remaining, &data_length))
+        goto truncated;
+      break;
+
+    case WIRETYPE_FIXED64:
+      data_length = 8;
+      break;
+
+    case WIRETYPE_FIXED32:
+      data_length = 4;
+      break;
+
+    case WIRETYPE_LENGTH_DELIMITED:
+      // The data is preceded by its length encoded as a varint.
+      if (!varint_decode(&value, data, remaining, &prefix_length))
+        goto truncated;
+
+      // Check that we do not exceed the available buffer here.
+      if (value > (unsigned PY_LONG_LONG)(remaining - prefix_length)) {
+        PyErr_SetString(
+            PyExc_ValueError, "Length tag exceeds available buffer.");
+        return NULL;
+      }
+      data_length = (Py_ssize_t)value;
+      break;
+
+    default:
+      PyErr_SetString(PyExc_ValueError, "Unexpected Tag");
+      return NULL;
+  }
+
+  if (prefix_length + data_length > remaining)
+    goto truncated;
+
+  result = Py_BuildValue("s#s#s#",
+                         *buffer, tag_length,
+                         data, prefix_length,
+                         data + prefix_length, data_length);
+  if (!result)
+    return NULL;
+
+  *buffer = data + prefix_length + data_length;
+  *length = remaining - prefix_length - data_length;
+  return result;
+
+truncated:
+  PyErr_SetString(PyExc_ValueError, "Buffer too short.");
+  return NULL;
+}
+
+
 PyObject *py_split_buffer(PyObject *self, PyObject *args, PyObject *kwargs) {
-  char *buffer;
+  const char *buffer;
   Py_ssize_t buffer_len = 0;
   Py_ssize_t length = 0;
   Py_ssize_t index = 0;
   static const char *kwlist[] = {"buffer", "index", "length", NULL};
-  PyObject *encoded_tag = NULL;
-
-  PyObject *result = PyList_New(0);
-  if (!result)
-    return NULL;
+  PyObject *result = NULL;
 
   if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s#|nn", (char **)kwlist,
                                    &buffer, &buffer_len, &index, &length))
@@ -153,168 +245,341 @@ PyObject *py_split_buffer(PyObject *self, PyObject *args, PyObject *kwargs) {
     length = buffer_len - index;
   }
 
+  result = PyList_New(0);
+  if (!result)
+    return NULL;
+
   // We advance the buffer and decrement the length until there is no more
   // buffer space left.
   while (length > 0) {
-    Py_ssize_t decoded_length = 0;
-    unsigned PY_LONG_LONG tag;
-    int tag_type;
-
-    // Read the tag off the buffer.
-    varint_decode(&tag, buffer, length, &decoded_length);
-
-    // Prepare to pass the encoded tag into the result tuple.
-    encoded_tag = PyString_FromStringAndSize(buffer, decoded_length);
-    buffer += decoded_length;
-    length -= decoded_length;
-
-    // Handle the tag depending on its type.
-    tag_type = tag & TAG_TYPE_MASK;
-    switch (tag_type) {
-      case WIRETYPE_VARINT: {
-        // Decode the varint and position ourselves at the next tag.
-        Py_ssize_t tag_length = 0;
-        PyObject *entry = NULL;
-
-        varint_decode(&tag, buffer, length, &tag_length);
-
-        // Create an entry to add to the result set. Note: We use
-        // PyTuple_SetItem which steals the references here instead of
-        // PyTuple_Pack which does not (meaning its more involved to use).
-        entry = PyTuple_New(3);
-        PyTuple_SET_ITEM(
-            entry, 0, encoded_tag);
-
-        // Empty string "".
-        PyTuple_SET_ITEM(
-            entry, 1,
-            PyString_FromStringAndSize(buffer, 0));
-
-        PyTuple_SET_ITEM(
-            entry, 2,
-            PyString_FromStringAndSize(buffer, tag_length));
-
-        PyList_Append(result, entry);
-        Py_DECREF(entry);
-
-        buffer += tag_length;
-        length -= tag_length;
-
-        break;
-      }
+    PyObject *entry = split_next(&buffer, &length);
+    int error;
 
-      case WIRETYPE_FIXED64: {
-        // Fixed size data.
-        Py_ssize_t tag_length = 8;
+    if (!entry)
+      goto error;
 
-        PyObject *entry = PyTuple_New(3);
-        PyTuple_SET_ITEM(
-            entry, 0, encoded_tag);
+    error = PyList_Append(result, entry);
+    Py_DECREF(entry);
+    if (error < 0)
+      goto error;
+  }
 
-        // Empty string "".
-        PyTuple_SET_ITEM(
-            entry, 1,
-            PyString_FromStringAndSize(buffer, 0));
+  return result;
 
-        PyTuple_SET_ITEM(
-            entry, 2,
-            PyString_FromStringAndSize(buffer, tag_length));
+error:
+  Py_DECREF(result);
+  return NULL;
+}
 
-        PyList_Append(result, entry);
-        Py_DECREF(entry);
 
-        buffer += tag_length;
-        length -= tag_length;
+// Appends (None, wire_format) to the wrapped list of a repeated field.
+static int append_repeated(PyObject *wrapped_list, PyObject *wire_format) {
+  PyObject *item = PyTuple_Pack(2, Py_None, wire_format);
+  PyObject *res = NULL;
 
-        break;
-      }
+  if (!item)
+    return -1;
 
-      case WIRETYPE_FIXED32: {
-        // Fixed size data.
-        Py_ssize_t tag_length = 4;
+  if (PyList_CheckExact(wrapped_list)) {
+    int error = PyList_Append(wrapped_list, item);
+    Py_DECREF(item);
+    return error;
+  }
 
-        PyObject *entry = PyTuple_New(3);
-        PyTuple_SET_ITEM(
-            entry, 0, encoded_tag);
+  res = PyObject_CallMethod(wrapped_list, "append", "(O)", item);
+  Py_DECREF(item);
+  if (!res)
+    return -1;
 
-        // Empty string "".
-        PyTuple_SET_ITEM(
-            entry, 1,
-            PyString_FromStringAndSize(buffer, 0));
+  Py_DECREF(res);
+  return 0;
+}
 
-        PyTuple_SET_ITEM(
-            entry, 2,
-            PyString_FromStringAndSize(buffer, tag_length));
 
-        PyList_Append(result, entry);
-        Py_DECREF(entry);
+// Returns a new reference to the wrapped list of the repeated field described
+// by type_info. Lists of fields whose default is stored on access are cached
+// in wrapped_lists since every Get() returns the same helper for them.
+static PyObject *get_wrapped_list(PyObject *value_obj, PyObject *type_info,
+                                  PyObject *wrapped_lists) {
+  PyObject *wrapped_list = PyDict_GetItem(wrapped_lists, type_info);
+  PyObject *name = NULL;
+  PyObject *helper = NULL;
+  PyObject *cacheable = NULL;
+  int is_cacheable;
+
+  if (wrapped_list) {
+    Py_INCREF(wrapped_list);
+    return wrapped_list;
+  }
 
-        buffer += tag_length;
-        length -= tag_length;
+  name = PyObject_GetAttr(type_info, str_name);
+  if (!name)
+    return NULL;
 
-        break;
-      }
+  helper = PyObject_CallMethodObjArgs(value_obj, str_get, name, NULL);
+  Py_DECREF(name);
+  if (!helper)
+    return NULL;
 
-      case WIRETYPE_LENGTH_DELIMITED: {
-        // Decode the length varint and position ourselves at the start of the
-        // data.
-        Py_ssize_t decoded_length = 0;
-        unsigned PY_LONG_LONG data_size;
-        PyObject *entry = NULL;
+  wrapped_list = PyObject_GetAttr(helper, str_wrapped_list);
+  Py_DECREF(helper);
+  if (!wrapped_list)
+    return NULL;
 
-        varint_decode(&data_size, buffer, length, &decoded_length);
+  cacheable = PyObject_GetAttr(type_info, str_set_default_on_access);
+  if (!cacheable)
+    goto error;
 
-        // Check that we do not exceed the available buffer here.
-        if (data_size + decoded_length > (unsigned int)length) {
-          PyErr_SetString(
-              PyExc_ValueError, "Length tag exceeds available buffer.");
+  is_cacheable = PyObject_IsTrue(cacheable);
+  Py_DECREF(cacheable);
+  if (is_cacheable < 0)
+    goto error;
 
-          goto error;
-        }
+  if (is_cacheable &&
+      PyDict_SetItem(wrapped_lists, type_info, wrapped_list) < 0)
+    goto error;
 
-        entry = PyTuple_New(3);
-        PyTuple_SET_ITEM(
-            entry, 0, encoded_tag);
+  return wrapped_list;
 
-        // Empty string "".
-        PyTuple_SET_ITEM(
-            entry, 1,
-            PyString_FromStringAndSize(buffer, decoded_length));
+error:
+  Py_DECREF(wrapped_list);
+  return NULL;
+}
 
-        PyTuple_SET_ITEM(
-            entry, 2,
-            PyString_FromStringAndSize(buffer + decoded_length, data_size));
 
-        PyList_Append(result, entry);
-        Py_DECREF(entry);
+// Stores the fields of a serialized protobuf into the raw data of an RDFStruct
+// without decoding them. This is the C version of structs.ReadIntoObject().
+PyObject *py_read_into_object(PyObject *self, PyObject *args,
+                              PyObject *kwargs) {
+  const char *buffer;
+  Py_ssize_t buffer_len = 0;
+  Py_ssize_t index = 0;
+  Py_ssize_t length = 0;
+  PyObject *value_obj = NULL;
+  PyObject *proto_list_class = NULL;
+  static const char *kwlist[] = {
+    "buffer", "index", "value_obj", "length", "proto_list_class", NULL};
+  PyObject *raw_data = NULL;
+  PyObject *type_infos = NULL;
+  PyObject *wrapped_lists = NULL;
+  PyObject *entry = NULL;
+  PyObject *res = NULL;
+  Py_ssize_t count = 0;
+
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s#nOnO", (char **)kwlist,
+                                   &buffer, &buffer_len, &index, &value_obj,
+                                   &length, &proto_list_class))
+    return NULL;
 
-        buffer += decoded_length + data_size;
-        length -= decoded_length + data_size;
+  if (index < 0 || length < 0 || index > buffer_len) {
+    PyErr_SetString(
+        PyExc_ValueError, "Invalid parameters.");
+    return NULL;
+  }
 
-        break;
-      }
+  // Parse up to the given length (relative to the start of the buffer like
+  // the pure Python version does) or up to the end of the buffer.
+  if (length == 0 || length > buffer_len)
+    length = buffer_len;
+  buffer += index;
+  length -= index;
 
-      default:
-        PyErr_SetString(
-            PyExc_ValueError, "Unexpected Tag");
+  raw_data = PyObject_CallMethodObjArgs(value_obj, str_get_raw_data, NULL);
+  if (!raw_data)
+    goto error;
+
+  type_infos = PyObject_GetAttr(value_obj, str_type_infos_by_encoded_tag);
+  if (!type_infos)
+    goto error;
+
+  if (!PyDict_Check(type_infos)) {
+    PyErr_SetString(
+        PyExc_TypeError, "type_infos_by_encoded_tag must be a dict.");
+    goto error;
+  }
 
+  wrapped_lists = PyDict_New();
+  if (!wrapped_lists)
+    goto error;
+
+  while (length > 0) {
+    PyObject *type_info = NULL;
+    PyObject *key = NULL;
+    PyObject *value = NULL;
+    int error;
+
+    entry = split_next(&buffer, &length);
+    if (!entry)
+      goto error;
+
+    // Borrowed reference.
+    type_info = PyDict_GetItem(type_infos, PyTuple_GET_ITEM(entry, 0));
+
+    if (!type_info) {
+      // Unknown fields are kept under a unique integer key so they are
+      // serialized back unchanged.
+      key = PyInt_FromSsize_t(count);
+      value = PyTuple_Pack(3, Py_None, entry, Py_None);
+      count++;
+
+    } else if ((PyObject *)Py_TYPE(type_info) == proto_list_class) {
+      PyObject *wrapped_list = get_wrapped_list(
+          value_obj, type_info, wrapped_lists);
+
+      if (!wrapped_list)
+        goto error;
+
+      error = append_repeated(wrapped_list, entry);
+      Py_DECREF(wrapped_list);
+      if (error < 0)
         goto error;
+
+      Py_CLEAR(entry);
+      continue;
+
+    } else {
+      // The python format is None so the field is decoded lazily on access.
+      key = PyObject_GetAttr(type_info, str_name);
+      value = PyTuple_Pack(3, Py_None, entry, type_info);
+    }
+
+    if (!key || !value) {
+      Py_XDECREF(key);
+      Py_XDECREF(value);
+      goto error;
     }
+
+    error = PyObject_SetItem(raw_data, key, value);
+    Py_DECREF(key);
+    Py_DECREF(value);
+    if (error < 0)
+      goto error;
+
+    Py_CLEAR(entry);
   }
 
-  return result;
+  res = PyObject_CallMethodObjArgs(value_obj, str_set_raw_data, raw_data,
+                                   NULL);
 
 error:
-  Py_DECREF(encoded_tag);
-  return NULL;
+  Py_XDECREF(entry);
+  Py_XDECREF(wrapped_lists);
+  Py_XDECREF(type_infos);
+  Py_XDECREF(raw_data);
+  return res;
+}
+
+
+// Returns the wire format for one (python_format, wire_format,
+// type_descriptor) entry as a new reference. Entries which were not modified
+// since they were parsed are returned as is.
+static PyObject *entry_wire_format(PyObject *entry) {
+  PyObject *fields = NULL;
+  PyObject *python_format = NULL;
+  PyObject *wire_format = NULL;
+  PyObject *type_descriptor = NULL;
+  PyObject *result = NULL;
+  int convert;
+
+  fields = PySequence_Fast(entry, "Entries must be sequences.");
+  if (!fields)
+    return NULL;
+
+  if (PySequence_Fast_GET_SIZE(fields) != 3) {
+    PyErr_SetString(PyExc_ValueError, "Entries must have three items.");
+    goto exit;
+  }
+
+  python_format = PySequence_Fast_GET_ITEM(fields, 0);
+  wire_format = PySequence_Fast_GET_ITEM(fields, 1);
+  type_descriptor = PySequence_Fast_GET_ITEM(fields, 2);
+
+  convert = (wire_format == Py_None);
+  if (!convert) {
+    int has_python_format = PyObject_IsTrue(python_format);
+
+    if (has_python_format < 0)
+      goto exit;
+
+    if (has_python_format) {
+      PyObject *dirty = PyObject_CallMethodObjArgs(
+          type_descriptor, str_is_dirty, python_format, NULL);
+
+      if (!dirty)
+        goto exit;
+
+      convert = PyObject_IsTrue(dirty);
+      Py_DECREF(dirty);
+      if (convert < 0)
+        goto exit;
+    }
+  }
+
+  if (convert) {
+    result = PyObject_CallMethodObjArgs(
+        type_descriptor, str_convert_to_wire_format, python_format, NULL);
+  } else {
+    Py_INCREF(wire_format);
+    result = wire_format;
+  }
+
+exit:
+  Py_DECREF(fields);
+  return result;
 }
 
+
+// Serializes (python_format, wire_format, type_descriptor) entries. This is
+// the C version of structs.SerializeEntries().
+PyObject *py_serialize_entries(PyObject *self, PyObject *entries) {
+  PyObject *iterator = NULL;
+  PyObject *output = NULL;
+  PyObject *entry = NULL;
+  PyObject *result = NULL;
+
+  iterator = PyObject_GetIter(entries);
+  if (!iterator)
+    return NULL;
+
+  output = PyList_New(0);
+  if (!output)
+    goto exit;
+
+  while ((entry = PyIter_Next(iterator))) {
+    PyObject *wire_format = entry_wire_format(entry);
+    PyObject *extended = NULL;
+
+    Py_DECREF(entry);
+    if (!wire_format)
+      goto exit;
+
+    extended = _PyList_Extend((PyListObject *)output, wire_format);
+    Py_DECREF(wire_format);
+    if (!extended)
+      goto exit;
+
+    Py_DECREF(extended);
+  }
+
+  if (PyErr_Occurred())
+    goto exit;
+
+  // Same as "".join(output), which also handles unicode parts.
+  result = _PyString_Join(empty_string, output);
+
+exit:
+  Py_XDECREF(output);
+  Py_DECREF(iterator);
+  return result;
+}
+
+
 /* Retrieves the semantic protobuf version
  * Returns a Python object if successful or NULL on error
  */
 PyObject *py_semantic_get_version(PyObject *self, PyObject *arguments) {
     const char *errors = NULL;
-    return(PyUnicode_DecodeUTF8("20150518", (Py_ssize_t) 8, errors));
+    return(PyUnicode_DecodeUTF8("20171016", (Py_ssize_t) 8, errors));
 }
 
 static PyMethodDef _semantic_methods[] = {
@@ -340,11 +605,46 @@ static PyMethodDef _semantic_methods[] = {
      METH_VARARGS | METH_KEYWORDS,
      "Split a buffer into tags and wire format data."},
 
+    {"read_into_object",
+     (PyCFunction)py_read_into_object,
+     METH_VARARGS | METH_KEYWORDS,
+     "Store the fields of a buffer in the raw data of an RDFStruct."},
+
+    {"serialize_entries",
+     (PyCFunction)py_serialize_entries,
+     METH_O,
+     "Serialize the raw data entries of an RDFStruct."},
+
     {NULL}  /* Sentinel */
 };
 
 
+static int init_strings(void) {
+  str_get = PyString_InternFromString("Get");
+  str_get_raw_data = PyString_InternFromString("GetRawData");
+  str_set_raw_data = PyString_InternFromString("SetRawData");
+  str_name = PyString_InternFromString("name");
+  str_type_infos_by_encoded_tag = PyString_InternFromString(
+      "type_infos_by_encoded_tag");
+  str_set_default_on_access = PyString_InternFromString(
+      "set_default_on_access");
+  str_wrapped_list = PyString_InternFromString("wrapped_list");
+  str_is_dirty = PyString_InternFromString("IsDirty");
+  str_convert_to_wire_format = PyString_InternFromString(
+      "ConvertToWireFormat");
+  empty_string = PyString_FromString("");
+
+  return (str_get && str_get_raw_data && str_set_raw_data && str_name &&
+          str_type_infos_by_encoded_tag && str_set_default_on_access &&
+          str_wrapped_list && str_is_dirty && str_convert_to_wire_format &&
+          empty_string);
+}
+
+
 PyMODINIT_FUNC init_semantic(void) {
+  if (!init_strings())
+    return;
+
   /* create module */
   Py_InitModule3("_semantic", _semantic_methods,
                  "Semantic Protobuf accelerator.");
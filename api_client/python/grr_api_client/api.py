@@ -44,10 +44,18 @@ class GrrApi(object):
     return self._context.username
 
 
-def InitHttp(api_endpoint=None, page_size=None, auth=None):
+def InitHttp(api_endpoint=None,
+             page_size=None,
+             auth=None,
+             prefetch_pages=None,
+             max_retries=None):
   """Inits an GRR API object with a HTTP connector."""
 
   connector = http_connector.HttpConnector(
-      api_endpoint=api_endpoint, page_size=page_size, auth=auth)
+      api_endpoint=api_endpoint,
+      page_size=page_size,
+      auth=auth,
+      prefetch_pages=prefetch_pages,
+      max_retries=max_retries)
 
   return GrrApi(connector=connector)
@@ -23,6 +23,16 @@ class GrrApiShellArgParser(argparse.ArgumentParser):
         "--page_size",
         type=int,
         help="Page size used when paging through collections of items.")
+    self.add_argument(
+        "--prefetch_pages",
+        type=int,
+        help="Number of pages fetched in parallel when paging through "
+        "collections of items.")
+    self.add_argument(
+        "--max_retries",
+        type=int,
+        help="How many times read-only requests are retried on connection "
+        "errors and transient server errors.")
     self.add_argument(
         "--basic_auth_username",
         type=str,
@@ -70,7 +80,11 @@ def main(argv=None):
     auth = (flags.basic_auth_username, flags.basic_auth_password or "")
 
   grrapi = api.InitHttp(
-      api_endpoint=flags.api_endpoint, page_size=flags.page_size, auth=auth)
+      api_endpoint=flags.api_endpoint,
+      page_size=flags.page_size,
+      auth=auth,
+      prefetch_pages=flags.prefetch_pages,
+      max_retries=flags.max_retries)
 
   if flags.exec_code and flags.exec_file:
     print "--exec_code --exec_file flags can't be supplied together"
@@ -8,6 +8,11 @@ class Connector(object):
   def page_size(self):
     raise NotImplementedError()
 
+  @property
+  def prefetch_pages(self):
+    """Number of pages fetched ahead of time when paging through items."""
+    return 0
+
   def SendRequest(self, handler_name, args):
     raise NotImplementedError()
 
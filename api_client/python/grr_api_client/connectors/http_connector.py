@@ -4,6 +4,8 @@
 import collections
 import json
 import logging
+import threading
+import time
 import urlparse
 
 import requests
@@ -31,20 +33,99 @@ class HttpConnector(connector.Connector):
   JSON_PREFIX = ")]}\'\n"
   DEFAULT_PAGE_SIZE = 50
   DEFAULT_BINARY_CHUNK_SIZE = 66560
-
-  def __init__(self, api_endpoint=None, auth=None, page_size=None):
+  DEFAULT_MAX_RETRIES = 3
+  DEFAULT_RETRY_DELAY = 1
+
+  # Server responses which indicate a transient error.
+  RETRY_STATUS_CODES = frozenset([502, 503, 504])
+
+  def __init__(self,
+               api_endpoint=None,
+               auth=None,
+               page_size=None,
+               prefetch_pages=None,
+               max_retries=None,
+               retry_delay=None):
+    """Constructor.
+
+    Args:
+      api_endpoint: URL of the GRR AdminUI.
+      auth: Authentication to use, as accepted by the requests library.
+      page_size: Number of items fetched per request when paging through
+        collections of items.
+      prefetch_pages: Number of pages fetched in parallel, ahead of the
+        items being consumed. If 0 or None, pages are fetched one by one.
+      max_retries: How many times GET requests are retried on connection
+        errors and transient server errors.
+      retry_delay: Delay in seconds before the first retry, doubled for
+        every following one.
+    """
     super(HttpConnector, self).__init__()
 
     self.api_endpoint = api_endpoint
     self.auth = auth
     self._page_size = page_size or self.DEFAULT_PAGE_SIZE
+    self._prefetch_pages = prefetch_pages or 0
+    if max_retries is None:
+      max_retries = self.DEFAULT_MAX_RETRIES
+    self.max_retries = max_retries
+    if retry_delay is None:
+      retry_delay = self.DEFAULT_RETRY_DELAY
+    self.retry_delay = retry_delay
+
+    # Sessions keep connections alive so that they are reused. Sessions are
+    # not thread safe (their cookie jar is updated by every response), so
+    # every thread sending requests, e.g. when prefetching pages, gets its
+    # own.
+    self._local = threading.local()
 
     self.csrf_token = None
+    self._init_lock = threading.Lock()
+
+  @property
+  def session(self):
+    """The requests.Session used by the current thread."""
+    try:
+      return self._local.session
+    except AttributeError:
+      self._local.session = requests.Session()
+      return self._local.session
+
+  def _Send(self, prepped_request, stream=False):
+    """Sends a request, retrying GET requests on transient errors."""
+    # Other requests are not retried since they might have had side effects
+    # on the server even if they failed.
+    retries = self.max_retries if prepped_request.method == "GET" else 0
+
+    for attempt in range(retries + 1):
+      if attempt:
+        delay = self.retry_delay * 2**(attempt - 1)
+        logger.warning("Retrying %s in %s seconds (%d/%d)...",
+                       prepped_request.url, delay, attempt, retries)
+        time.sleep(delay)
+
+      try:
+        response = self.session.send(prepped_request, stream=stream)
+      except requests.ConnectionError as e:
+        if attempt == retries:
+          raise
+
+        logger.warning("Error sending request %s: %s", prepped_request.url, e)
+        continue
+
+      if (response.status_code not in self.RETRY_STATUS_CODES or
+          attempt == retries):
+        return response
+
+      logger.warning("Request %s failed with status %d.", prepped_request.url,
+                     response.status_code)
+      response.close()
 
   def _GetCSRFToken(self):
     logger.debug("Fetching CSRF token from %s...", self.api_endpoint)
 
-    index_response = requests.get(self.api_endpoint, auth=self.auth)
+    index_response = self._Send(
+        requests.Request("GET", self.api_endpoint, auth=self.auth).prepare())
     self._CheckResponseStatus(index_response)
 
     csrf_token = index_response.cookies.get("csrftoken")
@@ -56,17 +137,19 @@ class HttpConnector(connector.Connector):
 
     return csrf_token
 
-  def _FetchRoutingMap(self):
+  def _FetchRoutingMap(self, csrf_token):
     headers = {
-        "x-csrftoken": self.csrf_token,
+        "x-csrftoken": csrf_token,
         "x-requested-with": "XMLHttpRequest"
     }
-    cookies = {"csrftoken": self.csrf_token}
+    cookies = {"csrftoken": csrf_token}
 
     url = "%s/%s" % (self.api_endpoint.strip("/"),
                      "api/v2/reflection/api-methods")
-    response = requests.get(
-        url, headers=headers, cookies=cookies, auth=self.auth)
+    response = self._Send(
+        requests.Request(
+            "GET", url, headers=headers, cookies=cookies,
+            auth=self.auth).prepare())
     self._CheckResponseStatus(response)
 
     json_str = response.content[len(self.JSON_PREFIX):]
@@ -98,9 +181,14 @@ class HttpConnector(connector.Connector):
     self.urls = self.handlers_map.bind(parsed_endpoint_url.netloc, "/")
 
   def _InitializeIfNeeded(self):
-    if not self.csrf_token:
-      self.csrf_token = self._GetCSRFToken()
-      self._FetchRoutingMap()
+    # Requests might be sent from multiple threads when prefetching pages.
+    with self._init_lock:
+      if not self.csrf_token:
+        csrf_token = self._GetCSRFToken()
+        self._FetchRoutingMap(csrf_token)
+        # The token marks the connector as initialized, so it is only set
+        # once the routing map was fetched.
+        self.csrf_token = csrf_token
 
   def _CoerceValueToQueryStringType(self, field, value):
     if isinstance(value, bool):
@@ -208,6 +296,10 @@ class HttpConnector(connector.Connector):
   def page_size(self):
     return self._page_size
 
+  @property
+  def prefetch_pages(self):
+    return self._prefetch_pages
+
   def SendRequest(self, handler_name, args):
     self._InitializeIfNeeded()
     method_descriptor = self.api_methods[handler_name]
@@ -215,8 +307,7 @@ class HttpConnector(connector.Connector):
     request = self.BuildRequest(method_descriptor.name, args)
     prepped_request = request.prepare()
 
-    session = requests.Session()
-    response = session.send(prepped_request)
+    response = self._Send(prepped_request)
     self._CheckResponseStatus(response)
 
     content = response.content
@@ -238,8 +329,7 @@ class HttpConnector(connector.Connector):
     request = self.BuildRequest(method_descriptor.name, args)
     prepped_request = request.prepare()
 
-    session = requests.Session()
-    response = session.send(prepped_request, stream=True)
+    response = self._Send(prepped_request, stream=True)
     self._CheckResponseStatus(response)
 
     def GenerateChunks():
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Tests for the HTTP API connector."""
+
+import threading
+import unittest
+
+import mock
+import requests
+
+from grr_api_client.connectors import http_connector
+
+
+def _Response(status_code):
+  return mock.MagicMock(spec=requests.Response, status_code=status_code)
+
+
+class HttpConnectorSendTest(unittest.TestCase):
+  """Tests for HttpConnector._Send."""
+
+  def setUp(self):
+    super(HttpConnectorSendTest, self).setUp()
+    self.connector = http_connector.HttpConnector(
+        api_endpoint="http://localhost", max_retries=2, retry_delay=0)
+
+    self.sleep_patcher = mock.patch("time.sleep")
+    self.sleep_patcher.start()
+
+  def tearDown(self):
+    super(HttpConnectorSendTest, self).tearDown()
+    self.sleep_patcher.stop()
+
+  def _Send(self, method, responses):
+    request = requests.Request(method, "http://localhost/api/foo").prepare()
+    with mock.patch.object(
+        requests.Session, "send", side_effect=responses) as send:
+      try:
+        return self.connector._Send(request)
+      finally:
+        self.num_sent = send.call_count
+
+  def testGetIsRetriedOnTransientErrors(self):
+    for status_code in [502, 503, 504]:
+      response = self._Send("GET", [_Response(status_code), _Response(200)])
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(self.num_sent, 2)
+
+  def testGetIsRetriedOnConnectionErrors(self):
+    response = self._Send("GET",
+                          [requests.ConnectionError(), _Response(200)])
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(self.num_sent, 2)
+
+  def testGetRetriesAreLimited(self):
+    response = self._Send("GET", [_Response(503)] * 3)
+    self.assertEqual(response.status_code, 503)
+    self.assertEqual(self.num_sent, 3)
+
+    self.assertRaises(requests.ConnectionError, self._Send, "GET",
+                      [requests.ConnectionError()] * 3)
+    self.assertEqual(self.num_sent, 3)
+
+  def testGetIsNotRetriedOnOtherErrors(self):
+    response = self._Send("GET", [_Response(500), _Response(200)])
+    self.assertEqual(response.status_code, 500)
+    self.assertEqual(self.num_sent, 1)
+
+  def testPostIsNeverRetried(self):
+    response = self._Send("POST", [_Response(503), _Response(200)])
+    self.assertEqual(response.status_code, 503)
+    self.assertEqual(self.num_sent, 1)
+
+    self.assertRaises(requests.ConnectionError, self._Send, "POST",
+                      [requests.ConnectionError(), _Response(200)])
+    self.assertEqual(self.num_sent, 1)
+
+  def testEveryThreadUsesItsOwnSession(self):
+    sessions = []
+    thread = threading.Thread(
+        target=lambda: sessions.append(self.connector.session))
+    thread.start()
+    thread.join()
+
+    self.assertIs(self.connector.session, self.connector.session)
+    self.assertIsNot(self.connector.session, sessions[0])
+
+
+class HttpConnectorInitializationTest(unittest.TestCase):
+  """Tests for the initialization of the HttpConnector."""
+
+  def testRoutingMapRequestCarriesTheCSRFToken(self):
+    connector = http_connector.HttpConnector(
+        api_endpoint="http://localhost", max_retries=0)
+
+    index_response = _Response(200)
+    index_response.cookies = {"csrftoken": "token"}
+    sent = []
+
+    def Send(request, **unused_kwargs):
+      sent.append(request)
+      if len(sent) == 1:
+        return index_response
+      raise requests.ConnectionError()
+
+    with mock.patch.object(requests.Session, "send", side_effect=Send):
+      self.assertRaises(requests.ConnectionError,
+                        connector._InitializeIfNeeded)
+
+    self.assertEqual(len(sent), 2)
+    self.assertEqual(sent[1].headers["x-csrftoken"], "token")
+    self.assertEqual(sent[1].headers["Cookie"], "csrftoken=token")
+    # The connector is initialized again on the next request.
+    self.assertIsNone(connector.csrf_token)
+
+
+if __name__ == "__main__":
+  unittest.main()
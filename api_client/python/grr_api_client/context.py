@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 """API context definition. Context defines request/response behavior."""
 
+import collections
 import itertools
+from multiprocessing import pool as multiprocessing_pool
 
 from grr_api_client import utils
 
@@ -21,14 +23,17 @@ class GrrApiContext(object):
   def SendRequest(self, handler_name, args):
     return self.connector.SendRequest(handler_name, args)
 
+  def _SendPageRequest(self, handler_name, args, offset):
+    args_copy = utils.CopyProto(args)
+    args_copy.offset = offset
+    args_copy.count = self.connector.page_size
+    return self.connector.SendRequest(handler_name, args_copy)
+
   def _GeneratePages(self, handler_name, args):
     offset = args.offset
 
     while True:
-      args_copy = utils.CopyProto(args)
-      args_copy.offset = offset
-      args_copy.count = self.connector.page_size
-      result = self.connector.SendRequest(handler_name, args_copy)
+      result = self._SendPageRequest(handler_name, args, offset)
 
       yield result
 
@@ -37,13 +42,52 @@ class GrrApiContext(object):
 
       offset += self.connector.page_size
 
+  def _GeneratePagesWithPrefetching(self, handler_name, args):
+    """Generates pages in order while fetching the next ones in parallel."""
+    prefetch_pages = self.connector.prefetch_pages
+    page_size = self.connector.page_size
+
+    # The first page is fetched right away, this also initializes the
+    # connector before it is used from multiple threads.
+    offset = args.offset
+    result = self._SendPageRequest(handler_name, args, offset)
+    yield result
+
+    if not result.items:
+      return
+
+    pool = multiprocessing_pool.ThreadPool(prefetch_pages)
+    try:
+      pending = collections.deque()
+      while True:
+        # Keep up to prefetch_pages requests in flight. Pages past the end
+        # of the collection come back empty and end the iteration.
+        while len(pending) < prefetch_pages:
+          offset += page_size
+          pending.append(
+              pool.apply_async(self._SendPageRequest,
+                               (handler_name, args, offset)))
+
+        result = pending.popleft().get()
+        yield result
+
+        if not result.items:
+          break
+    finally:
+      # The caller might stop iterating early, outstanding requests are
+      # not needed then.
+      pool.terminate()
+
   def SendIteratorRequest(self, handler_name, args):
     if not args or not hasattr(args, "count"):
       result = self.connector.SendRequest(handler_name, args)
       total_count = getattr(result, "total_count", None)
       return utils.ItemsIterator(items=result.items, total_count=total_count)
     else:
-      pages = self._GeneratePages(handler_name, args)
+      if self.connector.prefetch_pages:
+        pages = self._GeneratePagesWithPrefetching(handler_name, args)
+      else:
+        pages = self._GeneratePages(handler_name, args)
 
       first_page = pages.next()
       total_count = getattr(first_page, "total_count", None)
@@ -14,6 +14,7 @@ import stat
 import psutil
 
 from grr.client import actions
+from grr.client import hash_cache
 from grr.client.client_actions import standard as standard_actions
 from grr.client.vfs_handlers import files
 
@@ -216,9 +217,12 @@ class FileFinderOS(actions.ActionPlugin):
 
       elif args.action.action_type == args.action.Action.HASH:
         result.stat_entry = stat_entry
-        result.hash_entry = self.Hash(fname, stat_object,
-                                      args.action.hash.max_size,
-                                      args.action.hash.oversized_file_policy)
+        result.hash_entry = self.Hash(
+            fname,
+            stat_object,
+            args.action.hash.max_size,
+            args.action.hash.oversized_file_policy,
+            bypass_cache=args.action.hash.bypass_hash_cache)
       self.SendReply(result)
 
   def Stat(self, fname, stat_object, resolve_links):
@@ -237,7 +241,8 @@ class FileFinderOS(actions.ActionPlugin):
            stat_object,
            policy_max_hash_size,
            oversized_file_policy,
-           resolve_links=True):
+           resolve_links=True,
+           bypass_cache=False):
     file_size = stat_object.st_size
     if file_size <= policy_max_hash_size:
       max_hash_size = file_size
@@ -248,18 +253,27 @@ class FileFinderOS(actions.ActionPlugin):
       elif oversized_file_policy == ff_opts.OversizedFilePolicy.HASH_TRUNCATED:
         max_hash_size = policy_max_hash_size
 
-    try:
-      file_obj = open(fname, "rb")
-    except IOError:
-      return
-
-    with file_obj:
-      hashers, bytes_read = standard_actions.HashFile().HashFile(
-          ["md5", "sha1", "sha256"], file_obj, max_hash_size)
-    result = rdf_crypto.Hash(**dict((k, v.digest())
-                                    for k, v in hashers.iteritems()))
-    result.num_bytes = bytes_read
-    return result
+    def ComputeHash():
+      try:
+        file_obj = open(fname, "rb")
+      except IOError:
+        return None, 0
+
+      with file_obj:
+        hashers, bytes_read = standard_actions.HashFile().HashFile(
+            ["md5", "sha1", "sha256"], file_obj, max_hash_size)
+      result = rdf_crypto.Hash(**dict((k, v.digest())
+                                      for k, v in hashers.iteritems()))
+      result.num_bytes = bytes_read
+      return result, bytes_read
+
+    return hash_cache.CachedValue(
+        fname,
+        standard_actions.HashFile.CacheKind(["md5", "sha1", "sha256"],
+                                            max_hash_size, file_size),
+        rdf_crypto.Hash,
+        ComputeHash,
+        bypass_cache=bypass_cache)
 
   def CollectGlobs(self, globs):
     expanded_globs = {}
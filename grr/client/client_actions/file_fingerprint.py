@@ -5,6 +5,7 @@
 import hashlib
 
 from grr.lib import fingerprint
+from grr.client import hash_cache
 from grr.client import vfs
 from grr.client.client_actions import standard
 from grr.lib.rdfvalues import client as rdf_client
@@ -44,9 +45,6 @@ class FingerprintFile(standard.ReadBuffer):
     """Fingerprint a file."""
     with vfs.VFSOpen(
         args.pathspec, progress_callback=self.Progress) as file_obj:
-      fingerprinter = Fingerprinter(self.Progress, file_obj)
-      response = rdf_client.FingerprintResponse()
-      response.pathspec = file_obj.pathspec
       if args.tuples:
         tuples = args.tuples
       else:
@@ -55,40 +53,66 @@ class FingerprintFile(standard.ReadBuffer):
         for k in self._fingerprint_types.iterkeys():
           tuples.append(rdf_client.FingerprintTuple(fp_type=k))
 
-      for finger in tuples:
-        hashers = [self._hash_types[h] for h in finger.hashers] or None
-        if finger.fp_type in self._fingerprint_types:
-          invoke = self._fingerprint_types[finger.fp_type]
-          res = invoke(fingerprinter, hashers)
-          if res:
-            response.matching_types.append(finger.fp_type)
-        else:
-          raise RuntimeError(
-              "Encountered unknown fingerprint type. %s" % finger.fp_type)
-
-      # Structure of the results is a list of dicts, each containing the
-      # name of the hashing method, hashes for enabled hash algorithms,
-      # and auxilliary data where present (e.g. signature blobs).
-      # Also see Fingerprint:HashIt()
-      response.results = fingerprinter.HashIt()
-
-      # We now return data in a more structured form.
-      for result in response.results:
-        if result.GetItem("name") == "generic":
-          for hash_type in ["md5", "sha1", "sha256"]:
-            value = result.GetItem(hash_type)
-            if value is not None:
-              setattr(response.hash, hash_type, value)
-
-        if result["name"] == "pecoff":
-          for hash_type in ["md5", "sha1", "sha256"]:
-            value = result.GetItem(hash_type)
-            if value:
-              setattr(response.hash, "pecoff_" + hash_type, value)
-
-          signed_data = result.GetItem("SignedData", [])
-          for data in signed_data:
-            response.hash.signed_data.Append(
-                revision=data[0], cert_type=data[1], certificate=data[2])
+      local_path = hash_cache.CacheablePath(file_obj)
+      if local_path:
+        response = hash_cache.CachedValue(
+            local_path,
+            self._CacheKind(tuples),
+            rdf_client.FingerprintResponse,
+            lambda: self._Fingerprint(file_obj, tuples),
+            bypass_cache=args.bypass_hash_cache)
+      else:
+        response, _ = self._Fingerprint(file_obj, tuples)
 
+      response.pathspec = file_obj.pathspec
       self.SendReply(response)
+
+  def _CacheKind(self, tuples):
+    """Describes a fingerprint computation for the client's hash cache."""
+    return "fingerprint:%s" % ";".join(
+        "%d:%s" % (finger.fp_type, ",".join(str(int(h))
+                                            for h in finger.hashers))
+        for finger in tuples)
+
+  def _Fingerprint(self, file_obj, tuples):
+    """Fingerprints file_obj, returns the response and bytes read."""
+    fingerprinter = Fingerprinter(self.Progress, file_obj)
+    response = rdf_client.FingerprintResponse()
+
+    for finger in tuples:
+      hashers = [self._hash_types[h] for h in finger.hashers] or None
+      if finger.fp_type in self._fingerprint_types:
+        invoke = self._fingerprint_types[finger.fp_type]
+        res = invoke(fingerprinter, hashers)
+        if res:
+          response.matching_types.append(finger.fp_type)
+      else:
+        raise RuntimeError(
+            "Encountered unknown fingerprint type. %s" % finger.fp_type)
+
+    # Structure of the results is a list of dicts, each containing the
+    # name of the hashing method, hashes for enabled hash algorithms,
+    # and auxilliary data where present (e.g. signature blobs).
+    # Also see Fingerprint:HashIt()
+    response.results = fingerprinter.HashIt()
+
+    # We now return data in a more structured form.
+    for result in response.results:
+      if result.GetItem("name") == "generic":
+        for hash_type in ["md5", "sha1", "sha256"]:
+          value = result.GetItem(hash_type)
+          if value is not None:
+            setattr(response.hash, hash_type, value)
+
+      if result["name"] == "pecoff":
+        for hash_type in ["md5", "sha1", "sha256"]:
+          value = result.GetItem(hash_type)
+          if value:
+            setattr(response.hash, "pecoff_" + hash_type, value)
+
+        signed_data = result.GetItem("SignedData", [])
+        for data in signed_data:
+          response.hash.signed_data.Append(
+              revision=data[0], cert_type=data[1], certificate=data[2])
+
+    return response, fingerprinter.filelength
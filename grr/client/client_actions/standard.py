@@ -18,6 +18,7 @@ import psutil
 from grr import config
 from grr.client import actions
 from grr.client import client_utils_common
+from grr.client import hash_cache
 from grr.client import vfs
 from grr.client.client_actions import tempfiles
 from grr.lib import constants
@@ -151,6 +152,12 @@ class HashFile(actions.ActionPlugin):
 
     return hashers, bytes_read
 
+  @staticmethod
+  def CacheKind(hash_types, max_length, file_size):
+    """Describes a HashFile computation for the client's hash cache."""
+    return "hash:%s:%d" % (",".join(sorted(hash_types)),
+                           min(max_length, file_size))
+
   def Run(self, args):
     hash_types = set()
     for t in args.tuples:
@@ -159,15 +166,29 @@ class HashFile(actions.ActionPlugin):
 
     with vfs.VFSOpen(
         args.pathspec, progress_callback=self.Progress) as file_obj:
-      hashers, bytes_read = self.HashFile(hash_types, file_obj,
-                                          args.max_filesize)
 
-    self.SendReply(
-        rdf_client.FingerprintResponse(
-            pathspec=file_obj.pathspec,
+      def ComputeHash():
+        hashers, bytes_read = self.HashFile(hash_types, file_obj,
+                                            args.max_filesize)
+        result = rdf_client.FingerprintResponse(
             bytes_read=bytes_read,
             hash=rdf_crypto.Hash(**dict((k, v.digest())
-                                        for k, v in hashers.iteritems()))))
+                                        for k, v in hashers.iteritems())))
+        return result, bytes_read
+
+      local_path = hash_cache.CacheablePath(file_obj)
+      if local_path:
+        response = hash_cache.CachedValue(
+            local_path,
+            self.CacheKind(hash_types, args.max_filesize, file_obj.size),
+            rdf_client.FingerprintResponse,
+            ComputeHash,
+            bypass_cache=args.bypass_hash_cache)
+      else:
+        response, _ = ComputeHash()
+
+    response.pathspec = file_obj.pathspec
+    self.SendReply(response)
 
 
 class CopyPathToFile(actions.ActionPlugin):
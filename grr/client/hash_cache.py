@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""A persistent cache of file hashes computed on the client.
+
+Hashing large directory trees is expensive and most files don't change between
+hunts. The cache remembers hashes keyed by the identity and stat information
+of a file (device, inode, size, mtime and ctime), so a file is only read again
+after it was modified or replaced.
+"""
+
+import logging
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+from grr import config
+from grr.client.vfs_handlers import files
+from grr.lib import registry
+from grr.lib import stats
+
+# Files modified less than this many seconds ago are not cached. Their
+# timestamps might not change again on a quick subsequent modification since
+# some file systems only have a coarse mtime resolution.
+_MIN_FILE_AGE = 2
+
+# When the cache is full, this fraction of the least recently used entries is
+# evicted at once so that we don't need to evict on every insert.
+_EVICT_FRACTION = 0.1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+  device INTEGER,
+  file_id TEXT,
+  kind TEXT,
+  size INTEGER,
+  mtime REAL,
+  ctime REAL,
+  num_bytes INTEGER,
+  value BLOB,
+  last_used INTEGER,
+  PRIMARY KEY (device, file_id, kind)
+)
+"""
+
+
+class HashCache(object):
+  """An on-disk cache of serialized hash results, bounded in size.
+
+  The cache is best effort: any database error disables it for the lifetime
+  of the process and hashes are computed as if there was no cache.
+  """
+
+  def __init__(self, path, max_entries):
+    self.path = path
+    self.max_entries = max_entries
+    self.lock = threading.RLock()
+    self.connection = None
+    self.num_entries = None
+    self.disabled = False
+
+  def _Connection(self):
+    """Opens the cache database on first use."""
+    if self.connection is None:
+      dirname = os.path.dirname(self.path)
+      if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+      self.connection = sqlite3.connect(self.path, check_same_thread=False)
+      # Losing the last few entries in a crash is fine for a cache.
+      self.connection.execute("PRAGMA synchronous = OFF")
+      self.connection.execute(_SCHEMA)
+      self.num_entries = self.connection.execute(
+          "SELECT COUNT(*) FROM hashes").fetchone()[0]
+    return self.connection
+
+  def _Disable(self, e):
+    logging.warning("Disabling hash cache %s: %s", self.path, e)
+    self.disabled = True
+    if self.connection is not None:
+      try:
+        self.connection.close()
+      except sqlite3.Error:
+        pass
+      self.connection = None
+
+  def _FileId(self, local_path, stat_object):
+    # Some platforms (e.g. Windows with Python 2) report no inode numbers, in
+    # this case we fall back to the path of the file.
+    if stat_object.st_ino:
+      return str(stat_object.st_ino)
+    return local_path
+
+  def Get(self, local_path, stat_object, kind, value_cls):
+    """Looks up a cached value.
+
+    Args:
+      local_path: The path of the file on the local file system.
+      stat_object: The current os.stat result for the file.
+      kind: A string describing what was computed, e.g. which hashes over how
+            many bytes.
+      value_cls: The RDFValue class of the cached value.
+
+    Returns:
+      A tuple of the cached value and the number of bytes that were read to
+      compute it, or (None, 0) if there is no up to date entry.
+    """
+    with self.lock:
+      if self.disabled:
+        return None, 0
+
+      try:
+        connection = self._Connection()
+        key = (stat_object.st_dev, self._FileId(local_path, stat_object), kind)
+        row = connection.execute(
+            "SELECT size, mtime, ctime, num_bytes, value FROM hashes "
+            "WHERE device = ? AND file_id = ? AND kind = ?", key).fetchone()
+        if row is None:
+          return None, 0
+
+        size, mtime, ctime, num_bytes, value = row
+        if (size != stat_object.st_size or mtime != stat_object.st_mtime or
+            ctime != stat_object.st_ctime):
+          return None, 0
+
+        connection.execute("UPDATE hashes SET last_used = ? "
+                           "WHERE device = ? AND file_id = ? AND kind = ?",
+                           (int(time.time()),) + key)
+        connection.commit()
+      except (sqlite3.Error, OSError) as e:
+        self._Disable(e)
+        return None, 0
+
+    return value_cls.FromSerializedString(str(value)), num_bytes
+
+  def Put(self, local_path, stat_object, kind, value, num_bytes):
+    """Stores a value computed for the file described by stat_object."""
+    with self.lock:
+      if self.disabled:
+        return
+
+      try:
+        connection = self._Connection()
+        if self.num_entries >= self.max_entries:
+          self._Evict(connection)
+
+        connection.execute(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (stat_object.st_dev, self._FileId(local_path, stat_object), kind,
+             stat_object.st_size, stat_object.st_mtime, stat_object.st_ctime,
+             num_bytes, sqlite3.Binary(value.SerializeToString()),
+             int(time.time())))
+        connection.commit()
+        self.num_entries += 1
+      except (sqlite3.Error, OSError) as e:
+        self._Disable(e)
+
+  def _Evict(self, connection):
+    """Removes the least recently used entries."""
+    to_evict = max(1, int(self.max_entries * _EVICT_FRACTION))
+    connection.execute(
+        "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes "
+        "ORDER BY last_used, rowid LIMIT ?)", (to_evict,))
+    self.num_entries = connection.execute(
+        "SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+
+def CacheablePath(file_obj):
+  """Returns the local path for a VFS file whose hashes can be cached.
+
+  Only files read directly and completely from the local file system can be
+  identified by their stat information.
+
+  Args:
+    file_obj: An open VFS file object.
+
+  Returns:
+    The path of the file on the local file system or None.
+  """
+  if not isinstance(file_obj, files.File):
+    return None
+  if file_obj.file_offset or file_obj.pathspec.last.HasField(
+      "file_size_override"):
+    return None
+  return file_obj.filename
+
+
+_HASH_CACHE = None
+_HASH_CACHE_LOCK = threading.Lock()
+
+
+def GetHashCache():
+  """Returns the client's hash cache or None if it is disabled."""
+  global _HASH_CACHE
+
+  max_entries = config.CONFIG["Client.hash_cache_size"]
+  if not max_entries:
+    return None
+
+  path = config.CONFIG["Client.hash_cache_path"]
+  with _HASH_CACHE_LOCK:
+    if (_HASH_CACHE is None or _HASH_CACHE.path != path or
+        _HASH_CACHE.max_entries != max_entries):
+      _HASH_CACHE = HashCache(path, max_entries)
+    return _HASH_CACHE
+
+
+def CachedValue(local_path, kind, value_cls, compute_fn, bypass_cache=False):
+  """Returns a value computed over a file's content, using the hash cache.
+
+  Args:
+    local_path: The path of the file on the local file system.
+    kind: A string describing what compute_fn computes. Values are only shared
+          between calls using the same kind.
+    value_cls: The RDFValue class of the computed value.
+    compute_fn: A function returning a tuple of the computed value (or None if
+                it could not be computed) and the number of bytes read.
+    bypass_cache: If set, the value is always computed and not cached.
+
+  Returns:
+    The computed or cached value.
+  """
+  cache = GetHashCache()
+  if cache is None or bypass_cache:
+    return compute_fn()[0]
+
+  try:
+    stat_object = os.stat(local_path)
+  except OSError:
+    return compute_fn()[0]
+
+  # The stat information of devices and other special files says nothing
+  # about their content.
+  if not stat.S_ISREG(stat_object.st_mode):
+    return compute_fn()[0]
+
+  value, num_bytes = cache.Get(local_path, stat_object, kind, value_cls)
+  if value is not None:
+    stats.STATS.IncrementCounter("grr_client_hash_cache_hits")
+    stats.STATS.IncrementCounter(
+        "grr_client_hash_cache_bytes_saved", delta=num_bytes)
+    return value
+
+  stats.STATS.IncrementCounter("grr_client_hash_cache_misses")
+  value, num_bytes = compute_fn()
+  if value is None:
+    return value
+
+  # Only cache the value if the file did not change while we were reading it
+  # and its timestamps are old enough to catch the next modification.
+  try:
+    new_stat_object = os.stat(local_path)
+  except OSError:
+    return value
+
+  unchanged = all(
+      getattr(stat_object, attr) == getattr(new_stat_object, attr)
+      for attr in ["st_dev", "st_ino", "st_size", "st_mtime", "st_ctime"])
+  settled = time.time() - max(stat_object.st_mtime,
+                              stat_object.st_ctime) >= _MIN_FILE_AGE
+  if unchanged and settled:
+    cache.Put(local_path, stat_object, kind, value, num_bytes)
+
+  return value
+
+
+class HashCacheInit(registry.InitHook):
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric("grr_client_hash_cache_hits")
+    stats.STATS.RegisterCounterMetric("grr_client_hash_cache_misses")
+    stats.STATS.RegisterCounterMetric("grr_client_hash_cache_bytes_saved")
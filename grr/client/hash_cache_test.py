@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Tests for the client's hash cache."""
+
+import hashlib
+import os
+import time
+
+from grr.client import hash_cache
+from grr.client.client_actions import file_fingerprint
+from grr.client.client_actions import standard
+from grr.lib import flags
+from grr.lib import stats
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import crypto as rdf_crypto
+from grr.lib.rdfvalues import paths as rdf_paths
+from grr.test_lib import client_test_lib
+from grr.test_lib import test_lib
+
+
+class HashCacheTest(client_test_lib.EmptyActionTest):
+  """Tests for the hash cache."""
+
+  def setUp(self):
+    super(HashCacheTest, self).setUp()
+    self.config_overrider = test_lib.ConfigOverrider({
+        "Client.hash_cache_path": os.path.join(self.temp_dir, "hash_cache.db"),
+        "Client.hash_cache_size": 10
+    })
+    self.config_overrider.Start()
+
+    self.path = os.path.join(self.temp_dir, "file")
+    self._WriteFile("hello world", mtime=1000000000)
+
+  def tearDown(self):
+    super(HashCacheTest, self).tearDown()
+    self.config_overrider.Stop()
+
+  def _WriteFile(self, content, mtime=None):
+    with open(self.path, "wb") as fd:
+      fd.write(content)
+
+    # Set explicit modification times so that tests don't depend on the
+    # resolution of the file system's timestamps.
+    if mtime is not None:
+      os.utime(self.path, (mtime, mtime))
+
+  def _CachedHash(self, bypass_cache=False, age=10):
+    self.computed = 0
+
+    def Compute():
+      self.computed += 1
+      content = open(self.path, "rb").read()
+      return rdf_crypto.Hash(sha256=hashlib.sha256(content).digest()), len(
+          content)
+
+    # Pretend some time has passed so that the file is old enough to be
+    # cached.
+    with test_lib.FakeTime(time.time() + age):
+      return hash_cache.CachedValue(
+          self.path,
+          "test",
+          rdf_crypto.Hash,
+          Compute,
+          bypass_cache=bypass_cache)
+
+  def testCachedValueIsReused(self):
+    hits = stats.STATS.GetMetricValue("grr_client_hash_cache_hits")
+    saved = stats.STATS.GetMetricValue("grr_client_hash_cache_bytes_saved")
+
+    first = self._CachedHash()
+    self.assertEqual(self.computed, 1)
+
+    second = self._CachedHash()
+    self.assertEqual(self.computed, 0)
+    self.assertEqual(first, second)
+
+    self.assertEqual(
+        stats.STATS.GetMetricValue("grr_client_hash_cache_hits"), hits + 1)
+    self.assertEqual(
+        stats.STATS.GetMetricValue("grr_client_hash_cache_bytes_saved"),
+        saved + len("hello world"))
+
+    self._CachedHash(bypass_cache=True)
+    self.assertEqual(self.computed, 1)
+
+  def testModifiedFilesAreHashedAgain(self):
+    first = self._CachedHash()
+
+    # Same size as before, only the timestamps tell the files apart.
+    self._WriteFile("hello again", mtime=1000000100)
+    second = self._CachedHash()
+    self.assertEqual(self.computed, 1)
+    self.assertNotEqual(first.sha256, second.sha256)
+
+  def testRecentlyModifiedFilesAreNotCached(self):
+    self._WriteFile("hello again", mtime=time.time())
+
+    self._CachedHash(age=0)
+    self.assertEqual(self.computed, 1)
+    self._CachedHash(age=0)
+    self.assertEqual(self.computed, 1)
+
+  def testCacheIsBounded(self):
+    cache = hash_cache.GetHashCache()
+    stat_object = os.stat(self.path)
+    for i in range(25):
+      cache.Put(self.path, stat_object, "kind_%d" % i, rdf_crypto.Hash(), 0)
+
+    self.assertLessEqual(cache.num_entries, 10)
+    self.assertEqual(
+        cache.Get(self.path, stat_object, "kind_24", rdf_crypto.Hash)[0],
+        rdf_crypto.Hash())
+    self.assertEqual(
+        cache.Get(self.path, stat_object, "kind_0", rdf_crypto.Hash)[0], None)
+
+  def testHashFileAndFingerprintFileUseTheCache(self):
+    pathspec = rdf_paths.PathSpec(
+        path=self.path, pathtype=rdf_paths.PathSpec.PathType.OS)
+    misses = stats.STATS.GetMetricValue("grr_client_hash_cache_misses")
+
+    for action in [standard.HashFile, file_fingerprint.FingerprintFile]:
+      request = rdf_client.FingerprintRequest(
+          pathspec=pathspec,
+          tuples=[
+              rdf_client.FingerprintTuple(
+                  fp_type=rdf_client.FingerprintTuple.Type.FPT_GENERIC,
+                  hashers=[rdf_client.FingerprintTuple.HashType.SHA256])
+          ])
+      with test_lib.FakeTime(time.time() + 10):
+        first = self.RunAction(action, request)[0]
+        second = self.RunAction(action, request)[0]
+
+      self.assertEqual(first, second)
+      self.assertEqual(first.hash.sha256,
+                       hashlib.sha256("hello world").digest())
+      self.assertEqual(second.pathspec.path, self.path)
+
+    # Each action missed the cache once.
+    self.assertEqual(
+        stats.STATS.GetMetricValue("grr_client_hash_cache_misses"), misses + 2)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
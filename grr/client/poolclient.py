@@ -38,6 +38,17 @@ flags.DEFINE_bool("fast_poll", False,
                   "poll mode the timeouts are predictable and benchmarks "
                   "results are more stable.")
 
+flags.DEFINE_integer("benchmark_seconds", 0,
+                     "If specified, the pool polls the server for this many "
+                     "seconds once all clients are enrolled, reports the "
+                     "number of polls per second and exits. Use together "
+                     "with --fast_poll.")
+
+flags.DEFINE_integer("frontend_processes", 1,
+                     "The number of processes of the frontend the pool is "
+                     "running against. Used to report the polls per second "
+                     "handled by each frontend process.")
+
 
 class PoolGRRClient(threading.Thread):
   """A GRR client for running in pool mode."""
@@ -55,12 +66,15 @@ class PoolGRRClient(threading.Thread):
     self.stop = False
     # Is this client already enrolled?
     self.enrolled = False
+    # The number of successful polls.
+    self.polls = 0
 
   def Run(self):
     while not self.stop:
       status = self.client.RunOnce()
       if status.code == 200:
         self.enrolled = True
+        self.polls += 1
       self.client.timer.Wait()
 
   def Stop(self):
@@ -104,7 +118,10 @@ def CreateClientPool(n):
     bits = config.CONFIG["Client.rsa_key_length"]
     key = rdf_crypto.RSAPrivateKey.GenerateKey(bits=bits)
     clients.append(
-        PoolGRRClient(private_key=key, ca_cert=config.CONFIG["CA.certificate"]))
+        PoolGRRClient(
+            private_key=key,
+            ca_cert=config.CONFIG["CA.certificate"],
+            fast_poll=flags.FLAGS.fast_poll))
 
   # Start all the clients now.
   for c in clients:
@@ -124,6 +141,8 @@ def CreateClientPool(n):
         else:
           logging.info("%s: Enrolled %d/%d clients.",
                        int(time.time()), enrolled, n)
+    elif flags.FLAGS.benchmark_seconds:
+      RunBenchmark(clients, flags.FLAGS.benchmark_seconds)
     else:
       try:
         while True:
@@ -157,6 +176,26 @@ def CreateClientPool(n):
       fd.write("\n".join(b64_certs))
 
 
+def RunBenchmark(clients, seconds):
+  """Measures the polls per second the server handles for the pool."""
+  while not all(c.enrolled for c in clients):
+    logging.info("Waiting for %d/%d clients to enroll.",
+                 len([c for c in clients if not c.enrolled]), len(clients))
+    time.sleep(1)
+
+  start_polls = sum(c.polls for c in clients)
+  start_time = time.time()
+  time.sleep(seconds)
+  polls = sum(c.polls for c in clients) - start_polls
+  elapsed = time.time() - start_time
+
+  polls_per_second = polls / elapsed
+  logging.info("%d clients, %d polls in %.1f seconds: %.1f polls/sec, "
+               "%.1f polls/sec per frontend process.", len(clients), polls,
+               elapsed, polls_per_second,
+               polls_per_second / flags.FLAGS.frontend_processes)
+
+
 def CheckLocation():
   """Checks that the poolclient is not accidentally ran against production."""
   for url in (config.CONFIG["Client.server_urls"] +
@@ -57,6 +57,17 @@ config_lib.DEFINE_string(
     default=r"%(Client.install_path)\\rekall_profiles",
     help="Where GRR stores cached Rekall profiles needed for memory analysis")
 
+config_lib.DEFINE_string(
+    name="Client.hash_cache_path",
+    default=r"%(Client.install_path)\\hash_cache.db",
+    help="Where GRR stores hashes of files computed on the client.")
+
+config_lib.DEFINE_integer(
+    name="Client.hash_cache_size",
+    default=100000,
+    help=("Maximum number of file hashes kept in the client's hash cache. 0 "
+          "disables the cache."))
+
 config_lib.DEFINE_list(
     name="Client.server_urls", default=[], help="Base URL for client control.")
 
@@ -13,6 +13,30 @@ config_lib.DEFINE_string("Datastore.implementation", "FakeDataStore",
 config_lib.DEFINE_string("Blobstore.implementation", "MemoryStreamBlobstore",
                          "Blob storage subsystem to use.")
 
+config_lib.DEFINE_string(
+    "FileBlobstore.root",
+    default="%(Config.prefix)/var/grr-blobstore",
+    help="Directory the FileBlobstore keeps blobs in.")
+
+config_lib.DEFINE_bool(
+    "FileBlobstore.compression",
+    default=False,
+    help="If set, the FileBlobstore stores blobs zlib compressed.")
+
+config_lib.DEFINE_integer(
+    "FileBlobstore.bloom_filter_bits",
+    default=2**26,
+    help=("Size in bits of the bloom filter the FileBlobstore uses to answer "
+          "existence checks without hitting the disk. 0 disables the filter."))
+
+config_lib.DEFINE_semantic(
+    rdfvalue.Duration,
+    "FileBlobstore.bloom_filter_update_interval",
+    default="1m",
+    description=("How often the FileBlobstore lists the blob directories "
+                 "modified since their last listing to pick up blobs written "
+                 "by other processes."))
+
 DATASTORE_PATHING = [
     r"%{(?P<path>files/hash/generic/sha256/...).*}",
     r"%{(?P<path>files/hash/generic/sha1/...).*}",
@@ -35,6 +59,24 @@ config_lib.DEFINE_string(
     help=("Location of the data store (usually a "
           "filesystem directory)"))
 
+config_lib.DEFINE_integer(
+    "AFF4.attribute_cache_size",
+    default=0,
+    help=("Number of AFF4 objects whose attributes are kept in the in "
+          "process read cache of the AFF4 factory. 0 disables the cache."))
+
+config_lib.DEFINE_integer(
+    "AFF4.attribute_cache_age",
+    default=10,
+    help=("Maximum number of seconds attributes are served from the AFF4 "
+          "attribute cache before being read from the data store again."))
+
+config_lib.DEFINE_integer(
+    "AFF4.image_read_ahead_threads",
+    default=4,
+    help=("Maximum number of threads used to read ahead chunks of AFF4 images "
+          "that are read sequentially. 0 disables asynchronous read ahead."))
+
 # SQLite data store.
 config_lib.DEFINE_integer(
     "SqliteDatastore.vacuum_check",
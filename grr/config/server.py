@@ -37,6 +37,54 @@ config_lib.DEFINE_integer("Worker.queue_shards", 5,
                           "Queue notifications will be sharded across "
                           "this number of datastore subjects.")
 
+config_lib.DEFINE_bool("Worker.parallel_processing", False,
+                       "If set, workers fetch notifications from every queue "
+                       "shard in dedicated threads and process flows from a "
+                       "shared priority queue instead of walking the queues "
+                       "one by one.")
+
+config_lib.DEFINE_integer("Worker.processor_threads", 10,
+                          "Number of threads processing flows when "
+                          "Worker.parallel_processing is set.")
+
+config_lib.DEFINE_string("Worker.notification_channel",
+                         "LocalNotificationChannel",
+                         "The NotificationChannel used to wake up workers as "
+                         "soon as notifications are written to their queues. "
+                         "LocalNotificationChannel only covers notifications "
+                         "written in the same process, "
+                         "SocketNotificationChannel shares them through a "
+                         "notification broker. Empty to only poll.")
+
+config_lib.DEFINE_string("NotificationBroker.address", "localhost",
+                         "The address the notification broker listens on.")
+
+config_lib.DEFINE_integer("NotificationBroker.port", 8010,
+                          "The port the notification broker listens on.")
+
+config_lib.DEFINE_integer("Server.index_updater_threads", 4,
+                          "Number of threads updating the indexes of "
+                          "sequential collections in the background.")
+
+config_lib.DEFINE_bool("Server.client_search_index", False,
+                       "If set, client searches are answered from an index "
+                       "held in memory. It only matches the latest keywords "
+                       "of every client.")
+
+config_lib.DEFINE_semantic(
+    rdfvalue.Duration,
+    "Server.client_search_index_reconcile_interval",
+    default="1m",
+    description="How often the in-memory client search index reads the "
+    "clients indexed by other processes.")
+
+config_lib.DEFINE_semantic(
+    rdfvalue.Duration,
+    "Server.client_search_index_rebuild_interval",
+    default="6h",
+    description="How often the in-memory client search index is rebuilt "
+    "from all clients.")
+
 config_lib.DEFINE_list("Frontend.well_known_flows", ["TransferStore", "Stats"],
                        "Allow these well known flows to run directly on the "
                        "frontend. Other flows are scheduled as normal.")
@@ -111,6 +159,66 @@ config_lib.DEFINE_integer("Frontend.message_expiry_time", 600,
                           "Maximum time messages remain valid within the "
                           "system.")
 
+config_lib.DEFINE_bool("Frontend.pipeline_writes", False,
+                       "If set, messages received from clients are written to "
+                       "the data store by background threads in batches "
+                       "covering many clients while the request thread "
+                       "drains the client's queue. Messages that fail to be "
+                       "written are retried until they are stored.")
+
+config_lib.DEFINE_integer("Frontend.pipeline_queue_size", 1000,
+                          "Maximum number of client requests waiting to be "
+                          "written before request threads block.")
+
+config_lib.DEFINE_integer("Frontend.pipeline_batch_size", 500,
+                          "Maximum number of client requests written in a "
+                          "single data store flush.")
+
+config_lib.DEFINE_integer("Frontend.pipeline_writer_threads", 2,
+                          "Number of threads writing received messages.")
+
+config_lib.DEFINE_bool("Frontend.batch_drains", False,
+                       "If set, the task queues of clients polling at about "
+                       "the same time are drained together.")
+
+config_lib.DEFINE_float("Frontend.drain_batch_delay", 0.005,
+                        "How long in seconds a poll waits for others to join "
+                        "its drain batch.")
+
+config_lib.DEFINE_integer("Frontend.drain_batch_size", 100,
+                          "Maximum number of clients drained together.")
+
+config_lib.DEFINE_integer("Frontend.processes", 1,
+                          "Number of frontend processes accepting client "
+                          "connections on the frontend port. With more than "
+                          "one, client keys and ciphers are shared between "
+                          "the processes.")
+
+config_lib.DEFINE_integer("Frontend.client_key_preload_count", 50000,
+                          "Number of client keys the frontend loads from the "
+                          "client key index when it starts. 0 disables "
+                          "preloading.")
+
+config_lib.DEFINE_semantic(
+    rdfvalue.Duration,
+    "Frontend.client_key_preload_age",
+    default="7d",
+    description="The frontend preloads the keys of clients active within "
+    "this time when it starts.")
+
+config_lib.DEFINE_integer("Frontend.outbound_cipher_cache_size", 50000,
+                          "Number of clients to keep the cipher for responses "
+                          "cached for.")
+
+config_lib.DEFINE_integer("Frontend.outbound_cipher_ttl", 3600,
+                          "Seconds a cipher for responses to a client is "
+                          "reused before a new one is created.")
+
+config_lib.DEFINE_integer("Frontend.outbound_cipher_max_uses", 10000,
+                          "Number of responses to a client encrypted with the "
+                          "same cipher before a new one is created. 0 for no "
+                          "limit.")
+
 config_lib.DEFINE_string("Frontend.upload_store", "FileUploadFileStore",
                          "The implementation of the upload file store.")
 
@@ -259,6 +367,14 @@ config_lib.DEFINE_integer(
     "maximum number of clients that are allowed to crash before the hunt is "
     "automatically hard-stopped.")
 
+config_lib.DEFINE_integer(
+    "Hunt.results_processing_threads",
+    default=0,
+    help="If non-zero, ProcessHuntResultCollectionsCronFlow runs the output "
+    "plugins of up to this many hunts at the same time, each in its own "
+    "thread, and reads the next batch of results while the plugins process "
+    "the current one. 0 processes the hunts one by one.")
+
 config_lib.DEFINE_bool("Rekall.enabled", False,
                        "If True then Rekall-based flows (AnalyzeClientMemory, "
                        "MemoryCollector, ListVADBinaries) will be enabled in "
@@ -266,3 +382,10 @@ config_lib.DEFINE_bool("Rekall.enabled", False,
                        "in the maintenance mode and may not work correctly or "
                        "may not be stable enough.")
 
+
+config_lib.DEFINE_integer(
+    "Export.conversion_processes",
+    default=0,
+    help="If non-zero, instant output plugins run the export converters that "
+    "support it in a pool of this many processes. 0 converts the values in "
+    "the exporting process.")
@@ -262,6 +262,23 @@ class ApiClientLibHuntTest(standard_test.StandardHuntTestMixin, ApiE2ETest):
       self.assertEqual(r.timestamp, 42000000)
       self.assertEqual(r.payload.pathspec.path, "/tmp/evil.txt")
 
+  def testListResultsWithPrefetching(self):
+    self.client_ids = self.SetupClients(5)
+    hunt_urn = self.StartHunt()
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    results = list(self.api.Hunt(hunt_urn.Basename()).ListResults())
+
+    prefetching_api = grr_api.InitHttp(
+        api_endpoint=self.endpoint, page_size=2, prefetch_pages=3)
+    prefetched_results = list(
+        prefetching_api.Hunt(hunt_urn.Basename()).ListResults())
+
+    self.assertEqual(len(prefetched_results), 5)
+    self.assertEqual([r.data for r in prefetched_results],
+                     [r.data for r in results])
+
   def testListLogsWithoutClientIds(self):
     self.hunt_obj.Log("Sample message: foo.")
     self.hunt_obj.Log("Sample message: bar.")
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""A compressed bitmap of non-negative integers.
+
+Like a roaring bitmap, values are split into chunks of 2**16 by their upper
+bits. Sparse chunks are stored as sorted arrays of the lower 16 bits, dense
+chunks as a single 65536 bit integer. A set with a handful of values only takes
+a few bytes while operations on dense chunks run over machine words instead of
+Python objects.
+"""
+
+
+import array
+import bisect
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+
+# Chunks holding more values than this are stored as bit sets.
+ARRAY_MAX_SIZE = 4096
+
+
+def _IsArray(container):
+  return isinstance(container, array.array)
+
+
+def _BitsFromValues(values):
+  """Builds the bit set of a chunk from a sequence of values."""
+  data = bytearray(CHUNK_SIZE // 8)
+  for value in values:
+    data[value >> 3] |= 1 << (value & 7)
+  data.reverse()
+  return long(str(data).encode("hex"), 16)
+
+
+def _BytesFromBits(bits):
+  """Returns the bytes of a bit set, least significant byte first."""
+  data = bytearray(("%x" % bits).zfill(CHUNK_SIZE // 4).decode("hex"))
+  data.reverse()
+  return data
+
+
+def _ValuesFromBits(bits):
+  """Returns the sorted values in a bit set."""
+  values = array.array("H")
+  for i, byte in enumerate(_BytesFromBits(bits)):
+    if byte:
+      base = i << 3
+      for j in xrange(8):
+        if byte >> j & 1:
+          values.append(base + j)
+  return values
+
+
+def _ToBits(container):
+  if _IsArray(container):
+    return _BitsFromValues(container)
+  return container
+
+
+def _Count(container):
+  if _IsArray(container):
+    return len(container)
+  return bin(container).count("1")
+
+
+def _Compact(container):
+  """Returns the container in its preferred form or None if it is empty."""
+  if not container:
+    return None
+
+  if _IsArray(container):
+    if len(container) > ARRAY_MAX_SIZE:
+      return _BitsFromValues(container)
+    return container
+
+  if _Count(container) <= ARRAY_MAX_SIZE:
+    return _ValuesFromBits(container)
+  return container
+
+
+def _Filter(values, bits, keep):
+  """Returns the values whose presence in bits equals keep."""
+  data = _BytesFromBits(bits)
+  return array.array(
+      "H", [v for v in values if bool(data[v >> 3] >> (v & 7) & 1) == keep])
+
+
+def _And(a, b):
+  if _IsArray(a) and _IsArray(b):
+    return array.array("H", sorted(set(a).intersection(b)))
+  if _IsArray(a):
+    return _Filter(a, b, True)
+  if _IsArray(b):
+    return _Filter(b, a, True)
+  return a & b
+
+
+def _Or(a, b):
+  if _IsArray(a) and _IsArray(b):
+    return array.array("H", sorted(set(a).union(b)))
+  return _ToBits(a) | _ToBits(b)
+
+
+def _AndNot(a, b):
+  if _IsArray(a):
+    if _IsArray(b):
+      excluded = set(b)
+      return array.array("H", [v for v in a if v not in excluded])
+    return _Filter(a, b, False)
+  return a & ~_ToBits(b)
+
+
+def _Copy(container):
+  if _IsArray(container):
+    return array.array("H", container)
+  return container
+
+
+class Bitmap(object):
+  """A set of non-negative integers supporting fast set operations."""
+
+  __slots__ = ("chunks",)
+
+  def __init__(self, values=None):
+    self.chunks = {}
+
+    groups = {}
+    for value in values or ():
+      groups.setdefault(value >> CHUNK_BITS, set()).add(value & CHUNK_MASK)
+
+    for key, low_values in groups.iteritems():
+      self.chunks[key] = _Compact(array.array("H", sorted(low_values)))
+
+  def _SetChunk(self, key, container):
+    container = _Compact(container)
+    if container is None:
+      self.chunks.pop(key, None)
+    else:
+      self.chunks[key] = container
+
+  def Add(self, value):
+    key, low = value >> CHUNK_BITS, value & CHUNK_MASK
+    container = self.chunks.get(key)
+    if container is None:
+      self.chunks[key] = array.array("H", [low])
+    elif _IsArray(container):
+      i = bisect.bisect_left(container, low)
+      if i == len(container) or container[i] != low:
+        container.insert(i, low)
+        if len(container) > ARRAY_MAX_SIZE:
+          self.chunks[key] = _BitsFromValues(container)
+    else:
+      self.chunks[key] = container | (1 << low)
+
+  def Discard(self, value):
+    key, low = value >> CHUNK_BITS, value & CHUNK_MASK
+    container = self.chunks.get(key)
+    if container is None:
+      return
+
+    if _IsArray(container):
+      i = bisect.bisect_left(container, low)
+      if i < len(container) and container[i] == low:
+        del container[i]
+        if not container:
+          del self.chunks[key]
+    elif container >> low & 1:
+      self._SetChunk(key, container & ~(1 << low))
+
+  def Copy(self):
+    result = Bitmap()
+    for key, container in self.chunks.iteritems():
+      result.chunks[key] = _Copy(container)
+    return result
+
+  def __contains__(self, value):
+    key, low = value >> CHUNK_BITS, value & CHUNK_MASK
+    container = self.chunks.get(key)
+    if container is None:
+      return False
+
+    if _IsArray(container):
+      i = bisect.bisect_left(container, low)
+      return i < len(container) and container[i] == low
+    return bool(container >> low & 1)
+
+  def __len__(self):
+    return sum(_Count(container) for container in self.chunks.itervalues())
+
+  def __nonzero__(self):
+    return bool(self.chunks)
+
+  def __iter__(self):
+    for key in sorted(self.chunks):
+      container = self.chunks[key]
+      if not _IsArray(container):
+        container = _ValuesFromBits(container)
+
+      base = key << CHUNK_BITS
+      for low in container:
+        yield base + low
+
+  def __eq__(self, other):
+    if not isinstance(other, Bitmap):
+      return NotImplemented
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    if result is NotImplemented:
+      return result
+    return not result
+
+  def __and__(self, other):
+    result = Bitmap()
+    if len(other.chunks) < len(self.chunks):
+      self, other = other, self  # pylint: disable=self-cls-assignment
+
+    for key, container in self.chunks.iteritems():
+      other_container = other.chunks.get(key)
+      if other_container is not None:
+        result._SetChunk(key, _And(container, other_container))
+    return result
+
+  def __or__(self, other):
+    result = self.Copy()
+    for key, container in other.chunks.iteritems():
+      own_container = result.chunks.get(key)
+      if own_container is None:
+        result.chunks[key] = _Copy(container)
+      else:
+        result._SetChunk(key, _Or(own_container, container))
+    return result
+
+  def __sub__(self, other):
+    result = Bitmap()
+    for key, container in self.chunks.iteritems():
+      other_container = other.chunks.get(key)
+      if other_container is None:
+        result.chunks[key] = _Copy(container)
+      else:
+        result._SetChunk(key, _AndNot(container, other_container))
+    return result
+
+  def __repr__(self):
+    return "<Bitmap with %d values>" % len(self)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Tests for grr.lib.bitmap."""
+
+
+import array
+import random
+
+from grr.lib import bitmap
+from grr.lib import flags
+from grr.test_lib import test_lib
+
+
+class BitmapTest(test_lib.GRRBaseTest):
+  """Tests the Bitmap."""
+
+  def _RandomValues(self, rand, count, max_value):
+    return set(rand.randrange(max_value) for _ in xrange(count))
+
+  def testAddDiscardContains(self):
+    b = bitmap.Bitmap()
+    self.assertFalse(b)
+    self.assertNotIn(5, b)
+
+    for value in [5, 3, 70000, 5]:
+      b.Add(value)
+    self.assertEqual(list(b), [3, 5, 70000])
+    self.assertEqual(len(b), 3)
+    self.assertIn(70000, b)
+
+    b.Discard(5)
+    b.Discard(6)
+    self.assertEqual(list(b), [3, 70000])
+
+  def testDenseChunks(self):
+    values = range(0, 20000, 2)
+    b = bitmap.Bitmap(values)
+    # More values than fit into an array chunk.
+    self.assertIsInstance(b.chunks[0], long)
+    self.assertEqual(list(b), values)
+
+    for value in values[bitmap.ARRAY_MAX_SIZE:]:
+      b.Discard(value)
+    self.assertEqual(list(b), values[:bitmap.ARRAY_MAX_SIZE])
+    self.assertIsInstance(b.chunks[0], array.array)
+
+  def testSetOperationsMatchSets(self):
+    rand = random.Random(0)
+    for first_count, second_count in [(10, 10), (10, 20000), (20000, 30000),
+                                      (100000, 10)]:
+      first = self._RandomValues(rand, first_count, 200000)
+      second = self._RandomValues(rand, second_count, 200000)
+      first_bitmap = bitmap.Bitmap(first)
+      second_bitmap = bitmap.Bitmap(second)
+
+      self.assertEqual(list(first_bitmap), sorted(first))
+      self.assertEqual(len(first_bitmap), len(first))
+      self.assertEqual(
+          list(first_bitmap & second_bitmap), sorted(first & second))
+      self.assertEqual(
+          list(first_bitmap | second_bitmap), sorted(first | second))
+      self.assertEqual(
+          list(first_bitmap - second_bitmap), sorted(first - second))
+
+  def testOperationsDoNotModifyOperands(self):
+    first = bitmap.Bitmap([1, 2, 3])
+    second = bitmap.Bitmap([3, 4])
+
+    union = first | second
+    union.Add(10)
+    difference = first - second
+    difference.Add(11)
+
+    self.assertEqual(first, bitmap.Bitmap([1, 2, 3]))
+    self.assertEqual(second, bitmap.Bitmap([3, 4]))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
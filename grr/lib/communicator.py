@@ -161,6 +161,23 @@ class ReceivedCipher(Cipher):
     except (rdf_crypto.InvalidSignature, rdf_crypto.CipherError) as e:
       raise DecryptionError(e)
 
+  def __getstate__(self):
+    # Once verified, a cipher only needs its keys and metadata. This is what
+    # gets shared with other processes.
+    return {
+        "serialized_cipher": self.serialized_cipher,
+        "cipher_metadata": self.cipher_metadata.SerializeToString()
+    }
+
+  def __setstate__(self, state):
+    self.private_key = None
+    self.response_comms = None
+    self.serialized_cipher = state["serialized_cipher"]
+    self.cipher = rdf_flows.CipherProperties.FromSerializedString(
+        self.serialized_cipher)
+    self.cipher_metadata = rdf_flows.CipherMetadata.FromSerializedString(
+        state["cipher_metadata"])
+
   def GetSource(self):
     return self.cipher_metadata.source
 
@@ -305,6 +322,11 @@ class Communicator(object):
     self.server_cipher_age = rdfvalue.RDFDatetime.Now()
     return self.server_cipher
 
+  def _GetCipherForDestination(self, destination):
+    """Returns a cipher to encrypt messages for destination."""
+    remote_public_key = self._GetRemotePublicKey(destination)
+    return Cipher(self.common_name, self.private_key, remote_public_key)
+
   def EncodeMessages(self,
                      message_list,
                      result,
@@ -349,8 +371,7 @@ class Communicator(object):
       # it's the only cipher it ever uses.
       cipher = self._GetServerCipher()
     else:
-      remote_public_key = self._GetRemotePublicKey(destination)
-      cipher = Cipher(self.common_name, self.private_key, remote_public_key)
+      cipher = self._GetCipherForDestination(destination)
 
     # Make a nonce for this transaction
     if timestamp is None:
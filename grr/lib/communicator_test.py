@@ -5,6 +5,7 @@
 import array
 import logging
 import pdb
+import pickle
 import time
 
 
@@ -276,6 +277,136 @@ class ClientCommsTest(test_lib.GRRBaseTest):
       except communicator.DecodingError as e:
         logging.debug("Detected alteration at %s: %s", x, e)
 
+  def testReceivedCipherCanBePickled(self):
+    self.MakeClientAFF4Record()
+    self.ClientServerCommunicate()
+
+    response_comms = rdf_flows.ClientCommunication.FromSerializedString(
+        self.cipher_text)
+    cipher = self.server_communicator.encrypted_cipher_cache.Get(
+        response_comms.encrypted_cipher)
+
+    restored = pickle.loads(pickle.dumps(cipher, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(restored.GetSource(), cipher.GetSource())
+    self.assertTrue(restored.VerifyReceivedHMAC(response_comms))
+    self.assertTrue(
+        restored.VerifyCipherSignature(
+            self.client_private_key.GetPublicKey()))
+
+  def testServerCommunicatorsShareCaches(self):
+    self.MakeClientAFF4Record()
+    shared_caches = {
+        "pub_keys": utils.FastStore(max_size=10),
+        "ciphers": utils.FastStore(max_size=10)
+    }
+    self.server_communicator = front_end.ServerCommunicator(
+        certificate=self.server_certificate,
+        private_key=self.server_private_key,
+        token=self.token,
+        shared_caches=shared_caches)
+    self.ClientServerCommunicate()
+
+    other_communicator = front_end.ServerCommunicator(
+        certificate=self.server_certificate,
+        private_key=self.server_private_key,
+        token=self.token,
+        shared_caches=shared_caches)
+
+    rsa_operations = stats.STATS.GetMetricValue("grr_rsa_operations")
+    decoded_messages, _, _ = other_communicator.DecryptMessage(
+        self.cipher_text)
+    # The cipher was verified by the first communicator already.
+    self.assertEqual(
+        stats.STATS.GetMetricValue("grr_rsa_operations"), rsa_operations)
+    self.assertEqual(decoded_messages[0].auth_state,
+                     rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED)
+
+  def testPublicKeysAreReadFromTheKeyIndex(self):
+    self.MakeClientAFF4Record()
+    self.ClientServerCommunicate()
+
+    # A restarted frontend finds the key in the index.
+    self.server_communicator = front_end.ServerCommunicator(
+        certificate=self.server_certificate,
+        private_key=self.server_private_key,
+        token=self.token)
+    hits = stats.STATS.GetMetricValue("grr_client_key_index", fields=["hits"])
+    decoded_messages = self.ClientServerCommunicate()
+    self.assertEqual(
+        stats.STATS.GetMetricValue("grr_client_key_index", fields=["hits"]),
+        hits + 1)
+    self.assertEqual(decoded_messages[0].auth_state,
+                     rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED)
+
+  def testPreloadPublicKeys(self):
+    self.MakeClientAFF4Record()
+    self.ClientServerCommunicate()
+
+    server_communicator = front_end.ServerCommunicator(
+        certificate=self.server_certificate,
+        private_key=self.server_private_key,
+        token=self.token)
+    self.assertEqual(
+        server_communicator.PreloadPublicKeys(rdfvalue.Duration("1d")), 1)
+
+    client_key = server_communicator.pub_key_cache.Get(
+        str(self.client_communicator.common_name))
+    self.assertEqual(client_key.AsPEM(),
+                     self.client_private_key.GetPublicKey().AsPEM())
+
+  def _ServerResponse(self):
+    message_list = rdf_flows.MessageList()
+    message_list.job.Append(session_id="W:1234", name="response")
+    result = rdf_flows.ClientCommunication()
+    self.server_communicator.EncodeMessages(
+        message_list,
+        result,
+        destination=self.client_communicator.common_name)
+
+    decoded, _, _ = self.client_communicator.DecryptMessage(
+        result.SerializeToString())
+    self.assertEqual(decoded[0].name, "response")
+    return result
+
+  def testServerReusesCipherForClient(self):
+    self.MakeClientAFF4Record()
+
+    with test_lib.FakeTime(1000):
+      first = self._ServerResponse()
+      second = self._ServerResponse()
+      self.assertEqual(first.encrypted_cipher, second.encrypted_cipher)
+      # Every packet still gets its own iv.
+      self.assertNotEqual(first.packet_iv, second.packet_iv)
+
+    ttl = config.CONFIG["Frontend.outbound_cipher_ttl"]
+    with test_lib.FakeTime(1000 + ttl + 1):
+      third = self._ServerResponse()
+      self.assertNotEqual(first.encrypted_cipher, third.encrypted_cipher)
+
+  def testServerReusesCipherForReloadedKey(self):
+    self.MakeClientAFF4Record()
+    first = self._ServerResponse()
+
+    # Key caches hand out new objects for the same key, e.g. after a reload.
+    common_name = str(self.client_communicator.common_name)
+    pub_key = self.server_communicator.pub_key_cache.Get(common_name)
+    self.server_communicator.pub_key_cache.Put(
+        common_name,
+        rdf_crypto.RSAPublicKey.FromSerializedString(
+            pub_key.SerializeToString()))
+
+    second = self._ServerResponse()
+    self.assertEqual(first.encrypted_cipher, second.encrypted_cipher)
+
+  def testServerRotatesCipherAfterMaxUses(self):
+    self.MakeClientAFF4Record()
+    self.server_communicator.outbound_cipher_max_uses = 2
+
+    ciphers = [self._ServerResponse().encrypted_cipher for _ in range(4)]
+    self.assertEqual(ciphers[0], ciphers[1])
+    self.assertNotEqual(ciphers[1], ciphers[2])
+    self.assertEqual(ciphers[2], ciphers[3])
+
   def testEnrollingCommunicator(self):
     """Test that the ClientCommunicator generates good keys."""
     self.client_communicator = comms.ClientCommunicator()
@@ -2,10 +2,16 @@
 """This module tests the RDFValue implementation for performance."""
 
 
+import gc
+import sys
+import time
+import types
 
 from grr.lib import flags
 from grr.lib import type_info
+from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import paths as rdf_paths
 from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import jobs_pb2
 from grr.proto import knowledge_base_pb2
@@ -55,6 +61,35 @@ class FastGrrMessageList(rdf_structs.RDFProtoStruct):
               name="job", field_number=1, nested=StructGrrMessage)))
 
 
+def DeepSize(objects):
+  """Approximates the memory used by objects and everything they reference.
+
+  Classes, modules, functions and type descriptors are shared by all instances
+  and are not counted.
+
+  Args:
+    objects: A list of objects.
+
+  Returns:
+    The size in bytes.
+  """
+  shared_types = (type, types.ModuleType, types.FunctionType,
+                  rdf_structs.ProtoType)
+  seen = set()
+  size = 0
+  todo = list(objects)
+  while todo:
+    obj = todo.pop()
+    if id(obj) in seen or isinstance(obj, shared_types):
+      continue
+
+    seen.add(id(obj))
+    size += sys.getsizeof(obj)
+    todo.extend(gc.get_referents(obj))
+
+  return size
+
+
 class RDFValueBenchmark(benchmark_test_lib.AverageMicroBenchmarks):
   """Microbenchmark tests for RDFProtos."""
 
@@ -207,6 +242,69 @@ class RDFValueBenchmark(benchmark_test_lib.AverageMicroBenchmarks):
     self.assertEqual(unserialized.job[134].session_id, "test")
     self.assertEqual(unserialized.job[100].request_id, 100)
 
+  def testAcceleratedDecodeEncode(self):
+    """Compare the C accelerator with the pure Python implementation."""
+    repeats = self.REPEATS / 50
+    s = jobs_pb2.MessageList()
+    for i in range(self.REPEATS):
+      s.job.add(session_id="test", name="foobar", request_id=i, args="x" * 100)
+
+    test_data = s.SerializeToString()
+
+    def DecodeEncode():
+      message_list = FastGrrMessageList.FromSerializedString(test_data)
+      # Decode one message so it is not just copied.
+      message_list.job[100].request_id = 1000
+      self.assertEqual(message_list.job[101].request_id, 101)
+      return message_list.SerializeToString()
+
+    accelerated = DecodeEncode()
+    self.TimeIt(
+        DecodeEncode, "Accelerated Repeated Decode/Encode", repetitions=repeats)
+
+    with utils.MultiStubber(
+        (rdf_structs, "ReadIntoObject", rdf_structs.PyReadIntoObject),
+        (rdf_structs, "SerializeEntries", rdf_structs.PySerializeEntries)):
+      pure = DecodeEncode()
+      self.TimeIt(
+          DecodeEncode,
+          "Pure Python Repeated Decode/Encode",
+          repetitions=repeats)
+
+    self.assertEqual(accelerated, pure)
+
+  def testCompactMemoryUsage(self):
+    """Compare the memory used by parsed and compact structs."""
+    count = self.REPEATS * 10
+    serialized = [
+        rdf_client.StatEntry(
+            pathspec=rdf_paths.PathSpec(
+                path="/home/user/file%d" % i,
+                pathtype=rdf_paths.PathSpec.PathType.OS),
+            st_mode=33188,
+            st_ino=1000 + i,
+            st_dev=2049,
+            st_nlink=1,
+            st_uid=1000,
+            st_gid=1000,
+            st_size=i * 100,
+            st_atime=1500000000 + i,
+            st_mtime=1500000000 + i,
+            st_ctime=1500000000 + i).SerializeToString() for i in range(count)
+    ]
+
+    for name, compact in [("Parsed", False), ("Compact", True)]:
+      start = time.time()
+      entries = [
+          rdf_client.StatEntry.FromSerializedString(data, compact=compact)
+          for data in serialized
+      ]
+      time_taken = (time.time() - start) / count
+
+      self.AddResult("%s StatEntry (bytes per object)" % name, time_taken,
+                     count, DeepSize(entries) / count)
+      self.assertEqual(entries[count - 1].st_size, (count - 1) * 100)
+
   def testDecode(self):
     """Test decoding performance."""
 
@@ -262,6 +262,9 @@ class RSAPublicKey(rdfvalue.RDFValue):
         raise rdfvalue.InitializeError("Cannot initialize %s from %s." %
                                        (self.__class__, initializer))
 
+  def __reduce__(self):
+    return (RSAPublicKey, (self.SerializeToString(),))
+
   def GetRawPublicKey(self):
     return self._value
 
@@ -288,6 +291,23 @@ class RSAPublicKey(rdfvalue.RDFValue):
   def AsPEM(self):
     return self.SerializeToString()
 
+  def AsDER(self):
+    """Returns the key in the more compact DER encoding."""
+    if self._value is None:
+      return ""
+    return self._value.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo)
+
+  @classmethod
+  def FromDER(cls, der_string):
+    try:
+      return cls(
+          serialization.load_der_public_key(
+              der_string, backend=openssl.backend))
+    except (TypeError, ValueError, exceptions.UnsupportedAlgorithm) as e:
+      raise type_info.TypeValueError("Public key invalid: %s" % e)
+
   def KeyLen(self):
     if self._value is None:
       return 0
@@ -252,12 +252,25 @@ def ReadIntoObject(buff, index, value_obj, length=0):
   value_obj.SetRawData(raw_data)
 
 
-# pylint: disable=invalid-name
+# The pure Python versions are used when the accelerator is not available and
+# in tests, to check that the accelerated versions produce identical results.
+PySerializeEntries = SerializeEntries
+PyReadIntoObject = ReadIntoObject
+
+# pylint: disable=invalid-name,function-redefined
 if _semantic:
   VarintEncode = _semantic.varint_encode
   VarintReader = _semantic.varint_decode
   SplitBuffer = _semantic.split_buffer
-# pylint: enable=invalid-name
+
+  # Older builds of the accelerator only handle varints and splitting.
+  if hasattr(_semantic, "serialize_entries"):
+    SerializeEntries = _semantic.serialize_entries
+
+    def ReadIntoObject(buff, index, value_obj, length=0):
+      _semantic.read_into_object(buff, index, value_obj, length, ProtoList)
+
+# pylint: enable=invalid-name,function-redefined
 
 
 class ProtoType(type_info.TypeInfoObject):
@@ -1465,6 +1478,28 @@ class ProtoRDFValue(ProtoType):
         self.name, self.proto_type_name, self.owner.__name__, self.field_number)
 
 
+class _CompactRawData(object):
+  """Parses the serialized form of compact structs on first access.
+
+  This is a non-data descriptor, once the raw data is stored in the instance
+  dict it is found there directly and this is not called anymore.
+  """
+
+  def __get__(self, instance, owner):
+    if instance is None:
+      return None
+
+    serialized = instance.__dict__.pop("_serialized", None)
+    if serialized is None:
+      return None
+
+    # pylint: disable=protected-access
+    instance._data = {}
+    ReadIntoObject(serialized, 0, instance)
+    return instance._data
+    # pylint: enable=protected-access
+
+
 class RDFStructMetaclass(rdfvalue.RDFValueMetaclass):
   """A metaclass which registers new RDFProtoStruct instances."""
 
@@ -1543,7 +1578,10 @@ class RDFStruct(rdfvalue.RDFValue):
   dirty = False
 
   # Stores the raw data here.
-  _data = None
+  _data = _CompactRawData()
+
+  # The serialized form of compact structs whose raw data was not parsed yet.
+  _serialized = None
 
   # A list of fields which will be removed from this class's type descriptor
   # set.
@@ -1591,7 +1629,12 @@ class RDFStruct(rdfvalue.RDFValue):
       other: An instance of the same type of this class.
 
     """
+    if other._serialized is not None:  # pylint: disable=protected-access
+      self._SetSerialized(other._serialized)  # pylint: disable=protected-access
+      return
+
     self._data = {}
+    self.__dict__.pop("_serialized", None)
     for name, (obj, serialized, t_info) in other.GetRawData().iteritems():
       if serialized is None:
         serialized = t_info.ConvertToWireFormat(obj)
@@ -1601,6 +1644,67 @@ class RDFStruct(rdfvalue.RDFValue):
   def Clear(self):
     """Clear all the fields."""
     self._data = {}
+    self.__dict__.pop("_serialized", None)
+
+  @classmethod
+  def _SupportsCompact(cls):
+    """Returns True if instances of this class can be made compact."""
+    supported = cls.__dict__.get("_supports_compact")
+    if supported is None:
+      # Compact structs bypass these methods, classes customizing them need
+      # their raw data parsed.
+      supported = all(
+          getattr(cls, method).__func__ is getattr(RDFStruct, method).__func__
+          for method in ["ParseFromString", "SerializeToString", "GetRawData",
+                         "SetRawData"])
+      cls._supports_compact = supported
+
+    return supported
+
+  def _SetSerialized(self, serialized):
+    self.__dict__.pop("_data", None)
+    self._serialized = serialized
+    self.dirty = True
+
+  def Compact(self):
+    """Releases the parsed fields, keeping only the serialized form.
+
+    A compact struct uses a fraction of the memory of a parsed one, which
+    matters when holding many of them. The serialized form is parsed again on
+    first access to any field. Values previously obtained from fields of this
+    struct are no longer connected to it, modifying them does not modify the
+    struct anymore. The first access modifies the struct, so compact structs
+    must not be shared between threads without locking.
+
+    Returns:
+      This struct.
+    """
+    if self._SupportsCompact():
+      self._SetSerialized(self.SerializeToString())
+
+    return self
+
+  @classmethod
+  def FromSerializedString(cls, value, age=None, compact=False):
+    """Creates a struct from its serialized form.
+
+    Args:
+      value: The serialized struct.
+      age: The age of the struct.
+      compact: If set, the fields are only parsed on first access, see
+        Compact(). Parsing errors are raised then instead of here.
+
+    Returns:
+      The new struct.
+    """
+    if not (compact and cls._SupportsCompact()):
+      return super(RDFStruct, cls).FromSerializedString(value, age=age)
+
+    res = cls()
+    res._SetSerialized(value)  # pylint: disable=protected-access
+    if age:
+      res.age = age
+    return res
 
   def HasField(self, field_name):
     """Checks if the field exists."""
@@ -1636,7 +1740,12 @@ class RDFStruct(rdfvalue.RDFValue):
   def Copy(self):
     """Make an efficient copy of this protobuf."""
     result = self.__class__()
-    result.SetRawData(self._CopyRawData())
+    if self._serialized is not None:
+      # pylint: disable=protected-access
+      result._SetSerialized(self._serialized)
+      # pylint: enable=protected-access
+    else:
+      result.SetRawData(self._CopyRawData())
 
     # The copy should have the same age as us.
     result.age = self.age
@@ -1671,9 +1780,14 @@ class RDFStruct(rdfvalue.RDFValue):
 
   def SetRawData(self, data):
     self._data = data
+    self.__dict__.pop("_serialized", None)
     self.dirty = True
 
   def SerializeToString(self):
+    # Compact structs which were not accessed since are serialized as is.
+    if self._serialized is not None:
+      return self._serialized
+
     return SerializeEntries(self._data.itervalues())
 
   def ParseFromString(self, string):
@@ -1684,6 +1798,12 @@ class RDFStruct(rdfvalue.RDFValue):
     if not isinstance(other, self.__class__):
       return False
 
+    # pylint: disable=protected-access
+    if (self._serialized is not None and
+        self._serialized == other._serialized):
+      return True
+    # pylint: enable=protected-access
+
     if len(self._data) != len(other.GetRawData()):
       return False
 
@@ -1992,6 +2112,9 @@ class RDFProtoStruct(RDFStruct):
         return value
 
   def __nonzero__(self):
+    if self._serialized is not None:
+      return bool(self._serialized)
+
     return bool(self._data)
 
   @classmethod
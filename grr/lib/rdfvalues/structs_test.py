@@ -363,6 +363,67 @@ class RDFStructsTest(test_base.RDFValueTestCase):
     # Check that nested fields are also preserved.
     self.assertEqual(decoded_tested.nested.foobar, "goodbye")
 
+  def testAcceleratedFunctionsMatchPurePython(self):
+    """The accelerator must behave exactly like the pure Python code."""
+    tested = TestStruct(
+        foobar="hello",
+        int=2,
+        repeated=["value0", "value1"],
+        nested=TestStruct(int=567),
+        repeat_nested=[TestStruct(int=568), TestStruct(foobar="nested")])
+    data = tested.SerializeToString()
+
+    # Decode with a struct missing most fields so unknown fields are kept too.
+    for cls in [TestStruct, PartialTest1]:
+      accelerated = cls()
+      structs.ReadIntoObject(data, 0, accelerated)
+      pure = cls()
+      structs.PyReadIntoObject(data, 0, pure)
+
+      self.assertEqual(accelerated.GetRawData().keys(),
+                       pure.GetRawData().keys())
+      self.assertEqual(
+          structs.SerializeEntries(accelerated.GetRawData().itervalues()),
+          structs.PySerializeEntries(pure.GetRawData().itervalues()))
+
+    # Modified fields are serialized again, unmodified ones are copied.
+    decoded = TestStruct.FromSerializedString(data)
+    decoded.nested.int = 1
+    decoded.repeat_nested[0].foobar = "changed"
+    self.assertEqual(
+        structs.SerializeEntries(decoded.GetRawData().itervalues()),
+        structs.PySerializeEntries(decoded.GetRawData().itervalues()))
+    self.assertEqual(
+        TestStruct.FromSerializedString(decoded.SerializeToString()).nested.int,
+        1)
+
+  def testCompactStructs(self):
+    data = TestStruct(
+        foobar="hello", int=2, nested=TestStruct(int=567)).SerializeToString()
+
+    compact = TestStruct.FromSerializedString(data, compact=True)
+    self.assertNotIn("_data", compact.__dict__)
+    self.assertEqual(compact.SerializeToString(), data)
+
+    # Copies stay compact.
+    self.assertNotIn("_data", compact.Copy().__dict__)
+    self.assertNotIn("_data", TestStruct(compact).__dict__)
+
+    # Fields are parsed on first access.
+    self.assertEqual(compact, TestStruct.FromSerializedString(data))
+    self.assertIn("_data", compact.__dict__)
+    self.assertEqual(compact.nested.int, 567)
+
+    compact.int = 3
+    compact.Compact()
+    self.assertNotIn("_data", compact.__dict__)
+    self.assertEqual(compact.int, 3)
+    self.assertEqual(compact.foobar, "hello")
+
+    compact.Compact().Clear()
+    self.assertFalse(compact)
+    self.assertEqual(compact.SerializeToString(), "")
+
   def testRDFStruct(self):
     tested = TestStruct()
 
@@ -165,6 +165,10 @@ class _Metric(object):
     else:
       return []
 
+  def DeleteFieldsValue(self, fields):
+    """Forgets the value corresponding to the given fields values."""
+    self._values.pop(self._FieldsToKey(fields), None)
+
 
 class _CounterMetric(_Metric):
   """Simple counter metric."""
@@ -498,6 +502,20 @@ class StatsCollector(object):
     """
     self._metrics[varname].SetCallback(callback, fields)
 
+  @utils.Synchronized
+  def DeleteMetricFields(self, varname, fields):
+    """Forgets the value of a metric for the given fields values.
+
+    Metrics with fields keep a value for every fields value ever used. This
+    lets long running processes bound the number of values kept for fields
+    like flow or hunt ids.
+
+    Args:
+      varname: Metric name.
+      fields: List of values for this metric's fields.
+    """
+    self._metrics[varname].DeleteFieldsValue(fields)
+
   def GetMetricMetadata(self, varname):
     """Returns stats.MetricMetadata for a metric with a given name.
 
@@ -296,6 +296,28 @@ class StatsTests(test_lib.GRRBaseTest):
         stats.STATS.GetMetricFields("test_event_metric"), key=lambda t: t[0])
     self.assertEqual([("a",), ("b",)], fields)
 
+  def testDeleteMetricFields(self):
+    stats.STATS.RegisterCounterMetric(
+        "test_counter", fields=[("dimension", str)])
+    stats.STATS.RegisterEventMetric(
+        "test_event_metric", fields=[("dimension", str)])
+
+    for field in ["a", "b"]:
+      stats.STATS.IncrementCounter("test_counter", fields=[field])
+      stats.STATS.RecordEvent("test_event_metric", 0.1, fields=[field])
+
+    stats.STATS.DeleteMetricFields("test_counter", ["a"])
+    stats.STATS.DeleteMetricFields("test_event_metric", ["a"])
+    # Deleting unknown fields values is fine.
+    stats.STATS.DeleteMetricFields("test_counter", ["c"])
+
+    self.assertEqual(list(stats.STATS.GetMetricFields("test_counter")),
+                     [("b",)])
+    self.assertEqual(list(stats.STATS.GetMetricFields("test_event_metric")),
+                     [("b",)])
+    self.assertEqual(
+        stats.STATS.GetMetricValue("test_counter", fields=["a"]), 0)
+
   @stats.Counted("test_counter")
   def CountedFunc(self):
     pass
@@ -18,6 +18,7 @@ from grr import config
 from grr.lib import lexer
 from grr.lib import rdfvalue
 from grr.lib import registry
+from grr.lib import stats
 from grr.lib import type_info
 from grr.lib import utils
 from grr.lib.rdfvalues import aff4_rdfvalues
@@ -26,6 +27,7 @@ from grr.lib.rdfvalues import paths as rdf_paths
 from grr.lib.rdfvalues import protodict as rdf_protodict
 from grr.server import access_control
 from grr.server import data_store
+from grr.server import threadpool
 
 # Factor to convert from seconds to microseconds
 MICROSECONDS = 1000000
@@ -64,6 +66,10 @@ class BadGetAttributeError(Exception):
   pass
 
 
+class AttributeNotLoadedError(Exception):
+  """Raised when accessing an attribute left out of an attribute projection."""
+
+
 class MissingChunksError(Exception):
 
   def __init__(self, message, missing_chunks=None):
@@ -271,6 +277,18 @@ def _ValidateAFF4Type(aff4_type):
   return aff4_type
 
 
+class AttributeCache(utils.AgeBasedCache):
+  """A read cache for the attributes returned by Factory.GetAttributes().
+
+  Entries are keyed by urn so they can be invalidated when the object is
+  written. Each entry is a dict mapping the cache invariant (which captures the
+  token and age used for reading) to the attribute values.
+  """
+
+  def KillObject(self, obj):
+    stats.STATS.IncrementCounter("aff4_attribute_cache_evictions")
+
+
 class Factory(object):
   """A central factory for AFF4 objects."""
 
@@ -282,6 +300,18 @@ class Factory(object):
         max_size=self.intermediate_cache_max_size,
         max_age=self.intermediate_cache_age)
 
+    # The attribute cache is opt-in since it is only coherent with writes made
+    # by this process.
+    self.attribute_cache = None
+    attribute_cache_size = config.CONFIG["AFF4.attribute_cache_size"]
+    if attribute_cache_size:
+      self.attribute_cache = AttributeCache(
+          max_size=attribute_cache_size,
+          max_age=config.CONFIG["AFF4.attribute_cache_age"])
+    # Incremented on every invalidation so reads racing with a write don't
+    # populate the cache with stale data.
+    self.attribute_cache_generation = 0
+
     # Create a token for system level actions. This token is used by other
     # classes such as HashFileStore and NSRLFilestore to create entries under
     # aff4:/files, as well as to create top level paths like aff4:/foreman
@@ -308,13 +338,51 @@ class Factory(object):
 
     raise RuntimeError("Unknown age specification: %s" % age)
 
-  def GetAttributes(self, urns, token=None, age=NEWEST_TIME):
-    """Retrieves all the attributes for all the urns."""
+  def _ProjectedPredicates(self, attributes):
+    """Returns the names of the attributes to read for a projection."""
+    if attributes is None:
+      return None
+
+    predicates = set(str(attribute) for attribute in attributes)
+    # The type is needed to instantiate the right class and the symlink target
+    # to follow symlinks.
+    predicates.add(str(AFF4Object.SchemaCls.TYPE))
+    predicates.add(str(AFF4Symlink.SchemaCls.SYMLINK_TARGET))
+    return frozenset(predicates)
+
+  def GetAttributes(self, urns, token=None, age=NEWEST_TIME, attributes=None):
+    """Retrieves the attributes for all the urns.
+
+    Args:
+      urns: The urns to read.
+      token: The Security Token to use for reading.
+      age: The age policy used for reading.
+      attributes: If set, only these attributes (and the object type) are
+        read, otherwise all attributes are.
+
+    Yields:
+      Tuples of urn and a list of (attribute name, value, timestamp) tuples.
+    """
+    if attributes is not None:
+      for urn, values in self._GetProjectedAttributes(
+          urns, token, age, self._ProjectedPredicates(attributes)):
+        yield urn, values
+      return
+
     urns = set([utils.SmartUnicode(u) for u in urns])
     to_read = {urn: self._MakeCacheInvariant(urn, token, age) for urn in urns}
 
+    if self.attribute_cache is not None:
+      for urn, key in to_read.items():
+        values = self._GetCachedAttributes(urn, key)
+        if values is not None:
+          del to_read[urn]
+          yield urn, values
+
     # Urns not present in the cache we need to get from the database.
     if to_read:
+      generation = self.attribute_cache_generation
+
       for subject, values in data_store.DB.MultiResolvePrefix(
           to_read,
           AFF4_PREFIXES,
@@ -325,8 +393,72 @@ class Factory(object):
         # Ensure the values are sorted.
         values.sort(key=lambda x: x[-1], reverse=True)
 
+        subject = utils.SmartUnicode(subject)
+        if self.attribute_cache is not None:
+          self._CacheAttributes(subject, to_read[subject], values, generation)
+
+        yield subject, values
+
+  def _GetProjectedAttributes(self, urns, token, age, predicates):
+    """Retrieves only the given attributes for all the urns."""
+    urns = set([utils.SmartUnicode(u) for u in urns])
+
+    # Complete rows from the attribute cache can serve projections, but
+    # projected rows are never cached.
+    if self.attribute_cache is not None:
+      for urn in list(urns):
+        values = self._GetCachedAttributes(
+            urn, self._MakeCacheInvariant(urn, token, age))
+        if values is not None:
+          urns.remove(urn)
+          values = [v for v in values if v[0] in predicates]
+          if values:
+            yield urn, values
+
+    if urns:
+      for subject, values in data_store.DB.MultiResolveAttributes(
+          urns,
+          predicates,
+          timestamp=self.ParseAgeSpecification(age),
+          token=token):
+        values.sort(key=lambda x: x[-1], reverse=True)
         yield utils.SmartUnicode(subject), values
 
+  def _GetCachedAttributes(self, urn, key):
+    """Returns a copy of the cached attributes or None on a cache miss."""
+    try:
+      values = list(self.attribute_cache.Get(urn)[key])
+    except KeyError:
+      stats.STATS.IncrementCounter("aff4_attribute_cache_misses")
+      return None
+
+    stats.STATS.IncrementCounter("aff4_attribute_cache_hits")
+    return values
+
+  def _CacheAttributes(self, urn, key, values, generation):
+    """Stores attributes read at the given cache generation."""
+    with self.attribute_cache.lock:
+      # The object was written while we were reading it.
+      if generation != self.attribute_cache_generation:
+        return
+
+      try:
+        # Entries are updated in place so they still expire based on the time
+        # the first set of attributes for this urn was cached.
+        self.attribute_cache.Get(urn)[key] = list(values)
+      except KeyError:
+        self.attribute_cache.Put(urn, {key: list(values)})
+
+  def InvalidateAttributeCache(self, urns):
+    """Drops cached attributes for the given urns."""
+    if self.attribute_cache is None:
+      return
+
+    with self.attribute_cache.lock:
+      self.attribute_cache_generation += 1
+      for urn in urns:
+        self.attribute_cache.Pop(utils.SmartUnicode(urn))
+
   def SetAttributes(self,
                     urn,
                     attributes,
@@ -335,6 +467,7 @@ class Factory(object):
                     mutation_pool=None,
                     token=None):
     """Sets the attributes in the data store."""
+    self.InvalidateAttributeCache([urn])
 
     attributes[AFF4Object.SchemaCls.LAST] = [
         rdfvalue.RDFDatetime.Now().SerializeToDataStore()
@@ -633,7 +766,8 @@ class Factory(object):
            local_cache=None,
            age=NEWEST_TIME,
            follow_symlinks=True,
-           transaction=None):
+           transaction=None,
+           attributes=None):
     """Opens the named object.
 
     This instantiates the object from the AFF4 data store.
@@ -667,6 +801,9 @@ class Factory(object):
 
       follow_symlinks: If object opened is a symlink, follow it.
       transaction: A lock in case this object is opened under lock.
+      attributes: If set, only these attributes are read from the data store.
+        Accessing any other attribute of the returned object raises
+        AttributeNotLoadedError. Only supported in read only mode.
 
     Returns:
       An AFF4Object instance.
@@ -680,6 +817,9 @@ class Factory(object):
     if mode not in ["w", "r", "rw"]:
       raise AttributeError("Invalid mode %s" % mode)
 
+    if attributes is not None and mode != "r":
+      raise AttributeError("Attribute projections need read only mode.")
+
     if mode == "w":
       if aff4_type is None:
         raise AttributeError("Need a type to open in write only mode.")
@@ -698,7 +838,9 @@ class Factory(object):
       token = data_store.default_token
 
     if "r" in mode and (local_cache is None or urn not in local_cache):
-      local_cache = dict(self.GetAttributes([urn], age=age, token=token))
+      local_cache = dict(
+          self.GetAttributes(
+              [urn], age=age, token=token, attributes=attributes))
 
     # Read the row from the table. We know the object already exists if there is
     # some data in the local_cache already for this object.
@@ -710,7 +852,8 @@ class Factory(object):
         age=age,
         follow_symlinks=follow_symlinks,
         object_exists=bool(local_cache.get(urn)),
-        transaction=transaction)
+        transaction=transaction,
+        loaded_attributes=self._ProjectedPredicates(attributes))
 
     result.aff4_type = aff4_type
 
@@ -738,8 +881,12 @@ class Factory(object):
                 token=None,
                 aff4_type=None,
                 age=NEWEST_TIME,
-                follow_symlinks=True):
-    """Opens a bunch of urns efficiently."""
+                follow_symlinks=True,
+                attributes=None):
+    """Opens a bunch of urns efficiently.
+
+    If attributes is set, only these attributes are read, see Open().
+    """
 
     if token is None:
       token = data_store.default_token
@@ -747,11 +894,15 @@ class Factory(object):
     if mode not in ["w", "r", "rw"]:
       raise RuntimeError("Invalid mode %s" % mode)
 
+    if attributes is not None and mode != "r":
+      raise RuntimeError("Attribute projections need read only mode.")
+
     symlinks = {}
 
     aff4_type = _ValidateAFF4Type(aff4_type)
 
-    for urn, values in self.GetAttributes(urns, token=token, age=age):
+    for urn, values in self.GetAttributes(
+        urns, token=token, age=age, attributes=attributes):
       try:
         obj = self.Open(
             urn,
@@ -759,7 +910,8 @@ class Factory(object):
             token=token,
             local_cache={urn: values},
             age=age,
-            follow_symlinks=False)
+            follow_symlinks=False,
+            attributes=attributes)
         # We can't pass aff4_type to Open since it will raise on AFF4Symlinks.
         # Setting it here, if needed, so that BadGetAttributeError checking
         # works.
@@ -780,10 +932,16 @@ class Factory(object):
 
     if symlinks:
       for obj in self.MultiOpen(
-          symlinks, mode=mode, token=token, aff4_type=aff4_type, age=age):
+          symlinks,
+          mode=mode,
+          token=token,
+          aff4_type=aff4_type,
+          age=age,
+          attributes=attributes):
         to_link = symlinks[obj.urn]
         for additional_symlink in to_link[1:]:
-          clone = obj.__class__(obj.urn, clone=obj)
+          clone = obj.__class__(
+              obj.urn, clone=obj, loaded_attributes=obj.loaded_attributes)
           clone.symlink_urn = additional_symlink
           yield clone
 
@@ -926,15 +1084,38 @@ class Factory(object):
 
     if isinstance(urns, basestring):
       raise RuntimeError("Expected an iterable, not string.")
-    for subject, values in data_store.DB.MultiResolvePrefix(
-        urns, ["aff4:type", "metadata:last"], token=token):
-      res = dict(urn=rdfvalue.RDFURN(subject))
-      for v in values:
-        if v[0] == "aff4:type":
-          res["type"] = v
-        elif v[0] == "metadata:last":
-          res["last"] = rdfvalue.RDFDatetime(v[1])
-      yield res
+
+    stat_attributes = ["aff4:type", "metadata:last"]
+
+    if self.attribute_cache is not None:
+      # Objects which were recently opened can be stat'ed from the cache.
+      to_stat = []
+      for urn in urns:
+        values = self._GetCachedAttributes(
+            utils.SmartUnicode(urn),
+            self._MakeCacheInvariant(urn, token, NEWEST_TIME))
+        if values is None:
+          to_stat.append(urn)
+          continue
+
+        values = [v for v in values if v[0] in stat_attributes]
+        if values:
+          yield self._MakeStat(urn, values)
+      urns = to_stat
+
+    if urns:
+      for subject, values in data_store.DB.MultiResolvePrefix(
+          urns, stat_attributes, token=token):
+        yield self._MakeStat(subject, values)
+
+  def _MakeStat(self, subject, values):
+    res = dict(urn=rdfvalue.RDFURN(subject))
+    for v in values:
+      if v[0] == "aff4:type":
+        res["type"] = v
+      elif v[0] == "metadata:last":
+        res["last"] = rdfvalue.RDFDatetime(v[1])
+    return res
 
   def Exists(self, urn, token=None):
     """Returns whether the provided urn exists."""
@@ -1196,6 +1377,10 @@ class Factory(object):
 
   def Flush(self):
     self.intermediate_cache.Flush()
+    if self.attribute_cache is not None:
+      with self.attribute_cache.lock:
+        self.attribute_cache_generation += 1
+        self.attribute_cache.Flush()
 
   # Well known AFF4 paths.
   def _InitWellKnownPaths(self):
@@ -1677,7 +1862,8 @@ class AFF4Object(object):
                aff4_type=None,
                object_exists=False,
                mutation_pool=None,
-               transaction=None):
+               transaction=None,
+               loaded_attributes=None):
     if urn is not None:
       urn = rdfvalue.RDFURN(urn)
     self.urn = urn
@@ -1712,6 +1898,10 @@ class AFF4Object(object):
     # verify aff4 attributes exist in the schema at Get() time.
     self.aff4_type = aff4_type
 
+    # The names of the attributes read from the data store if the object was
+    # opened with an attribute projection, None if all attributes were read.
+    self.loaded_attributes = loaded_attributes
+
     # We maintain two attribute caches - self.synced_attributes reflects the
     # attributes which are synced with the data_store, while self.new_attributes
     # are new attributes which still need to be flushed to the data_store. When
@@ -1746,7 +1936,10 @@ class AFF4Object(object):
         else:
           # Populate the caches from the data store.
           for urn, values in FACTORY.GetAttributes(
-              [urn], age=age, token=self.token):
+              [urn],
+              age=age,
+              token=self.token,
+              attributes=loaded_attributes):
             for attribute_name, value, ts in values:
               self.DecodeValueFromAttribute(attribute_name, value, ts)
 
@@ -2086,9 +2279,22 @@ class AFF4Object(object):
     Checking Get against None doesn't work as Get will return a default
     attribute value. This determines if the attribute has been manually set.
     """
+    self._CheckAttributeLoaded(attribute)
     return (attribute in self.synced_attributes or
             attribute in self.new_attributes)
 
+  def _CheckAttributeLoaded(self, attribute):
+    """Raises if the attribute was left out of the attribute projection."""
+    if (self.loaded_attributes is None or
+        str(attribute) in self.loaded_attributes or
+        attribute in self.new_attributes or
+        isinstance(attribute, SubjectAttribute)):
+      return
+
+    raise AttributeNotLoadedError(
+        "Attribute %s of %s was not loaded, it has to be passed in the "
+        "attributes argument of Open() or MultiOpen()." % (attribute, self.urn))
+
   def Get(self, attribute, default=None):
     """Gets the attribute from this object."""
     if attribute is None:
@@ -2130,6 +2336,7 @@ class AFF4Object(object):
     elif isinstance(attribute, basestring):
       attribute = Attribute.GetAttributeByName(attribute)
 
+    self._CheckAttributeLoaded(attribute)
     return attribute.GetValues(self)
 
   def Update(self, attribute=None, user=None, priority=None):
@@ -2204,7 +2411,8 @@ class AFF4Object(object):
         follow_symlinks=self.follow_symlinks,
         aff4_type=self.aff4_type,
         mutation_pool=self.mutation_pool,
-        transaction=self.transaction)
+        transaction=self.transaction,
+        loaded_attributes=self.loaded_attributes)
     result.symlink_urn = self.urn
     result.Initialize()
 
@@ -2739,6 +2947,113 @@ class ChunkCache(utils.FastStore):
     return self.__dict__
 
 
+class ChunkReadAhead(object):
+  """Adaptive asynchronous read ahead for AFF4 images.
+
+  Sequential access is detected from the chunks a reader asks for. While the
+  reader consumes the chunks that are already cached, the next window of chunks
+  is fetched on a shared thread pool. Whenever the reader catches up with a
+  fetch that has not completed yet the window is doubled, up to max_window.
+  Random access resets the window to its initial size.
+  """
+
+  POOL_NAME = "aff4_image_read_ahead"
+
+  def __init__(self, fetch_cb, window, max_window, pool=None):
+    """Constructor.
+
+    Args:
+      fetch_cb: A callable taking a list of chunk numbers which reads those
+        chunks into the cache of the image.
+      window: The initial number of chunks to read ahead.
+      max_window: The maximum number of chunks to read ahead.
+      pool: The thread pool to run fetches on, defaults to a shared pool.
+    """
+    self.fetch_cb = fetch_cb
+    self.min_window = window
+    self.window = window
+    self.max_window = max(window, max_window)
+    self.pool = pool or self._GetPool()
+
+    self.next_chunk = None
+    self.fetched_until = 0
+    # A list of (first_chunk, last_chunk + 1, event) for running fetches.
+    self.pending = []
+    self.lock = threading.RLock()
+
+  @classmethod
+  def _GetPool(cls):
+    pool = threadpool.ThreadPool.Factory(
+        cls.POOL_NAME,
+        min_threads=1,
+        max_threads=config.CONFIG["AFF4.image_read_ahead_threads"])
+    pool.Start()
+    return pool
+
+  @utils.Synchronized
+  def Access(self, chunk):
+    """Records that chunk is read and schedules read ahead if needed."""
+    if self.next_chunk is not None and chunk == self.next_chunk - 1:
+      # Another read from the same chunk.
+      return
+
+    if chunk != self.next_chunk:
+      # Not sequential. The caller reads the initial window synchronously.
+      self.window = self.min_window
+      self.next_chunk = chunk + 1
+      self.fetched_until = chunk + self.min_window
+      return
+
+    self.next_chunk = chunk + 1
+    if self.fetched_until - chunk > self.window / 2:
+      return
+
+    start = max(self.fetched_until, chunk + 1)
+    end = start + self.window
+    self.fetched_until = end
+
+    event = threading.Event()
+    self.pending.append((start, end, event))
+    stats.STATS.IncrementCounter("aff4_image_read_ahead_chunks", end - start)
+    self.pool.AddTask(
+        target=self._Fetch,
+        args=(range(start, end), event),
+        name="AFF4ImageReadAhead")
+
+  def _Fetch(self, chunks, event):
+    try:
+      self.fetch_cb(chunks)
+    finally:
+      event.set()
+      with self.lock:
+        self.pending = [x for x in self.pending if x[2] is not event]
+
+  def Wait(self, chunk):
+    """Waits for a running fetch covering chunk.
+
+    Args:
+      chunk: The chunk number the caller could not find in the cache.
+
+    Returns:
+      True if a fetch covering the chunk was running, False otherwise.
+    """
+    with self.lock:
+      events = [e for start, end, e in self.pending if start <= chunk < end]
+
+    if not events:
+      return False
+
+    for event in events:
+      if not event.is_set():
+        # The reader is faster than the fetches, read more at a time.
+        stats.STATS.IncrementCounter("aff4_image_read_ahead_stalls")
+        with self.lock:
+          self.window = min(self.window * 2, self.max_window)
+        event.wait()
+
+    return True
+
+
 class AFF4ImageBase(AFF4Stream):
   """An AFF4 Image is stored in segments.
 
@@ -2759,6 +3074,10 @@ class AFF4ImageBase(AFF4Stream):
   # How many chunks should be cached.
   LOOK_AHEAD = 10
 
+  # Sequential reads grow the read ahead window up to this many chunks. This
+  # needs to stay well below the size of the chunk cache.
+  MAX_LOOK_AHEAD = 40
+
   class SchemaCls(AFF4Stream.SchemaCls):
     """The schema for AFF4ImageBase."""
     _CHUNKSIZE = Attribute(
@@ -2837,6 +3156,7 @@ class AFF4ImageBase(AFF4Stream):
     self.offset = 0
     # A cache for segments.
     self.chunk_cache = ChunkCache(self._WriteChunk, 100)
+    self._read_ahead = None
 
     if "r" in self.mode:
       self.size = int(self.Get(self.Schema.SIZE))
@@ -2927,13 +3247,55 @@ class AFF4ImageBase(AFF4Stream):
     self.chunk_cache.Put(chunk, fd)
     return fd
 
+  def _StartReadAhead(self, chunk):
+    """Registers a read of chunk with the asynchronous read ahead.
+
+    Read ahead is only done for images opened read only since fetched chunks
+    may evict others from the chunk cache and dirty chunks have to be written
+    by the thread using the image.
+
+    Args:
+      chunk: The number of the chunk that is about to be read.
+    """
+    if self.mode != "r":
+      return
+
+    if self._read_ahead is None:
+      if not config.CONFIG["AFF4.image_read_ahead_threads"]:
+        return
+
+      self._read_ahead = ChunkReadAhead(self._ReadAheadChunks, self.LOOK_AHEAD,
+                                        self.MAX_LOOK_AHEAD)
+
+    self._read_ahead.Access(chunk)
+
+  def _WaitForReadAhead(self, chunk):
+    """Waits for the read ahead of chunk, returns True if there was one."""
+    return self._read_ahead is not None and self._read_ahead.Wait(chunk)
+
+  def _ReadAheadChunks(self, chunks):
+    """Reads the chunks with the given numbers into the chunk cache."""
+    last_chunk = (self.size - 1) / self.chunksize
+    self._ReadChunks([
+        chunk for chunk in chunks
+        if chunk <= last_chunk and chunk not in self.chunk_cache
+    ])
+
   def _GetChunkForReading(self, chunk):
     """Returns the relevant chunk from the datastore and reads ahead."""
+    self._StartReadAhead(chunk)
     try:
       return self.chunk_cache.Get(chunk)
     except KeyError:
       pass
 
+    # The chunk might be on its way from a read ahead that is still running.
+    if self._WaitForReadAhead(chunk):
+      try:
+        return self.chunk_cache.Get(chunk)
+      except KeyError:
+        pass
+
     # We don't have this chunk already cached. The most common read
     # access pattern is contiguous reading so since we have to go to
     # the data store already, we read ahead to reduce round trips.
@@ -2972,20 +3334,35 @@ class AFF4ImageBase(AFF4Stream):
     if retries >= self.NUM_RETRIES:
       raise IOError("Chunk not found for reading.")
 
-    fd.seek(chunk_offset)
-
-    result = fd.read(available_to_read)
+    # Slicing the chunk contents directly avoids the seek/read round trip
+    # through the StringIO. For clean chunks getvalue() returns the stored
+    # string as is and a slice covering a whole chunk is not copied either.
+    data = fd.getvalue()
+    if chunk_offset == 0 and available_to_read >= len(data):
+      result = data
+    else:
+      result = data[chunk_offset:chunk_offset + available_to_read]
     self.offset += len(result)
 
     return result
 
-  def Read(self, length):
-    """Read a block of data from the file."""
-    result = ""
+  def StreamChunks(self, length=None):
+    """Yields the data from the current offset in chunk aligned pieces.
 
-    # The total available size in the file
-    length = int(length)
-    length = min(length, self.size - self.offset)
+    Each piece extends at most up to the next chunk boundary so callers can
+    process large files without ever concatenating them.
+
+    Args:
+      length: The maximum number of bytes to read, defaults to everything up to
+        the end of the stream.
+
+    Yields:
+      Strings with consecutive pieces of the stream.
+    """
+    available = self.size - self.offset
+    if length is None:
+      length = available
+    length = min(int(length), available)
 
     while length > 0:
       data = self._ReadPartial(length)
@@ -2993,8 +3370,30 @@ class AFF4ImageBase(AFF4Stream):
         break
 
       length -= len(data)
-      result += data
-    return result
+      yield data
+
+  def Read(self, length):
+    """Read a block of data from the file."""
+    # Joining once keeps large reads linear in the amount of data returned.
+    return "".join(self.StreamChunks(length))
+
+  def ReadInto(self, buf):
+    """Reads data from the current offset into a writable buffer.
+
+    Args:
+      buf: An object supporting the writable buffer interface, e.g. a
+        bytearray. At most len(buf) bytes are read.
+
+    Returns:
+      The number of bytes written to buf.
+    """
+    view = memoryview(buf)
+    pos = 0
+    for data in self.StreamChunks(len(view)):
+      view[pos:pos + len(data)] = data
+      pos += len(data)
+
+    return pos
 
   def _WritePartial(self, data):
     """Writes at most one chunk of data."""
@@ -3050,12 +3449,14 @@ class AFF4ImageBase(AFF4Stream):
       self.chunk_cache.Flush()
       res = self.__dict__.copy()
       del res["chunk_cache"]
+      res.pop("_read_ahead", None)
       return res
     return self.__dict__
 
   def __setstate__(self, state):
     self.__dict__ = state
     self.chunk_cache = ChunkCache(self._WriteChunk, 100)
+    self._read_ahead = None
 
 
 class AFF4Image(AFF4ImageBase):
@@ -3079,6 +3480,21 @@ class AFF4InitHook(registry.InitHook):
 
     FACTORY = Factory()  # pylint: disable=g-bad-name
 
+  def RunOnce(self):
+    """Register the attribute cache stats and invalidation."""
+    stats.STATS.RegisterCounterMetric("aff4_attribute_cache_hits")
+    stats.STATS.RegisterCounterMetric("aff4_attribute_cache_misses")
+    stats.STATS.RegisterCounterMetric("aff4_attribute_cache_evictions")
+    stats.STATS.RegisterCounterMetric("aff4_image_read_ahead_chunks")
+    stats.STATS.RegisterCounterMetric("aff4_image_read_ahead_stalls")
+
+    data_store.mutation_listeners.append(_InvalidateAttributeCache)
+
+
+def _InvalidateAttributeCache(subjects):
+  if FACTORY is not None:
+    FACTORY.InvalidateAttributeCache(subjects)
+
 
 class AFF4Filter(object):
   """A simple filtering system to be used with Query()."""
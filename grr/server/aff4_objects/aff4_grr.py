@@ -10,6 +10,7 @@ import time
 from grr.client.components.rekall_support import rekall_types as rdf_rekall_types
 from grr.lib import rdfvalue
 from grr.lib import registry
+from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import cloud
 from grr.lib.rdfvalues import crypto as rdf_crypto
@@ -23,6 +24,7 @@ from grr.server import aff4
 from grr.server import data_store
 from grr.server import flow
 from grr.server import foreman as rdf_foreman
+from grr.server import foreman_rule_index
 from grr.server import grr_collections
 from grr.server import queue_manager
 from grr.server.aff4_objects import standard
@@ -443,6 +445,9 @@ class GRRForeman(aff4.AFF4Object):
         creates_new_object_version=False,
         default=rdf_foreman.ForemanRules())
 
+  # The compiled rules, see _GetRuleIndex.
+  _rule_index = None
+
   def ExpireRules(self):
     """Removes any rules with an expiration date in the past."""
     rules = self.Get(self.Schema.RULES)
@@ -473,25 +478,56 @@ class GRRForeman(aff4.AFF4Object):
       self.Set(self.Schema.RULES, new_rules)
       self.Flush()
 
+  def _GetRuleIndex(self, rules):
+    """Returns the rules compiled into a ForemanRuleIndex."""
+    rule_index = self._rule_index
+    if rule_index is None or rule_index.rules is not rules:
+      rule_index = foreman_rule_index.ForemanRuleIndex(rules)
+      self._rule_index = rule_index
+    return rule_index
+
+  def _HuntTaskURN(self, client_id, hunt_id):
+    return client_id.Add("flows/%s:hunt" % rdfvalue.RDFURN(hunt_id).Basename())
+
   def _CheckIfHuntTaskWasAssigned(self, client_id, hunt_id):
     """Will return True if hunt's task was assigned to this client before."""
     for _ in aff4.FACTORY.Stat(
-        [client_id.Add("flows/%s:hunt" % rdfvalue.RDFURN(hunt_id).Basename())],
-        token=self.token):
+        [self._HuntTaskURN(client_id, hunt_id)], token=self.token):
       return True
 
     return False
 
-  def _EvaluateRules(self, objects, rule, client_id):
-    """Evaluates the rules."""
-    return rule.client_rule_set.Evaluate(objects, client_id)
+  def _GetAssignedHuntTasks(self, client_rules):
+    """Finds the hunt tasks that were already assigned to clients.
+
+    Args:
+      client_rules: A list of (client_id, rules) tuples.
+
+    Returns:
+      A set with the URNs of the hunt tasks which exist.
+    """
+    urns = []
+    for client_id, rules in client_rules:
+      for rule in rules:
+        for action in rule.actions:
+          if action.HasField("hunt_id"):
+            urns.append(self._HuntTaskURN(client_id, action.hunt_id))
+
+    if not urns:
+      return set()
+
+    return set(
+        utils.SmartStr(stat["urn"])
+        for stat in aff4.FACTORY.Stat(urns, token=self.token))
 
-  def _RunActions(self, rule, client_id):
+  def _RunActions(self, rule, client_id, assigned_hunt_tasks=None):
     """Run all the actions specified in the rule.
 
     Args:
       rule: Rule which actions are to be executed.
       client_id: Id of a client where rule's actions are to be executed.
+      assigned_hunt_tasks: An optional set of the URNs of hunt tasks known to
+        exist. If not given, the data store is checked for every hunt.
 
     Returns:
       Number of actions started.
@@ -505,7 +541,15 @@ class GRRForeman(aff4.AFF4Object):
         token.username = "Foreman"
 
         if action.HasField("hunt_id"):
-          if self._CheckIfHuntTaskWasAssigned(client_id, action.hunt_id):
+          if assigned_hunt_tasks is None:
+            assigned = self._CheckIfHuntTaskWasAssigned(client_id,
+                                                        action.hunt_id)
+          else:
+            assigned = utils.SmartStr(
+                self._HuntTaskURN(client_id,
+                                  action.hunt_id)) in assigned_hunt_tasks
+
+          if assigned:
             logging.info("Foreman: ignoring hunt %s on client %s: was started "
                          "here before", client_id, action.hunt_id)
           else:
@@ -540,61 +584,97 @@ class GRRForeman(aff4.AFF4Object):
       Number of assigned tasks.
     """
     client_id = rdf_client.ClientURN(client_id)
+    return self.AssignTasksToClients([client_id]).get(client_id, 0)
 
-    rules = self.Get(self.Schema.RULES)
-    if not rules:
-      return 0
+  def AssignTasksToClients(self, client_ids):
+    """Examines our rules and starts up flows for many clients at once.
 
-    client = aff4.FACTORY.Open(client_id, mode="rw", token=self.token)
-    try:
-      last_foreman_run = client.Get(client.Schema.LAST_FOREMAN_TIME) or 0
-    except AttributeError:
-      last_foreman_run = 0
+    The clients, the objects the rules need and the hunts already running on
+    the clients are each read in a single round trip.
 
-    latest_rule = max(rule.created for rule in rules)
+    Args:
+      client_ids: A list of client ids of the clients for tasks to be assigned.
 
-    if latest_rule <= int(last_foreman_run):
-      return 0
+    Returns:
+      A dict mapping client URNs to the number of tasks assigned to them.
+    """
+    client_ids = [rdf_client.ClientURN(client_id) for client_id in client_ids]
+    result = dict((client_id, 0) for client_id in client_ids)
 
-    # Update the latest checked rule on the client.
-    client.Set(client.Schema.LAST_FOREMAN_TIME(latest_rule))
-    client.Close()
+    rules = self.Get(self.Schema.RULES)
+    if not rules:
+      return result
 
-    # For efficiency we collect all the objects we want to open first and then
-    # open them all in one round trip.
-    object_urns = {}
-    relevant_rules = []
-    expired_rules = False
+    rule_index = self._GetRuleIndex(rules)
 
-    now = time.time() * 1e6
+    # The clients hold the time of the latest rule they were checked against.
+    clients = {}
+    for client in aff4.FACTORY.MultiOpen(
+        set(client_ids), mode="r", token=self.token):
+      clients[client.urn] = client
 
-    for rule in rules:
-      if rule.expires < now:
-        expired_rules = True
-        continue
-      if rule.created <= int(last_foreman_run):
+    last_foreman_runs = {}
+    for client_id in client_ids:
+      client = clients.get(client_id)
+      if client is None or client_id in last_foreman_runs:
         continue
 
-      relevant_rules.append(rule)
+      try:
+        last_foreman_run = int(client.Get(client.Schema.LAST_FOREMAN_TIME) or 0)
+      except AttributeError:
+        last_foreman_run = 0
+
+      if rule_index.latest_rule > last_foreman_run:
+        last_foreman_runs[client_id] = last_foreman_run
+
+    if not last_foreman_runs:
+      return result
+
+    # Update the latest checked rule on the clients.
+    latest_rule = rdfvalue.RDFDatetime(rule_index.latest_rule)
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for client_id in last_foreman_runs:
+        aff4.FACTORY.SetAttributes(
+            client_id, {
+                VFSGRRClient.SchemaCls.LAST_FOREMAN_TIME:
+                    [latest_rule.SerializeToDataStore()]
+            },
+            set(),
+            add_child_index=False,
+            mutation_pool=pool,
+            token=self.token)
 
-      for path in rule.client_rule_set.GetPathsToCheck():
+    # For efficiency we collect all the objects we want to open first and then
+    # open them all in one round trip.
+    objects = dict(clients)
+    object_urns = {}
+    for client_id, last_foreman_run in last_foreman_runs.iteritems():
+      for path in rule_index.PathsToCheck(last_foreman_run):
         aff4_object = client_id.Add(path)
-        object_urns[str(aff4_object)] = aff4_object
+        if aff4_object not in objects:
+          object_urns[str(aff4_object)] = aff4_object
 
-    # Retrieve all aff4 objects we need.
-    objects = {}
     for fd in aff4.FACTORY.MultiOpen(object_urns, token=self.token):
       objects[fd.urn] = fd
 
-    actions_count = 0
-    for rule in relevant_rules:
-      if self._EvaluateRules(objects, rule, client_id):
-        actions_count += self._RunActions(rule, client_id)
-
-    if expired_rules:
+    now = time.time() * 1e6
+    client_rules = []
+    for client_id, last_foreman_run in last_foreman_runs.iteritems():
+      matching_rules = rule_index.MatchingRules(client_id, objects,
+                                                last_foreman_run, now)
+      if matching_rules:
+        client_rules.append((client_id, matching_rules))
+
+    assigned_hunt_tasks = self._GetAssignedHuntTasks(client_rules)
+    for client_id, matching_rules in client_rules:
+      for rule in matching_rules:
+        result[client_id] += self._RunActions(
+            rule, client_id, assigned_hunt_tasks=assigned_hunt_tasks)
+
+    if rule_index.HasExpiredRules(now):
       self.ExpireRules()
 
-    return actions_count
+    return result
 
 
 class GRRAFF4Init(registry.InitHook):
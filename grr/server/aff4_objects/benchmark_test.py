@@ -100,6 +100,34 @@ class AFF4Benchmark(benchmark_test_lib.AverageMicroBenchmarks):
     self.TimeIt(
         ReadAVersionedAFF4Attribute, name="Read one versioned Attributes")
 
+  LARGE_IMAGE_SIZE = 1024 * 1024 * 1024
+  LARGE_IMAGE_CHUNKSIZE = 1024 * 1024
+
+  def testAFF4ImageLargeRead(self):
+    """How long does it take to read a 1GB AFF4Image."""
+    urn = "aff4:/C.1234567812345678/fs/os/large_image"
+    block = "X" * self.LARGE_IMAGE_CHUNKSIZE
+    with aff4.FACTORY.Create(urn, aff4.AFF4Image, token=self.token) as fd:
+      fd.SetChunksize(self.LARGE_IMAGE_CHUNKSIZE)
+      for _ in xrange(self.LARGE_IMAGE_SIZE / self.LARGE_IMAGE_CHUNKSIZE):
+        fd.Write(block)
+
+    def Read():
+      fd = aff4.FACTORY.Open(urn, token=self.token)
+      return len(fd.Read(self.LARGE_IMAGE_SIZE))
+
+    def ReadInto():
+      fd = aff4.FACTORY.Open(urn, token=self.token)
+      return fd.ReadInto(bytearray(self.LARGE_IMAGE_SIZE))
+
+    def StreamChunks():
+      fd = aff4.FACTORY.Open(urn, token=self.token)
+      return sum(len(chunk) for chunk in fd.StreamChunks())
+
+    self.TimeIt(Read, name="Read 1GB AFF4Image", repetitions=1)
+    self.TimeIt(ReadInto, name="ReadInto 1GB AFF4Image", repetitions=1)
+    self.TimeIt(StreamChunks, name="StreamChunks 1GB AFF4Image", repetitions=1)
+
 
 def main(argv):
   # Run the full test suite
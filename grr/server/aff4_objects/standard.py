@@ -105,7 +105,7 @@ class BlobImage(aff4.AFF4ImageBase):
   _HASH_SIZE = 32
 
   # How many chunks we read ahead
-  _READAHEAD = 5
+  LOOK_AHEAD = 5
 
   @classmethod
   def _GenerateChunkIds(cls, fds):
@@ -186,8 +186,24 @@ class BlobImage(aff4.AFF4ImageBase):
     """Chunks must be added using the AddBlob() method."""
     raise NotImplementedError("Direct writing of BlobImage not allowed.")
 
+  def _ChunkNames(self, chunks):
+    """Returns the blob hashes for the given chunk numbers from the index."""
+    # This does not move the index so it can be used from read ahead threads.
+    index = self.index.getvalue()
+    names = []
+    for chunk in chunks:
+      name = index[chunk * self._HASH_SIZE:(chunk + 1) * self._HASH_SIZE]
+      if name:
+        names.append(name.encode("hex"))
+    return names
+
+  def _ReadAheadChunks(self, chunks):
+    names = self._ChunkNames(chunks)
+    self._ReadChunks([name for name in names if name not in self.chunk_cache])
+
   def _GetChunkForReading(self, chunk):
     """Retrieve the relevant blob from the AFF4 data store or cache."""
+    self._StartReadAhead(chunk)
     offset = chunk * self._HASH_SIZE
     self.index.seek(offset)
 
@@ -198,13 +214,19 @@ class BlobImage(aff4.AFF4ImageBase):
     except KeyError:
       pass
 
+    if self._WaitForReadAhead(chunk):
+      try:
+        return self.chunk_cache.Get(chunk_name)
+      except KeyError:
+        pass
+
     # We don't have this chunk already cached. The most common read
     # access pattern is contiguous reading so since we have to go to
     # the data store already, we read ahead to reduce round trips.
     self.index.seek(offset)
     readahead = []
 
-    for _ in range(self._READAHEAD):
+    for _ in range(self.LOOK_AHEAD):
       name = self.index.read(self._HASH_SIZE).encode("hex")
       if name and name not in self.chunk_cache:
         readahead.append(name)
@@ -313,8 +335,6 @@ class AFF4SparseImage(aff4.AFF4ImageBase):
 
   _HASH_SIZE = 32
 
-  _READAHEAD = 10
-
   chunksize = 512 * 1024
 
   class SchemaCls(aff4.AFF4ImageBase.SchemaCls):
@@ -369,19 +389,32 @@ class AFF4SparseImage(aff4.AFF4ImageBase):
           res[chunk_names[obj.urn]] = hsh.encode("hex")
     return res
 
+  def _ReadAheadChunks(self, chunks):
+    self._ReadChunks([
+        chunk for chunk in chunks
+        if chunk <= self.last_chunk and chunk not in self.chunk_cache
+    ])
+
   def _GetChunkForReading(self, chunk):
     """Returns the relevant chunk from the datastore and reads ahead."""
+    self._StartReadAhead(chunk)
     try:
       return self.chunk_cache.Get(chunk)
     except KeyError:
       pass
 
+    if self._WaitForReadAhead(chunk):
+      try:
+        return self.chunk_cache.Get(chunk)
+      except KeyError:
+        pass
+
     # We don't have this chunk already cached. The most common read
     # access pattern is contiguous reading so since we have to go to
     # the data store already, we read ahead to reduce round trips.
 
     missing_chunks = []
-    for chunk_number in range(chunk, chunk + 10):
+    for chunk_number in range(chunk, chunk + self.LOOK_AHEAD):
       if chunk_number not in self.chunk_cache:
         missing_chunks.append(chunk_number)
 
@@ -12,16 +12,19 @@ import mock
 
 from grr.lib import flags
 from grr.lib import rdfvalue
+from grr.lib import stats
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import crypto as rdf_crypto
 from grr.lib.rdfvalues import paths as rdf_paths
 from grr.lib.rdfvalues import protodict as rdf_protodict
+from grr.server import access_control
 from grr.server import aff4
 from grr.server import data_store
 from grr.server import flow
 from grr.server import foreman as rdf_foreman
 from grr.server import queue_manager
+from grr.server import threadpool
 from grr.server.aff4_objects import aff4_grr
 from grr.server.aff4_objects import collects
 from grr.server.aff4_objects import standard as aff4_standard
@@ -1193,6 +1196,48 @@ class AFF4Test(aff4_test_lib.AFF4ObjectTest):
     for i in range(100):
       self.assertEqual(fd.Read(13), "Test%08X\n" % i)
 
+  def testAFF4ImageStreamChunks(self):
+    path = "/C.12345/foo"
+    self.WriteImage(path, "Test")
+    expected = "".join("Test%08X\n" % i for i in range(100))
+
+    fd = aff4.FACTORY.Open(path, token=self.token)
+    chunks = list(fd.StreamChunks())
+    self.assertEqual("".join(chunks), expected)
+    self.assertEqual([len(c) for c in chunks], [10] * 130)
+    self.assertEqual(fd.Tell(), len(expected))
+
+    # Reads starting in the middle of a chunk are aligned to the next chunk.
+    fd.Seek(15)
+    chunks = list(fd.StreamChunks(20))
+    self.assertEqual(chunks, [expected[15:20], expected[20:30], expected[30:35]])
+
+    # Reading past the end stops at the end of the stream.
+    fd.Seek(len(expected) - 3)
+    self.assertEqual(list(fd.StreamChunks(100)), [expected[-3:]])
+
+  def testAFF4ImageReadInto(self):
+    path = "/C.12345/foo"
+    self.WriteImage(path, "Test")
+    expected = "".join("Test%08X\n" % i for i in range(100))
+
+    fd = aff4.FACTORY.Open(path, token=self.token)
+    buf = bytearray(len(expected))
+    self.assertEqual(fd.ReadInto(buf), len(expected))
+    self.assertEqual(str(buf), expected)
+
+    fd.Seek(7)
+    buf = bytearray(25)
+    self.assertEqual(fd.ReadInto(buf), 25)
+    self.assertEqual(str(buf), expected[7:32])
+    self.assertEqual(fd.Tell(), 32)
+
+    # A buffer larger than the remaining data is only partially filled.
+    fd.Seek(len(expected) - 5)
+    buf = bytearray("X" * 10)
+    self.assertEqual(fd.ReadInto(buf), 5)
+    self.assertEqual(str(buf), expected[-5:] + "X" * 5)
+
   def WriteImage(self,
                  path,
                  prefix="Test",
@@ -1318,6 +1363,54 @@ class AFF4Test(aff4_test_lib.AFF4ObjectTest):
         sorted([x.urn for x in all_children]),
         [root_urn.Add("some1"), root_urn.Add("some2")])
 
+  def _CreateClientsForProjection(self):
+    urns = []
+    for i in range(2):
+      urn = rdfvalue.RDFURN("aff4:/C.000000000000000%d" % (i + 1))
+      with aff4.FACTORY.Create(
+          urn, aff4_grr.VFSGRRClient, mode="w", token=self.token) as fd:
+        fd.Set(fd.Schema.HOSTNAME("host%d" % i))
+        fd.Set(fd.Schema.SYSTEM("Linux"))
+      urns.append(urn)
+    return urns
+
+  def testMultiOpenWithAttributeProjection(self):
+    urns = self._CreateClientsForProjection()
+    schema = aff4_grr.VFSGRRClient.SchemaCls
+
+    fds = list(
+        aff4.FACTORY.MultiOpen(
+            urns, attributes=[schema.HOSTNAME], token=self.token))
+    self.assertEqual(len(fds), 2)
+    for fd in sorted(fds, key=lambda fd: fd.urn):
+      self.assertTrue(isinstance(fd, aff4_grr.VFSGRRClient))
+      self.assertEqual(
+          fd.Get(fd.Schema.HOSTNAME), "host%d" % urns.index(fd.urn))
+      self.assertRaises(aff4.AttributeNotLoadedError, fd.Get, fd.Schema.SYSTEM)
+      self.assertRaises(aff4.AttributeNotLoadedError, fd.IsAttributeSet,
+                        fd.Schema.SYSTEM)
+
+  def testOpenWithAttributeProjection(self):
+    urn = self._CreateClientsForProjection()[0]
+    schema = aff4_grr.VFSGRRClient.SchemaCls
+
+    fd = aff4.FACTORY.Open(urn, attributes=[schema.SYSTEM], token=self.token)
+    self.assertEqual(fd.Get(fd.Schema.SYSTEM), "Linux")
+    self.assertRaises(aff4.AttributeNotLoadedError, fd.Get, fd.Schema.HOSTNAME)
+
+    # Projections are only allowed for read only objects.
+    self.assertRaises(
+        AttributeError,
+        aff4.FACTORY.Open,
+        urn,
+        mode="rw",
+        attributes=[schema.SYSTEM],
+        token=self.token)
+    with self.assertRaises(RuntimeError):
+      list(
+          aff4.FACTORY.MultiOpen(
+              [urn], mode="rw", attributes=[schema.SYSTEM], token=self.token))
+
   def testObjectListChildren(self):
     root_urn = aff4.ROOT_URN.Add("path")
 
@@ -1761,6 +1854,249 @@ class AFF4Test(aff4_test_lib.AFF4ObjectTest):
             self.fail("Class %s used aff4.FACTORY during init: %s" % (cls, e))
 
 
+class _DelayedThreadPool(object):
+  """A thread pool which runs each task on its own thread after a delay."""
+
+  def __init__(self, delay):
+    self.delay = delay
+
+  def AddTask(self, target, args, name="Unnamed task"):
+    _ = name
+    threading.Timer(self.delay, target, args).start()
+
+
+class ChunkReadAheadTest(aff4_test_lib.AFF4ObjectTest):
+  """Tests for the asynchronous AFF4 image read ahead."""
+
+  def _MakeReadAhead(self, pool):
+    self.fetched = []
+    return aff4.ChunkReadAhead(
+        self.fetched.append, window=10, max_window=40, pool=pool)
+
+  def testSequentialAccessReadsAhead(self):
+    read_ahead = self._MakeReadAhead(threadpool.MockThreadPool("test", 1))
+
+    # The first access is read synchronously by the image.
+    read_ahead.Access(0)
+    self.assertEqual(self.fetched, [])
+
+    for chunk in range(1, 5):
+      read_ahead.Access(chunk)
+    self.assertEqual(self.fetched, [])
+
+    # Half way through the window, the next window is fetched.
+    read_ahead.Access(5)
+    self.assertEqual(self.fetched, [range(10, 20)])
+
+    for chunk in range(6, 16):
+      read_ahead.Access(chunk)
+    self.assertEqual(self.fetched, [range(10, 20), range(20, 30)])
+
+  def testRepeatedAccessToSameChunkIsSequential(self):
+    read_ahead = self._MakeReadAhead(threadpool.MockThreadPool("test", 1))
+
+    for chunk in [0, 0, 1, 1, 1, 2, 3, 4, 4, 5]:
+      read_ahead.Access(chunk)
+    self.assertEqual(self.fetched, [range(10, 20)])
+
+  def testRandomAccessResetsWindow(self):
+    read_ahead = self._MakeReadAhead(threadpool.MockThreadPool("test", 1))
+    read_ahead.window = 40
+
+    read_ahead.Access(100)
+    self.assertEqual(read_ahead.window, 10)
+    self.assertEqual(self.fetched, [])
+
+    read_ahead.Access(3)
+    self.assertEqual(self.fetched, [])
+
+  def testWindowGrowsWhenReaderStalls(self):
+    read_ahead = self._MakeReadAhead(_DelayedThreadPool(0.1))
+
+    for chunk in range(6):
+      read_ahead.Access(chunk)
+
+    self.assertTrue(read_ahead.Wait(10))
+    self.assertEqual(self.fetched, [range(10, 20)])
+    self.assertEqual(read_ahead.window, 20)
+
+    # The fetch is done now, there is nothing to wait for.
+    self.assertFalse(read_ahead.Wait(10))
+
+  def testWindowIsCapped(self):
+    read_ahead = self._MakeReadAhead(_DelayedThreadPool(0))
+    read_ahead.window = 40
+    read_ahead.pending.append((0, 10, threading.Event()))
+    read_ahead.pending[0][2].set()
+
+    read_ahead.Wait(5)
+    self.assertEqual(read_ahead.window, 40)
+
+  def _WriteImage(self, urn, data, chunksize=10):
+    with aff4.FACTORY.Create(urn, aff4.AFF4Image, token=self.token) as fd:
+      fd.SetChunksize(chunksize)
+      fd.Write(data)
+
+  def testSequentialImageReadUsesReadAhead(self):
+    urn = "aff4:/C.12345/read_ahead"
+    data = "".join("Test%08X\n" % i for i in range(100))
+    self._WriteImage(urn, data)
+
+    before = stats.STATS.GetMetricValue("aff4_image_read_ahead_chunks")
+    fd = aff4.FACTORY.Open(urn, token=self.token)
+    self.assertEqual("".join(fd.StreamChunks()), data)
+    self.assertGreater(
+        stats.STATS.GetMetricValue("aff4_image_read_ahead_chunks"), before)
+
+    # Random reads still return the right data.
+    for offset in [1100, 3, 512, 1290]:
+      fd.Seek(offset)
+      self.assertEqual(fd.Read(17), data[offset:offset + 17])
+
+  def testNoReadAheadForWritableImages(self):
+    urn = "aff4:/C.12345/read_ahead"
+    data = "X" * 1000
+    self._WriteImage(urn, data)
+
+    fd = aff4.FACTORY.Open(urn, mode="rw", token=self.token)
+    self.assertEqual(fd.Read(1000), data)
+    self.assertIsNone(fd._read_ahead)
+
+  def testReadAheadCanBeDisabled(self):
+    urn = "aff4:/C.12345/read_ahead"
+    data = "X" * 1000
+    self._WriteImage(urn, data)
+
+    with test_lib.ConfigOverrider({"AFF4.image_read_ahead_threads": 0}):
+      fd = aff4.FACTORY.Open(urn, token=self.token)
+      self.assertEqual(fd.Read(1000), data)
+      self.assertIsNone(fd._read_ahead)
+
+
+class AFF4AttributeCacheTest(aff4_test_lib.AFF4ObjectTest):
+  """Tests for the Factory attribute read cache."""
+
+  def setUp(self):
+    super(AFF4AttributeCacheTest, self).setUp()
+    with test_lib.ConfigOverrider({"AFF4.attribute_cache_size": 100}):
+      self.factory = aff4.Factory()
+    self.factory_stubber = utils.Stubber(aff4, "FACTORY", self.factory)
+    self.factory_stubber.Start()
+
+  def tearDown(self):
+    self.factory_stubber.Stop()
+    super(AFF4AttributeCacheTest, self).tearDown()
+
+  def _CreateObject(self, urn, aff4_type):
+    with aff4.FACTORY.Create(urn, aff4_type, mode="w", token=self.token) as fd:
+      return fd
+
+  def _CountReads(self, func):
+    with mock.patch.object(
+        data_store.DB,
+        "MultiResolvePrefix",
+        wraps=data_store.DB.MultiResolvePrefix) as multi_resolve_prefix:
+      func()
+      return multi_resolve_prefix.call_count
+
+  def testRepeatedOpenIsServedFromCache(self):
+    self._CreateObject("aff4:/obj1", aff4.AFF4MemoryStream)
+
+    def OpenObject():
+      fd = aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+      self.assertEqual(fd.Get(fd.Schema.TYPE), "AFF4MemoryStream")
+
+    self.assertEqual(self._CountReads(OpenObject), 1)
+    self.assertEqual(self._CountReads(OpenObject), 0)
+
+  def testMultiOpenOnlyReadsMissingObjects(self):
+    self._CreateObject("aff4:/obj1", aff4.AFF4MemoryStream)
+    self._CreateObject("aff4:/obj2", aff4.AFF4MemoryStream)
+
+    aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+
+    with mock.patch.object(
+        data_store.DB,
+        "MultiResolvePrefix",
+        wraps=data_store.DB.MultiResolvePrefix) as multi_resolve_prefix:
+      fds = list(
+          aff4.FACTORY.MultiOpen(["aff4:/obj1", "aff4:/obj2"],
+                                 token=self.token))
+      self.assertEqual(len(fds), 2)
+      self.assertEqual(multi_resolve_prefix.call_count, 1)
+      self.assertEqual(
+          list(multi_resolve_prefix.call_args[0][0]), [u"aff4:/obj2"])
+
+  def testCacheIsKeyedByTokenAndAge(self):
+    self._CreateObject("aff4:/obj1", aff4.AFF4MemoryStream)
+
+    aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+
+    other_token = access_control.ACLToken(username="other", reason="test")
+    self.assertEqual(
+        self._CountReads(
+            lambda: aff4.FACTORY.Open("aff4:/obj1", token=other_token)), 1)
+    self.assertEqual(
+        self._CountReads(lambda: aff4.FACTORY.Open(
+            "aff4:/obj1", age=aff4.ALL_TIMES, token=self.token)), 1)
+
+  def testWritesInvalidateCache(self):
+    self._CreateObject("aff4:/obj1", aff4.AFF4MemoryStream)
+    aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+
+    self._CreateObject("aff4:/obj1", aff4.AFF4Volume)
+
+    fd = aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+    self.assertEqual(fd.Get(fd.Schema.TYPE), "AFF4Volume")
+
+  def testMutationPoolFlushInvalidatesCache(self):
+    self._CreateObject("aff4:/obj1", aff4.AFF4MemoryStream)
+    aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      pool.Set("aff4:/obj1", aff4.AFF4Object.SchemaCls.TYPE, "AFF4Volume")
+
+    fd = aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+    self.assertEqual(fd.Get(fd.Schema.TYPE), "AFF4Volume")
+
+  def testDeleteInvalidatesCache(self):
+    self._CreateObject("aff4:/obj1", aff4.AFF4MemoryStream)
+    aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+
+    aff4.FACTORY.Delete("aff4:/obj1", token=self.token)
+
+    fd = aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+    self.assertNotIsInstance(fd, aff4.AFF4MemoryStream)
+
+  def testStatIsServedFromCache(self):
+    self._CreateObject("aff4:/obj1", aff4.AFF4MemoryStream)
+    aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+
+    def StatObject():
+      results = list(aff4.FACTORY.Stat(["aff4:/obj1"], token=self.token))
+      self.assertEqual(len(results), 1)
+      self.assertEqual(results[0]["type"][1], "AFF4MemoryStream")
+
+    self.assertEqual(self._CountReads(StatObject), 0)
+
+  def testCacheCountersAreUpdated(self):
+    self._CreateObject("aff4:/obj1", aff4.AFF4MemoryStream)
+
+    hits = stats.STATS.GetMetricValue("aff4_attribute_cache_hits")
+    misses = stats.STATS.GetMetricValue("aff4_attribute_cache_misses")
+
+    aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+    aff4.FACTORY.Open("aff4:/obj1", token=self.token)
+
+    self.assertEqual(
+        stats.STATS.GetMetricValue("aff4_attribute_cache_hits"), hits + 1)
+    self.assertEqual(
+        stats.STATS.GetMetricValue("aff4_attribute_cache_misses"), misses + 1)
+
+  def testCacheIsDisabledByDefault(self):
+    self.assertIsNone(aff4.Factory().attribute_cache)
+
+
 class AFF4SymlinkTestSubject(aff4.AFF4Volume):
   """A test subject for AFF4SymlinkTest."""
 
@@ -1951,6 +2287,57 @@ class ForemanTests(aff4_test_lib.AFF4ObjectTest):
 
       self.assertEqual(len(self.clients_launched), 0)
 
+  def testAssignTasksToClients(self):
+    """Tests that many clients can be checked against the rules at once."""
+    client_ids = []
+    for i, system in enumerate(["Windows XP", "Linux", "Windows 7"]):
+      client_id = rdf_client.ClientURN("C.000000000000003%d" % i)
+      fd = aff4.FACTORY.Create(
+          client_id, aff4_grr.VFSGRRClient, token=self.token)
+      fd.Set(fd.Schema.SYSTEM, rdfvalue.RDFString(system))
+      fd.Close()
+      client_ids.append(client_id)
+
+    with utils.Stubber(flow.GRRFlow, "StartFlow", self.StartFlow):
+      now = time.time() * 1e6
+      expires = (time.time() + 3600) * 1e6
+      foreman = aff4.FACTORY.Open("aff4:/foreman", mode="rw", token=self.token)
+
+      rule_set = foreman.Schema.RULES()
+      # Two rules with the same client rule set, matching Windows boxes.
+      for description in ["Test rule", "Other test rule"]:
+        rule = rdf_foreman.ForemanRule(
+            created=int(now), expires=int(expires), description=description)
+        rule.client_rule_set = rdf_foreman.ForemanClientRuleSet(rules=[
+            rdf_foreman.ForemanClientRule(
+                rule_type=rdf_foreman.ForemanClientRule.Type.OS,
+                os=rdf_foreman.ForemanOsClientRule(os_windows=True))
+        ])
+        rule.actions.Append(
+            flow_name="Test Flow", argv=rdf_protodict.Dict(foo="bar"))
+        rule_set.Append(rule)
+
+      foreman.Set(foreman.Schema.RULES, rule_set)
+      foreman.Close()
+
+      self.clients_launched = []
+      result = foreman.AssignTasksToClients(
+          client_ids + ["C.0000000000000039"])
+      self.assertEqual(result[client_ids[0]], 2)
+      self.assertEqual(result[client_ids[1]], 0)
+      self.assertEqual(result[client_ids[2]], 2)
+      # Clients which do not exist are skipped.
+      self.assertEqual(result[rdf_client.ClientURN("C.0000000000000039")], 0)
+      self.assertEqual(
+          sorted(client_id for client_id, _ in self.clients_launched),
+          [client_ids[0]] * 2 + [client_ids[2]] * 2)
+
+      # The clients were checked against these rules already.
+      self.clients_launched = []
+      result = foreman.AssignTasksToClients(client_ids)
+      self.assertEqual(sum(result.values()), 0)
+      self.assertEqual(self.clients_launched, [])
+
   def testIntegerComparisons(self):
     """Tests that we can use integer matching rules on the foreman."""
 
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""A content addressed blob store keeping blobs in a local directory tree.
+
+Blobs are stored in files named after the hex encoded sha256 digest of their
+content. Files are sharded over two levels of subdirectories using the first
+four characters of the digest (e.g. "ab/cd/abcd...") so that no single
+directory grows too large. Writes go to a temporary file in the target
+directory which is then atomically renamed into place, so readers never see
+partially written blobs.
+"""
+
+import binascii
+import hashlib
+import logging
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from grr import config
+from grr.lib import utils
+from grr.server import blob_store
+
+# Every blob file starts with a single byte describing how the content is
+# encoded.
+_RAW = "\x00"
+_ZLIB = "\x01"
+
+_DIGEST_RE = re.compile("^[0-9a-f]{64}$")
+
+# Shard directories modified less than this many seconds before they were last
+# listed are listed again, some file systems only have a coarse mtime
+# resolution.
+_MTIME_SLACK = 2
+
+
+class BloomFilter(object):
+  """A bloom filter over sha256 digests.
+
+  Since the keys are already uniformly distributed hash values, the bit
+  positions are taken directly from the digest bytes instead of hashing the
+  keys again.
+  """
+
+  # A sha256 digest holds eight 32 bit words, each one gives a bit position.
+  MAX_HASHES = 8
+
+  def __init__(self, num_bits, num_hashes=4):
+    if num_bits <= 0:
+      raise ValueError("Bloom filter needs a positive size.")
+    if not 0 < num_hashes <= self.MAX_HASHES:
+      raise ValueError("Number of hashes must be between 1 and %d." %
+                       self.MAX_HASHES)
+
+    self.num_bits = num_bits
+    self.num_hashes = num_hashes
+    self.bits = bytearray((num_bits + 7) // 8)
+
+  def _Positions(self, digest):
+    words = struct.unpack(">8I", binascii.unhexlify(digest))
+    return [word % self.num_bits for word in words[:self.num_hashes]]
+
+  def Add(self, digest):
+    for pos in self._Positions(digest):
+      self.bits[pos >> 3] |= 1 << (pos & 7)
+
+  def __contains__(self, digest):
+    for pos in self._Positions(digest):
+      if not self.bits[pos >> 3] & (1 << (pos & 7)):
+        return False
+    return True
+
+
+class FileBlobstore(blob_store.Blobstore):
+  """A blob store keeping each blob in its own file on local disk.
+
+  BlobsExist is answered from an in-memory bloom filter of all stored digests
+  when possible: a digest that is not in the filter is reported as missing
+  without touching the disk, a digest that is in the filter is confirmed with
+  a stat call. The filter is built by a full scan of the directory tree and
+  then knows about blobs written through this process. Blobs written by
+  other processes are picked up every
+  FileBlobstore.bloom_filter_update_interval by listing only the shard
+  directories modified since they were last listed. Until then they may be
+  reported as missing, which at most causes them to be transferred and
+  stored again. Setting FileBlobstore.bloom_filter_bits to 0 disables the
+  filter.
+  """
+
+  def __init__(self, root=None, compression=None, bloom_filter_bits=None):
+    super(FileBlobstore, self).__init__()
+    if root is None:
+      root = config.CONFIG["FileBlobstore.root"]
+    if compression is None:
+      compression = config.CONFIG["FileBlobstore.compression"]
+    if bloom_filter_bits is None:
+      bloom_filter_bits = config.CONFIG["FileBlobstore.bloom_filter_bits"]
+
+    self.root = root
+    self.compression = compression
+    self.bloom_filter_bits = bloom_filter_bits
+
+    self.bloom_filter = None
+    self.pending_filter = None
+    self.bloom_filter_lock = threading.Lock()
+    self.update_thread = None
+    # Maps shard directories to the time they were last listed at.
+    self.shard_watermarks = {}
+
+  def _BlobPath(self, digest):
+    return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+  def _Encode(self, content):
+    if self.compression:
+      compressed = zlib.compress(content)
+      # Don't bother keeping compressed data that isn't smaller.
+      if len(compressed) < len(content):
+        return _ZLIB + compressed
+    return _RAW + content
+
+  def _WriteBlob(self, digest, content):
+    """Atomically writes a blob file unless it already exists."""
+    path = self._BlobPath(digest)
+    if os.path.exists(path):
+      logging.debug("Blob %s already stored.", digest)
+      return
+
+    dirname = os.path.dirname(path)
+    try:
+      os.makedirs(dirname)
+    except OSError:
+      if not os.path.isdir(dirname):
+        raise
+
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as tmp_file:
+        tmp_file.write(self._Encode(content))
+      try:
+        os.rename(tmp_path, path)
+      except OSError:
+        # On platforms where rename does not replace existing files this
+        # happens when another writer stored the same blob concurrently. The
+        # content is identical so there is nothing to do.
+        if not os.path.exists(path):
+          raise
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    logging.debug("Got blob %s (length %s)", digest, len(content))
+
+  def _ReadBlob(self, digest):
+    """Reads a single blob, returns None if it does not exist."""
+    try:
+      blob_file = open(self._BlobPath(digest), "rb")
+    except IOError:
+      return None
+
+    with blob_file:
+      # Reading the encoding byte first saves copying the content to strip it.
+      encoding = blob_file.read(1)
+      if encoding == _ZLIB:
+        return zlib.decompress(blob_file.read())
+      return blob_file.read()
+
+  def _ListDir(self, path):
+    try:
+      return os.listdir(path)
+    except OSError:
+      return []
+
+  def _IterModifiedShards(self):
+    """Yields the shard directories modified since they were last listed."""
+    for first in sorted(self._ListDir(self.root)):
+      first_path = os.path.join(self.root, first)
+      for second in sorted(self._ListDir(first_path)):
+        shard = os.path.join(first_path, second)
+        try:
+          mtime = os.stat(shard).st_mtime
+        except OSError:
+          continue
+
+        watermark = self.shard_watermarks.get(shard)
+        if watermark is None or mtime >= watermark - _MTIME_SLACK:
+          yield shard
+
+  def _UpdateBloomFilter(self):
+    """Adds the blobs stored by other processes to the bloom filter.
+
+    The first call builds the filter from all blobs stored on disk, later
+    calls only list the shard directories that were modified since.
+    """
+    if self.bloom_filter is None:
+      bloom_filter = BloomFilter(self.bloom_filter_bits)
+      # Blobs written during the initial scan might be missed by it, so they
+      # are recorded in the pending filter as well.
+      with self.bloom_filter_lock:
+        self.pending_filter = bloom_filter
+    else:
+      bloom_filter = self.bloom_filter
+
+    try:
+      for shard in self._IterModifiedShards():
+        listed_at = time.time()
+        digests = [
+            filename for filename in self._ListDir(shard)
+            if _DIGEST_RE.match(filename)
+        ]
+        with self.bloom_filter_lock:
+          for digest in digests:
+            bloom_filter.Add(digest)
+        self.shard_watermarks[shard] = listed_at
+    except Exception as e:  # pylint: disable=broad-except
+      # An incomplete initial filter would report stored blobs as missing,
+      # don't use it. Shards which were not listed are retried next time.
+      logging.exception("Error updating blob bloom filter: %s", e)
+      if self.bloom_filter is None:
+        self.shard_watermarks = {}
+        bloom_filter = None
+
+    with self.bloom_filter_lock:
+      self.pending_filter = None
+      self.bloom_filter = bloom_filter
+
+  def _StartBloomFilterUpdates(self):
+    """Starts the thread that periodically updates the bloom filter."""
+    with self.bloom_filter_lock:
+      if self.update_thread is not None:
+        return
+
+      interval = config.CONFIG["FileBlobstore.bloom_filter_update_interval"]
+      self.update_thread = utils.InterruptableThread(
+          name="FileBlobstore bloom filter thread",
+          target=self._UpdateBloomFilter,
+          sleep_time=interval.seconds)
+      self.update_thread.start()
+
+  def _AddToBloomFilter(self, digests):
+    with self.bloom_filter_lock:
+      for bloom_filter in (self.bloom_filter, self.pending_filter):
+        if bloom_filter is not None:
+          for digest in digests:
+            bloom_filter.Add(digest)
+
+  def StoreBlobs(self, contents, token=None):
+    """Creates blobs, returns their digests in the order of contents."""
+    digests = []
+    contents_by_digest = {}
+    for content in contents:
+      digest = hashlib.sha256(content).hexdigest()
+      digests.append(digest)
+      contents_by_digest[digest] = content
+
+    for digest, content in contents_by_digest.iteritems():
+      self._WriteBlob(digest, content)
+
+    self._AddToBloomFilter(contents_by_digest)
+
+    return digests
+
+  def ReadBlobs(self, digests, token=None):
+    return {digest: self._ReadBlob(digest) for digest in digests}
+
+  def BlobsExist(self, digests, token=None):
+    """Check if blobs for the given digests already exist."""
+    bloom_filter = None
+    if self.bloom_filter_bits:
+      self._StartBloomFilterUpdates()
+      # Until the first scan of the directory tree has finished there is no
+      # filter and all lookups go to disk.
+      bloom_filter = self.bloom_filter
+
+    res = {}
+    for digest in digests:
+      if bloom_filter is not None and digest not in bloom_filter:
+        res[digest] = False
+      else:
+        res[digest] = os.path.exists(self._BlobPath(digest))
+    return res
+
+  def DeleteBlobs(self, digests, token=None):
+    # Bloom filters can't forget entries. Deleted digests will just fail the
+    # stat check in BlobsExist.
+    for digest in digests:
+      try:
+        os.remove(self._BlobPath(digest))
+      except OSError:
+        pass
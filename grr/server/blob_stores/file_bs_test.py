@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Tests for the file based blob store."""
+
+import hashlib
+import os
+
+from grr.lib import flags
+from grr.lib import utils
+from grr.server.blob_stores import file_bs
+from grr.test_lib import test_lib
+
+
+class FileBlobstoreTest(test_lib.GRRBaseTest):
+  """Tests for FileBlobstore."""
+
+  def setUp(self):
+    super(FileBlobstoreTest, self).setUp()
+    self.root = os.path.join(self.temp_dir, "blobs")
+
+  def _Blobstore(self, **kwargs):
+    kwargs.setdefault("compression", False)
+    kwargs.setdefault("bloom_filter_bits", 0)
+    return file_bs.FileBlobstore(root=self.root, **kwargs)
+
+  def testStoreAndReadBlobs(self):
+    blobstore = self._Blobstore()
+    contents = ["foo", "bar" * 100000, "foo", ""]
+
+    digests = blobstore.StoreBlobs(contents, token=self.token)
+    self.assertEqual(digests, [hashlib.sha256(c).hexdigest() for c in contents])
+
+    # Blobs end up in a sharded directory tree.
+    digest = digests[0]
+    self.assertTrue(
+        os.path.exists(
+            os.path.join(self.root, digest[:2], digest[2:4], digest)))
+
+    missing = hashlib.sha256("missing").hexdigest()
+    blobs = blobstore.ReadBlobs(digests + [missing], token=self.token)
+    self.assertEqual(blobs[missing], None)
+    for digest, content in zip(digests, contents):
+      self.assertEqual(blobs[digest], content)
+
+  def testCompression(self):
+    compressed = self._Blobstore(compression=True)
+    content = "x" * 200000
+    digest = compressed.StoreBlob(content, token=self.token)
+
+    path = os.path.join(self.root, digest[:2], digest[2:4], digest)
+    self.assertLess(os.path.getsize(path), len(content))
+
+    # Compressed blobs can be read back regardless of the current setting.
+    for blobstore in [compressed, self._Blobstore()]:
+      self.assertEqual(blobstore.ReadBlob(digest, token=self.token), content)
+
+  def testBlobsExistAndDelete(self):
+    blobstore = self._Blobstore()
+    digests = blobstore.StoreBlobs(["foo", "bar"], token=self.token)
+    missing = hashlib.sha256("missing").hexdigest()
+
+    self.assertEqual(
+        blobstore.BlobsExist(digests + [missing], token=self.token), {
+            digests[0]: True,
+            digests[1]: True,
+            missing: False
+        })
+
+    blobstore.DeleteBlobs(digests[:1], token=self.token)
+    self.assertFalse(blobstore.BlobExists(digests[0], token=self.token))
+    self.assertTrue(blobstore.BlobExists(digests[1], token=self.token))
+
+  def testBloomFilter(self):
+    writer = self._Blobstore()
+    old_digest = writer.StoreBlob("old", token=self.token)
+
+    blobstore = self._Blobstore(bloom_filter_bits=1024)
+    blobstore._UpdateBloomFilter()
+    self.assertIn(old_digest, blobstore.bloom_filter)
+
+    # Blobs stored through this instance are added to the filter right away.
+    new_digest = blobstore.StoreBlob("new", token=self.token)
+    self.assertIn(new_digest, blobstore.bloom_filter)
+
+    with utils.Stubber(file_bs.FileBlobstore, "_StartBloomFilterUpdates",
+                       lambda self: None):
+      self.assertTrue(blobstore.BlobExists(old_digest, token=self.token))
+      self.assertTrue(blobstore.BlobExists(new_digest, token=self.token))
+
+      # Blobs written elsewhere are only seen after the next rebuild.
+      other_digest = writer.StoreBlob("other", token=self.token)
+      self.assertNotIn(other_digest, blobstore.bloom_filter)
+      self.assertFalse(blobstore.BlobExists(other_digest, token=self.token))
+
+      blobstore._UpdateBloomFilter()
+      self.assertTrue(blobstore.BlobExists(other_digest, token=self.token))
+
+  def testBloomFilterUpdatesOnlyListModifiedShards(self):
+    writer = self._Blobstore()
+    digests = writer.StoreBlobs(["foo", "bar"], token=self.token)
+
+    blobstore = self._Blobstore(bloom_filter_bits=1024)
+    blobstore._UpdateBloomFilter()
+    for digest in digests:
+      self.assertIn(digest, blobstore.bloom_filter)
+
+    # Pretend the shards were listed long after they were last modified.
+    for shard in blobstore.shard_watermarks:
+      blobstore.shard_watermarks[shard] += 3600
+    self.assertEqual(list(blobstore._IterModifiedShards()), [])
+
+    # A shard modified after it was listed is listed again, so is a new one.
+    foo_shard = os.path.dirname(writer._BlobPath(digests[0]))
+    mtime = blobstore.shard_watermarks[foo_shard] + 10
+    os.utime(foo_shard, (mtime, mtime))
+    other_digest = writer.StoreBlob("other", token=self.token)
+    other_shard = os.path.dirname(writer._BlobPath(other_digest))
+    self.assertEqual(
+        sorted(blobstore._IterModifiedShards()),
+        sorted([foo_shard, other_shard]))
+
+    blobstore._UpdateBloomFilter()
+    self.assertIn(other_digest, blobstore.bloom_filter)
+    for digest in digests:
+      self.assertIn(digest, blobstore.bloom_filter)
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -5,3 +5,6 @@
 
 # The memory stream object based blob store.
 from grr.server.blob_stores import memory_stream_bs
+
+# A content addressed blob store keeping blobs in local files.
+from grr.server.blob_stores import file_bs
@@ -5,16 +5,25 @@ An index of client machines, associating likely identifiers to client IDs.
 """
 
 
+import threading
+
+from grr import config
 from grr.lib import rdfvalue
+from grr.lib import registry
+from grr.lib import stats
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.server import aff4
+from grr.server import client_search_index
 from grr.server import keyword_index
 from grr.server.aff4_objects import aff4_grr
 
 # The system's primary client index.
 MAIN_INDEX = rdfvalue.RDFURN("aff4:/client_index")
 
+# The in-memory search index of the primary client index, if enabled.
+SEARCH_INDEX = None
+
 
 def CreateClientIndex(token=None):
   return aff4.FACTORY.Create(
@@ -43,6 +52,11 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
   def _NormalizeKeyword(self, keyword):
     return keyword.lower()
 
+  def _SearchIndex(self):
+    """Returns the in-memory search index for this index, if there is one."""
+    if SEARCH_INDEX is not None and self.urn == MAIN_INDEX:
+      return SEARCH_INDEX
+
   def _AnalyzeKeywords(self, keywords):
     start_time = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("180d")
     end_time = rdfvalue.RDFDatetime(self.LAST_TIMESTAMP)
@@ -93,6 +107,14 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
     start_time, end_time, filtered_keywords, unversioned_keywords = (
         self._AnalyzeKeywords(keywords))
 
+    search_index = self._SearchIndex()
+    if search_index is not None and search_index.ready:
+      client_ids = search_index.Lookup(
+          map(self._NormalizeKeyword, filtered_keywords),
+          start_time=start_time.AsMicroSecondsFromEpoch(),
+          end_time=end_time.AsMicroSecondsFromEpoch())
+      return [rdf_client.ClientURN(client_id) for client_id in client_ids]
+
     last_seen_map = None
     if unversioned_keywords:
       last_seen_map = {}
@@ -263,6 +285,10 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
     client_id, keywords = self.AnalyzeClient(client)
     self.AddKeywordsForName(client_id, keywords)
 
+    search_index = self._SearchIndex()
+    if search_index is not None:
+      search_index.AddClient(client_id, keywords)
+
   def RemoveClientLabels(self, client):
     """Removes all labels for a given client object.
 
@@ -279,7 +305,36 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
       keywords.append(keyword)
       keywords.append("label:%s" % keyword)
 
-    self.RemoveKeywordsForName(self._ClientIdFromURN(client.urn), keywords)
+    client_id = self._ClientIdFromURN(client.urn)
+    self.RemoveKeywordsForName(client_id, keywords)
+
+    search_index = self._SearchIndex()
+    if search_index is not None:
+      search_index.RemoveKeywords(client_id, keywords)
+
+
+class ClientSearchIndexInit(registry.InitHook):
+  """Starts maintaining the in-memory client search index if enabled."""
+
+  pre = [aff4.AFF4InitHook]
+
+  def RunOnce(self):
+    global SEARCH_INDEX
+
+    stats.STATS.RegisterGaugeMetric("client_search_index_clients", int)
+
+    if not config.CONFIG["Server.client_search_index"]:
+      return
+
+    SEARCH_INDEX = client_search_index.ClientSearchIndex()
+    thread = threading.Thread(
+        target=SEARCH_INDEX.Maintain,
+        args=(lambda: CreateClientIndex(token=aff4.FACTORY.root_token),
+              config.CONFIG["Server.client_search_index_reconcile_interval"],
+              config.CONFIG["Server.client_search_index_rebuild_interval"]),
+        name="ClientSearchIndex")
+    thread.daemon = True
+    thread.start()
 
 
 def GetClientURNsForHostnames(hostnames, token=None):
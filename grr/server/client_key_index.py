@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""A compact index of client public keys.
+
+The frontend needs the public key of every client it talks to. Getting it from
+the client object means reading the whole client row, so the keys are also
+kept in a few index subjects with one small attribute per client holding the
+DER encoded key. Client ids are derived from the public key, so an entry never
+changes once written.
+
+The timestamp of an entry records when a frontend last loaded the key, this
+lets a restarting frontend preload the keys of recently active clients.
+"""
+
+import logging
+
+from grr.lib import rdfvalue
+from grr.lib import type_info
+from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import crypto as rdf_crypto
+from grr.server import data_store
+
+# The keys are spread over subjects below this URN, named after the first
+# SHARD_DIGITS hex digits of the client ids. Every frontend writes to the
+# index, so a single subject would be a hot spot.
+INDEX_URN = rdfvalue.RDFURN("aff4:/index/client_keys")
+SHARD_DIGITS = 2
+
+KEY_ATTRIBUTE_PREFIX = "index:client_key:"
+
+
+def _AllShards():
+  return [
+      INDEX_URN.Add("%0*x" % (SHARD_DIGITS, i))
+      for i in range(16**SHARD_DIGITS)
+  ]
+
+
+class ClientKeyIndex(object):
+  """Reads and writes the public keys of clients."""
+
+  # Entries loaded longer ago than this are rewritten when they are read again,
+  # so their timestamp stays close to the time the client was last active.
+  REFRESH_AGE = rdfvalue.Duration("1d")
+
+  def __init__(self, token=None, store=None):
+    self.token = token
+    self.data_store = store or data_store.DB
+
+  def _Attribute(self, client_id):
+    return KEY_ATTRIBUTE_PREFIX + rdf_client.ClientURN(client_id).Basename()
+
+  def _Shard(self, client_id):
+    # Client ids are "C." followed by hex digits.
+    basename = rdf_client.ClientURN(client_id).Basename()
+    return INDEX_URN.Add(basename[2:2 + SHARD_DIGITS].lower())
+
+  def WriteKey(self, client_id, public_key):
+    """Stores the public key of a client.
+
+    Args:
+      client_id: The client id or URN.
+      public_key: An rdf_crypto.RSAPublicKey.
+    """
+    self.data_store.Set(
+        self._Shard(client_id),
+        self._Attribute(client_id),
+        public_key.AsDER(),
+        token=self.token,
+        sync=False)
+
+  def _DecodeKey(self, attribute, value):
+    try:
+      return rdf_crypto.RSAPublicKey.FromDER(value)
+    except type_info.TypeValueError as e:
+      logging.warning("Invalid key index entry %s: %s", attribute, e)
+      return None
+
+  def ReadKeys(self, client_ids):
+    """Reads the public keys of several clients in a single lookup.
+
+    Args:
+      client_ids: A list of client ids or URNs.
+
+    Returns:
+      A dict mapping the client ids found in the index, as given, to their
+      rdf_crypto.RSAPublicKey.
+    """
+    client_ids_by_attribute = {}
+    shards = set()
+    for client_id in client_ids:
+      client_ids_by_attribute[self._Attribute(client_id)] = client_id
+      shards.add(self._Shard(client_id))
+
+    result = {}
+    stale = []
+    refresh_before = (
+        rdfvalue.RDFDatetime.Now() - self.REFRESH_AGE).AsMicroSecondsFromEpoch()
+    for _, values in self.data_store.MultiResolveAttributes(
+        shards,
+        client_ids_by_attribute.keys(),
+        timestamp=self.data_store.NEWEST_TIMESTAMP,
+        token=self.token):
+      for attribute, value, timestamp in values:
+        key = self._DecodeKey(attribute, value)
+        if key is None:
+          continue
+
+        client_id = client_ids_by_attribute[utils.SmartStr(attribute)]
+        result[client_id] = key
+        if timestamp < refresh_before:
+          stale.append(client_id)
+
+    for client_id in stale:
+      self.WriteKey(client_id, result[client_id])
+
+    return result
+
+  def ReadKey(self, client_id):
+    """Returns the public key of a client or None if it is not indexed."""
+    return self.ReadKeys([client_id]).get(client_id)
+
+  def ReadRecentKeys(self, max_age, limit=None):
+    """Reads the keys of the clients whose keys were recently loaded.
+
+    Args:
+      max_age: An rdfvalue.Duration, only keys loaded within this time are
+        returned.
+      limit: The maximum number of keys to return, the most recently loaded
+        ones are returned first.
+
+    Returns:
+      A dict mapping client URNs to rdf_crypto.RSAPublicKey objects.
+    """
+    now = rdfvalue.RDFDatetime.Now()
+    entries = []
+    for _, values in self.data_store.MultiResolvePrefix(
+        _AllShards(),
+        KEY_ATTRIBUTE_PREFIX,
+        timestamp=((now - max_age).AsMicroSecondsFromEpoch(),
+                   now.AsMicroSecondsFromEpoch()),
+        token=self.token):
+      for attribute, value, timestamp in values:
+        entries.append((timestamp, utils.SmartStr(attribute), value))
+
+    # The data store returns the entries in attribute order.
+    entries.sort(reverse=True)
+
+    result = {}
+    for _, attribute, value in entries:
+      if limit is not None and len(result) >= limit:
+        break
+
+      try:
+        client_id = rdf_client.ClientURN(attribute[len(KEY_ATTRIBUTE_PREFIX):])
+      except type_info.TypeValueError as e:
+        logging.warning("Invalid key index entry %s: %s", attribute, e)
+        continue
+
+      # Older versions of an entry might be in the time range as well.
+      if client_id in result:
+        continue
+
+      key = self._DecodeKey(attribute, value)
+      if key is not None:
+        result[client_id] = key
+
+    return result
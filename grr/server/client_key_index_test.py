@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Tests for grr.server.client_key_index."""
+
+from grr import config
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib.rdfvalues import client as rdf_client
+from grr.server import client_key_index
+from grr.server import data_store
+from grr.test_lib import test_lib
+
+
+class ClientKeyIndexTest(test_lib.GRRBaseTest):
+  """Tests the ClientKeyIndex."""
+
+  def setUp(self):
+    super(ClientKeyIndexTest, self).setUp()
+    self.index = client_key_index.ClientKeyIndex(token=self.token)
+    self.client_key = config.CONFIG["Client.private_key"].GetPublicKey()
+    self.server_key = config.CONFIG["PrivateKeys.server_key"].GetPublicKey()
+
+  def testWriteAndReadKeys(self):
+    first = rdf_client.ClientURN("C.1000000000000000")
+    second = rdf_client.ClientURN("C.2000000000000000")
+    missing = rdf_client.ClientURN("C.3000000000000000")
+
+    self.index.WriteKey(first, self.client_key)
+    self.index.WriteKey(second, self.server_key)
+
+    keys = self.index.ReadKeys([first, second, missing])
+    self.assertItemsEqual(keys, [first, second])
+    self.assertEqual(keys[first].AsPEM(), self.client_key.AsPEM())
+    self.assertEqual(keys[second].AsPEM(), self.server_key.AsPEM())
+
+    self.assertEqual(
+        self.index.ReadKey("aff4:/C.1000000000000000").AsPEM(),
+        self.client_key.AsPEM())
+    self.assertIsNone(self.index.ReadKey(missing))
+
+  def testReadRecentKeys(self):
+    old = rdf_client.ClientURN("C.1000000000000000")
+    recent = rdf_client.ClientURN("C.2000000000000000")
+
+    with test_lib.FakeTime(1000):
+      self.index.WriteKey(old, self.client_key)
+
+    with test_lib.FakeTime(1000 + 10 * 24 * 3600):
+      self.index.WriteKey(recent, self.server_key)
+
+      keys = self.index.ReadRecentKeys(rdfvalue.Duration("7d"))
+      self.assertEqual(keys.keys(), [recent])
+      self.assertEqual(keys[recent].AsPEM(), self.server_key.AsPEM())
+
+      # Reading a key refreshes its entry.
+      self.index.ReadKey(old)
+      keys = self.index.ReadRecentKeys(rdfvalue.Duration("7d"))
+      self.assertItemsEqual(keys, [old, recent])
+
+  def testReadRecentKeysReturnsMostRecentFirst(self):
+    client_ids = [
+        rdf_client.ClientURN("C.%016x" % (i << 60)) for i in range(1, 4)
+    ]
+    # The clients were last seen in reverse order of their ids.
+    for i, client_id in enumerate(reversed(client_ids)):
+      with test_lib.FakeTime(10000 + i):
+        self.index.WriteKey(client_id, self.client_key)
+
+    with test_lib.FakeTime(10100):
+      keys = self.index.ReadRecentKeys(rdfvalue.Duration("1h"), limit=2)
+    self.assertItemsEqual(keys, client_ids[:2])
+
+  def testKeysAreSharded(self):
+    first = rdf_client.ClientURN("C.1000000000000000")
+    second = rdf_client.ClientURN("C.a000000000000000")
+    self.index.WriteKey(first, self.client_key)
+    self.index.WriteKey(second, self.server_key)
+
+    for shard, client_id in [("10", first), ("a0", second)]:
+      values = data_store.DB.ResolvePrefix(
+          client_key_index.INDEX_URN.Add(shard),
+          client_key_index.KEY_ATTRIBUTE_PREFIX,
+          token=self.token)
+      self.assertEqual([v[0] for v in values],
+                       [client_key_index.KEY_ATTRIBUTE_PREFIX +
+                        client_id.Basename()])
+
+    self.assertItemsEqual(self.index.ReadKeys([first, second]), [first, second])
+
+  def testInvalidEntriesAreSkipped(self):
+    valid = rdf_client.ClientURN("C.1000000000000000")
+    invalid = rdf_client.ClientURN("C.1100000000000000")
+    self.index.WriteKey(valid, self.client_key)
+    data_store.DB.Set(
+        client_key_index.INDEX_URN.Add("11"),
+        client_key_index.KEY_ATTRIBUTE_PREFIX + invalid.Basename(),
+        "not a key",
+        token=self.token)
+
+    self.assertItemsEqual(self.index.ReadKeys([valid, invalid]), [valid])
+    self.assertItemsEqual(
+        self.index.ReadRecentKeys(rdfvalue.Duration("1h")), [valid])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""An in-memory search index of client machines.
+
+Searching the keyword index in the data store reads one row per keyword and
+intersects sets of client ids in Python. This index keeps the keywords in
+memory instead: clients are numbered densely and every keyword maps to a
+compressed bitmap of client numbers, so a search is a few bitmap operations.
+
+The index only knows the keywords of the latest version of every client, so
+all keywords match like unversioned ("+") keywords do in the data store index.
+It is updated by ClientIndex.AddClient and RemoveClientLabels in this process
+and regularly reconciled with the clients other processes indexed.
+"""
+
+
+import logging
+import threading
+import time
+
+from grr.lib import bitmap
+from grr.lib import rdfvalue
+from grr.lib import stats
+from grr.lib import utils
+from grr.server import aff4
+from grr.server.aff4_objects import aff4_grr
+
+# The keyword every client is indexed with.
+UNIVERSAL_KEYWORD = "."
+
+
+class ClientSearchIndex(object):
+  """Keeps the keywords of all clients as bitmaps in memory."""
+
+  # Number of clients opened together while reconciling.
+  RECONCILE_BATCH_SIZE = 1000
+
+  # The attributes holding the indexed data.
+  STATE_ATTRIBUTES = ("numbers", "client_ids", "last_seen", "keywords",
+                      "postings", "reconciled_time")
+
+  def __init__(self):
+    self.lock = threading.RLock()
+    self.ready = False
+    self._Reset()
+
+  def _Reset(self):
+    # Maps client ids to their numbers.
+    self.numbers = {}
+    # Client ids, last index times and keywords, indexed by client number.
+    self.client_ids = []
+    self.last_seen = []
+    self.keywords = []
+    # Maps keywords to bitmaps of client numbers.
+    self.postings = {}
+    # Clients indexed in the data store after this time are not known yet.
+    self.reconciled_time = 0
+
+  def _Number(self, client_id):
+    client_id = intern(utils.SmartStr(client_id))
+    number = self.numbers.get(client_id)
+    if number is None:
+      number = len(self.client_ids)
+      self.numbers[client_id] = number
+      self.client_ids.append(client_id)
+      self.last_seen.append(0)
+      self.keywords.append(())
+    return number
+
+  def _Posting(self, keyword):
+    return self.postings.get(keyword) or bitmap.Bitmap()
+
+  def __len__(self):
+    return len(self.numbers)
+
+  def AddClient(self, client_id, keywords, timestamp=None):
+    """Replaces the keywords of a client.
+
+    Args:
+      client_id: The client id, e.g. "C.00aaeccbb45f33a3".
+      keywords: The normalized keywords of the latest version of the client.
+      timestamp: The time the client was indexed, in microseconds since the
+        epoch. Defaults to now.
+    """
+    if timestamp is None:
+      timestamp = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
+    new_keywords = set(intern(utils.SmartStr(k)) for k in keywords)
+
+    with self.lock:
+      number = self._Number(client_id)
+      old_keywords = set(self.keywords[number])
+
+      for keyword in old_keywords - new_keywords:
+        self._RemovePosting(keyword, number)
+      for keyword in new_keywords - old_keywords:
+        self.postings.setdefault(keyword, bitmap.Bitmap()).Add(number)
+
+      self.keywords[number] = tuple(new_keywords)
+      self.last_seen[number] = max(self.last_seen[number], timestamp)
+
+  def RemoveKeywords(self, client_id, keywords):
+    """Removes some keywords of a client."""
+    keywords = set(utils.SmartStr(k) for k in keywords)
+    with self.lock:
+      number = self.numbers.get(utils.SmartStr(client_id))
+      if number is None:
+        return
+
+      for keyword in keywords.intersection(self.keywords[number]):
+        self._RemovePosting(keyword, number)
+      self.keywords[number] = tuple(
+          k for k in self.keywords[number] if k not in keywords)
+
+  def _RemovePosting(self, keyword, number):
+    posting = self.postings.get(keyword)
+    if posting is not None:
+      posting.Discard(number)
+      if not posting:
+        del self.postings[keyword]
+
+  def _Intersect(self, bitmaps):
+    bitmaps = sorted(bitmaps, key=len)
+    result = bitmaps[0]
+    for other in bitmaps[1:]:
+      if not result:
+        break
+      result &= other
+    return result
+
+  def _Union(self, bitmaps):
+    result = bitmap.Bitmap()
+    for other in bitmaps:
+      result |= other
+    return result
+
+  def _ClientIds(self, numbers, start_time=None, end_time=None):
+    if start_time is None and end_time is None:
+      return [self.client_ids[n] for n in numbers]
+
+    start_time = start_time or 0
+    if end_time is None:
+      end_time = float("inf")
+    return [
+        self.client_ids[n] for n in numbers
+        if start_time <= self.last_seen[n] <= end_time
+    ]
+
+  def Lookup(self, keywords, start_time=None, end_time=None, match_any=False):
+    """Finds the clients associated with keywords.
+
+    Args:
+      keywords: A list of normalized keywords.
+      start_time: Only returns clients indexed at or after this time, in
+        microseconds since the epoch.
+      end_time: Only returns clients indexed at or before this time.
+      match_any: If set, clients matching any of the keywords are returned,
+        otherwise only clients matching all of them.
+
+    Returns:
+      A list of client ids, ordered by client number.
+    """
+    if not keywords:
+      return []
+
+    with self.lock:
+      postings = [self._Posting(utils.SmartStr(k)) for k in keywords]
+      if match_any:
+        numbers = self._Union(postings)
+      else:
+        numbers = self._Intersect(postings)
+
+      return self._ClientIds(numbers, start_time=start_time, end_time=end_time)
+
+  def Reconcile(self, index, full=False):
+    """Reads the clients indexed in the data store since the last reconcile.
+
+    Args:
+      index: The client_index.ClientIndex backing this index.
+      full: If set, the index is rebuilt from all indexed clients. This also
+        drops clients which were removed from the data store.
+    """
+    start_time = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
+
+    if full:
+      rebuilt = ClientSearchIndex()
+      rebuilt.Reconcile(index)
+      with self.lock:
+        for name in self.STATE_ATTRIBUTES:
+          setattr(self, name, getattr(rebuilt, name))
+        self.ready = True
+      return
+
+    last_seen_map = {}
+    index.ReadPostingLists(
+        [UNIVERSAL_KEYWORD],
+        start_time=self.reconciled_time,
+        last_seen_map=last_seen_map)
+
+    last_seen = {}
+    for (_, client_id), timestamp in last_seen_map.iteritems():
+      last_seen[client_id] = timestamp
+
+    urns = [rdfvalue.RDFURN(client_id) for client_id in last_seen]
+    for batch in utils.Grouper(urns, self.RECONCILE_BATCH_SIZE):
+      for client in aff4.FACTORY.MultiOpen(
+          batch,
+          aff4_type=aff4_grr.VFSGRRClient,
+          mode="r",
+          token=index.token):
+        client_id, keywords = index.AnalyzeClient(client)
+        self.AddClient(client_id, keywords, timestamp=last_seen[client_id])
+
+    with self.lock:
+      self.reconciled_time = start_time
+      self.ready = True
+
+    stats.STATS.SetGaugeValue("client_search_index_clients", len(self))
+
+  def Maintain(self, index_factory, reconcile_interval, rebuild_interval):
+    """Keeps the index reconciled with the data store, never returns.
+
+    Args:
+      index_factory: A callable returning the backing client_index.ClientIndex.
+      reconcile_interval: An rdfvalue.Duration, the time between reconciles.
+      rebuild_interval: An rdfvalue.Duration, the time between full rebuilds.
+    """
+    last_rebuild = 0
+    while True:
+      now = time.time()
+      full = now - last_rebuild >= rebuild_interval.seconds
+      try:
+        self.Reconcile(index_factory(), full=full)
+        if full:
+          last_rebuild = now
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception("Error reconciling the client search index: %s", e)
+
+      time.sleep(reconcile_interval.seconds)
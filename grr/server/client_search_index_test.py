@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Tests for grr.server.client_search_index."""
+
+
+from grr.lib import flags
+from grr.lib import utils
+from grr.server import aff4
+from grr.server import client_index
+from grr.server import client_search_index
+from grr.server.aff4_objects import aff4_grr
+from grr.test_lib import aff4_test_lib
+from grr.test_lib import test_lib
+
+
+class ClientSearchIndexTest(aff4_test_lib.AFF4ObjectTest):
+  """Tests the ClientSearchIndex."""
+
+  def testLookup(self):
+    index = client_search_index.ClientSearchIndex()
+    index.AddClient("C.1", [".", "windows", "label:a"], timestamp=10)
+    index.AddClient("C.2", [".", "linux", "label:a"], timestamp=20)
+    index.AddClient("C.3", [".", "linux"], timestamp=30)
+
+    self.assertEqual(index.Lookup(["label:a"]), ["C.1", "C.2"])
+    self.assertEqual(index.Lookup(["label:a", "linux"]), ["C.2"])
+    self.assertEqual(
+        index.Lookup(["windows", "linux"], match_any=True),
+        ["C.1", "C.2", "C.3"])
+    self.assertEqual(index.Lookup(["label:a", "missing"]), [])
+    self.assertEqual(index.Lookup(["."], start_time=15, end_time=25), ["C.2"])
+
+    # Updating a client replaces its keywords.
+    index.AddClient("C.1", [".", "linux"], timestamp=40)
+    self.assertEqual(index.Lookup(["linux"]), ["C.1", "C.2", "C.3"])
+    self.assertEqual(index.Lookup(["label:a"]), ["C.2"])
+    self.assertEqual(index.Lookup(["windows"]), [])
+
+    index.RemoveKeywords("C.2", ["label:a"])
+    self.assertEqual(index.Lookup(["label:a"]), [])
+    self.assertEqual(index.Lookup(["linux"]), ["C.1", "C.2", "C.3"])
+    self.assertEqual(len(index), 3)
+
+  def testReconcile(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/client-index-search/",
+        aff4_type=client_index.ClientIndex,
+        mode="rw",
+        token=self.token)
+    client_urns = self.SetupClients(5)
+    for urn in client_urns:
+      client = aff4.FACTORY.Open(urn, mode="r", token=self.token)
+      index.AddClient(client)
+
+    search_index = client_search_index.ClientSearchIndex()
+    self.assertFalse(search_index.ready)
+    search_index.Reconcile(index)
+    self.assertTrue(search_index.ready)
+    self.assertEqual(len(search_index), 5)
+    self.assertEqual(search_index.Lookup(["host-2"]), ["C.1000000000000002"])
+
+    # A client indexed by another process is picked up by the next reconcile.
+    with aff4.FACTORY.Open(
+        client_urns[3],
+        aff4_type=aff4_grr.VFSGRRClient,
+        mode="rw",
+        token=self.token) as client:
+      client.AddLabel("reconciled")
+    index.AddClient(client)
+
+    self.assertEqual(search_index.Lookup(["label:reconciled"]), [])
+    search_index.Reconcile(index)
+    self.assertEqual(
+        search_index.Lookup(["label:reconciled"]), ["C.1000000000000003"])
+
+    search_index.Reconcile(index, full=True)
+    self.assertEqual(len(search_index), 5)
+    self.assertEqual(
+        search_index.Lookup(["label:reconciled"]), ["C.1000000000000003"])
+
+  def testLookupClientsUsesSearchIndex(self):
+    search_index = client_search_index.ClientSearchIndex()
+    with utils.Stubber(client_index, "SEARCH_INDEX", search_index):
+      client_urns = self.SetupClients(3)
+      search_index.Reconcile(client_index.CreateClientIndex(token=self.token))
+
+      index = client_index.CreateClientIndex(token=self.token)
+      self.assertEqual(index.LookupClients(["Host-1"]), [client_urns[1]])
+
+      with aff4.FACTORY.Open(
+          client_urns[2],
+          aff4_type=aff4_grr.VFSGRRClient,
+          mode="rw",
+          token=self.token) as client:
+        client.AddLabel("searched")
+      # Clients indexed in this process are found right away.
+      index.AddClient(client)
+      self.assertEqual(
+          index.LookupClients(["label:searched"]), [client_urns[2]])
+
+      index.RemoveClientLabels(client)
+      self.assertEqual(index.LookupClients(["label:searched"]), [])
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -83,6 +83,14 @@ class DBSubjectLockError(Error):
 # This token will be used by default if no token was provided.
 default_token = None
 
+# Callables which are called with the list of subjects modified by each
+# MutationPool.Flush(). This is used to keep in process caches coherent.
+mutation_listeners = []
+
+# Callables which are called with the list of queue shards each
+# MutationPool.Flush() wrote notifications to.
+notification_listeners = []
+
 
 def GetDefaultToken(token):
   """Returns the provided token or the default token.
@@ -133,6 +141,8 @@ class MutationPool(object):
     self.delete_subject_requests = []
     self.set_requests = []
     self.delete_attributes_requests = []
+    # Maps (collection_id, bucket) to the number of records added.
+    self.collection_counts = {}
 
     self.new_notifications = []
 
@@ -159,6 +169,15 @@ class MutationPool(object):
 
   def Flush(self):
     """Flushing actually applies all the operations in the pool."""
+    for (collection_id, bucket), count in self.collection_counts.iteritems():
+      self.Set(
+          collection_id,
+          DataStore.COLLECTION_COUNT_DELTA_TEMPLATE %
+          (bucket, random.randint(0, 0xffffffff)),
+          "%d" % count,
+          replace=False)
+    self.collection_counts = {}
+
     DB.DeleteSubjects(
         self.delete_subject_requests, token=self.token, sync=False)
 
@@ -189,8 +208,21 @@ class MutationPool(object):
 
     for queue, notifications in self.new_notifications:
       DB.CreateNotifications(queue, notifications, token=self.token)
+
+    if notification_listeners and self.new_notifications:
+      queue_shards = [queue for queue, _ in self.new_notifications]
+      for listener in notification_listeners:
+        listener(queue_shards)
     self.new_notifications = []
 
+    if mutation_listeners:
+      subjects = set(self.delete_subject_requests)
+      subjects.update(req[0] for req in self.delete_attributes_requests)
+      subjects.update(req[0] for req in self.set_requests)
+      if subjects:
+        for listener in mutation_listeners:
+          listener(subjects)
+
     self.delete_subject_requests = []
     self.set_requests = []
     self.delete_attributes_requests = []
@@ -224,6 +256,13 @@ class MutationPool(object):
         item.SerializeToString(),
         timestamp=timestamp,
         replace=replace)
+
+    # Adding a record with the timestamp and suffix of an existing one
+    # replaces it but still counts as a new record here. The count stays too
+    # high until ReconcileCounters() recounts the bucket.
+    bucket = timestamp - timestamp % DataStore.COLLECTION_COUNT_BUCKET
+    key = (collection_id, bucket)
+    self.collection_counts[key] = self.collection_counts.get(key, 0) + 1
     return result_subject, timestamp, suffix
 
   def CollectionAddIndex(self, collection_id, index, timestamp, suffix):
@@ -234,6 +273,14 @@ class MutationPool(object):
         timestamp=timestamp,
         replace=True)
 
+  def CollectionSetCount(self, collection_id, count, timestamp):
+    self.Set(
+        collection_id,
+        DataStore.COLLECTION_COUNT_BASE_ATTRIBUTE,
+        "%d" % count,
+        timestamp=timestamp,
+        replace=True)
+
   def CollectionAddStoredTypeIndex(self, collection_id, stored_type):
     self.Set(
         collection_id,
@@ -242,6 +289,16 @@ class MutationPool(object):
         timestamp=0)
 
   def CollectionDelete(self, collection_id):
+    counters = [
+        attribute
+        for attribute, _, _ in DB.ResolvePrefix(
+            collection_id,
+            DataStore.COLLECTION_COUNT_ATTRIBUTE_PREFIX,
+            token=self.token)
+    ]
+    if counters:
+      self.DeleteAttributes(collection_id, counters)
+
     for subject, _, _ in DB.ScanAttribute(
         collection_id.Add("Results"),
         DataStore.COLLECTION_ATTRIBUTE,
@@ -390,6 +447,68 @@ class MutationPool(object):
       logging.warning("Datastore exception: %s", e)
       return []
 
+  def QueueMultiQueryAndOwn(self, queue_limits, lease_seconds, timestamp):
+    """Leases tasks from several queues with a single data store query.
+
+    Unlike QueueQueryAndOwn() this does not retry locking a queue, queues which
+    are currently locked are skipped. The leases are written before the queue
+    locks are released, they are not queued on this pool.
+
+    Args:
+      queue_limits: A dict mapping queues to the number of tasks to lease.
+      lease_seconds: The tasks will be leased for this long.
+      timestamp: Range of times for consideration.
+    Returns:
+        A dict mapping every queue to the list of GrrMessage() objects leased.
+    """
+    user = ""
+    if self.token:
+      user = self.token.username
+
+    result = dict((queue, []) for queue in queue_limits)
+    lease_pool = DB.GetMutationPool(token=self.token)
+    locks = {}
+    try:
+      for queue in queue_limits:
+        try:
+          lock = DB.DBSubjectLock(
+              queue, lease_time=lease_seconds, token=self.token)
+          locks[lock.subject] = (queue, lock)
+        except DBSubjectLockError:
+          pass
+        except Error as e:
+          logging.warning("Datastore exception: %s", e)
+
+      if not locks:
+        return result
+
+      try:
+        resolved = DB.MultiResolvePrefix(
+            locks.keys(),
+            DataStore.QUEUE_TASK_PREDICATE_PREFIX,
+            timestamp=(0, timestamp or rdfvalue.RDFDatetime.Now()),
+            token=self.token)
+      except Error as e:
+        logging.warning("Datastore exception: %s", e)
+        return result
+
+      for subject, values in resolved:
+        queue, _ = locks[utils.SmartStr(subject)]
+        result[queue] = lease_pool._QueueOwnTasks(
+            subject,
+            values,
+            lease_seconds=lease_seconds,
+            limit=queue_limits[queue],
+            user=user)
+
+      # Another poll could lease the same tasks again if it got the lock
+      # before the new lease timestamps are stored.
+      lease_pool.Flush()
+      return result
+    finally:
+      for _, lock in locks.itervalues():
+        lock.Release()
+
   def _QueueQueryAndOwn(self,
                         subject,
                         lease_seconds=100,
@@ -397,18 +516,25 @@ class MutationPool(object):
                         user="",
                         timestamp=None):
     """Business logic helper for QueueQueryAndOwn()."""
+    # Only grab attributes with timestamps in the past.
+    values = DB.ResolvePrefix(
+        subject,
+        DataStore.QUEUE_TASK_PREDICATE_PREFIX,
+        timestamp=(0, timestamp or rdfvalue.RDFDatetime.Now()),
+        token=self.token)
+    return self._QueueOwnTasks(
+        subject, values, lease_seconds=lease_seconds, limit=limit, user=user)
+
+  def _QueueOwnTasks(self, subject, values, lease_seconds=100, limit=1,
+                     user=""):
+    """Leases up to limit tasks out of the values resolved from a queue."""
     tasks = []
 
     lease = long(lease_seconds * 1e6)
 
-    # Only grab attributes with timestamps in the past.
     delete_attrs = set()
     serialized_tasks_dict = {}
-    for predicate, task, timestamp in DB.ResolvePrefix(
-        subject,
-        DataStore.QUEUE_TASK_PREDICATE_PREFIX,
-        timestamp=(0, timestamp or rdfvalue.RDFDatetime.Now()),
-        token=self.token):
+    for predicate, task, timestamp in values:
       task = rdf_flows.GrrMessage.FromSerializedString(task)
       task.eta = timestamp
       task.last_lease = "%s@%s:%d" % (user, socket.gethostname(), os.getpid())
@@ -828,6 +954,34 @@ class DataStore(object):
       AccessError: if anything goes wrong.
     """
 
+  def MultiResolveAttributes(self,
+                             subjects,
+                             attributes,
+                             timestamp=None,
+                             token=None):
+    """Resolves exactly the given attributes for multiple subjects.
+
+    Data stores which can select attributes by name more efficiently than by
+    prefix should override this method.
+
+    Args:
+      subjects: A list of subjects.
+      attributes: A list of attribute names.
+      timestamp: A timestamp specification as in MultiResolvePrefix.
+      token: An ACL token.
+
+    Yields:
+      Tuples of subject and a list of (attribute, value, timestamp) tuples, for
+      subjects which have at least one of the attributes.
+    """
+    attributes = set(attributes)
+    for subject, values in self.MultiResolvePrefix(
+        subjects, attributes, timestamp=timestamp, token=token):
+      # Attribute names are matched as prefixes, drop longer names.
+      values = [v for v in values if v[0] in attributes]
+      if values:
+        yield subject, values
+
   def ResolvePrefix(self,
                     subject,
                     attribute_prefix,
@@ -1411,6 +1565,18 @@ class DataStore(object):
   # suffix is stored as the value.
   COLLECTION_INDEX_ATTRIBUTE_PREFIX = "index:sc_"
 
+  # Record counters. "index:count_base" at timestamp <t> holds the number of
+  # records stored before t. Every mutation pool flush adds an attribute
+  # "index:count_<bucket>.<id>" holding the number of records it wrote with a
+  # timestamp inside the bucket starting at <bucket>. The random id keeps
+  # concurrent writers from overwriting each other's counts.
+  COLLECTION_COUNT_ATTRIBUTE_PREFIX = "index:count_"
+  COLLECTION_COUNT_BASE_ATTRIBUTE = "index:count_base"
+  COLLECTION_COUNT_DELTA_TEMPLATE = "index:count_%016x.%08x"
+
+  # The size of the count buckets in microseconds.
+  COLLECTION_COUNT_BUCKET = 60 * 1000000
+
   # The attribute prefix to use when storing the index of stored types
   # for multi type collections.
   COLLECTION_VALUE_TYPE_PREFIX = "aff4:value_type_"
@@ -1481,6 +1647,35 @@ class DataStore(object):
       i = int(attr[len(self.COLLECTION_INDEX_ATTRIBUTE_PREFIX):], 16)
       yield (i, ts, int(value, 16))
 
+  def CollectionReadCounters(self, collection_id, token=None):
+    """Reads the record counters of the given collection.
+
+    Args:
+      collection_id: ID of the collection for which the counters should be
+                     retrieved.
+      token: Datastore token.
+
+    Returns:
+      A tuple (count, timestamp, deltas). count is the number of records stored
+      before timestamp, or None if the counters were never reconciled. deltas
+      is a list of (attribute, bucket, count) tuples.
+    """
+    count, count_timestamp = None, 0
+    deltas = []
+    for (attr, value, ts) in self.ResolvePrefix(
+        collection_id,
+        self.COLLECTION_COUNT_ATTRIBUTE_PREFIX,
+        timestamp=self.ALL_TIMESTAMPS,
+        token=token):
+      if attr == self.COLLECTION_COUNT_BASE_ATTRIBUTE:
+        count, count_timestamp = int(value), ts
+      else:
+        name = attr[len(self.COLLECTION_COUNT_ATTRIBUTE_PREFIX):]
+        bucket, _ = name.split(".")
+        deltas.append((attr, int(bucket, 16), int(value)))
+
+    return count, count_timestamp, deltas
+
   def CollectionReadStoredTypes(self, collection_id, token=None):
     for attribute, _, _ in self.ResolveRow(collection_id, token=token):
       if attribute.startswith(self.COLLECTION_VALUE_TYPE_PREFIX):
@@ -153,6 +153,10 @@ class MySQLAdvancedDataStore(data_store.DataStore):
 
   POOL = None
 
+  # The maximum number of subjects resolved by a single MultiResolvePrefix
+  # query.
+  MULTI_QUERY_SUBJECTS = 1000
+
   def __init__(self, database_name=None):
     self.database_name = database_name or config.CONFIG["Mysql.database_name"]
     # Use the global connection pool.
@@ -279,21 +283,87 @@ class MySQLAdvancedDataStore(data_store.DataStore):
                          timestamp=None,
                          limit=None,
                          token=None):
-    """Result multiple subjects using one or more attribute regexps."""
-    result = {}
+    """Result multiple subjects using one or more attribute regexps.
+
+    Subjects are resolved with one query per batch of MULTI_QUERY_SUBJECTS
+    subjects instead of one query per subject and prefix.
+
+    Args:
+      subjects: A list of subjects.
+      attribute_prefix: A single prefix or a list of prefixes.
+      timestamp: A timestamp specification as in ResolvePrefix.
+      limit: The total number of values to return over all subjects.
+      token: An ACL token.
+
+    Returns:
+      An iterator of (subject, [(attribute, value, timestamp), ...]) tuples.
+    """
+    _ = token
+    if isinstance(attribute_prefix, basestring):
+      attribute_prefix = [attribute_prefix]
+    attribute_prefix = [utils.SmartUnicode(p) for p in attribute_prefix]
+
+    return self._MultiResolve(subjects, attribute_prefix, timestamp, limit)
+
+  def MultiResolveAttributes(self,
+                             subjects,
+                             attributes,
+                             timestamp=None,
+                             token=None):
+    """Resolves exactly the given attributes for multiple subjects.
+
+    Unlike MultiResolvePrefix, attributes are selected by their hash which
+    doesn't need to match attribute names against all attributes of a row.
 
+    Args:
+      subjects: A list of subjects.
+      attributes: A list of attribute names.
+      timestamp: A timestamp specification as in ResolvePrefix.
+      token: An ACL token.
+
+    Returns:
+      An iterator of (subject, [(attribute, value, timestamp), ...]) tuples.
+    """
+    _ = token
+    attributes = [utils.SmartUnicode(a) for a in attributes]
+    return self._MultiResolve(subjects, attributes, timestamp, None, exact=True)
+
+  def _MultiResolve(self, subjects, attributes, timestamp, limit, exact=False):
+    """Resolves attributes or attribute prefixes for multiple subjects."""
+    subjects = list(subjects)
+    original_subjects = {}
     for subject in subjects:
-      values = self.ResolvePrefix(
-          subject,
-          attribute_prefix,
-          token=token,
-          timestamp=timestamp,
-          limit=limit)
-
-      if values:
-        result[subject] = values
-        if limit:
-          limit -= len(values)
+      original_subjects.setdefault(utils.SmartStr(subject), subject)
+
+    # Rows are keyed by the subject string returned from the subjects table.
+    rows_by_subject = {}
+    for batch in utils.Grouper(original_subjects, self.MULTI_QUERY_SUBJECTS):
+      query, args = self._BuildMultiPrefixQuery(
+          batch, attributes, timestamp, exact=exact)
+      rows, _ = self.ExecuteQuery(query, args)
+      for row in rows:
+        rows_by_subject.setdefault(utils.SmartStr(row["subject"]),
+                                   []).append(row)
+
+    result = {}
+    for subject in subjects:
+      subject_str = utils.SmartStr(subject)
+      rows = rows_by_subject.pop(subject_str, None)
+      if not rows:
+        continue
+
+      values = []
+      # Rows are ordered newest first so a stable sort on the attribute keeps
+      # the per attribute timestamp ordering.
+      for row in sorted(rows, key=lambda x: x["attribute"]):
+        attribute = row["attribute"]
+        value = self._Decode(attribute, row["value"])
+        values.append((attribute, value, row["timestamp"]))
+
+      if limit:
+        values = values[:limit]
+        limit -= len(values)
+      result[original_subjects[subject_str]] = values
 
       if limit is not None and limit <= 0:
         break
@@ -718,6 +788,63 @@ class MySQLAdvancedDataStore(data_store.DataStore):
 
     return (query, args)
 
+  def _BuildMultiPrefixQuery(self,
+                             subjects,
+                             prefixes,
+                             timestamp=None,
+                             exact=False):
+    """Build a SELECT query resolving prefixes for many subjects at once.
+
+    Args:
+      subjects: The subjects to resolve.
+      prefixes: The attribute prefixes to resolve.
+      timestamp: A timestamp specification as in ResolvePrefix.
+      exact: If set, prefixes are full attribute names matched exactly.
+
+    Returns:
+      A tuple of the query and its arguments.
+    """
+    args = []
+    criteria = "WHERE aff4.subject_hash IN (%s)" % ", ".join(
+        ["unhex(md5(%s))"] * len(subjects))
+    args.extend(utils.SmartUnicode(subject) for subject in subjects)
+
+    if exact:
+      criteria += " AND aff4.attribute_hash IN (%s)" % ", ".join(
+          ["unhex(md5(%s))"] * len(prefixes))
+      args.extend(prefixes)
+    else:
+      criteria += " AND (%s)" % " OR ".join(
+          ["attributes.attribute like %s"] * len(prefixes))
+      args.extend(prefix + "%" for prefix in prefixes)
+
+    # Limit to time range if specified
+    if isinstance(timestamp, (tuple, list)):
+      criteria += " AND aff4.timestamp >= %s AND aff4.timestamp <= %s"
+      args.append(int(timestamp[0]))
+      args.append(int(timestamp[1]))
+
+    fields = ("aff4.value, aff4.timestamp, attributes.attribute, "
+              "subjects.subject")
+    tables = "FROM aff4 JOIN attributes ON aff4.attribute_hash=attributes.hash"
+    sorting = "ORDER BY aff4.timestamp DESC"
+
+    # Only fetch the newest version of each subject/attribute pair.
+    if timestamp is None or timestamp == self.NEWEST_TIMESTAMP:
+      tables += (" JOIN (SELECT aff4.subject_hash, aff4.attribute_hash, "
+                 "MAX(aff4.timestamp) timestamp %s %s "
+                 "GROUP BY aff4.subject_hash, aff4.attribute_hash) maxtime ON "
+                 "aff4.subject_hash=maxtime.subject_hash AND "
+                 "aff4.attribute_hash=maxtime.attribute_hash AND "
+                 "aff4.timestamp=maxtime.timestamp") % (tables, criteria)
+      args += args
+
+    tables += " JOIN subjects ON aff4.subject_hash=subjects.hash"
+
+    query = " ".join(["SELECT", fields, tables, criteria, sorting])
+
+    return (query, args)
+
   def _BuildDelete(self, subject, attribute=None, timestamp=None):
     """Build the DELETE query to be executed."""
     subjects_q = {
@@ -2,9 +2,14 @@
 """Benchmark tests for MySQL advanced data store."""
 
 
+import time
+
 from grr.lib import flags
+from grr.lib import utils
+from grr.server import data_store
 from grr.server import data_store_test
 from grr.server.data_stores import mysql_advanced_data_store_test
+from grr.test_lib import benchmark_test_lib
 from grr.test_lib import test_lib
 
 
@@ -20,6 +25,64 @@ class MysqlAdvancedDataStoreCSVBenchmarks(
   """Benchmark the mysql data store abstraction."""
 
 
+class MysqlAdvancedMultiResolvePrefixBenchmarks(
+    mysql_advanced_data_store_test.MysqlAdvancedTestMixin,
+    benchmark_test_lib.MicroBenchmarks):
+  """Compare batched MultiResolvePrefix to per subject ResolvePrefix calls."""
+
+  units = "s"
+
+  nr_subjects = 1000
+  prefixes = ["metadata:", "aff4:"]
+
+  def _CountQueries(self, func):
+    """Runs func and returns (elapsed time, number of MySQL queries)."""
+    queries = []
+
+    def CountingExecuteQuery(query, args=None):
+      queries.append(query)
+      return CountingExecuteQuery.old_target(query, args=args)
+
+    with utils.Stubber(data_store.DB, "ExecuteQuery", CountingExecuteQuery):
+      start_time = time.time()
+      func()
+      elapsed_time = time.time() - start_time
+
+    return elapsed_time, len(queries)
+
+  @test_lib.SetLabel("benchmark")
+  def testMultiResolvePrefixRoundTrips(self):
+    subjects = ["aff4:/C.%016X" % i for i in xrange(self.nr_subjects)]
+    for subject in subjects:
+      data_store.DB.MultiSet(
+          subject, {
+              "metadata:last": ["1"],
+              "metadata:os": ["Linux"],
+              "aff4:type": ["VFSGRRClient"]
+          },
+          token=self.token)
+
+    def PerSubject():
+      for subject in subjects:
+        data_store.DB.ResolvePrefix(subject, self.prefixes, token=self.token)
+
+    def Batched():
+      results = dict(
+          data_store.DB.MultiResolvePrefix(
+              subjects, self.prefixes, token=self.token))
+      self.assertEqual(len(results), self.nr_subjects)
+
+    elapsed_time, queries = self._CountQueries(PerSubject)
+    self.AddResult("ResolvePrefix per subject (%d queries)" % queries,
+                   elapsed_time, self.nr_subjects)
+
+    elapsed_time, batched_queries = self._CountQueries(Batched)
+    self.AddResult("MultiResolvePrefix (%d queries)" % batched_queries,
+                   elapsed_time, self.nr_subjects)
+
+    self.assertLess(batched_queries, queries)
+
+
 def main(args):
   test_lib.main(args)
 
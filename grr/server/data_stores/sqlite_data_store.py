@@ -33,6 +33,9 @@ SQLITE_DETECT_TYPES = 0
 SQLITE_FACTORY = sqlite3.Connection
 SQLITE_CACHED_STATEMENTS = 20
 SQLITE_PAGE_SIZE = 1024
+# The maximum number of subjects resolved by a single MultiResolvePrefix query.
+# This keeps the number of bound parameters below SQLite's default limit.
+SQLITE_MULTI_QUERY_SUBJECTS = 500
 
 
 class SqliteConnectionCache(utils.FastStore):
@@ -154,6 +157,12 @@ class SqliteConnectionCache(utils.FastStore):
   def KillObject(self, conn):
     conn.Close()
 
+  def DestinationKey(self, subject):
+    """Returns the key of the database file holding subject."""
+    filename, directory = common.ResolveSubjectDestination(
+        subject, self.path_regexes)
+    return common.MakeDestinationKey(directory, filename)
+
   @utils.Synchronized
   def Get(self, subject):
     """This will create the connection if needed so should not fail."""
@@ -380,6 +389,56 @@ class SqliteConnection(object):
     data = self.Execute(query, args).fetchall()
     return data
 
+  def _BuildMultiPrefixCriteria(self, subjects, prefixes):
+    """Builds the WHERE clause and args for a multi subject prefix query."""
+    criteria = "subject IN (%s) AND (%s)" % (
+        ",".join("?" * len(subjects)),
+        " OR ".join(["predicate LIKE ?"] * len(prefixes)))
+    args = [utils.SmartStr(s) for s in subjects]
+    args.extend(utils.SmartStr(p) + "%" for p in prefixes)
+    return criteria, args
+
+  @utils.Synchronized
+  def MultiGetNewestFromPrefix(self, subjects, prefixes):
+    """Returns the newest values for many subjects in a single query.
+
+    Args:
+     subjects: A list of subjects.
+     prefixes: A list of attribute prefixes.
+
+    Returns:
+     A list of the form (subject, attribute, value, timestamp).
+    """
+    criteria, args = self._BuildMultiPrefixCriteria(subjects, prefixes)
+    query = """SELECT subject, predicate, MAX(timestamp), value FROM tbl
+               WHERE %s
+               GROUP BY subject, predicate""" % criteria
+
+    # Reorder columns.
+    data = self.Execute(query, args).fetchall()
+    return [(sub, pred, val, ts) for sub, pred, ts, val in data]
+
+  @utils.Synchronized
+  def MultiGetValuesFromPrefix(self, subjects, prefixes, start, end):
+    """Returns the values for many subjects in a single query.
+
+    Args:
+     subjects: A list of subjects.
+     prefixes: A list of attribute prefixes.
+     start: The start timestamp.
+     end: The end timestamp.
+
+    Returns:
+     A list of the form (subject, attribute, value, timestamp).
+    """
+    criteria, args = self._BuildMultiPrefixCriteria(subjects, prefixes)
+    query = """SELECT subject, predicate, value, timestamp FROM tbl
+               WHERE %s AND timestamp >= ? AND timestamp <= ?
+               ORDER BY timestamp DESC""" % criteria
+    args.extend([start, end])
+
+    return self.Execute(query, args).fetchall()
+
   @utils.Synchronized
   def GetValues(self, subject, attribute, start, end, limit=None):
     """Returns the values of the attribute between 'start' and 'end'.
@@ -725,25 +784,79 @@ class SqliteDataStore(data_store.DataStore):
                          timestamp=None,
                          limit=None,
                          token=None):
-    """Result multiple subjects using one or more attribute prefixes."""
-    result = {}
+    """Result multiple subjects using one or more attribute prefixes.
+
+    Instead of issuing one query per subject and prefix, subjects are grouped
+    by the database file they live in and each group is resolved with a single
+    query per batch of SQLITE_MULTI_QUERY_SUBJECTS subjects.
+
+    Args:
+      subjects: A list of subjects.
+      attribute_prefix: A single prefix or a list of prefixes.
+      timestamp: A timestamp specification as in ResolvePrefix.
+      limit: The total number of values to return over all subjects.
+      token: An ACL token.
+
+    Returns:
+      An iterator of (subject, [(attribute, value, timestamp), ...]) tuples.
+    """
+    _ = token
+    if isinstance(attribute_prefix, basestring):
+      attribute_prefix = [attribute_prefix]
+    attribute_prefix = list(attribute_prefix)
+
+    start, end = self._GetStartEndTimestamp(timestamp)
+
+    # Group the subjects by database file, remembering the original subject
+    # objects so results can be keyed by what the caller passed in.
+    subjects = list(subjects)
+    subjects_by_db = {}
+    original_subjects = {}
+    for subject in subjects:
+      subject_str = utils.SmartStr(subject)
+      original_subjects.setdefault(subject_str, subject)
+      subjects_by_db.setdefault(self.cache.DestinationKey(subject),
+                                []).append(subject_str)
 
+    # Holds all the attributes which matched, keyed by subject. Values are
+    # dicts mapping attribute names to lists of timestamped data.
+    results = {}
+    for db_subjects in subjects_by_db.itervalues():
+      with self.cache.Get(db_subjects[0]) as sqlite_connection:
+        for batch in utils.Grouper(db_subjects, SQLITE_MULTI_QUERY_SUBJECTS):
+          if timestamp == self.NEWEST_TIMESTAMP:
+            data = sqlite_connection.MultiGetNewestFromPrefix(
+                batch, attribute_prefix)
+          else:
+            data = sqlite_connection.MultiGetValuesFromPrefix(
+                batch, attribute_prefix, start, end)
+
+          for subject, attribute, value, ts in data:
+            value = self._Decode(attribute, value)
+            results.setdefault(subject, {}).setdefault(attribute, []).append(
+                (value, ts))
+
+    result = {}
     remaining_limit = limit
     for subject in subjects:
-      values = self.ResolvePrefix(
-          subject,
-          attribute_prefix,
-          token=token,
-          timestamp=timestamp,
-          limit=remaining_limit)
-
-      if values:
-        if limit:
-          if len(values) >= remaining_limit:
-            result[subject] = values[:remaining_limit]
-            return result.iteritems()
-          remaining_limit -= len(values)
-        result[subject] = values
+      subject_str = utils.SmartStr(subject)
+      subject_results = results.pop(subject_str, None)
+      if not subject_results:
+        continue
+
+      values = []
+      for attribute, attribute_values in sorted(subject_results.items()):
+        attribute_values.sort(key=lambda x: x[1], reverse=True)
+        for value, ts in attribute_values:
+          values.append((attribute, value, ts))
+
+      subject = original_subjects[subject_str]
+      if limit:
+        if len(values) >= remaining_limit:
+          result[subject] = values[:remaining_limit]
+          return result.iteritems()
+        remaining_limit -= len(values)
+      result[subject] = values
 
     return result.iteritems()
 
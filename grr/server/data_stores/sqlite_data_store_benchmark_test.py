@@ -2,10 +2,16 @@
 """Benchmark tests for sqlite datastore."""
 
 
+import time
+
 from grr.lib import flags
+from grr.lib import utils
+from grr.server import data_store
 from grr.server import data_store_test
+from grr.server.data_stores import sqlite_data_store
 from grr.server.data_stores import sqlite_data_store_test
 
+from grr.test_lib import benchmark_test_lib
 from grr.test_lib import test_lib
 
 
@@ -19,6 +25,69 @@ class SqliteDataStoreCSVBenchmarks(sqlite_data_store_test.SqliteTestMixin,
   """Benchmark the SQLite data store abstraction."""
 
 
+class SqliteMultiResolvePrefixBenchmarks(
+    sqlite_data_store_test.SqliteTestMixin, benchmark_test_lib.MicroBenchmarks):
+  """Compare batched MultiResolvePrefix to per subject ResolvePrefix calls."""
+
+  units = "s"
+
+  nr_subjects = 1000
+  prefixes = ["metadata:", "aff4:"]
+
+  def _CountQueries(self, func):
+    """Runs func and returns (elapsed time, number of SQLite queries)."""
+    queries = []
+
+    def CountingExecute(connection, *args):
+      queries.append(args)
+      return CountingExecute.old_target(connection, *args)
+
+    with utils.Stubber(sqlite_data_store.SqliteConnection, "Execute",
+                       CountingExecute):
+      start_time = time.time()
+      func()
+      elapsed_time = time.time() - start_time
+
+    return elapsed_time, len(queries)
+
+  @test_lib.SetLabel("benchmark")
+  def testMultiResolvePrefixRoundTrips(self):
+    # Subjects below a single client share a database file so they can be
+    # resolved together.
+    subjects = [
+        "aff4:/C.0000000000000001/fs/os/file%d" % i
+        for i in xrange(self.nr_subjects)
+    ]
+    for subject in subjects:
+      data_store.DB.MultiSet(
+          subject, {
+              "metadata:last": ["1"],
+              "metadata:size": ["1024"],
+              "aff4:type": ["VFSFile"]
+          },
+          token=self.token)
+
+    def PerSubject():
+      for subject in subjects:
+        data_store.DB.ResolvePrefix(subject, self.prefixes, token=self.token)
+
+    def Batched():
+      results = dict(
+          data_store.DB.MultiResolvePrefix(
+              subjects, self.prefixes, token=self.token))
+      self.assertEqual(len(results), self.nr_subjects)
+
+    elapsed_time, queries = self._CountQueries(PerSubject)
+    self.AddResult("ResolvePrefix per subject (%d queries)" % queries,
+                   elapsed_time, self.nr_subjects)
+
+    elapsed_time, batched_queries = self._CountQueries(Batched)
+    self.AddResult("MultiResolvePrefix (%d queries)" % batched_queries,
+                   elapsed_time, self.nr_subjects)
+
+    self.assertLess(batched_queries, queries)
+
+
 def main(args):
   test_lib.main(args)
 
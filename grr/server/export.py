@@ -6,9 +6,11 @@ Exporters defined here convert various complex RDFValues to simple RDFValues
 easily be written to a relational database or just to a set of files.
 """
 
+import collections
 import hashlib
 import json
 import logging
+import multiprocessing
 import re
 import time
 
@@ -194,6 +196,10 @@ class ExportConverter(object):
   # Cache used for GetConvertersByValue() lookups.
   converters_cache = {}
 
+  # Converters which neither access the data store nor generate classes at
+  # runtime can be run by an ExportProcessPool.
+  process_pool_compatible = False
+
   def __init__(self, options=None):
     """Constructor.
 
@@ -562,6 +568,7 @@ class StatEntryToExportedRegistryKeyConverter(ExportConverter):
   """Converts StatEntry to ExportedRegistryKey."""
 
   input_rdf_type = "StatEntry"
+  process_pool_compatible = True
 
   def Convert(self, metadata, stat_entry, token=None):
     """Converts StatEntry to ExportedRegistryKey.
@@ -607,6 +614,7 @@ class NetworkConnectionToExportedNetworkConnectionConverter(ExportConverter):
   """Converts NetworkConnection to ExportedNetworkConnection."""
 
   input_rdf_type = "NetworkConnection"
+  process_pool_compatible = True
 
   def Convert(self, metadata, conn, token=None):
     """Converts NetworkConnection to ExportedNetworkConnection."""
@@ -627,6 +635,7 @@ class ProcessToExportedProcessConverter(ExportConverter):
   """Converts Process to ExportedProcess."""
 
   input_rdf_type = "Process"
+  process_pool_compatible = True
 
   def Convert(self, metadata, process, token=None):
     """Converts Process to ExportedProcess."""
@@ -664,6 +673,7 @@ class ProcessToExportedNetworkConnectionConverter(ExportConverter):
   """Converts Process to ExportedNetworkConnection."""
 
   input_rdf_type = "Process"
+  process_pool_compatible = True
 
   def Convert(self, metadata, process, token=None):
     """Converts Process to ExportedNetworkConnection."""
@@ -678,6 +688,7 @@ class ProcessToExportedOpenFileConverter(ExportConverter):
   """Converts Process to ExportedOpenFile."""
 
   input_rdf_type = "Process"
+  process_pool_compatible = True
 
   def Convert(self, metadata, process, token=None):
     """Converts Process to ExportedOpenFile."""
@@ -688,6 +699,7 @@ class ProcessToExportedOpenFileConverter(ExportConverter):
 
 class InterfaceToExportedNetworkInterfaceConverter(ExportConverter):
   input_rdf_type = "Interface"
+  process_pool_compatible = True
 
   def Convert(self, metadata, interface, token=None):
     """Converts Interface to ExportedNetworkInterfaces."""
@@ -715,6 +727,7 @@ class InterfaceToExportedNetworkInterfaceConverter(ExportConverter):
 
 class DNSClientConfigurationToExportedDNSClientConfiguration(ExportConverter):
   input_rdf_type = "DNSClientConfiguration"
+  process_pool_compatible = True
 
   def Convert(self, metadata, config, token=None):
     """Converts DNSClientConfiguration to ExportedDNSClientConfiguration."""
@@ -739,6 +752,7 @@ class ClientSummaryToExportedNetworkInterfaceConverter(
 
 class ClientSummaryToExportedClientConverter(ExportConverter):
   input_rdf_type = "ClientSummary"
+  process_pool_compatible = True
 
   def Convert(self, metadata, unused_client_summary, token=None):
     return [ExportedClient(metadata=metadata)]
@@ -748,6 +762,7 @@ class BufferReferenceToExportedMatchConverter(ExportConverter):
   """Export converter for BufferReference instances."""
 
   input_rdf_type = "BufferReference"
+  process_pool_compatible = True
 
   def Convert(self, metadata, buffer_reference, token=None):
     yield ExportedMatch(
@@ -880,9 +895,16 @@ class CollectionConverterBase(ExportConverter):
     if not collection:
       return
 
+    # The converters are shared by all batches, so that e.g. the client
+    # metadata cached by the GrrMessageConverter is reused.
+    converters = {}
     for batch in utils.Grouper(collection, self.BATCH_SIZE):
       converted_batch = ConvertValues(
-          metadata, batch, token=token, options=self.options)
+          metadata,
+          batch,
+          token=token,
+          options=self.options,
+          cached_converters=converters)
       for v in converted_batch:
         yield v
 
@@ -937,6 +959,7 @@ class VFSFileToExportedFileConverter(ExportConverter):
 class RDFBytesToExportedBytesConverter(ExportConverter):
 
   input_rdf_type = "RDFBytes"
+  process_pool_compatible = True
 
   def Convert(self, metadata, data, token=None):
     result = ExportedBytes(
@@ -967,7 +990,7 @@ class GrrMessageConverter(ExportConverter):
 
   def __init__(self, *args, **kw):
     super(GrrMessageConverter, self).__init__(*args, **kw)
-    self.cached_metadata = {}
+    self.cached_metadata = ExportedMetadataCache()
 
   def Convert(self, metadata, grr_message, token=None):
     """Converts GrrMessage into a set of RDFValues.
@@ -1002,26 +1025,8 @@ class GrrMessageConverter(ExportConverter):
     for metadata, msg in metadata_value_pairs:
       msg_dict.setdefault(msg.source, []).append((metadata, msg))
 
-    metadata_objects = []
-    metadata_to_fetch = []
-
-    # Open the clients we don't have metadata for and fetch metadata.
-    for client_urn in msg_dict.iterkeys():
-      try:
-        metadata_objects.append(self.cached_metadata[client_urn])
-      except KeyError:
-        metadata_to_fetch.append(client_urn)
-
-    if metadata_to_fetch:
-      client_fds = aff4.FACTORY.MultiOpen(
-          metadata_to_fetch, mode="r", token=token)
-
-      fetched_metadata = [
-          GetMetadata(client_fd, token=token) for client_fd in client_fds
-      ]
-      for metadata in fetched_metadata:
-        self.cached_metadata[metadata.client_urn] = metadata
-      metadata_objects.extend(fetched_metadata)
+    metadata_objects = self.cached_metadata.GetMany(
+        msg_dict.iterkeys(), token=token).values()
 
     data_by_type = {}
     for metadata in metadata_objects:
@@ -1096,6 +1101,7 @@ class FileStoreHashConverter(ExportConverter):
 
 class CheckResultConverter(ExportConverter):
   input_rdf_type = "CheckResult"
+  process_pool_compatible = True
 
   def Convert(self, metadata, checkresult, token=None):
     """Converts a single CheckResult.
@@ -1884,7 +1890,159 @@ def GetMetadata(client, token=None):
   return metadata
 
 
-def ConvertValuesWithMetadata(metadata_value_pairs, token=None, options=None):
+class ExportedMetadataCache(object):
+  """A bounded cache of client ExportedMetadata objects.
+
+  Metadata of clients which are not in the cache is fetched with a single
+  MultiOpen call for all of them.
+  """
+
+  def __init__(self, max_size=10000, max_age=600):
+    """Constructor.
+
+    Args:
+      max_size: The maximum number of clients to keep the metadata of.
+      max_age: The number of seconds the metadata of a client is kept for.
+    """
+    self._cache = utils.AgeBasedCache(max_size=max_size, max_age=max_age)
+
+  def GetMany(self, client_urns, token=None):
+    """Returns the metadata of several clients.
+
+    Args:
+      client_urns: An iterable of client urns.
+      token: Security token.
+
+    Returns:
+      A dict mapping client urns to ExportedMetadata objects. Clients which
+      do not exist are left out.
+    """
+    results = {}
+    to_fetch = []
+    for client_urn in set(client_urns):
+      try:
+        results[client_urn] = self._cache.Get(client_urn)
+      except KeyError:
+        to_fetch.append(client_urn)
+
+    if to_fetch:
+      for client_fd in aff4.FACTORY.MultiOpen(to_fetch, mode="r", token=token):
+        metadata = GetMetadata(client_fd, token=token)
+        self._cache.Put(metadata.client_urn, metadata)
+        results[metadata.client_urn] = metadata
+
+    return results
+
+  def Get(self, client_urn, token=None):
+    """Returns the metadata of a client or None if it does not exist."""
+    return self.GetMany([client_urn], token=token).get(client_urn)
+
+  def Flush(self):
+    self._cache.Flush()
+
+
+def _SerializeMetadataValuePairs(metadata_value_pairs):
+  return [(metadata.SerializeToString(), value.__class__.__name__,
+           value.SerializeToString(), int(value.age))
+          for metadata, value in metadata_value_pairs]
+
+
+def _ConvertInProcess(args):
+  """Runs a converter on a serialized batch in an ExportProcessPool process."""
+  converter_name, serialized_options, serialized_pairs = args
+
+  converter = ExportConverter.classes[converter_name](
+      ExportOptions.FromSerializedString(serialized_options))
+  metadata_value_pairs = []
+  for metadata, value_cls_name, value, age in serialized_pairs:
+    value_cls = rdfvalue.RDFValue.classes[value_cls_name]
+    metadata_value_pairs.append(
+        (ExportedMetadata.FromSerializedString(metadata),
+         value_cls.FromSerializedString(value, age=rdfvalue.RDFDatetime(age))))
+
+  return _SerializeValues(converter.BatchConvert(metadata_value_pairs))
+
+
+def _SerializeValues(values):
+  return [(value.__class__.__name__, value.SerializeToString())
+          for value in values]
+
+
+def _ParseValues(serialized_values):
+  for value_cls_name, value in serialized_values:
+    yield rdfvalue.RDFValue.classes[value_cls_name].FromSerializedString(value)
+
+
+class ExportProcessPool(object):
+  """Runs export converters in a pool of worker processes.
+
+  The values are sent to the processes in serialized batches. The results are
+  yielded in the order of the values while the following batches are still
+  being converted. Converters which are not process_pool_compatible are run
+  in the calling process.
+  """
+
+  def __init__(self, processes, batch_size=1000):
+    """Constructor.
+
+    Args:
+      processes: The number of worker processes.
+      batch_size: The number of values sent to a process at once.
+    """
+    self.processes = processes
+    self.batch_size = batch_size
+    self._pool = None
+
+  def BatchConvert(self, converter, metadata_value_pairs, token=None):
+    """Converts values like converter.BatchConvert does.
+
+    Args:
+      converter: An ExportConverter instance.
+      metadata_value_pairs: An iterable of (metadata, value) tuples.
+      token: Security token.
+
+    Yields:
+      The converted values, in the order BatchConvert would produce them.
+    """
+    if not converter.process_pool_compatible:
+      for result in converter.BatchConvert(metadata_value_pairs, token=token):
+        yield result
+      return
+
+    if self._pool is None:
+      self._pool = multiprocessing.Pool(self.processes)
+
+    converter_name = converter.__class__.__name__
+    serialized_options = converter.options.SerializeToString()
+
+    # At most two batches per process are converted ahead of the consumer.
+    pending = collections.deque()
+    for batch in utils.Grouper(metadata_value_pairs, self.batch_size):
+      pending.append(
+          self._pool.apply_async(
+              _ConvertInProcess,
+              ((converter_name, serialized_options,
+                _SerializeMetadataValuePairs(batch)),)))
+      if len(pending) >= 2 * self.processes:
+        for result in _ParseValues(pending.popleft().get()):
+          yield result
+
+    while pending:
+      for result in _ParseValues(pending.popleft().get()):
+        yield result
+
+  def Close(self):
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
+
+
+def ConvertValuesWithMetadata(metadata_value_pairs,
+                              token=None,
+                              options=None,
+                              cached_converters=None,
+                              process_pool=None):
   """Converts a set of RDFValues into a set of export-friendly RDFValues.
 
   Args:
@@ -1894,6 +2052,9 @@ def ConvertValuesWithMetadata(metadata_value_pairs, token=None, options=None):
     token: Security token.
     options: rdfvalue.ExportOptions instance that will be passed to
              ExportConverters.
+    cached_converters: If set, a dict in which the converters are kept by
+                       value type, so that they are reused by further calls.
+    process_pool: If set, an ExportProcessPool the conversion is run in.
   Yields:
     Converted values. Converted values may be of different types.
 
@@ -1918,16 +2079,34 @@ def ConvertValuesWithMetadata(metadata_value_pairs, token=None, options=None):
           first_value)
       continue
 
-    converters = [cls(options) for cls in converters_classes]
+    if cached_converters is None:
+      converters = [cls(options) for cls in converters_classes]
+    else:
+      converters = cached_converters.get(first_value.__class__.__name__)
+      if converters is None:
+        converters = [cls(options) for cls in converters_classes]
+        cached_converters[first_value.__class__.__name__] = converters
+
     for converter in converters:
-      for result in converter.BatchConvert(metadata_values_group, token=token):
+      if process_pool is None:
+        results = converter.BatchConvert(metadata_values_group, token=token)
+      else:
+        results = process_pool.BatchConvert(
+            converter, metadata_values_group, token=token)
+
+      for result in results:
         yield result
 
   if no_converter_found_error is not None:
     raise NoConverterFound(no_converter_found_error)
 
 
-def ConvertValues(default_metadata, values, token=None, options=None):
+def ConvertValues(default_metadata,
+                  values,
+                  token=None,
+                  options=None,
+                  cached_converters=None,
+                  process_pool=None):
   """Converts a set of RDFValues into a set of export-friendly RDFValues.
 
   Args:
@@ -1938,6 +2117,9 @@ def ConvertValues(default_metadata, values, token=None, options=None):
     token: Security token.
     options: rdfvalue.ExportOptions instance that will be passed to
              ExportConverters.
+    cached_converters: If set, a dict in which the converters are kept by
+                       value type, so that they are reused by further calls.
+    process_pool: If set, an ExportProcessPool the conversion is run in.
   Returns:
     Converted values. Converted values may be of different types
     (unlike the source values which are all of the same type). This is due to
@@ -1949,4 +2131,9 @@ def ConvertValues(default_metadata, values, token=None, options=None):
   """
 
   batch_data = [(default_metadata, obj) for obj in values]
-  return ConvertValuesWithMetadata(batch_data, token=token, options=options)
+  return ConvertValuesWithMetadata(
+      batch_data,
+      token=token,
+      options=options,
+      cached_converters=cached_converters,
+      process_pool=process_pool)
@@ -12,6 +12,7 @@ from grr.client.components.rekall_support import rekall_types as rdf_rekall_type
 from grr.lib import flags
 from grr.lib import queues
 from grr.lib import rdfvalue
+from grr.lib import utils
 from grr.lib.rdfvalues import anomaly as rdf_anomaly
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import crypto as rdf_crypto
@@ -944,6 +945,57 @@ class ExportTest(ExportTestBase):
     self.assertItemsEqual(["DummyRDFValue2", "DummyRDFValue", "DummyRDFValue5"],
                           [x.__class__.__name__ for x in results])
 
+  def testExportedMetadataCacheOpensClientsInBulk(self):
+    client_urns = [
+        rdf_client.ClientURN("C.000000000000000%d" % i) for i in range(3)
+    ]
+    for client_urn in client_urns[:2]:
+      fixture_test_lib.ClientFixture(client_urn, token=self.token)
+
+    opened = []
+    multi_open = aff4.FACTORY.MultiOpen
+
+    def MultiOpenStub(urns, **kwargs):
+      urns = list(urns)
+      opened.append(urns)
+      return multi_open(urns, **kwargs)
+
+    cache = export.ExportedMetadataCache()
+    with utils.Stubber(aff4.FACTORY, "MultiOpen", MultiOpenStub):
+      metadata = cache.GetMany(client_urns[:1], token=self.token)
+      self.assertEqual(metadata.keys(), client_urns[:1])
+
+      # Only the clients which are not cached yet are opened, in one call.
+      metadata = cache.GetMany(client_urns, token=self.token)
+      self.assertItemsEqual(metadata.keys(), client_urns[:2])
+      self.assertEqual(metadata[client_urns[1]].client_urn, client_urns[1])
+      self.assertIsNone(cache.Get(client_urns[2], token=self.token))
+
+    self.assertEqual(len(opened), 3)
+    self.assertItemsEqual(opened[1], client_urns[1:])
+
+  def testExportProcessPoolKeepsTheOrderOfResults(self):
+    processes = [
+        rdf_client.Process(pid=i, name="proc%d" % i) for i in range(20)
+    ]
+    metadata_value_pairs = [(self.metadata, p) for p in processes]
+
+    pool = export.ExportProcessPool(2, batch_size=3)
+    try:
+      converter = export.ProcessToExportedProcessConverter()
+      results = list(pool.BatchConvert(converter, metadata_value_pairs))
+      self.assertEqual([r.pid for r in results], range(20))
+      self.assertEqual(results[5].name, "proc5")
+      self.assertEqual(results[5].metadata.client_urn, self.client_id)
+
+      # Converters which are not marked as compatible run in this process.
+      converter = DummyRDFValueConverter()
+      results = list(
+          pool.BatchConvert(converter, [(self.metadata, DummyRDFValue("a"))]))
+      self.assertEqual(results, [rdfvalue.RDFString("a")])
+    finally:
+      pool.Close()
+
   def testDNSClientConfigurationToExportedDNSClientConfiguration(self):
     dns_servers = ["192.168.1.1", "8.8.8.8"]
     dns_suffixes = ["internal.company.com", "company.com"]
@@ -133,6 +133,10 @@ class CleanInactiveClients(cronjobs.SystemCronFlow):
           client_group,
           mode="r",
           aff4_type=aff4_grr.VFSGRRClient,
+          attributes=[
+              aff4_grr.VFSGRRClient.SchemaCls.LABELS,
+              aff4_grr.VFSGRRClient.SchemaCls.LAST
+          ],
           token=self.token):
         if exception_label in client.GetLabelsNames():
           continue
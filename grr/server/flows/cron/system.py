@@ -9,7 +9,10 @@ import time
 from grr import config
 from grr.endtoend_tests import base
 from grr.lib import rdfvalue
+from grr.lib import registry
+from grr.lib import stats
 from grr.lib import utils
+from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
 from grr.lib.rdfvalues import stats as rdfstats
 from grr.server import access_control
@@ -90,13 +93,19 @@ class _ActiveCounter(object):
       # pylint: enable=protected-access
 
 
-class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
-  """A cron job which opens every client in the system.
+class ClientStatsProcessor(object):
+  """Computes fleet statistics from client objects.
 
-  We feed all the client objects to the AbstractClientStatsCollector instances.
+  Processors are run by AbstractClientStatsCronFlow, which feeds every client
+  in the system to all of its processors in a single scan. Client objects only
+  hold the attributes the processors declare, plus the client labels.
   """
 
-  CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
+  # The client attributes this processor reads.
+  attributes = []
+
+  def __init__(self, cron_flow):
+    self.cron_flow = cron_flow
 
   def BeginProcessing(self):
     pass
@@ -114,60 +123,21 @@ class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
     client_labels.extend(label_set)
     return client_labels
 
-  def _StatsForLabel(self, label):
-    if label not in self.stats:
-      self.stats[label] = aff4.FACTORY.Create(
-          self.CLIENT_STATS_URN.Add(label),
-          aff4_stats.ClientFleetStats,
-          mode="w",
-          token=self.token)
-    return self.stats[label]
-
-  @flow.StateHandler()
-  def Start(self):
-    """Retrieve all the clients for the AbstractClientStatsCollectors."""
-    try:
-
-      self.stats = {}
-
-      self.BeginProcessing()
-
-      root = aff4.FACTORY.Open(aff4.ROOT_URN, token=self.token)
-      children_urns = list(root.ListChildren())
-      logging.debug("Found %d children.", len(children_urns))
-
-      processed_count = 0
-      for child in aff4.FACTORY.MultiOpen(
-          children_urns, mode="r", token=self.token, age=aff4.NEWEST_TIME):
-        if isinstance(child, aff4_grr.VFSGRRClient):
-          self.ProcessClient(child)
-          processed_count += 1
-
-        # This flow is not dead: we don't want to run out of lease time.
-        self.HeartBeat()
 
-      self.FinishProcessing()
-      for fd in self.stats.values():
-        fd.Close()
-
-      logging.info("%s: processed %d clients.", self.__class__.__name__,
-                   processed_count)
-    except Exception as e:  # pylint: disable=broad-except
-      logging.exception("Error while calculating stats: %s", e)
-      raise
-
-
-class GRRVersionBreakDown(AbstractClientStatsCronFlow):
+class GRRVersionStatsProcessor(ClientStatsProcessor):
   """Records relative ratios of GRR versions in 7 day actives."""
 
-  frequency = rdfvalue.Duration("4h")
+  attributes = [
+      aff4_grr.VFSGRRClient.SchemaCls.PING,
+      aff4_grr.VFSGRRClient.SchemaCls.CLIENT_INFO
+  ]
 
   def BeginProcessing(self):
     self.counter = _ActiveCounter(
         aff4_stats.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM)
 
   def FinishProcessing(self):
-    self.counter.Save(self)
+    self.counter.Save(self.cron_flow)
 
   def ProcessClient(self, client):
     ping = client.Get(client.Schema.PING)
@@ -183,9 +153,15 @@ class GRRVersionBreakDown(AbstractClientStatsCronFlow):
         self.counter.Add(category, label, ping)
 
 
-class OSBreakDown(AbstractClientStatsCronFlow):
+class OSStatsProcessor(ClientStatsProcessor):
   """Records relative ratios of OS versions in 7 day actives."""
 
+  attributes = [
+      aff4_grr.VFSGRRClient.SchemaCls.PING,
+      aff4_grr.VFSGRRClient.SchemaCls.SYSTEM,
+      aff4_grr.VFSGRRClient.SchemaCls.UNAME
+  ]
+
   def BeginProcessing(self):
     self.counters = [
         _ActiveCounter(aff4_stats.ClientFleetStats.SchemaCls.OS_HISTOGRAM),
@@ -195,7 +171,7 @@ class OSBreakDown(AbstractClientStatsCronFlow):
   def FinishProcessing(self):
     # Write all the counter attributes.
     for counter in self.counters:
-      counter.Save(self)
+      counter.Save(self.cron_flow)
 
   def ProcessClient(self, client):
     """Update counters for system, version and release attributes."""
@@ -214,9 +190,11 @@ class OSBreakDown(AbstractClientStatsCronFlow):
       self.counters[1].Add(uname, label, ping)
 
 
-class LastAccessStats(AbstractClientStatsCronFlow):
+class LastAccessStatsProcessor(ClientStatsProcessor):
   """Calculates a histogram statistics of clients last contacted times."""
 
+  attributes = [aff4_grr.VFSGRRClient.SchemaCls.PING]
+
   # The number of clients fall into these bins (number of hours ago)
   _bins = [1, 2, 3, 7, 14, 30, 60]
 
@@ -239,7 +217,9 @@ class LastAccessStats(AbstractClientStatsCronFlow):
         cumulative_count += y
         graph.Append(x_value=x, y_value=cumulative_count)
 
-      self._StatsForLabel(label).AddAttribute(graph)
+      # pylint: disable=protected-access
+      self.cron_flow._StatsForLabel(label).AddAttribute(graph)
+      # pylint: enable=protected-access
 
   def ProcessClient(self, client):
     now = rdfvalue.RDFDatetime.Now()
@@ -257,6 +237,155 @@ class LastAccessStats(AbstractClientStatsCronFlow):
           pass
 
 
+class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
+  """A cron job which scans every client in the system.
+
+  All clients are fed to the ClientStatsProcessor instances of the job in a
+  single pass. Instead of opening full client objects, the job lists the
+  clients once and reads only the attributes the processors need, in batches
+  of client_scan_batch_size clients.
+  """
+
+  CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
+
+  # The ClientStatsProcessor classes run by this job.
+  processors = []
+
+  client_scan_batch_size = 5000
+
+  def _StatsForLabel(self, label):
+    if label not in self.stats:
+      self.stats[label] = aff4.FACTORY.Create(
+          self.CLIENT_STATS_URN.Add(label),
+          aff4_stats.ClientFleetStats,
+          mode="w",
+          token=self.token)
+    return self.stats[label]
+
+  def _ScanClients(self, attributes):
+    """Yields batches of client objects holding only the given attributes."""
+    attribute_names = sorted(
+        set(attribute.predicate for attribute in attributes))
+    # Client labels are needed by all processors.
+    attribute_names.append(aff4_grr.VFSGRRClient.SchemaCls.LABELS.predicate)
+
+    # The clients are listed once, other objects under aff4:/ are never read.
+    children = aff4.FACTORY.ListChildren(aff4.ROOT_URN, token=self.token)
+    client_urns = [
+        urn for urn in children if rdf_client.ClientURN.Validate(urn)
+    ]
+    logging.debug("Found %d clients.", len(client_urns))
+
+    for batch_urns in utils.Grouper(client_urns, self.client_scan_batch_size):
+      batch = []
+      for subject, values in data_store.DB.MultiResolveAttributes(
+          batch_urns,
+          attribute_names,
+          timestamp=data_store.DB.NEWEST_TIMESTAMP,
+          token=self.token):
+        batch.append(
+            aff4_grr.VFSGRRClient(
+                rdf_client.ClientURN(subject),
+                mode="r",
+                token=self.token,
+                local_cache={utils.SmartUnicode(subject): values},
+                object_exists=True))
+
+      if batch:
+        yield batch
+
+  @flow.StateHandler()
+  def Start(self):
+    """Feeds all the clients to the ClientStatsProcessors."""
+    try:
+
+      self.stats = {}
+
+      processors = [cls(self) for cls in self.processors]
+      for processor in processors:
+        processor.BeginProcessing()
+
+      attributes = []
+      for processor in processors:
+        attributes.extend(processor.attributes)
+
+      processed_count = 0
+      start_time = time.time()
+      for batch in self._ScanClients(attributes):
+        for client in batch:
+          for processor in processors:
+            processor.ProcessClient(client)
+
+        processed_count += len(batch)
+        stats.STATS.IncrementCounter(
+            "client_stats_clients_scanned",
+            delta=len(batch),
+            fields=[self.__class__.__name__])
+
+        # This flow is not dead: we don't want to run out of lease time.
+        self.HeartBeat()
+
+      for processor in processors:
+        processor.FinishProcessing()
+      for fd in self.stats.values():
+        fd.Close()
+
+      elapsed = time.time() - start_time
+      logging.info("%s: processed %d clients in %.1fs (%.1f clients/s).",
+                   self.__class__.__name__, processed_count, elapsed,
+                   processed_count / max(elapsed, 1e-6))
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error while calculating stats: %s", e)
+      raise
+
+
+class ClientFleetStatsCronFlow(AbstractClientStatsCronFlow):
+  """Computes all client fleet statistics in a single scan of the clients."""
+
+  frequency = rdfvalue.Duration("4h")
+
+  processors = [
+      GRRVersionStatsProcessor, OSStatsProcessor, LastAccessStatsProcessor
+  ]
+
+
+# The following jobs compute a subset of the statistics computed by
+# ClientFleetStatsCronFlow. They are not scheduled anymore but are kept so that
+# they can still be run on their own.
+
+
+class GRRVersionBreakDown(AbstractClientStatsCronFlow):
+  """Records relative ratios of GRR versions in 7 day actives."""
+
+  frequency = rdfvalue.Duration("4h")
+  disabled = True
+
+  processors = [GRRVersionStatsProcessor]
+
+
+class OSBreakDown(AbstractClientStatsCronFlow):
+  """Records relative ratios of OS versions in 7 day actives."""
+
+  disabled = True
+
+  processors = [OSStatsProcessor]
+
+
+class LastAccessStats(AbstractClientStatsCronFlow):
+  """Calculates a histogram statistics of clients last contacted times."""
+
+  disabled = True
+
+  processors = [LastAccessStatsProcessor]
+
+
+class ClientStatsCronInit(registry.InitHook):
+
+  def RunOnce(self):
+    stats.STATS.RegisterCounterMetric(
+        "client_stats_clients_scanned", fields=[("cron_job", str)])
+
+
 class InterrogateClientsCronFlow(cronjobs.SystemCronFlow):
   """A cron job which runs an interrogate hunt on all clients.
 
@@ -2,14 +2,18 @@
 """System cron flows tests."""
 
 
+import mock
+
 from grr.endtoend_tests import base
 from grr.endtoend_tests import endtoend_mocks
 from grr.lib import flags
+from grr.lib import stats
 from grr.lib import utils
 from grr.lib.rdfvalues import client as client_rdf
 from grr.lib.rdfvalues import flows
 from grr.server import aff4
 from grr.server import client_fixture
+from grr.server import data_store
 from grr.server import flow
 from grr.server.aff4_objects import aff4_grr
 from grr.server.aff4_objects import stats as aff4_stats
@@ -183,6 +187,62 @@ class SystemCronFlowTest(flow_test_lib.FlowTestsBaseclass):
     # All our clients appeared at the same time but this label is only half.
     self._CheckAccessStats("Label2", count=10L)
 
+  def testClientFleetStatsCronFlow(self):
+    """Check that all stats are computed in a single batched scan."""
+    scanned = stats.STATS.GetMetricValue(
+        "client_stats_clients_scanned",
+        fields=[system.ClientFleetStatsCronFlow.__name__])
+
+    # Use a small batch size so that clients are read over several batches.
+    with utils.Stubber(system.AbstractClientStatsCronFlow,
+                       "client_scan_batch_size", 3):
+      for _ in flow_test_lib.TestFlowHelper(
+          system.ClientFleetStatsCronFlow.__name__, token=self.token):
+        pass
+
+    self.assertEqual(
+        stats.STATS.GetMetricValue(
+            "client_stats_clients_scanned",
+            fields=[system.ClientFleetStatsCronFlow.__name__]), scanned + 20)
+
+    histogram = aff4_stats.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM
+    self._CheckVersionStats("All", histogram, [0, 0, 20, 20])
+    self._CheckVersionStats("Label1", histogram, [0, 0, 10, 10])
+
+    histogram = aff4_stats.ClientFleetStats.SchemaCls.OS_HISTOGRAM
+    self._CheckOSStats("All", histogram, [
+        0, 0, {
+            "Linux": 10,
+            "Windows": 10
+        }, {
+            "Linux": 10,
+            "Windows": 10
+        }
+    ])
+
+    self._CheckAccessStats("All", count=20L)
+    self._CheckAccessStats("Label1", count=10L)
+
+  def testClientFleetStatsCronFlowReadsClientsInOnePass(self):
+    db = data_store.DB
+    with utils.Stubber(system.AbstractClientStatsCronFlow,
+                       "client_scan_batch_size", 3):
+      with mock.patch.object(
+          db, "ScanAttributes", wraps=db.ScanAttributes) as scan:
+        with mock.patch.object(
+            db, "MultiResolveAttributes",
+            wraps=db.MultiResolveAttributes) as resolve:
+          for _ in flow_test_lib.TestFlowHelper(
+              system.ClientFleetStatsCronFlow.__name__, token=self.token):
+            pass
+
+    # 20 clients in batches of 3, each batch is read with a single call.
+    self.assertEqual(resolve.call_count, 7)
+    self.assertEqual(scan.call_count, 0)
+    for call in resolve.call_args_list:
+      for urn in call[0][0]:
+        self.assertTrue(client_rdf.ClientURN.Validate(urn))
+
   def testPurgeClientStats(self):
     max_age = system.PurgeClientStats.MAX_AGE
 
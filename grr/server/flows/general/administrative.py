@@ -373,18 +373,15 @@ class Foreman(flow.WellKnownFlow):
   # How often we refresh the rule set from the data store.
   cache_refresh_time = 60
 
-  lock = threading.Lock()
+  # The number of clients checked against the rules together.
+  batch_size = 100
 
-  def ProcessMessage(self, message):
-    """Run the foreman on the client."""
-    # Only accept authenticated messages
-    if (message.auth_state !=
-        rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED):
-      return
+  lock = threading.Lock()
 
+  def _GetForeman(self):
+    """Returns the foreman, maintaining a cache of it."""
     now = time.time()
 
-    # Maintain a cache of the foreman
     with self.lock:
       if (self.foreman_cache is None or
           now > self.foreman_cache.age + self.cache_refresh_time):
@@ -392,8 +389,40 @@ class Foreman(flow.WellKnownFlow):
             "aff4:/foreman", mode="rw", token=self.token)
         self.foreman_cache.age = now
 
-    if message.source:
-      self.foreman_cache.AssignTasksToClient(message.source)
+      return self.foreman_cache
+
+  def ProcessMessage(self, message):
+    """Run the foreman on the client."""
+    self.ProcessMessages([message])
+
+  def ProcessMessages(self, msgs):
+    """Run the foreman on all the clients sending messages at once."""
+    client_ids = []
+    for message in msgs:
+      # Only accept authenticated messages
+      if (message.auth_state ==
+          rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED and
+          message.source):
+        client_ids.append(message.source)
+
+    if client_ids:
+      self._GetForeman().AssignTasksToClients(client_ids)
+
+  def _SafeProcessMessages(self, msgs):
+    try:
+      self.ProcessMessages(msgs)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error in Foreman.ProcessMessages: %s", e)
+      stats.STATS.IncrementCounter(
+          "well_known_flow_errors", fields=[str(self.session_id)])
+
+  def ProcessResponses(self, responses, thread_pool):
+    """Checks the clients in batches instead of one task per message."""
+    for batch in utils.Grouper(responses, self.batch_size):
+      thread_pool.AddTask(
+          target=self._SafeProcessMessages,
+          args=(batch,),
+          name=self.__class__.__name__)
 
 
 class OnlineNotificationArgs(rdf_structs.RDFProtoStruct):
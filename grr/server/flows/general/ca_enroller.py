@@ -13,6 +13,7 @@ from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import flows_pb2
 from grr.server import aff4
 from grr.server import client_index
+from grr.server import client_key_index
 from grr.server import flow
 from grr.server.aff4_objects import aff4_grr
 
@@ -73,6 +74,9 @@ class CAEnroler(flow.GRRFlow):
       index = client_index.CreateClientIndex(token=self.token)
       index.AddClient(client)
 
+    client_key_index.ClientKeyIndex(token=self.token).WriteKey(
+        self.client_id, cert.GetPublicKey())
+
     # Publish the client enrollment message.
     self.Publish("ClientEnrollment", self.client_id)
 
@@ -8,6 +8,8 @@ import zlib
 from grr import config
 from grr.lib import constants
 from grr.lib import rdfvalue
+from grr.lib import registry
+from grr.lib import stats
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import crypto as rdf_crypto
 from grr.lib.rdfvalues import flows as rdf_flows
@@ -586,6 +588,11 @@ class MultiGetFileMixin(object):
 
     This drains the pending_files store by checking which blobs we already have
     in the store and issuing calls to the client to receive outstanding blobs.
+
+    Blobs we already have are added to the file right away as long as no
+    earlier blob of the same file is still being written. Only the blobs
+    following a missing one pass through the WriteBuffer state, to keep them
+    in order.
     """
     if not self.state.pending_files:
       return
@@ -600,30 +607,97 @@ class MultiGetFileMixin(object):
 
     self.state.blob_hashes_pending = 0
 
-    # Now iterate over all the blobs and add them directly to the blob image.
+    completed = []
+    blobs_deduplicated = bytes_deduplicated = blobs_transferred = 0
     for index, file_tracker in self.state.pending_files.iteritems():
       for hash_response in file_tracker.get("hash_list", []):
         # Make sure we read the correct pathspec on the client.
         hash_response.pathspec = file_tracker["stat_entry"].pathspec
 
-        if existing_blobs[hash_response.data.encode("hex")]:
-          # If we have the data we may call our state directly.
-          self.CallState(
-              [hash_response],
-              next_state="WriteBuffer",
-              request_data=dict(index=index))
-
-        else:
+        if not existing_blobs[hash_response.data.encode("hex")]:
           # We dont have this blob - ask the client to transmit it.
+          blobs_transferred += 1
           self.CallClient(
               server_stubs.TransferBuffer,
               hash_response,
               next_state="WriteBuffer",
               request_data=dict(index=index))
+          file_tracker["blobs_in_flight"] = (
+              file_tracker.get("blobs_in_flight", 0) + 1)
+          continue
+
+        blobs_deduplicated += 1
+        bytes_deduplicated += hash_response.length
+        if file_tracker.get("blobs_in_flight"):
+          # Earlier blobs are still being written, so this one has to wait
+          # for them in the WriteBuffer state.
+          self.CallState(
+              [hash_response],
+              next_state="WriteBuffer",
+              request_data=dict(index=index))
+          file_tracker["blobs_in_flight"] += 1
+        elif self._AddBlobToFile(file_tracker, hash_response):
+          completed.append(index)
+          break
 
       # Clear the file tracker's hash list.
       file_tracker["hash_list"] = []
 
+    stats.STATS.IncrementCounter(
+        "multi_get_file_blobs_deduplicated", delta=blobs_deduplicated)
+    stats.STATS.IncrementCounter(
+        "multi_get_file_bytes_deduplicated", delta=bytes_deduplicated)
+    stats.STATS.IncrementCounter(
+        "multi_get_file_blobs_transferred", delta=blobs_transferred)
+
+    for index in completed:
+      self._WriteBlobImage(self.state.pending_files[index])
+
+  def _AddBlobToFile(self, file_tracker, buffer_reference):
+    """Adds a blob to a file and returns True if the file is complete."""
+    file_tracker.setdefault("blobs", []).append((buffer_reference.data,
+                                                 buffer_reference.length))
+
+    return (buffer_reference.length < self.CHUNK_SIZE or
+            buffer_reference.offset + buffer_reference.length >=
+            file_tracker["size_to_download"])
+
+  def _WriteBlobImage(self, file_tracker):
+    """Writes a completely fetched file to the data store."""
+    stat_entry = file_tracker["stat_entry"]
+    urn = stat_entry.pathspec.AFF4Path(self.client_id)
+
+    with aff4.FACTORY.Create(
+        urn, aff4_grr.VFSBlobImage, mode="w", token=self.token) as fd:
+
+      fd.SetChunksize(self.CHUNK_SIZE)
+      fd.Set(fd.Schema.STAT(stat_entry))
+      fd.Set(fd.Schema.PATHSPEC(stat_entry.pathspec))
+      fd.Set(fd.Schema.CONTENT_LAST(rdfvalue.RDFDatetime().Now()))
+
+      for digest, length in file_tracker["blobs"]:
+        fd.AddBlob(digest, length)
+
+      # Save some space.
+      del file_tracker["blobs"]
+
+    # File done, remove from the store and close it.
+    self._ReceiveFetchedFile(file_tracker)
+
+    # Publish the new file event to cause the file to be added to the
+    # filestore. This is not time critical so do it when we have spare
+    # capacity.
+    self.Publish(
+        "FileStore.AddFileToStore",
+        urn,
+        priority=rdf_flows.GrrMessage.Priority.LOW_PRIORITY)
+
+    self.state.files_fetched += 1
+
+    if not self.state.files_fetched % 100:
+      self.Log("Fetched %d of %d files.", self.state.files_fetched,
+               self.state.files_to_fetch)
+
   @flow.StateHandler()
   def WriteBuffer(self, responses):
     """Write the hash received to the blob image."""
@@ -642,47 +716,11 @@ class MultiGetFileMixin(object):
     response = responses.First()
     file_tracker = self.state.pending_files.get(index)
     if file_tracker:
-      file_tracker.setdefault("blobs", []).append((response.data,
-                                                   response.length))
-
-      download_size = file_tracker["size_to_download"]
-      if (response.length < self.CHUNK_SIZE or
-          response.offset + response.length >= download_size):
-
-        # Write the file to the data store.
-        stat_entry = file_tracker["stat_entry"]
-        urn = stat_entry.pathspec.AFF4Path(self.client_id)
-
-        with aff4.FACTORY.Create(
-            urn, aff4_grr.VFSBlobImage, mode="w", token=self.token) as fd:
-
-          fd.SetChunksize(self.CHUNK_SIZE)
-          fd.Set(fd.Schema.STAT(stat_entry))
-          fd.Set(fd.Schema.PATHSPEC(stat_entry.pathspec))
-          fd.Set(fd.Schema.CONTENT_LAST(rdfvalue.RDFDatetime().Now()))
+      if file_tracker.get("blobs_in_flight"):
+        file_tracker["blobs_in_flight"] -= 1
 
-          for digest, length in file_tracker["blobs"]:
-            fd.AddBlob(digest, length)
-
-          # Save some space.
-          del file_tracker["blobs"]
-
-        # File done, remove from the store and close it.
-        self._ReceiveFetchedFile(file_tracker)
-
-        # Publish the new file event to cause the file to be added to the
-        # filestore. This is not time critical so do it when we have spare
-        # capacity.
-        self.Publish(
-            "FileStore.AddFileToStore",
-            urn,
-            priority=rdf_flows.GrrMessage.Priority.LOW_PRIORITY)
-
-        self.state.files_fetched += 1
-
-        if not self.state.files_fetched % 100:
-          self.Log("Fetched %d of %d files.", self.state.files_fetched,
-                   self.state.files_to_fetch)
+      if self._AddBlobToFile(file_tracker, response):
+        self._WriteBlobImage(file_tracker)
 
   @flow.StateHandler()
   def End(self):
@@ -1004,3 +1042,14 @@ class LoadComponentMixin(object):
                responses.First().summary.name,
                responses.First().summary.version)
     self.CallStateInline(next_state=responses.request_data["next_state"])
+
+
+class TransferInit(registry.InitHook):
+  """Init handler to define the file transfer metrics."""
+
+  def RunOnce(self):
+    # The ratio of deduplicated to transferred blobs shows how much of the
+    # fetched files' content was already stored.
+    stats.STATS.RegisterCounterMetric("multi_get_file_blobs_deduplicated")
+    stats.STATS.RegisterCounterMetric("multi_get_file_bytes_deduplicated")
+    stats.STATS.RegisterCounterMetric("multi_get_file_blobs_transferred")
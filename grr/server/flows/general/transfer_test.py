@@ -10,6 +10,7 @@ import unittest
 from grr.client import vfs
 from grr.lib import constants
 from grr.lib import flags
+from grr.lib import stats
 from grr.lib import utils
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import paths as rdf_paths
@@ -405,6 +406,46 @@ class TestTransfer(flow_test_lib.FlowTestsBaseclass):
 
     self.assertEqual(client_mock.action_counts["TransferBuffer"], 1)
 
+  def testMultiGetFileOnlyTransfersMissingBlobs(self):
+    chunk_size = transfer.MultiGetFile.CHUNK_SIZE
+    data = "".join(chr(i) * chunk_size for i in range(3)) + "end"
+    # Only the last chunk of the second file differs from the first one.
+    contents = [data, data[:-3] + "END"]
+
+    pathspecs = []
+    for i, content in enumerate(contents):
+      path = os.path.join(self.temp_dir, "blobs_%d.txt" % i)
+      with open(path, "wb") as fd:
+        fd.write(content)
+      pathspecs.append(
+          rdf_paths.PathSpec(
+              pathtype=rdf_paths.PathSpec.PathType.OS, path=path))
+
+    prev_deduplicated = stats.STATS.GetMetricValue(
+        "multi_get_file_blobs_deduplicated")
+    for pathspec, transferred in zip(pathspecs, [4, 1]):
+      client_mock = action_mocks.MultiGetFileClientMock()
+      args = transfer.MultiGetFileArgs(pathspecs=[pathspec])
+      for _ in flow_test_lib.TestFlowHelper(
+          transfer.MultiGetFile.__name__,
+          client_mock,
+          token=self.token,
+          client_id=self.client_id,
+          args=args):
+        pass
+
+      self.assertEqual(client_mock.action_counts["TransferBuffer"],
+                       transferred)
+
+    self.assertEqual(
+        stats.STATS.GetMetricValue("multi_get_file_blobs_deduplicated") -
+        prev_deduplicated, 3)
+
+    for pathspec, content in zip(pathspecs, contents):
+      fd = aff4.FACTORY.Open(
+          pathspec.AFF4Path(self.client_id), token=self.token)
+      self.assertEqual(fd.Read(len(content) + 1), content)
+
   def testMultiGetFileSetsFileHashAttributeWhenMultipleChunksDownloaded(self):
     client_mock = action_mocks.MultiGetFileClientMock()
     pathspec = rdf_paths.PathSpec(
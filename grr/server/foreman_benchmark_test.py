@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Benchmarks evaluating the foreman rules for many clients."""
+
+
+import time
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib.rdfvalues import client as rdf_client
+from grr.server import aff4
+from grr.server import foreman as rdf_foreman
+from grr.server import foreman_rule_index
+from grr.server.aff4_objects import aff4_grr
+from grr.test_lib import benchmark_test_lib
+from grr.test_lib import test_lib
+
+
+class ForemanRuleIndexBenchmark(benchmark_test_lib.MicroBenchmarks):
+  """Evaluates 100k clients against 1k foreman rules."""
+
+  labels = ["large"]
+  units = "s"
+
+  RULES = 1000
+  CLIENTS = 100000
+
+  # The rules are built from this many different client rule sets, the
+  # clients share this many different client objects.
+  DISTINCT_RULE_SETS = 50
+  DISTINCT_CLIENTS = 100
+
+  # The uncompiled rules are only evaluated for a sample of the clients.
+  UNCOMPILED_CLIENTS = 1000
+
+  def _ClientRuleSet(self, i):
+    label_modes = rdf_foreman.ForemanLabelClientRule.MatchMode
+    operators = rdf_foreman.ForemanIntegerClientRule.Operator
+    return rdf_foreman.ForemanClientRuleSet(rules=[
+        rdf_foreman.ForemanClientRule(
+            rule_type=rdf_foreman.ForemanClientRule.Type.OS,
+            os=rdf_foreman.ForemanOsClientRule(
+                os_windows=bool(i & 1), os_linux=bool(i & 2), os_darwin=True)),
+        rdf_foreman.ForemanClientRule(
+            rule_type=rdf_foreman.ForemanClientRule.Type.LABEL,
+            label=rdf_foreman.ForemanLabelClientRule(
+                match_mode=label_modes.MATCH_ANY,
+                label_names=["label%d" % (i % 7), "label%d" % (i % 11)])),
+        rdf_foreman.ForemanClientRule(
+            rule_type=rdf_foreman.ForemanClientRule.Type.REGEX,
+            regex=rdf_foreman.ForemanRegexClientRule(
+                attribute_name="System", attribute_regex="^[A-Z]")),
+        rdf_foreman.ForemanClientRule(
+            rule_type=rdf_foreman.ForemanClientRule.Type.INTEGER,
+            integer=rdf_foreman.ForemanIntegerClientRule(
+                attribute_name="InstallDate",
+                operator=operators.GREATER_THAN,
+                value=i)),
+    ])
+
+  def _Rules(self):
+    rule_sets = [
+        self._ClientRuleSet(i) for i in xrange(self.DISTINCT_RULE_SETS)
+    ]
+    return [
+        rdf_foreman.ForemanRule(
+            created=i + 1,
+            expires=2**62,
+            client_rule_set=rule_sets[i % len(rule_sets)])
+        for i in xrange(self.RULES)
+    ]
+
+  def _ClientObjects(self):
+    systems = ["Windows", "Linux", "Darwin"]
+    client_objects = []
+    for i in xrange(self.DISTINCT_CLIENTS):
+      fd = aff4.FACTORY.Create(
+          rdf_client.ClientURN("C.%016X" % i),
+          aff4_grr.VFSGRRClient,
+          mode="rw",
+          token=self.token)
+      fd.Set(fd.Schema.SYSTEM, rdfvalue.RDFString(systems[i % len(systems)]))
+      fd.Set(fd.Schema.INSTALL_DATE(i))
+      fd.AddLabel("label%d" % (i % 13))
+      client_objects.append(fd)
+    return client_objects
+
+  def testEvaluateClients(self):
+    """Evaluates all clients against all rules."""
+    rules = self._Rules()
+    client_objects = self._ClientObjects()
+
+    clients = []
+    for i in xrange(self.CLIENTS):
+      client_id = rdf_client.ClientURN("C.%016X" % i)
+      clients.append((client_id,
+                      {client_id: client_objects[i % len(client_objects)]}))
+
+    start = time.time()
+    rule_index = foreman_rule_index.ForemanRuleIndex(rules)
+    self.AddResult("Compile %d rules" % self.RULES, time.time() - start, 1)
+
+    start = time.time()
+    matches = 0
+    for client_id, objects in clients:
+      matches += len(rule_index.MatchingRules(client_id, objects, 0, 0))
+    self.AddResult("Compiled, %d clients" % self.CLIENTS,
+                   time.time() - start, self.CLIENTS)
+
+    start = time.time()
+    uncompiled_matches = 0
+    for client_id, objects in clients[:self.UNCOMPILED_CLIENTS]:
+      for rule in rules:
+        if rule.client_rule_set.Evaluate(objects, client_id):
+          uncompiled_matches += 1
+    self.AddResult("Uncompiled, %d clients" % self.UNCOMPILED_CLIENTS,
+                   time.time() - start, self.UNCOMPILED_CLIENTS)
+
+    self.assertGreater(matches, 0)
+    self.assertEqual(uncompiled_matches, sum(
+        len(rule_index.MatchingRules(client_id, objects, 0, 0))
+        for client_id, objects in clients[:self.UNCOMPILED_CLIENTS]))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
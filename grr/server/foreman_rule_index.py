@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""A compiled form of the foreman rules for evaluating many clients.
+
+Evaluating the foreman rules as they are stored walks the rule protos for every
+client and every rule. The ForemanRuleIndex compiles them once: rules with the
+same client rule set share a single predicate, attribute names and operators
+are resolved up front and every attribute value is read only once per client.
+Rules are kept ordered by creation time, so for a client which was already
+checked against the rules created up to some time, only the newer rules are
+looked at.
+"""
+
+
+import bisect
+import logging
+
+from grr.lib import utils
+from grr.server import aff4
+from grr.server import foreman as rdf_foreman
+
+# The path of the client object itself.
+CLIENT_PATH = "/"
+
+
+class ClientEvaluation(object):
+  """The objects of a client and the predicate results computed for it."""
+
+  def __init__(self, client_id, objects):
+    """Constructor.
+
+    Args:
+      client_id: The rdf_client.ClientURN of the client.
+      objects: A dict mapping URNs to the AFF4 objects of the client read for
+        the rules.
+    """
+    self.client_id = client_id
+    self.objects = objects
+    self.results = {}
+    self._fds = {}
+    self._values = {}
+
+  def GetObject(self, path):
+    """Returns the object at a path relative to the client or None."""
+    try:
+      return self._fds[path]
+    except KeyError:
+      fd = self.objects.get(self.client_id.Add(path))
+      self._fds[path] = fd
+      return fd
+
+  def GetValue(self, path, attribute):
+    """Returns an attribute value as a string or None if there is no object."""
+    key = (path, attribute)
+    try:
+      return self._values[key]
+    except KeyError:
+      fd = self.GetObject(path)
+      value = None
+      if fd is not None:
+        value = utils.SmartStr(fd.Get(attribute))
+      self._values[key] = value
+      return value
+
+  def Check(self, predicate):
+    """Evaluates a predicate, each one is only evaluated once per client."""
+    try:
+      return self.results[predicate.key]
+    except KeyError:
+      result = bool(predicate.Evaluate(self))
+      self.results[predicate.key] = result
+      return result
+
+
+class Predicate(object):
+  """A compiled client rule.
+
+  Predicates with the same key are interchangeable.
+  """
+
+  key = None
+
+  def Evaluate(self, evaluation):
+    raise NotImplementedError()
+
+
+class FalsePredicate(Predicate):
+  """A rule which never matches, e.g. because of an unknown attribute."""
+
+  key = ("false",)
+
+  def Evaluate(self, evaluation):
+    return False
+
+
+class OsPredicate(Predicate):
+  """Compiled ForemanOsClientRule."""
+
+  def __init__(self, rule):
+    prefixes = []
+    if rule.os_windows:
+      prefixes.append("Windows")
+    if rule.os_linux:
+      prefixes.append("Linux")
+    if rule.os_darwin:
+      prefixes.append("Darwin")
+    self.prefixes = tuple(prefixes)
+    self.attribute = aff4.Attribute.NAMES["System"]
+    self.key = ("os",) + self.prefixes
+
+  def Evaluate(self, evaluation):
+    value = evaluation.GetValue(CLIENT_PATH, self.attribute)
+    return value is not None and value.startswith(self.prefixes)
+
+
+class LabelPredicate(Predicate):
+  """Compiled ForemanLabelClientRule."""
+
+  def __init__(self, rule):
+    match_modes = rdf_foreman.ForemanLabelClientRule.MatchMode
+    quantifiers = {
+        match_modes.MATCH_ALL: all,
+        match_modes.MATCH_ANY: any,
+        match_modes.DOES_NOT_MATCH_ALL: lambda iterable: not all(iterable),
+        match_modes.DOES_NOT_MATCH_ANY: lambda iterable: not any(iterable),
+    }
+    try:
+      self.quantifier = quantifiers[rule.match_mode]
+    except KeyError:
+      raise ValueError("Unexpected match mode value: %s" % rule.match_mode)
+
+    self.label_names = tuple(rule.label_names)
+    self.key = ("label", int(rule.match_mode)) + self.label_names
+
+  def Evaluate(self, evaluation):
+    fd = evaluation.GetObject(CLIENT_PATH)
+    if fd is None:
+      return False
+
+    client_label_names = set(fd.GetLabelsNames())
+    return self.quantifier(
+        (name in client_label_names) for name in self.label_names)
+
+
+class RegexPredicate(Predicate):
+  """Compiled ForemanRegexClientRule."""
+
+  def __init__(self, rule):
+    self.path = utils.SmartStr(rule.path)
+    self.attribute = aff4.Attribute.NAMES[rule.attribute_name]
+    self.regex = rule.attribute_regex
+    self.key = ("regex", self.path, self.attribute.predicate,
+                self.regex.SerializeToString())
+
+  def Evaluate(self, evaluation):
+    value = evaluation.GetValue(self.path, self.attribute)
+    return value is not None and self.regex.Search(value)
+
+
+class IntegerPredicate(Predicate):
+  """Compiled ForemanIntegerClientRule."""
+
+  def __init__(self, rule):
+    operators = rdf_foreman.ForemanIntegerClientRule.Operator
+    self.comparison = {
+        operators.LESS_THAN: lambda value, other: value < other,
+        operators.GREATER_THAN: lambda value, other: value > other,
+        operators.EQUAL: lambda value, other: value == other,
+    }.get(rule.operator)
+
+    self.path = utils.SmartStr(rule.path)
+    self.attribute = aff4.Attribute.NAMES[rule.attribute_name]
+    self.value = rule.value
+    self.key = ("integer", self.path, self.attribute.predicate,
+                int(rule.operator), self.value)
+
+  def Evaluate(self, evaluation):
+    if self.comparison is None:
+      # Unknown operator.
+      return False
+
+    fd = evaluation.GetObject(self.path)
+    if fd is None:
+      return False
+
+    try:
+      value = int(fd.Get(self.attribute))
+    except (ValueError, TypeError):
+      # Not an integer attribute.
+      return False
+
+    return self.comparison(value, self.value)
+
+
+class RulePredicate(Predicate):
+  """Evaluates a client rule there is no compiled form for."""
+
+  def __init__(self, rule):
+    self.rule = rule
+    self.key = ("rule", rule.SerializeToString())
+
+  def Evaluate(self, evaluation):
+    return self.rule.Evaluate(evaluation.objects, evaluation.client_id)
+
+
+class RuleSetPredicate(Predicate):
+  """Compiled ForemanClientRuleSet."""
+
+  def __init__(self, rule_set, predicates):
+    match_modes = rdf_foreman.ForemanClientRuleSet.MatchMode
+    if rule_set.match_mode == match_modes.MATCH_ALL:
+      self.quantifier = all
+    elif rule_set.match_mode == match_modes.MATCH_ANY:
+      self.quantifier = any
+    else:
+      raise ValueError("Unexpected match mode value: %s" % rule_set.match_mode)
+
+    self.predicates = predicates
+    self.key = ("rule_set", int(rule_set.match_mode)) + tuple(
+        p.key for p in predicates)
+
+  def Evaluate(self, evaluation):
+    return self.quantifier(evaluation.Check(p) for p in self.predicates)
+
+
+PREDICATE_CLASSES = {
+    rdf_foreman.ForemanOsClientRule: OsPredicate,
+    rdf_foreman.ForemanLabelClientRule: LabelPredicate,
+    rdf_foreman.ForemanRegexClientRule: RegexPredicate,
+    rdf_foreman.ForemanIntegerClientRule: IntegerPredicate,
+}
+
+
+def CompileClientRule(rule):
+  """Compiles a single foreman.ForemanClientRule."""
+  rule = rule.UnionCast()
+  predicate_cls = PREDICATE_CLASSES.get(rule.__class__, RulePredicate)
+  try:
+    return predicate_cls(rule)
+  except KeyError:
+    # Rules using unknown attributes never match.
+    return FalsePredicate()
+
+
+def CompileClientRuleSet(rule_set):
+  """Compiles a foreman.ForemanClientRuleSet into a Predicate."""
+  return RuleSetPredicate(rule_set,
+                          [CompileClientRule(rule) for rule in rule_set.rules])
+
+
+class RuleGroup(object):
+  """Rules sharing the same client rule set."""
+
+  def __init__(self, predicate, paths):
+    self.predicate = predicate
+    self.paths = paths
+    # (created, position, rule) tuples, sorted by creation time.
+    self.entries = []
+    self.created = []
+
+  def Add(self, created, position, rule):
+    i = bisect.bisect_right(self.created, created)
+    self.created.insert(i, created)
+    self.entries.insert(i, (created, position, rule))
+
+  @property
+  def latest(self):
+    return self.created[-1]
+
+  def EntriesNewerThan(self, watermark):
+    return self.entries[bisect.bisect_right(self.created, watermark):]
+
+
+class ForemanRuleIndex(object):
+  """The foreman rules compiled for evaluating many clients at once."""
+
+  def __init__(self, rules):
+    """Constructor.
+
+    Args:
+      rules: A foreman.ForemanRules list.
+    """
+    self.rules = rules
+    self.latest_rule = 0
+    self.expires = []
+
+    groups = {}
+    for position, rule in enumerate(rules):
+      created = int(rule.created)
+      self.latest_rule = max(self.latest_rule, created)
+      self.expires.append(int(rule.expires))
+
+      try:
+        predicate = CompileClientRuleSet(rule.client_rule_set)
+      except ValueError as e:
+        logging.error("Foreman: ignoring invalid rule %s: %s",
+                      rule.description, e)
+        continue
+
+      group = groups.get(predicate.key)
+      if group is None:
+        group = RuleGroup(predicate, rule.client_rule_set.GetPathsToCheck())
+        groups[predicate.key] = group
+      group.Add(created, position, rule)
+
+    self.groups = groups.values()
+
+  def HasExpiredRules(self, now):
+    return any(expires < now for expires in self.expires)
+
+  def PathsToCheck(self, watermark):
+    """Returns the paths the rules created after watermark need."""
+    paths = set()
+    for group in self.groups:
+      if group.latest > watermark:
+        paths.update(group.paths)
+    return paths
+
+  def MatchingRules(self, client_id, objects, watermark, now):
+    """Finds the rules matching a client.
+
+    Args:
+      client_id: The rdf_client.ClientURN of the client.
+      objects: A dict mapping URNs to the AFF4 objects at the paths returned
+        by PathsToCheck.
+      watermark: Only rules created after this time are evaluated.
+      now: Rules which expired before this time are skipped.
+
+    Returns:
+      The matching foreman.ForemanRule objects in the order they are stored.
+    """
+    evaluation = ClientEvaluation(client_id, objects)
+    matching = []
+    for group in self.groups:
+      if group.latest <= watermark:
+        continue
+
+      entries = [
+          entry for entry in group.EntriesNewerThan(watermark)
+          if self.expires[entry[1]] >= now
+      ]
+      if entries and evaluation.Check(group.predicate):
+        matching.extend(entries)
+
+    return [rule for _, _, rule in sorted(matching, key=lambda e: e[1])]
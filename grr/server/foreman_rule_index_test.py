@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""Tests for grr.server.foreman_rule_index."""
+
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.server import aff4
+from grr.server import foreman as rdf_foreman
+from grr.server import foreman_rule_index
+from grr.server.aff4_objects import aff4_grr
+from grr.test_lib import aff4_test_lib
+from grr.test_lib import test_lib
+
+
+def OsRule(**kwargs):
+  return rdf_foreman.ForemanClientRule(
+      rule_type=rdf_foreman.ForemanClientRule.Type.OS,
+      os=rdf_foreman.ForemanOsClientRule(**kwargs))
+
+
+def LabelRule(match_mode, *label_names):
+  return rdf_foreman.ForemanClientRule(
+      rule_type=rdf_foreman.ForemanClientRule.Type.LABEL,
+      label=rdf_foreman.ForemanLabelClientRule(
+          match_mode=match_mode, label_names=list(label_names)))
+
+
+def RegexRule(attribute_name, regex, path="/"):
+  return rdf_foreman.ForemanClientRule(
+      rule_type=rdf_foreman.ForemanClientRule.Type.REGEX,
+      regex=rdf_foreman.ForemanRegexClientRule(
+          path=path, attribute_name=attribute_name, attribute_regex=regex))
+
+
+def IntegerRule(attribute_name, operator, value):
+  return rdf_foreman.ForemanClientRule(
+      rule_type=rdf_foreman.ForemanClientRule.Type.INTEGER,
+      integer=rdf_foreman.ForemanIntegerClientRule(
+          attribute_name=attribute_name, operator=operator, value=value))
+
+
+def Rule(created, *client_rules, **kwargs):
+  match_mode = kwargs.get("match_mode",
+                          rdf_foreman.ForemanClientRuleSet.MatchMode.MATCH_ALL)
+  return rdf_foreman.ForemanRule(
+      created=created,
+      expires=kwargs.get("expires", 2**62),
+      client_rule_set=rdf_foreman.ForemanClientRuleSet(
+          match_mode=match_mode, rules=list(client_rules)))
+
+
+class ForemanRuleIndexTest(aff4_test_lib.AFF4ObjectTest):
+  """Tests the ForemanRuleIndex."""
+
+  def setUp(self):
+    super(ForemanRuleIndexTest, self).setUp()
+
+    self.client_ids = []
+    for i, (system, labels) in enumerate([("Windows 7", ["a", "b"]),
+                                          ("Linux", ["a"]), ("Darwin", [])]):
+      with aff4.FACTORY.Create(
+          "C.100000000000000%d" % i,
+          aff4_grr.VFSGRRClient,
+          token=self.token) as fd:
+        fd.Set(fd.Schema.SYSTEM, rdfvalue.RDFString(system))
+        fd.Set(fd.Schema.INSTALL_DATE(1000 + i))
+        for label in labels:
+          fd.AddLabel(label)
+        self.client_ids.append(fd.urn)
+
+  def _Objects(self, rule_set):
+    urns = []
+    for client_id in self.client_ids:
+      urns.extend(client_id.Add(path) for path in rule_set.GetPathsToCheck())
+
+    return dict((fd.urn, fd)
+                for fd in aff4.FACTORY.MultiOpen(urns, token=self.token))
+
+  def testCompiledRulesMatchLikeRuleSets(self):
+    label_modes = rdf_foreman.ForemanLabelClientRule.MatchMode
+    operators = rdf_foreman.ForemanIntegerClientRule.Operator
+    rule_sets = [
+        [OsRule(os_windows=True)],
+        [OsRule(os_linux=True, os_darwin=True)],
+        [LabelRule(label_modes.MATCH_ALL, "a", "b")],
+        [LabelRule(label_modes.MATCH_ANY, "b", "c")],
+        [LabelRule(label_modes.DOES_NOT_MATCH_ALL, "a", "b")],
+        [LabelRule(label_modes.DOES_NOT_MATCH_ANY, "a")],
+        [RegexRule("System", "^(Linux|Darwin)$")],
+        [RegexRule("System", "."), OsRule(os_darwin=True)],
+        [RegexRule("System", ".", path="/fs/missing")],
+        [RegexRule("UnknownAttribute", ".")],
+        [IntegerRule("InstallDate", operators.GREATER_THAN, 1000)],
+        [IntegerRule("InstallDate", operators.EQUAL, 1001)],
+        [IntegerRule("System", operators.LESS_THAN, 1)],
+    ]
+
+    match_modes = rdf_foreman.ForemanClientRuleSet.MatchMode
+    for client_rules in rule_sets:
+      for match_mode in [match_modes.MATCH_ALL, match_modes.MATCH_ANY]:
+        rule = Rule(1, *client_rules, match_mode=match_mode)
+        rule_index = foreman_rule_index.ForemanRuleIndex([rule])
+        objects = self._Objects(rule.client_rule_set)
+
+        for client_id in self.client_ids:
+          expected = rule.client_rule_set.Evaluate(objects, client_id)
+          matching = rule_index.MatchingRules(client_id, objects, 0, 0)
+          self.assertEqual(
+              bool(expected), bool(matching),
+              "%s on %s" % (rule.client_rule_set, client_id))
+
+  def testRulesWithTheSameRuleSetShareAPredicate(self):
+    rules = [
+        Rule(1, OsRule(os_windows=True)),
+        Rule(2, OsRule(os_linux=True)),
+        Rule(3, OsRule(os_windows=True)),
+    ]
+    rule_index = foreman_rule_index.ForemanRuleIndex(rules)
+    self.assertEqual(len(rule_index.groups), 2)
+    self.assertEqual(rule_index.latest_rule, 3)
+
+    objects = self._Objects(rules[0].client_rule_set)
+    self.assertEqual(
+        rule_index.MatchingRules(self.client_ids[0], objects, 0, 0),
+        [rules[0], rules[2]])
+
+  def testWatermarkAndExpiry(self):
+    rules = [
+        Rule(1, OsRule(os_windows=True)),
+        Rule(5, OsRule(os_windows=True), expires=10),
+        Rule(3, OsRule(os_windows=True, os_linux=True)),
+    ]
+    rule_index = foreman_rule_index.ForemanRuleIndex(rules)
+    objects = self._Objects(rules[0].client_rule_set)
+    client_id = self.client_ids[0]
+
+    self.assertEqual(
+        rule_index.MatchingRules(client_id, objects, 0, 0), rules)
+    # Only the rules created after the watermark are evaluated.
+    self.assertEqual(
+        rule_index.MatchingRules(client_id, objects, 2, 0), rules[1:])
+    self.assertEqual(rule_index.MatchingRules(client_id, objects, 5, 0), [])
+    self.assertEqual(rule_index.PathsToCheck(5), set())
+    # Expired rules are skipped.
+    self.assertEqual(
+        rule_index.MatchingRules(client_id, objects, 0, 20),
+        [rules[0], rules[2]])
+    self.assertTrue(rule_index.HasExpiredRules(20))
+    self.assertFalse(rule_index.HasExpiredRules(5))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
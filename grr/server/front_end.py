@@ -3,6 +3,8 @@
 
 import logging
 import operator
+import Queue
+import threading
 import time
 
 from grr import config
@@ -18,27 +20,115 @@ from grr.lib.rdfvalues import flows as rdf_flows
 from grr.server import access_control
 from grr.server import aff4
 from grr.server import client_index
+from grr.server import client_key_index
 from grr.server import data_store
 from grr.server import events
 from grr.server import file_store
 from grr.server import flow
 from grr.server import queue_manager
 from grr.server import rekall_profile_server
+from grr.server import shared_cache
 from grr.server import threadpool
 from grr.server.aff4_objects import aff4_grr
 
 
+class OutboundCipher(object):
+  """A cipher used for the responses to one client."""
+
+  def __init__(self, cipher, public_key, expiry):
+    self.cipher = cipher
+    # The DER encoding of the client key the cipher was encrypted with. Key
+    # caches might hand out different objects for the same key.
+    self.public_key_der = public_key.AsDER()
+    self.expiry = expiry
+    self.uses = 0
+
+
 class ServerCommunicator(communicator.Communicator):
   """A communicator which stores certificates using AFF4."""
 
-  def __init__(self, certificate, private_key, token=None):
+  def __init__(self, certificate, private_key, token=None, shared_caches=None):
+    """Constructor.
+
+    Args:
+      certificate: Our own certificate.
+      private_key: Our own private key.
+      token: The token used to access the data store.
+      shared_caches: An optional dict with "pub_keys" and "ciphers" FastStore
+        proxies created by a shared_cache.SharedCacheManager. Client keys and
+        verified ciphers are shared with other frontend processes through
+        them.
+    """
     self.client_cache = utils.FastStore(1000)
     self.token = token
     super(ServerCommunicator, self).__init__(
         certificate=certificate, private_key=private_key)
     self.pub_key_cache = utils.FastStore(max_size=50000)
+    if shared_caches:
+      self.pub_key_cache = shared_cache.SharedStore(
+          shared_caches["pub_keys"], max_size=50000)
+      self.encrypted_cipher_cache = shared_cache.SharedStore(
+          shared_caches["ciphers"], max_size=50000)
     # Our common name as an RDFURN.
     self.common_name = rdfvalue.RDFURN(self.certificate.GetCN())
+    self.client_key_index = client_key_index.ClientKeyIndex(token=token)
+
+    # Ciphers for the responses to clients, keyed by client CN.
+    self.outbound_cipher_cache = utils.FastStore(
+        max_size=config.CONFIG["Frontend.outbound_cipher_cache_size"])
+    self.outbound_cipher_ttl = config.CONFIG["Frontend.outbound_cipher_ttl"]
+    self.outbound_cipher_max_uses = config.CONFIG[
+        "Frontend.outbound_cipher_max_uses"]
+    # Request threads share the cached entries.
+    self.outbound_cipher_lock = threading.Lock()
+
+  def _GetCipherForDestination(self, destination):
+    """Returns the cipher for the responses to destination.
+
+    Creating a cipher takes two RSA operations, so we reuse it for all
+    responses to the same client. The client caches ciphers it has already
+    seen, so it skips the RSA decryption as well. A new cipher is created
+    once the old one is older than Frontend.outbound_cipher_ttl, was used
+    Frontend.outbound_cipher_max_uses times or the client key changed.
+
+    Args:
+      destination: The CN of the client.
+
+    Returns:
+      A communicator.Cipher.
+    """
+    remote_public_key = self._GetRemotePublicKey(destination)
+    remote_public_key_der = remote_public_key.AsDER()
+    now = time.time()
+
+    try:
+      entry = self.outbound_cipher_cache.Get(str(destination))
+      with self.outbound_cipher_lock:
+        reuse = (entry.public_key_der == remote_public_key_der and
+                 entry.expiry > now and
+                 (not self.outbound_cipher_max_uses or
+                  entry.uses < self.outbound_cipher_max_uses))
+        if reuse:
+          entry.uses += 1
+
+      if reuse:
+        stats.STATS.IncrementCounter(
+            "grr_outbound_cipher_cache", fields=["hits"])
+        return entry.cipher
+
+      stats.STATS.IncrementCounter(
+          "grr_outbound_cipher_cache", fields=["rotations"])
+    except KeyError:
+      stats.STATS.IncrementCounter(
+          "grr_outbound_cipher_cache", fields=["misses"])
+
+    cipher = communicator.Cipher(self.common_name, self.private_key,
+                                 remote_public_key)
+    entry = OutboundCipher(cipher, remote_public_key,
+                           now + self.outbound_cipher_ttl)
+    entry.uses = 1
+    self.outbound_cipher_cache.Put(str(destination), entry)
+    return cipher
 
   def _GetRemotePublicKey(self, common_name):
     try:
@@ -49,7 +139,25 @@ class ServerCommunicator(communicator.Communicator):
     except KeyError:
       stats.STATS.IncrementCounter("grr_pub_key_cache", fields=["misses"])
 
-    # Fetch the client's cert and extract the key.
+    # The key index only needs a small read. We only open the client object
+    # for clients which are not indexed yet.
+    try:
+      pub_key = self.client_key_index.ReadKey(common_name)
+    except ValueError:
+      raise communicator.UnknownClientCert("Invalid client id")
+
+    if pub_key is None:
+      stats.STATS.IncrementCounter("grr_client_key_index", fields=["misses"])
+      pub_key = self._ReadClientPublicKey(common_name)
+      self.client_key_index.WriteKey(common_name, pub_key)
+    else:
+      stats.STATS.IncrementCounter("grr_client_key_index", fields=["hits"])
+
+    self.pub_key_cache.Put(common_name, pub_key)
+    return pub_key
+
+  def _ReadClientPublicKey(self, common_name):
+    """Returns the public key from the certificate in the client object."""
     client = aff4.FACTORY.Create(
         common_name,
         aff4.AFF4Object.classes["VFSGRRClient"],
@@ -68,9 +176,23 @@ class ServerCommunicator(communicator.Communicator):
     stats.STATS.SetGaugeValue("grr_frontendserver_client_cache_size",
                               len(self.client_cache))
 
-    pub_key = cert.GetPublicKey()
-    self.pub_key_cache.Put(common_name, pub_key)
-    return pub_key
+    return cert.GetPublicKey()
+
+  def PreloadPublicKeys(self, max_age, limit=None):
+    """Loads the keys of recently active clients into the key cache.
+
+    Args:
+      max_age: An rdfvalue.Duration, we load the keys of the clients which
+        were active within this time.
+      limit: The maximum number of keys to load.
+
+    Returns:
+      The number of loaded keys.
+    """
+    keys = self.client_key_index.ReadRecentKeys(max_age, limit=limit)
+    for client_id, pub_key in keys.iteritems():
+      self.pub_key_cache.Put(client_id, pub_key)
+    return len(keys)
 
   def VerifyMessageSignature(self, response_comms, packed_message_list, cipher,
                              cipher_verified, api_version, remote_public_key):
@@ -154,6 +276,196 @@ class ServerCommunicator(communicator.Communicator):
     return rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED
 
 
+class MessageWriter(object):
+  """Stores received client messages in the background.
+
+  Request threads hand over the decoded messages of one client with Put().
+  Writer threads take as many pending batches as are available and store them
+  through a single QueueManager, so responses, notifications and dequeued
+  client requests of many clients share one data store flush. The queue is
+  bounded: when the writers fall behind, Put() blocks the request thread.
+
+  The clients have already been answered when their messages are written, so
+  messages are never dropped. Failed writes are retried with backoff, first
+  for the whole batch and then client by client. Messages of a client which
+  still can't be written are queued again.
+  """
+
+  def __init__(self,
+               frontend,
+               queue_size=1000,
+               batch_size=500,
+               threads=2,
+               max_attempts=3,
+               retry_delay=1):
+    self.frontend = frontend
+    self.batch_size = batch_size
+    self.max_attempts = max_attempts
+    self.retry_delay = retry_delay
+    self.queue = Queue.Queue()
+    # Bounds the number of client messages waiting to be written. A slot is
+    # only released once the messages are written, requeued messages keep
+    # theirs.
+    self.slots = threading.BoundedSemaphore(queue_size)
+
+    for i in range(threads):
+      t = threading.Thread(
+          None, self.WriteLoop, name="FrontendMessageWriter%d" % i)
+      t.daemon = True
+      t.start()
+
+  def Put(self, client_id, messages):
+    """Queues the messages of a client for writing."""
+    if not self.slots.acquire(False):
+      start = time.time()
+      self.slots.acquire()
+      stats.STATS.RecordEvent("frontend_writer_blocked_time",
+                              time.time() - start)
+
+    self.queue.put((client_id, messages))
+    stats.STATS.SetGaugeValue("frontend_writer_queue_depth",
+                              self.queue.qsize())
+
+  def _GetBatches(self):
+    batches = [self.queue.get()]
+    while len(batches) < self.batch_size:
+      try:
+        batches.append(self.queue.get_nowait())
+      except Queue.Empty:
+        break
+
+    stats.STATS.SetGaugeValue("frontend_writer_queue_depth",
+                              self.queue.qsize())
+    return batches
+
+  def _Write(self, batches):
+    """Writes the batches, retrying with backoff. Returns True on success."""
+    for attempt in range(self.max_attempts):
+      if attempt:
+        time.sleep(self.retry_delay * 2**(attempt - 1))
+
+      try:
+        self.frontend.ReceiveMessageBatches(batches)
+        return True
+      except Exception as e:  # pylint: disable=broad-except
+        stats.STATS.IncrementCounter("frontend_writer_errors")
+        logging.exception("Error writing messages of %d clients (%d/%d): %s",
+                          len(batches), attempt + 1, self.max_attempts, e)
+
+    return False
+
+  def WriteLoop(self):
+    while True:
+      batches = self._GetBatches()
+      try:
+        stats.STATS.RecordEvent("frontend_writer_batch_size", len(batches))
+        if self._Write(batches):
+          failed = []
+        else:
+          # Don't let the messages of one client fail the others.
+          failed = [batch for batch in batches if not self._Write([batch])]
+
+        for batch in failed:
+          logging.error("Queueing messages of %s again.", batch[0])
+          self.queue.put(batch)
+
+        for _ in range(len(batches) - len(failed)):
+          self.slots.release()
+      finally:
+        for _ in batches:
+          self.queue.task_done()
+
+  def Flush(self):
+    """Blocks until all queued messages are written."""
+    self.queue.join()
+
+
+class _DrainRequest(object):
+  """A poll waiting in a DrainBatcher."""
+
+  def __init__(self, client, max_count):
+    self.client = client
+    self.max_count = max_count
+    self.done = threading.Event()
+    self.result = []
+    self.error = None
+
+
+class DrainBatcher(object):
+  """Drains the task queues of concurrently polling clients together.
+
+  The first poll to arrive waits up to batch_delay seconds for others to join
+  it (or until batch_size clients are waiting) and then drains the queues of
+  all of them through FrontEndServer.DrainTaskSchedulerQueuesForClients. The
+  other polls wait for its results.
+  """
+
+  def __init__(self, frontend, batch_delay=0.005, batch_size=100):
+    self.frontend = frontend
+    self.batch_delay = batch_delay
+    self.batch_size = batch_size
+    self.pending = []
+    self.cv = threading.Condition()
+
+  def Drain(self, client, max_count):
+    """Returns the tasks for the client, see DrainTaskSchedulerQueueForClient.
+
+    Args:
+      client: The ClientURN object specifying this client.
+      max_count: The maximum number of messages we will issue for the client.
+
+    Returns:
+      The tasks representing the messages returned.
+    """
+    request = _DrainRequest(rdf_client.ClientURN(client), max_count)
+
+    with self.cv:
+      self.pending.append(request)
+      leader = len(self.pending) == 1
+      if len(self.pending) >= self.batch_size:
+        self.cv.notify_all()
+
+      if leader:
+        deadline = time.time() + self.batch_delay
+        while len(self.pending) < self.batch_size:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+          self.cv.wait(remaining)
+
+        batch = self.pending
+        self.pending = []
+
+    if leader:
+      self._DrainBatch(batch)
+    else:
+      request.done.wait()
+
+    if request.error:
+      raise request.error
+    return request.result
+
+  def _DrainBatch(self, batch):
+    """Drains the queues for a batch of requests and wakes their threads."""
+    stats.STATS.RecordEvent("frontend_drain_batch_size", len(batch))
+
+    # A client polling twice at the same time only gets its tasks once.
+    max_counts = {}
+    for request in batch:
+      max_counts.setdefault(request.client, request.max_count)
+
+    try:
+      results = self.frontend.DrainTaskSchedulerQueuesForClients(max_counts)
+      for request in batch:
+        request.result = results.pop(request.client, [])
+    except Exception as e:  # pylint: disable=broad-except
+      for request in batch:
+        request.error = e
+    finally:
+      for request in batch:
+        request.done.set()
+
+
 class FrontEndServer(object):
   """This is the front end server.
 
@@ -175,7 +487,10 @@ class FrontEndServer(object):
                message_expiry_time=120,
                max_retransmission_time=10,
                store=None,
-               threadpool_prefix="grr_threadpool"):
+               threadpool_prefix="grr_threadpool",
+               pipeline_writes=False,
+               batch_drains=False,
+               shared_caches=None):
     # Identify ourselves as the server.
     self.token = access_control.ACLToken(
         username="GRRFrontEnd", reason="Implied.")
@@ -183,7 +498,10 @@ class FrontEndServer(object):
 
     # This object manages our crypto.
     self._communicator = ServerCommunicator(
-        certificate=certificate, private_key=private_key, token=self.token)
+        certificate=certificate,
+        private_key=private_key,
+        token=self.token,
+        shared_caches=shared_caches)
 
     self.data_store = store or data_store.DB
     self.receive_thread_pool = {}
@@ -207,6 +525,23 @@ class FrontEndServer(object):
     self.well_known_flows_blacklist = set(
         config.CONFIG["Frontend.DEBUG_well_known_flows_blacklist"])
 
+    # In pipeline mode received messages are stored by a MessageWriter while
+    # the request thread goes on to drain the client's queue.
+    self.message_writer = None
+    if pipeline_writes:
+      self.message_writer = MessageWriter(
+          self,
+          queue_size=config.CONFIG["Frontend.pipeline_queue_size"],
+          batch_size=config.CONFIG["Frontend.pipeline_batch_size"],
+          threads=config.CONFIG["Frontend.pipeline_writer_threads"])
+
+    self.drain_batcher = None
+    if batch_drains:
+      self.drain_batcher = DrainBatcher(
+          self,
+          batch_delay=config.CONFIG["Frontend.drain_batch_delay"],
+          batch_size=config.CONFIG["Frontend.drain_batch_size"])
+
   @stats.Counted("grr_frontendserver_handle_num")
   @stats.Timed("grr_frontendserver_handle_time")
   def HandleMessageBundles(self, request_comms, response_comms):
@@ -232,8 +567,14 @@ class FrontEndServer(object):
 
     now = time.time()
     if messages:
-      # Receive messages in line.
-      self.ReceiveMessages(source, messages)
+      if self.message_writer:
+        # The drain below must not send requests the client just completed
+        # again, so these are dequeued before the messages are handed off.
+        self.DeQueueCompletedRequests(source, messages)
+        self.message_writer.Put(source, messages)
+      else:
+        # Receive messages in line.
+        self.ReceiveMessages(source, messages)
 
     # We send the client a maximum of self.max_queue_size messages
     required_count = max(0, self.max_queue_size - request_comms.queue_size)
@@ -243,7 +584,10 @@ class FrontEndServer(object):
     # Only give the client messages if we are able to receive them in a
     # reasonable time.
     if time.time() - now < 10:
-      tasks = self.DrainTaskSchedulerQueueForClient(source, required_count)
+      if self.drain_batcher:
+        tasks = self.drain_batcher.Drain(source, required_count)
+      else:
+        tasks = self.DrainTaskSchedulerQueueForClient(source, required_count)
       message_list.job = tasks
 
     # Encode the message_list in the response_comms using the same API version
@@ -326,6 +670,68 @@ class FrontEndServer(object):
 
     return result
 
+  def DrainTaskSchedulerQueuesForClients(self, max_counts):
+    """Drains the Task Scheduler queues of several clients at once.
+
+    This works like DrainTaskSchedulerQueueForClient() but leases the tasks of
+    all clients with a single multi queue claim and checks all retransmitted
+    tasks for a status in one query.
+
+    Args:
+       max_counts: A dict mapping ClientURN objects to the maximum number of
+                   messages we will issue for each client.
+
+    Returns:
+       A dict mapping the clients to the tasks respresenting the messages
+       returned.
+    """
+    result = dict((client, []) for client in max_counts)
+
+    clients_by_queue = {}
+    queue_limits = {}
+    for client, max_count in max_counts.iteritems():
+      if max_count > 0:
+        queue = client.Queue()
+        clients_by_queue[queue] = client
+        queue_limits[queue] = max_count
+
+    if not queue_limits:
+      return result
+
+    start_time = time.time()
+    new_tasks = queue_manager.QueueManager(token=self.token).MultiQueryAndOwn(
+        queue_limits, lease_seconds=self.message_expiry_time)
+
+    initial_ttl = rdf_flows.GrrMessage().task_ttl
+    check_before_sending = []
+    for queue, tasks in new_tasks.iteritems():
+      client = clients_by_queue[queue]
+      for task in tasks:
+        if task.task_ttl < initial_ttl - 1:
+          # This message has been leased before.
+          check_before_sending.append((client, task))
+        else:
+          result[client].append(task)
+
+    if check_before_sending:
+      with queue_manager.QueueManager(token=self.token) as manager:
+        status_found = manager.MultiCheckStatus(
+            [task for _, task in check_before_sending])
+
+        # All messages that don't have a status yet should be sent again.
+        for client, task in check_before_sending:
+          if task not in status_found:
+            result[client].append(task)
+          else:
+            manager.DeQueueClientRequest(client, task.task_id)
+
+    sent = sum(len(tasks) for tasks in result.itervalues())
+    stats.STATS.IncrementCounter("grr_messages_sent", sent)
+    if sent:
+      logging.debug("Drained %d messages for %d clients in %s seconds.", sent,
+                    len(queue_limits), time.time() - start_time)
+
+    return result
 
   def ReceiveMessages(self, client_id, messages):
     """Receives and processes the messages from the source.
@@ -341,59 +747,101 @@ class FrontEndServer(object):
     now = time.time()
     with queue_manager.QueueManager(
         token=self.token, store=self.data_store) as manager:
-      for session_id, msgs in utils.GroupBy(
-          messages, operator.attrgetter("session_id")).iteritems():
+      self._QueueMessages(manager, client_id, messages)
 
-        # Remove and handle messages to WellKnownFlows
-        unprocessed_msgs = self.HandleWellKnownFlows(msgs)
+    logging.debug("Received %s messages from %s in %s sec",
+                  len(messages), client_id, time.time() - now)
 
-        if not unprocessed_msgs:
-          continue
+  def ReceiveMessageBatches(self, batches):
+    """Receives the messages of several clients using a single QueueManager.
 
-        for msg in unprocessed_msgs:
-          manager.QueueResponse(msg)
+    The client requests completed by these messages must have been dequeued
+    already using DeQueueCompletedRequests().
 
-        for msg in unprocessed_msgs:
-          # Messages for well known flows should notify even though they don't
-          # have a status.
-          if msg.request_id == 0:
-            manager.QueueNotification(
-                session_id=msg.session_id, priority=msg.priority)
-            # Those messages are all the same, one notification is enough.
-            break
-          elif msg.type == rdf_flows.GrrMessage.Type.STATUS:
-            # If we receive a status message from the client it means the client
-            # has finished processing this request. We therefore can de-queue it
-            # from the client queue. msg.task_id will raise if the task id is
-            # not set (message originated at the client, there was no request on
-            # the server), so we have to check .HasTaskID() first.
-            if msg.HasTaskID():
-              manager.DeQueueClientRequest(client_id, msg.task_id)
-
-            manager.QueueNotification(
-                session_id=msg.session_id,
-                priority=msg.priority,
-                last_status=msg.request_id)
-
-            stat = rdf_flows.GrrStatus(msg.payload)
-            if stat.status == rdf_flows.GrrStatus.ReturnedStatus.CLIENT_KILLED:
-              # A client crashed while performing an action, fire an event.
-              crash_details = rdf_client.ClientCrash(
-                  client_id=client_id,
-                  session_id=session_id,
-                  backtrace=stat.backtrace,
-                  crash_message=stat.error_message,
-                  nanny_status=stat.nanny_status,
-                  timestamp=rdfvalue.RDFDatetime.Now())
-              msg = rdf_flows.GrrMessage(
-                  source=client_id,
-                  payload=crash_details,
-                  auth_state=(
-                      rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED))
-              events.Events.PublishEvent("ClientCrash", msg, token=self.token)
+    Args:
+      batches: A list of (client_id, messages) tuples.
+    """
+    now = time.time()
+    with queue_manager.QueueManager(
+        token=self.token, store=self.data_store) as manager:
+      for client_id, messages in batches:
+        self._QueueMessages(
+            manager, client_id, messages, dequeue_requests=False)
 
-    logging.debug("Received %s messages from %s in %s sec",
-                  len(messages), client_id, time.time() - now)
+    logging.debug("Received messages from %d clients in %s sec",
+                  len(batches), time.time() - now)
+
+  def DeQueueCompletedRequests(self, client_id, messages):
+    """Removes the requests completed by the messages from the client queue.
+
+    Args:
+      client_id: The client which sent the messages.
+      messages: A list of GrrMessage RDFValues.
+    """
+    task_ids = [
+        msg.task_id
+        for msg in messages
+        if msg.type == rdf_flows.GrrMessage.Type.STATUS and msg.HasTaskID()
+    ]
+    if task_ids:
+      with queue_manager.QueueManager(
+          token=self.token, store=self.data_store) as manager:
+        for task_id in task_ids:
+          manager.DeQueueClientRequest(client_id, task_id)
+
+  def _QueueMessages(self, manager, client_id, messages,
+                     dequeue_requests=True):
+    """Queues responses and notifications for messages on the manager."""
+    for session_id, msgs in utils.GroupBy(
+        messages, operator.attrgetter("session_id")).iteritems():
+
+      # Remove and handle messages to WellKnownFlows
+      unprocessed_msgs = self.HandleWellKnownFlows(msgs)
+
+      if not unprocessed_msgs:
+        continue
+
+      for msg in unprocessed_msgs:
+        manager.QueueResponse(msg)
+
+      for msg in unprocessed_msgs:
+        # Messages for well known flows should notify even though they don't
+        # have a status.
+        if msg.request_id == 0:
+          manager.QueueNotification(
+              session_id=msg.session_id, priority=msg.priority)
+          # Those messages are all the same, one notification is enough.
+          break
+        elif msg.type == rdf_flows.GrrMessage.Type.STATUS:
+          # If we receive a status message from the client it means the client
+          # has finished processing this request. We therefore can de-queue it
+          # from the client queue. msg.task_id will raise if the task id is
+          # not set (message originated at the client, there was no request on
+          # the server), so we have to check .HasTaskID() first.
+          if dequeue_requests and msg.HasTaskID():
+            manager.DeQueueClientRequest(client_id, msg.task_id)
+
+          manager.QueueNotification(
+              session_id=msg.session_id,
+              priority=msg.priority,
+              last_status=msg.request_id)
+
+          stat = rdf_flows.GrrStatus(msg.payload)
+          if stat.status == rdf_flows.GrrStatus.ReturnedStatus.CLIENT_KILLED:
+            # A client crashed while performing an action, fire an event.
+            crash_details = rdf_client.ClientCrash(
+                client_id=client_id,
+                session_id=session_id,
+                backtrace=stat.backtrace,
+                crash_message=stat.error_message,
+                nanny_status=stat.nanny_status,
+                timestamp=rdfvalue.RDFDatetime.Now())
+            msg = rdf_flows.GrrMessage(
+                source=client_id,
+                payload=crash_details,
+                auth_state=(
+                    rdf_flows.GrrMessage.AuthorizationState.AUTHENTICATED))
+            events.Events.PublishEvent("ClientCrash", msg, token=self.token)
 
   def HandleWellKnownFlows(self, messages):
     """Hands off messages to well known flows."""
@@ -437,6 +885,24 @@ class FrontEndServer(object):
 
     return result
 
+  def PreloadClientKeys(self):
+    """Loads the keys of recently active clients after a restart.
+
+    Without this, every client's first poll after a restart needs a data
+    store read to get its key. The clients active within
+    Frontend.client_key_preload_age are loaded, at most
+    Frontend.client_key_preload_count of them.
+    """
+    limit = config.CONFIG["Frontend.client_key_preload_count"]
+    if not limit:
+      return
+
+    start = time.time()
+    count = self._communicator.PreloadPublicKeys(
+        config.CONFIG["Frontend.client_key_preload_age"], limit=limit)
+    logging.info("Preloaded %d client keys in %.1f seconds.", count,
+                 time.time() - start)
+
   def _GetClientPublicKey(self, client_id):
     client_obj = aff4.FACTORY.Open(client_id, token=aff4.FACTORY.root_token)
     return client_obj.Get(client_obj.Schema.CERT).GetPublicKey()
@@ -533,5 +999,15 @@ class FrontendInit(registry.InitHook):
     stats.STATS.RegisterGaugeMetric("grr_frontendserver_client_cache_size", int)
     stats.STATS.RegisterCounterMetric("grr_messages_sent")
 
+    stats.STATS.RegisterGaugeMetric("frontend_writer_queue_depth", int)
+    stats.STATS.RegisterEventMetric("frontend_writer_blocked_time")
+    stats.STATS.RegisterEventMetric("frontend_writer_batch_size")
+    stats.STATS.RegisterCounterMetric("frontend_writer_errors")
+    stats.STATS.RegisterEventMetric("frontend_drain_batch_size")
+
     stats.STATS.RegisterCounterMetric(
         "grr_pub_key_cache", fields=[("type", str)])
+    stats.STATS.RegisterCounterMetric(
+        "grr_outbound_cipher_cache", fields=[("type", str)])
+    stats.STATS.RegisterCounterMetric(
+        "grr_client_key_index", fields=[("type", str)])
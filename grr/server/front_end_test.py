@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 """Unittest for grr frontend server."""
 
+import threading
+
 from grr import config
 from grr.lib import communicator
 from grr.lib import flags
@@ -13,6 +15,7 @@ from grr.server import data_store
 from grr.server import flow
 from grr.server import front_end
 from grr.server import queue_manager
+from grr.server.data_stores import fake_data_store
 from grr.test_lib import client_test_lib
 from grr.test_lib import flow_test_lib
 from grr.test_lib import test_lib
@@ -489,6 +492,245 @@ class GRRFEServerTest(GRRFEServerTestBase):
         map(bool, msgs_recvd),
         [True] * 2 + [False] * (rdf_flows.GrrMessage().task_ttl - 2))
 
+  def _StartSendingFlows(self, client_ids):
+    for client_id in client_ids:
+      flow.GRRFlow.StartFlow(
+          client_id=client_id,
+          flow_name=flow_test_lib.SendingFlow.__name__,
+          message_count=2,
+          token=self.token)
+
+  def testDrainTaskSchedulerQueuesForClients(self):
+    client_ids = self.SetupClients(3)
+    self._StartSendingFlows(client_ids[:2])
+
+    max_counts = dict((client_id, 100) for client_id in client_ids)
+    tasks = self.server.DrainTaskSchedulerQueuesForClients(max_counts)
+    self.assertEqual(len(tasks[client_ids[0]]), 2)
+    self.assertEqual(len(tasks[client_ids[1]]), 2)
+    self.assertEqual(tasks[client_ids[2]], [])
+    for client_id in client_ids[:2]:
+      for task in tasks[client_id]:
+        self.assertEqual(task.queue, client_id.Queue())
+
+    # The tasks are leased now.
+    tasks = self.server.DrainTaskSchedulerQueuesForClients(max_counts)
+    self.assertEqual(sum(len(t) for t in tasks.itervalues()), 0)
+
+  def testDrainTaskSchedulerQueuesForClientsLimit(self):
+    client_ids = self.SetupClients(2)
+    self._StartSendingFlows(client_ids)
+
+    tasks = self.server.DrainTaskSchedulerQueuesForClients({
+        client_ids[0]: 1,
+        client_ids[1]: 0
+    })
+    self.assertEqual(len(tasks[client_ids[0]]), 1)
+    self.assertEqual(tasks[client_ids[1]], [])
+
+  def testDrainStoresLeasesBeforeReleasingQueueLocks(self):
+    client_id = self.SetupClients(1)[0]
+    self._StartSendingFlows([client_id])
+
+    leasable = []
+    release = fake_data_store.FakeDBSubjectLock.Release
+
+    def Release(lock):
+      if lock.locked and lock.subject == utils.SmartStr(client_id.Queue()):
+        # These tasks could be leased again as soon as the lock is gone.
+        leasable.append(
+            len(
+                data_store.DB.ResolvePrefix(
+                    lock.subject,
+                    data_store.DataStore.QUEUE_TASK_PREDICATE_PREFIX,
+                    timestamp=(0, rdfvalue.RDFDatetime.Now()),
+                    token=self.token)))
+      release(lock)
+
+    with utils.Stubber(fake_data_store.FakeDBSubjectLock, "Release", Release):
+      tasks = self.server.DrainTaskSchedulerQueuesForClients({client_id: 100})
+
+    self.assertEqual(len(tasks[client_id]), 2)
+    self.assertEqual(leasable, [0])
+
+  def testDrainBatcher(self):
+    client_ids = self.SetupClients(2)
+    self._StartSendingFlows(client_ids)
+
+    batcher = front_end.DrainBatcher(self.server, batch_delay=10, batch_size=2)
+    results = {}
+
+    def Drain(client_id):
+      results[client_id] = batcher.Drain(client_id, 100)
+
+    with test_lib.Instrument(self.server,
+                             "DrainTaskSchedulerQueuesForClients") as drain:
+      threads = [
+          threading.Thread(target=Drain, args=(client_id,))
+          for client_id in client_ids
+      ]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+
+    # The second poll completed the batch, so both were drained together.
+    self.assertEqual(drain.call_count, 1)
+    for client_id in client_ids:
+      self.assertEqual(len(results[client_id]), 2)
+
+
+class GRRFEServerPipelineTest(GRRFEServerTestBase):
+  """Tests the GRRFEServer with pipelined writes."""
+
+  def InitTestServer(self):
+    prefix = "pool-%s" % self._testMethodName
+    self.server = front_end.FrontEndServer(
+        certificate=config.CONFIG["Frontend.certificate"],
+        private_key=config.CONFIG["PrivateKeys.server_key"],
+        message_expiry_time=self.message_expiry_time,
+        threadpool_prefix=prefix,
+        pipeline_writes=True)
+
+  def _Responses(self, session_id, count):
+    return [
+        rdf_flows.GrrMessage(
+            request_id=1,
+            response_id=i,
+            session_id=session_id,
+            payload=rdfvalue.RDFInteger(i)) for i in range(1, count + 1)
+    ]
+
+  def testReceiveMessageBatches(self):
+    client_ids = self.SetupClients(2)
+    batches = []
+    for client_id in client_ids:
+      flow_obj = self.FlowSetup(
+          flow_test_lib.FlowOrderTest.__name__, client_id_urn=client_id)
+      batches.append((client_id, self._Responses(flow_obj.session_id, 5)))
+
+    self.server.ReceiveMessageBatches(batches)
+
+    for _, messages in batches:
+      stored_messages = data_store.DB.ReadResponsesForRequestId(
+          messages[0].session_id, 1, token=self.token)
+      self.assertEqual(len(stored_messages), len(messages))
+
+  def _MockCommunicator(self, messages):
+    client_id = self.client_id
+
+    class MockCommunicator(object):
+      """A fake that passes messages through unencrypted."""
+
+      def DecodeMessages(self, *unused_args):
+        return (messages, client_id, 100)
+
+      def EncodeMessages(self, message_list, *unused_args, **unused_kw):
+        self.message_list = message_list
+
+    mock_communicator = MockCommunicator()
+    self.server._communicator = mock_communicator
+    return mock_communicator
+
+  def testHandleMessageBundlesWritesInBackground(self):
+    flow_obj = self.FlowSetup(flow_test_lib.FlowOrderTest.__name__)
+    messages = self._Responses(flow_obj.session_id, 9)
+    mock_communicator = self._MockCommunicator(messages)
+
+    request_comms = rdf_flows.ClientCommunication()
+    self.server.HandleMessageBundles(request_comms, None)
+    self.server.message_writer.Flush()
+
+    # The flow's request was drained concurrently.
+    self.assertEqual(len(mock_communicator.message_list.job), 1)
+
+    stored_messages = data_store.DB.ReadResponsesForRequestId(
+        flow_obj.session_id, 1, token=self.token)
+    self.assertEqual(len(stored_messages), len(messages))
+
+  def testHandleMessageBundlesDoesNotResendCompletedRequests(self):
+    flow_obj = self.FlowSetup(flow_test_lib.FlowOrderTest.__name__)
+
+    # The lease of the request expired while the client was working on it.
+    tasks = queue_manager.QueueManager(token=self.token).QueryAndOwn(
+        queue=self.client_id.Queue(), limit=100, lease_seconds=0)
+    self.assertEqual(len(tasks), 1)
+
+    status = rdf_flows.GrrMessage(
+        request_id=1,
+        response_id=1,
+        task_id=tasks[0].task_id,
+        session_id=flow_obj.session_id,
+        payload=rdf_flows.GrrStatus(
+            status=rdf_flows.GrrStatus.ReturnedStatus.OK),
+        type=rdf_flows.GrrMessage.Type.STATUS)
+    mock_communicator = self._MockCommunicator([status])
+
+    # Hold back the writers until the client's queue has been drained.
+    drained = threading.Event()
+    receive_message_batches = self.server.ReceiveMessageBatches
+
+    def ReceiveMessageBatches(batches):
+      drained.wait()
+      receive_message_batches(batches)
+
+    with utils.Stubber(self.server, "ReceiveMessageBatches",
+                       ReceiveMessageBatches):
+      try:
+        self.server.HandleMessageBundles(rdf_flows.ClientCommunication(), None)
+      finally:
+        drained.set()
+        self.server.message_writer.Flush()
+
+    self.assertEqual(len(mock_communicator.message_list.job), 0)
+    self.assertEqual(
+        queue_manager.QueueManager(token=self.token).Query(
+            self.client_id, 100), [])
+
+    stored_messages = data_store.DB.ReadResponsesForRequestId(
+        flow_obj.session_id, 1, token=self.token)
+    self.assertEqual(len(stored_messages), 1)
+
+
+class FailingFrontend(object):
+  """A frontend whose writes fail for some clients a number of times."""
+
+  def __init__(self, failures):
+    # Maps client ids to the number of writes of their messages which fail.
+    self.failures = failures
+    self.written = []
+
+  def ReceiveMessageBatches(self, batches):
+    for client_id, _ in batches:
+      if self.failures.get(client_id):
+        self.failures[client_id] -= 1
+        raise IOError("Write failed.")
+
+    self.written.extend(batches)
+
+
+class MessageWriterTest(test_lib.GRRBaseTest):
+  """Tests for the MessageWriter."""
+
+  def _Write(self, frontend, batches):
+    writer = front_end.MessageWriter(frontend, threads=1, retry_delay=0)
+    for client_id, messages in batches:
+      writer.Put(client_id, messages)
+    writer.Flush()
+
+  def testFailedWritesAreRetried(self):
+    frontend = FailingFrontend({"C.1": 2})
+    self._Write(frontend, [("C.1", ["a"])])
+    self.assertEqual(frontend.written, [("C.1", ["a"])])
+
+  def testMessagesAreNeverDropped(self):
+    # The messages of C.2 fail more often than they are retried, so they are
+    # queued again.
+    frontend = FailingFrontend({"C.2": 7})
+    self._Write(frontend, [("C.1", ["a"]), ("C.2", ["b"])])
+    self.assertEqual(
+        sorted(frontend.written), [("C.1", ["a"]), ("C.2", ["b"])])
+
 
 def main(args):
   test_lib.main(args)
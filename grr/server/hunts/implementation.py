@@ -1423,7 +1423,7 @@ class GRRHunt(flow.FlowBase):
 
     def CollectionLen(collection_urn):
       if collection_urn in collections_dict:
-        return collections_dict[collection_urn].CalculateLength()
+        return len(collections_dict[collection_urn])
       else:
         return 0
 
@@ -2,8 +2,12 @@
 """Cron job to process hunt results.
 """
 
+import collections
 import logging
+import Queue
+import threading
 
+from grr import config
 from grr.lib import rdfvalue
 from grr.lib import stats
 from grr.lib import utils
@@ -20,6 +24,28 @@ from grr.server.hunts import implementation
 from grr.server.hunts import results as hunts_results
 
 
+# The per hunt processing metrics are only kept for this many recently
+# processed hunts, so the number of their fields values stays bounded in a
+# long running worker.
+MAX_HUNTS_IN_METRICS = 100
+
+_HUNT_METRICS = ["hunt_results_processed", "hunt_results_processing_lag"]
+
+_hunts_in_metrics = collections.OrderedDict()
+_hunts_in_metrics_lock = threading.Lock()
+
+
+def _TrackHuntInMetrics(hunt_id):
+  """Marks a hunt as recently processed and drops the oldest hunts' metrics."""
+  with _hunts_in_metrics_lock:
+    _hunts_in_metrics.pop(hunt_id, None)
+    _hunts_in_metrics[hunt_id] = True
+    while len(_hunts_in_metrics) > MAX_HUNTS_IN_METRICS:
+      old_hunt_id, _ = _hunts_in_metrics.popitem(last=False)
+      for metric in _HUNT_METRICS:
+        stats.STATS.DeleteMetricFields(metric, [old_hunt_id])
+
+
 class ProcessHuntResultCollectionsCronFlowArgs(rdf_structs.RDFProtoStruct):
   protobuf = flows_pb2.ProcessHuntResultCollectionsCronFlowArgs
   rdf_deps = [
@@ -64,6 +90,10 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
 
   DEFAULT_BATCH_SIZE = 5000
 
+  # How often the flow is heartbeated and the queue polled for new results
+  # while hunts are processed concurrently.
+  POLL_INTERVAL = 10
+
   def CheckIfRunningTooLong(self):
     if self.args.max_running_time:
       elapsed = (rdfvalue.RDFDatetime.Now().AsSecondsFromEpoch() -
@@ -127,18 +157,89 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
               hunt_urn, token=self.token).Add(
                   plugin_status, mutation_pool=pool)
 
-  def ProcessOneHunt(self, exceptions_by_hunt):
-    """Reads results for one hunt and process them."""
-    hunt_results_urn, results = (
-        hunts_results.HuntResultQueue.ClaimNotificationsForCollection(
-            start_time=self.args.start_processing_time,
-            token=self.token,
-            lease_time=self.lifetime))
-    logging.debug("Found %d results for hunt %s", len(results),
-                  hunt_results_urn)
-    if not results:
-      return 0
-
+  def _ResolvedBatches(self, collection_obj, notifications, batch_size,
+                       prefetch):
+    """Yields (notifications, results) batches for a hunt.
+
+    Args:
+      collection_obj: The HuntResultCollection of the hunt.
+      notifications: The claimed notification records.
+      batch_size: The number of results in each batch.
+      prefetch: If set, the results of the next batch are read in a separate
+        thread while the caller works on the current one.
+
+    Yields:
+      Pairs of a list of notification records and the results they point to.
+    """
+    batches = utils.Grouper(notifications, batch_size)
+    if not prefetch:
+      for batch in batches:
+        yield batch, list(
+            collection_obj.MultiResolve(
+                [r.value.ResultRecord() for r in batch]))
+      return
+
+    # Holds a single batch, so the reader is at most one batch ahead.
+    resolved = Queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def Put(item):
+      while not stop.is_set():
+        try:
+          resolved.put(item, timeout=1)
+          return True
+        except Queue.Full:
+          pass
+      return False
+
+    def ReadBatches():
+      try:
+        for batch in batches:
+          results = list(
+              collection_obj.MultiResolve(
+                  [r.value.ResultRecord() for r in batch]))
+          if not Put((batch, results, None)):
+            return
+      except Exception as e:  # pylint: disable=broad-except
+        Put((None, None, e))
+        return
+      Put(None)
+
+    reader = threading.Thread(
+        target=ReadBatches, name="HuntResultsReader %s" % collection_obj.urn)
+    reader.daemon = True
+    reader.start()
+    try:
+      while True:
+        item = resolved.get()
+        if item is None:
+          break
+        batch, results, error = item
+        if error is not None:
+          raise error
+        yield batch, results
+    finally:
+      stop.set()
+      reader.join()
+
+  def ProcessHunt(self,
+                  hunt_results_urn,
+                  notifications,
+                  exceptions_by_hunt,
+                  concurrent=False):
+    """Runs the output plugins of a hunt on claimed results.
+
+    Args:
+      hunt_results_urn: The urn of the hunt's result collection.
+      notifications: The claimed notification records for the collection.
+      exceptions_by_hunt: A dict the plugin exceptions are collected in.
+      concurrent: Set when called from a processing thread. The flow is not
+        heartbeated (the dispatching thread does that) and the next batch of
+        results is read while the plugins process the current one.
+
+    Returns:
+      The number of results processed.
+    """
     hunt_urn = rdfvalue.RDFURN(hunt_results_urn.Dirname())
     batch_size = self.args.batch_size or self.DEFAULT_BATCH_SIZE
     metadata_urn = hunt_urn.Add("ResultsMetadata")
@@ -152,17 +253,17 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
         all_plugins, used_plugins = self.LoadPlugins(metadata_obj)
         num_processed = int(
             metadata_obj.Get(metadata_obj.Schema.NUM_PROCESSED_RESULTS))
-        for batch in utils.Grouper(results, batch_size):
-          results = list(
-              collection_obj.MultiResolve(
-                  [r.value.ResultRecord() for r in batch]))
+        for batch, results in self._ResolvedBatches(
+            collection_obj, notifications, batch_size, concurrent):
           self.RunPlugins(hunt_urn, used_plugins, results, exceptions_by_plugin)
 
           hunts_results.HuntResultQueue.DeleteNotifications(
               batch, token=self.token)
           num_processed += len(batch)
           num_processed_for_hunt += len(batch)
-          self.HeartBeat()
+          self._RecordBatchStats(hunt_urn, batch)
+          if not concurrent:
+            self.HeartBeat()
           metadata_obj.Set(
               metadata_obj.Schema.NUM_PROCESSED_RESULTS(num_processed))
           metadata_obj.UpdateLease(600)
@@ -184,7 +285,97 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
             plugin, []).extend(exceptions)
 
     logging.debug("Processed %d results.", num_processed_for_hunt)
-    return len(results)
+    return num_processed_for_hunt
+
+  def _RecordBatchStats(self, hunt_urn, batch):
+    hunt_id = hunt_urn.Basename()
+    _TrackHuntInMetrics(hunt_id)
+    stats.STATS.IncrementCounter(
+        "hunt_results_processed", delta=len(batch), fields=[hunt_id])
+
+    # The lag is measured from the oldest result in the batch.
+    oldest = min(r.value.timestamp for r in batch)
+    lag = (rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch() -
+           oldest.AsMicroSecondsFromEpoch()) / 1e6
+    stats.STATS.RecordEvent(
+        "hunt_results_processing_lag", lag, fields=[hunt_id])
+
+  def ProcessOneHunt(self, exceptions_by_hunt):
+    """Reads results for one hunt and process them."""
+    hunt_results_urn, results = (
+        hunts_results.HuntResultQueue.ClaimNotificationsForCollection(
+            start_time=self.args.start_processing_time,
+            token=self.token,
+            lease_time=self.lifetime))
+    logging.debug("Found %d results for hunt %s", len(results),
+                  hunt_results_urn)
+    if not results:
+      return 0
+
+    return self.ProcessHunt(hunt_results_urn, results, exceptions_by_hunt)
+
+  def _ProcessHuntInThread(self, hunt_results_urn, notifications,
+                           exceptions_by_hunt, finished):
+    error = None
+    try:
+      self.ProcessHunt(
+          hunt_results_urn, notifications, exceptions_by_hunt, concurrent=True)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error processing results of %s", hunt_results_urn)
+      error = e
+    finally:
+      finished.put((hunt_results_urn, error))
+
+  def ProcessHuntsConcurrently(self, exceptions_by_hunt, max_hunts):
+    """Processes the results of up to max_hunts hunts at the same time.
+
+    Every hunt is processed in its own thread, so a hunt with slow output
+    plugins does not hold up the others. Whenever a hunt is done, the
+    notifications of the next hunt waiting in the HuntResultQueue are claimed.
+
+    Args:
+      exceptions_by_hunt: A dict the plugin exceptions are collected in.
+      max_hunts: The maximum number of hunts processed at the same time.
+    """
+    running = {}
+    finished = Queue.Queue()
+    while True:
+      if len(running) < max_hunts and not self.CheckIfRunningTooLong():
+        claimed = (
+            hunts_results.HuntResultQueue.ClaimNotificationsForCollections(
+                start_time=self.args.start_processing_time,
+                token=self.token,
+                lease_time=self.lifetime,
+                max_collections=max_hunts - len(running),
+                skip_collections=running.keys()))
+        for hunt_results_urn, notifications in claimed:
+          logging.debug("Found %d results for hunt %s", len(notifications),
+                        hunt_results_urn)
+          thread = threading.Thread(
+              target=self._ProcessHuntInThread,
+              args=(hunt_results_urn, notifications, exceptions_by_hunt,
+                    finished),
+              name="HuntResultsProcessor %s" % hunt_results_urn)
+          thread.daemon = True
+          thread.start()
+          running[hunt_results_urn] = thread
+
+      if not running:
+        break
+
+      self.HeartBeat()
+      try:
+        hunt_results_urn, error = finished.get(timeout=self.POLL_INTERVAL)
+      except Queue.Empty:
+        continue
+
+      running.pop(hunt_results_urn).join()
+      if error is not None:
+        # The other hunts are still processed, the cron run fails at the end
+        # like it does for plugin errors.
+        hunt_urn = rdfvalue.RDFURN(hunt_results_urn.Dirname())
+        exceptions_by_hunt.setdefault(hunt_urn, {}).setdefault(
+            self.__class__.__name__, []).append(error)
 
   @flow.StateHandler()
   def Start(self):
@@ -195,10 +386,14 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
       self.args.max_running_time = rdfvalue.Duration("%ds" % int(
           ProcessHuntResultCollectionsCronFlow.lifetime.seconds * 0.6))
 
-    while not self.CheckIfRunningTooLong():
-      count = self.ProcessOneHunt(exceptions_by_hunt)
-      if not count:
-        break
+    max_hunts = config.CONFIG["Hunt.results_processing_threads"]
+    if max_hunts:
+      self.ProcessHuntsConcurrently(exceptions_by_hunt, max_hunts)
+    else:
+      while not self.CheckIfRunningTooLong():
+        count = self.ProcessOneHunt(exceptions_by_hunt)
+        if not count:
+          break
 
     if exceptions_by_hunt:
       e = ResultsProcessingError()
@@ -92,6 +92,78 @@ class HuntResultQueue(aff4_queue.Queue):
         results.append(record)
     return (f.collection, results)
 
+  @classmethod
+  def ClaimNotificationsForCollections(cls,
+                                       token=None,
+                                       start_time=None,
+                                       lease_time=200,
+                                       max_collections=10,
+                                       skip_collections=None):
+    """Return unclaimed hunt result notifications for several collections.
+
+    Like ClaimNotificationsForCollection, but claims the notifications of up
+    to max_collections collections while holding the queue lock once.
+
+    Args:
+      token: The security token to perform database operations with.
+
+      start_time: If set, an RDFDateTime indicating at what point to start
+        claiming notifications. Only notifications with a timestamp after this
+        point will be claimed.
+
+      lease_time: How long to claim the notifications for.
+
+      max_collections: The maximum number of collections to claim
+        notifications for. The earliest (unclaimed) notifications determine
+        the collections.
+
+      skip_collections: Urns of collections whose notifications are left
+        unclaimed, e.g. because they are still being processed.
+
+    Returns:
+      A list of (collection, results) pairs, ordered by the earliest
+      notification for each collection. results is a list of Record objects
+      which identify GrrMessage within the result collection.
+    """
+
+    class CollectionsFilter(object):
+
+      def __init__(self, skip_collections):
+        self.skip_collections = set(skip_collections or [])
+        self.collections = []
+        self.results = {}
+
+      def FilterRecord(self, notification):
+        collection = notification.result_collection_urn
+        if collection in self.results:
+          return False
+        if (collection in self.skip_collections or
+            len(self.collections) >= max_collections):
+          return True
+
+        self.collections.append(collection)
+        self.results[collection] = []
+        return False
+
+    f = CollectionsFilter(skip_collections)
+    with aff4.FACTORY.OpenWithLock(
+        RESULT_NOTIFICATION_QUEUE,
+        aff4_type=HuntResultQueue,
+        lease_time=300,
+        blocking=True,
+        blocking_sleep_interval=15,
+        blocking_lock_timeout=600,
+        token=token) as queue:
+      for record in queue.ClaimRecords(
+          record_filter=f.FilterRecord,
+          start_time=start_time,
+          timeout=lease_time,
+          limit=100000):
+        f.results[record.value.result_collection_urn].append(record)
+    return [(collection, f.results[collection])
+            for collection in f.collections
+            if f.results[collection]]
+
   @classmethod
   def DeleteNotifications(cls, records, token=None):
     """Delete hunt notifications."""
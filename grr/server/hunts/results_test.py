@@ -143,6 +143,41 @@ class ResultTest(aff4_test_lib.AFF4ObjectTest):
 
     self.assertEqual(sorted(values_read), range(100, 200))
 
+  def testClaimNotificationsForSeveralCollections(self):
+    collection_urns = [
+        rdfvalue.RDFURN(
+            "aff4:/testClaimNotificationsForSeveralCollections/collection_%d" %
+            i) for i in range(3)
+    ]
+
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for i in range(10):
+        for collection_urn in collection_urns:
+          hunts_results.HuntResultCollection.StaticAdd(
+              collection_urn,
+              rdf_flows.GrrMessage(request_id=i),
+              mutation_pool=pool)
+
+    # The first collection is skipped, the next two are claimed.
+    results = hunts_results.HuntResultQueue.ClaimNotificationsForCollections(
+        token=self.token,
+        max_collections=2,
+        skip_collections=collection_urns[:1])
+    self.assertEqual([collection for collection, _ in results],
+                     collection_urns[1:])
+    for _, records in results:
+      self.assertEqual(10, len(records))
+
+    results = hunts_results.HuntResultQueue.ClaimNotificationsForCollections(
+        token=self.token, max_collections=2)
+    self.assertEqual(len(results), 1)
+    self.assertEqual(results[0][0], collection_urns[0])
+    self.assertEqual(10, len(results[0][1]))
+
+    self.assertEqual(
+        hunts_results.HuntResultQueue.ClaimNotificationsForCollections(
+            token=self.token), [])
+
 
 def main(argv):
   test_lib.main(argv)
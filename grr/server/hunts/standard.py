@@ -528,5 +528,9 @@ class StandardHuntInitHook(registry.InitHook):
         "hunt_output_plugin_errors", fields=[("plugin", str)])
     stats.STATS.RegisterCounterMetric(
         "hunt_results_ran_through_plugin", fields=[("plugin", str)])
+    stats.STATS.RegisterCounterMetric(
+        "hunt_results_processed", fields=[("hunt", str)])
+    stats.STATS.RegisterEventMetric(
+        "hunt_results_processing_lag", fields=[("hunt", str)])
     stats.STATS.RegisterCounterMetric("hunt_results_compacted")
     stats.STATS.RegisterCounterMetric("hunt_results_compaction_locking_errors")
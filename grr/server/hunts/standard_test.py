@@ -753,6 +753,67 @@ class StandardHuntTest(flow_test_lib.FlowTestsBaseclass, StandardHuntTestMixin):
     self.assertEqual(success_count - prev_success_count, 0)
     self.assertEqual(errors_count - prev_errors_count, 1)
 
+  def testResultsOfSeveralHuntsAreProcessedConcurrently(self):
+    hunt_urns = [
+        self.StartHunt(output_plugins=[
+            output_plugin.OutputPluginDescriptor(
+                plugin_name="DummyHuntOutputPlugin")
+        ]) for _ in range(2)
+    ]
+    prev_counts = [
+        stats.STATS.GetMetricValue(
+            "hunt_results_processed", fields=[hunt_urn.Basename()])
+        for hunt_urn in hunt_urns
+    ]
+
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+    with test_lib.ConfigOverrider({"Hunt.results_processing_threads": 2}):
+      self.ProcessHuntOutputPlugins(batch_size=3)
+
+    # 10 results for each hunt, processed in batches of 3.
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 20)
+    self.assertEqual(DummyHuntOutputPlugin.num_calls, 8)
+    for hunt_urn, prev_count in zip(hunt_urns, prev_counts):
+      count = stats.STATS.GetMetricValue(
+          "hunt_results_processed", fields=[hunt_urn.Basename()])
+      self.assertEqual(count - prev_count, 10)
+
+    # All notifications were consumed.
+    self.ProcessHuntOutputPlugins()
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 20)
+
+  def testConcurrentProcessingErrorsFailTheCronRun(self):
+    hunt_urn = self.StartHunt(output_plugins=[
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    with test_lib.ConfigOverrider({"Hunt.results_processing_threads": 2}):
+      with mock.patch.object(
+          process_results.ProcessHuntResultCollectionsCronFlow,
+          "ProcessHunt",
+          side_effect=RuntimeError("processing failed")):
+        try:
+          self.ProcessHuntOutputPlugins()
+          self.fail("ResultsProcessingError was not raised.")
+        except process_results.ResultsProcessingError as e:
+          self.assertEqual(e.exceptions_by_hunt.keys(), [hunt_urn])
+
+  def testMetricsAreOnlyKeptForRecentHunts(self):
+    with utils.Stubber(process_results, "MAX_HUNTS_IN_METRICS", 1):
+      hunt_urns = [self.StartHunt() for _ in range(2)]
+      self.AssignTasksToClients()
+      self.RunHunt(failrate=-1)
+      self.ProcessHuntOutputPlugins()
+
+    # Only the hunt processed last is still in the metrics.
+    fields = set(stats.STATS.GetMetricFields("hunt_results_processed"))
+    kept = [u for u in hunt_urns if (u.Basename(),) in fields]
+    self.assertEqual(len(kept), 1)
+
   def testOutputPluginsMaintainState(self):
     self.StartHunt(output_plugins=[
         output_plugin.OutputPluginDescriptor(
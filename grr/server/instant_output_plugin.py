@@ -6,6 +6,7 @@
 import itertools
 import re
 
+from grr import config
 from grr.lib import rdfvalue
 from grr.lib import registry
 from grr.lib import utils
@@ -178,7 +179,17 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
 
       yield converted_response
 
-  def _GenerateConvertedValues(self, converter, grr_messages):
+  def _GenerateMetadataValuePairs(self, grr_messages):
+    for grr_message in grr_messages:
+      if not grr_message.source:
+        raise ValueError("GrrMessage's source can't be empty")
+
+      metadata = self.GetDefaultMetadata()
+      metadata.client_urn = grr_message.source
+      yield metadata, grr_message.payload
+
+  def _GenerateConvertedValues(self, converter, grr_messages,
+                               process_pool=None):
     """Generates converted values using given converter from given messages.
 
     Groups values in batches of BATCH_SIZE size and applies the converter
@@ -187,6 +198,8 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
     Args:
       converter: ExportConverter instance.
       grr_messages: An iterable (a generator is assumed) with GRRMessage values.
+      process_pool: If set, an export.ExportProcessPool the values are
+          converted in. The pool does its own batching.
 
     Yields:
       Values generated by the converter.
@@ -194,18 +207,15 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
     Raises:
       ValueError: if any of the GrrMessage objects doesn't have "source" set.
     """
-    for batch in utils.Grouper(grr_messages, self.BATCH_SIZE):
-      batch_with_metadata = []
-      for grr_message in batch:
-        if not grr_message.source:
-          raise ValueError("GrrMessage's source can't be empty")
-
-        metadata = self.GetDefaultMetadata()
-        metadata.client_urn = grr_message.source
-        batch_with_metadata.append((metadata, grr_message.payload))
-
-      for result in converter.BatchConvert(
-          batch_with_metadata, token=self.token):
+    metadata_value_pairs = self._GenerateMetadataValuePairs(grr_messages)
+    if process_pool is not None:
+      for result in process_pool.BatchConvert(
+          converter, metadata_value_pairs, token=self.token):
+        yield result
+      return
+
+    for batch in utils.Grouper(metadata_value_pairs, self.BATCH_SIZE):
+      for result in converter.BatchConvert(batch, token=self.token):
         yield result
 
   def ProcessValues(self, value_type, values_generator_fn):
@@ -214,21 +224,32 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
       return
     converters = [cls(self.GetExportOptions()) for cls in converter_classes]
 
+    process_pool = None
+    processes = config.CONFIG["Export.conversion_processes"]
+    if processes:
+      process_pool = export.ExportProcessPool(processes)
+
     next_types = set()
     processed_types = set()
-    while True:
-      converted_responses = itertools.chain.from_iterable(
-          self._GenerateConvertedValues(converter, values_generator_fn())
-          for converter in converters)
-
-      generator = self._GenerateSingleTypeIteration(next_types, processed_types,
-                                                    converted_responses)
-
-      for chunk in self.ProcessSingleTypeExportedValues(value_type, generator):
-        yield chunk
-
-      if not next_types:
-        break
+    try:
+      while True:
+        converted_responses = itertools.chain.from_iterable(
+            self._GenerateConvertedValues(
+                converter, values_generator_fn(), process_pool=process_pool)
+            for converter in converters)
+
+        generator = self._GenerateSingleTypeIteration(
+            next_types, processed_types, converted_responses)
+
+        for chunk in self.ProcessSingleTypeExportedValues(
+            value_type, generator):
+          yield chunk
+
+        if not next_types:
+          break
+    finally:
+      if process_pool is not None:
+        process_pool.Close()
 
 
 def ApplyPluginToMultiTypeCollection(plugin, output_collection,
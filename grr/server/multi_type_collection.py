@@ -185,9 +185,15 @@ class MultiTypeCollection(object):
     return l
 
   def Delete(self):
+    sub_collection_urns = [
+        self.collection_id.Add(stored_type)
+        for stored_type in self.ListStoredTypes()
+    ]
     mutation_pool = data_store.DB.GetMutationPool(self.token)
     with mutation_pool:
       mutation_pool.DeleteSubject(self.collection_id)
+      # The sub collections hold the index and the record counters.
+      mutation_pool.DeleteSubjects(sub_collection_urns)
       for urn, _, _ in data_store.DB.ScanAttribute(
           self.collection_id,
           data_store.DataStore.COLLECTION_ATTRIBUTE,
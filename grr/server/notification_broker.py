@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""A broker forwarding queue notifications between GRR processes.
+
+Frontends and workers using the SocketNotificationChannel connect to the
+broker. Workers subscribe to their queue shards and are woken up as soon as
+another process writes notifications to them. See
+queue_manager.SocketNotificationChannel for the protocol.
+"""
+
+import logging
+import socket
+import SocketServer
+import threading
+
+
+# pylint: disable=unused-import,g-bad-import-order
+from grr.lib import server_plugins
+# pylint: enable=unused-import,g-bad-import-order
+
+from grr import config
+from grr.lib import flags
+from grr.server import server_startup
+
+
+class NotificationBrokerHandler(SocketServer.BaseRequestHandler):
+  """Handles a single connection to the broker."""
+
+  # Subscribers not taking a notification within this many seconds are
+  # dropped, so that a stalled process doesn't hold up the publishers.
+  SEND_TIMEOUT = 1
+
+  def setup(self):
+    self.request.settimeout(self.SEND_TIMEOUT)
+    self.send_lock = threading.Lock()
+    self.dropped = False
+
+  def handle(self):
+    buf = ""
+    try:
+      while not self.dropped:
+        try:
+          data = self.request.recv(4096)
+        except socket.timeout:
+          # The timeout is only meant for sends, idle connections are fine.
+          continue
+        if not data:
+          break
+
+        lines = (buf + data).split("\n")
+        buf = lines.pop()
+        for line in lines:
+          command, _, shard = line.strip().partition(" ")
+          if command == "S":
+            self.server.Subscribe(shard, self)
+          elif command == "N":
+            self.server.Publish(shard)
+    except socket.error:
+      pass
+    finally:
+      self.server.Unsubscribe(self)
+
+  def Send(self, data):
+    with self.send_lock:
+      if self.dropped:
+        return
+
+      try:
+        self.request.sendall(data)
+        return
+      except socket.error as e:
+        logging.info("Dropping subscriber %s: %s", self.client_address, e)
+        self.dropped = True
+
+    # The subscriber reconnects when it sees the connection close and falls
+    # back to polling in the meantime.
+    self.server.Unsubscribe(self)
+    try:
+      self.request.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+      pass
+
+
+class NotificationBroker(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  """Forwards notifications to the connections subscribed to a queue shard."""
+
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self, server_address):
+    SocketServer.TCPServer.__init__(self, server_address,
+                                    NotificationBrokerHandler)
+    self.lock = threading.Lock()
+    self.subscribers = {}
+
+  def Subscribe(self, shard, handler):
+    with self.lock:
+      self.subscribers.setdefault(shard, set()).add(handler)
+
+  def Unsubscribe(self, handler):
+    with self.lock:
+      for handlers in self.subscribers.itervalues():
+        handlers.discard(handler)
+
+  def Publish(self, shard):
+    with self.lock:
+      handlers = list(self.subscribers.get(shard, ()))
+
+    for handler in handlers:
+      handler.Send("N %s\n" % shard)
+
+
+def main(argv):
+  """Runs the notification broker."""
+  del argv  # Unused.
+  server_startup.Init()
+
+  server_address = (config.CONFIG["NotificationBroker.address"],
+                    config.CONFIG["NotificationBroker.port"])
+  broker = NotificationBroker(server_address)
+  logging.info("Notification broker listening on %s:%d", *server_address)
+  broker.serve_forever()
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -3,7 +3,11 @@
 
 import collections
 import logging
+import Queue
 import random
+import socket
+import threading
+import time
 
 from grr import config
 from grr.lib import rdfvalue
@@ -442,6 +446,11 @@ class QueueManager(object):
     return self._SortByPriority(
         self._GetUnsortedNotifications(queue_shard).values(), queue)
 
+  def GetNotificationsByPriorityForShard(self, queue, queue_shard):
+    """Same as GetNotificationsByPriority but for the given queue shard."""
+    return self._SortByPriority(
+        self._GetUnsortedNotifications(queue_shard).values(), queue)
+
   def GetNotificationsByPriorityForAllShards(self, queue):
     """Same as GetNotificationsByPriority but for all shards.
 
@@ -626,6 +635,19 @@ class QueueManager(object):
       return mutation_pool.QueueQueryAndOwn(queue, lease_seconds, limit,
                                             self.frozen_timestamp)
 
+  def MultiQueryAndOwn(self, queue_limits, lease_seconds=10):
+    """Leases tasks from several queues at once.
+
+    Args:
+      queue_limits: A dict mapping queues to the number of tasks to lease.
+      lease_seconds: The tasks will be leased for this long.
+    Returns:
+        A dict mapping queues to lists of GrrMessage() objects leased.
+    """
+    with self.data_store.GetMutationPool(token=self.token) as mutation_pool:
+      return mutation_pool.QueueMultiQueryAndOwn(queue_limits, lease_seconds,
+                                                 self.frozen_timestamp)
+
 
 class WellKnownQueueManager(QueueManager):
   """A flow manager for well known flows."""
@@ -656,6 +678,284 @@ class WellKnownQueueManager(QueueManager):
       yield response
 
 
+class NotificationSubscription(object):
+  """Lets a worker wait for notifications on a set of queue shards."""
+
+  def __init__(self, queue_shards):
+    self.queue_shards = queue_shards
+    self.event = threading.Event()
+
+  def Set(self):
+    self.event.set()
+
+  def Wait(self, timeout):
+    """Waits for a notification.
+
+    Notifications arriving between two calls are not lost, the next call
+    returns immediately.
+
+    Args:
+      timeout: The maximum number of seconds to wait.
+
+    Returns:
+      True if a notification arrived, False if the timeout expired.
+    """
+    notified = self.event.wait(timeout)
+    self.event.clear()
+    return bool(notified)
+
+
+class NotificationChannel(object):
+  """Wakes up workers when notifications are written to their queues.
+
+  The channel only ever makes workers poll earlier, notifications themselves
+  are always read from the data store.
+  """
+
+  __metaclass__ = registry.MetaclassRegistry
+
+  # If True, notifications written by other processes are delivered as well and
+  # workers can poll much less often.
+  cross_process = False
+
+  def Subscribe(self, queue_shards):
+    """Returns a NotificationSubscription for the given queue shards."""
+    raise NotImplementedError()
+
+  def Unsubscribe(self, subscription):
+    """Stops delivering notifications to the subscription."""
+    raise NotImplementedError()
+
+  def Notify(self, queue_shards):
+    """Wakes up the subscribers of the given queue shards."""
+    raise NotImplementedError()
+
+
+class LocalNotificationChannel(NotificationChannel):
+  """Delivers notifications within the current process."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.subscriptions = {}
+
+  def Subscribe(self, queue_shards):
+    queue_shards = [utils.SmartStr(shard) for shard in queue_shards]
+    subscription = NotificationSubscription(queue_shards)
+    with self.lock:
+      for shard in queue_shards:
+        self.subscriptions.setdefault(shard, []).append(subscription)
+    return subscription
+
+  def Unsubscribe(self, subscription):
+    with self.lock:
+      for shard in subscription.queue_shards:
+        subscriptions = self.subscriptions.get(shard, [])
+        if subscription in subscriptions:
+          subscriptions.remove(subscription)
+        if not subscriptions:
+          self.subscriptions.pop(shard, None)
+
+    # Anybody still waiting on the subscription goes back to polling.
+    subscription.Set()
+
+  def Notify(self, queue_shards):
+    with self.lock:
+      to_wake = set()
+      for shard in queue_shards:
+        to_wake.update(self.subscriptions.get(utils.SmartStr(shard), []))
+
+    for subscription in to_wake:
+      subscription.Set()
+
+  def NotifyAll(self):
+    with self.lock:
+      to_wake = set()
+      for subscriptions in self.subscriptions.itervalues():
+        to_wake.update(subscriptions)
+
+    for subscription in to_wake:
+      subscription.Set()
+
+
+class SocketNotificationChannel(NotificationChannel):
+  """Shares notifications between processes through a NotificationBroker.
+
+  The protocol is line based: "S <shard>" subscribes the connection to a queue
+  shard and "N <shard>" notifies it. The broker forwards notifications as
+  "N <shard>" to every connection subscribed to the shard.
+
+  Notify() only queues the notifications for a sender thread, so writing to
+  the data store never waits for the broker. If the broker is slow or can not
+  be reached, notifications are dropped and workers fall back to polling.
+  """
+
+  cross_process = True
+
+  CONNECT_TIMEOUT = 1
+  # A send to the broker taking longer than this drops the connection.
+  SEND_TIMEOUT = 1
+  RECONNECT_INTERVAL = 5
+  # Maximum number of notification batches waiting for the sender thread.
+  MAX_PENDING = 1000
+
+  def __init__(self, address=None, port=None):
+    self.address = address or config.CONFIG["NotificationBroker.address"]
+    self.port = port or config.CONFIG["NotificationBroker.port"]
+    self.local = LocalNotificationChannel()
+    self.lock = threading.Lock()
+    self.connection = None
+    self.next_connect = 0
+    # All shards we subscribed to and the ones already sent to the broker over
+    # the current connection.
+    self.subscribed = set()
+    self.sent_subscriptions = set()
+    self.pending = Queue.Queue(maxsize=self.MAX_PENDING)
+    self.start_lock = threading.Lock()
+    self.sender = None
+    self.reader = None
+
+  def _StartThread(self, name, target):
+    thread = threading.Thread(None, target, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+  def _Connect(self):
+    """Returns the connection to the broker, call with self.lock held."""
+    if self.connection is None:
+      if time.time() < self.next_connect:
+        raise socket.error("Waiting to reconnect to the notification broker.")
+
+      try:
+        connection = socket.create_connection((self.address, self.port),
+                                              self.CONNECT_TIMEOUT)
+      except socket.error:
+        self.next_connect = time.time() + self.RECONNECT_INTERVAL
+        raise
+
+      connection.settimeout(self.SEND_TIMEOUT)
+      self.connection = connection
+      self.sent_subscriptions = set()
+    return self.connection
+
+  def _Disconnect(self, connection):
+    """Drops the connection, call with self.lock held."""
+    if connection is not None and connection is self.connection:
+      self.connection = None
+      try:
+        connection.close()
+      except socket.error:
+        pass
+
+  def _Queue(self, data):
+    try:
+      self.pending.put_nowait(data)
+    except Queue.Full:
+      logging.debug("Notification broker too slow, dropping notifications.")
+
+  def _SendLoop(self):
+    """Sends queued notifications and new subscriptions to the broker."""
+    while True:
+      data = self.pending.get()
+      with self.lock:
+        try:
+          connection = self._Connect()
+        except socket.error as e:
+          logging.debug("Notification broker unavailable: %s", e)
+          continue
+
+        new_shards = self.subscribed - self.sent_subscriptions
+        self.sent_subscriptions.update(new_shards)
+
+      # Only this thread writes to the connection, so lines never interleave.
+      data = "".join("S %s\n" % shard for shard in new_shards) + data
+      try:
+        connection.sendall(data)
+      except socket.error as e:
+        logging.debug("Error sending to the notification broker: %s", e)
+        with self.lock:
+          self._Disconnect(connection)
+
+  def _ReadLoop(self):
+    """Receives notifications for our subscriptions from the broker."""
+    while True:
+      with self.lock:
+        try:
+          connection = self._Connect()
+        except socket.error:
+          connection = None
+
+      if connection is None:
+        time.sleep(self.RECONNECT_INTERVAL)
+        continue
+
+      # Makes the sender subscribe on the new connection.
+      self._Queue("")
+
+      buf = ""
+      try:
+        while True:
+          try:
+            data = connection.recv(4096)
+          except socket.timeout:
+            # The timeout is only meant for sends, idle connections are fine.
+            continue
+          if not data:
+            break
+
+          lines = (buf + data).split("\n")
+          buf = lines.pop()
+          shards = []
+          for line in lines:
+            command, _, shard = line.strip().partition(" ")
+            if command == "N":
+              shards.append(shard)
+          self.local.Notify(shards)
+      except socket.error:
+        pass
+
+      with self.lock:
+        self._Disconnect(connection)
+      # We may have missed notifications, so let everybody poll.
+      self.local.NotifyAll()
+
+  def Subscribe(self, queue_shards):
+    subscription = self.local.Subscribe(queue_shards)
+    with self.lock:
+      self.subscribed.update(subscription.queue_shards)
+
+    with self.start_lock:
+      if self.sender is None:
+        self.sender = self._StartThread("NotificationChannelSender",
+                                        self._SendLoop)
+      if self.reader is None:
+        self.reader = self._StartThread("NotificationChannelReader",
+                                        self._ReadLoop)
+
+    # Wakes up the sender which sends the new subscriptions.
+    self._Queue("")
+    return subscription
+
+  def Unsubscribe(self, subscription):
+    # The broker keeps forwarding notifications for the shards, other
+    # subscriptions in this process might still need them.
+    self.local.Unsubscribe(subscription)
+
+  def Notify(self, queue_shards):
+    if self.sender is None:
+      with self.start_lock:
+        if self.sender is None:
+          self.sender = self._StartThread("NotificationChannelSender",
+                                          self._SendLoop)
+
+    self._Queue("".join(
+        "N %s\n" % utils.SmartStr(shard) for shard in queue_shards))
+
+
+# The channel used by workers in this process, set up by QueueManagerInit.
+NOTIFICATION_CHANNEL = None
+
+
 class QueueManagerInit(registry.InitHook):
   """Registers vars used by the QueueManager."""
 
@@ -667,3 +967,11 @@ class QueueManagerInit(registry.InitHook):
         "notification_queue_count",
         int,
         fields=[("queue_name", str), ("priority", str)])
+
+  def RunOnce(self):
+    global NOTIFICATION_CHANNEL  # pylint: disable=global-statement
+
+    channel_name = config.CONFIG["Worker.notification_channel"]
+    if channel_name:
+      NOTIFICATION_CHANNEL = NotificationChannel.classes[channel_name]()
+      data_store.notification_listeners.append(NOTIFICATION_CHANNEL.Notify)
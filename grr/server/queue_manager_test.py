@@ -2,6 +2,8 @@
 """Tests the queue manager."""
 
 
+import socket
+import threading
 import time
 import mock
 
@@ -9,8 +11,10 @@ from grr.lib import flags
 from grr.lib import queues
 from grr.lib import rdfvalue
 from grr.lib import stats
+from grr.lib import utils
 from grr.lib.rdfvalues import flows as rdf_flows
 from grr.server import data_store
+from grr.server import notification_broker
 from grr.server import queue_manager
 from grr.test_lib import flow_test_lib
 from grr.test_lib import test_lib
@@ -590,6 +594,122 @@ class MultiShardedQueueManagerTest(QueueManagerTest):
           self.assertEqual(len(notifications), 0)
 
 
+class NotificationChannelTest(test_lib.GRRBaseTest):
+  """Tests the notification channels."""
+
+  def _QueueNotification(self, queue):
+    session_id = rdfvalue.SessionID(queue=queue, flow_name="test")
+    with queue_manager.QueueManager(token=self.token) as manager:
+      manager.QueueNotification(session_id=session_id)
+
+  def testLocalChannelWakesSubscribersOnFlush(self):
+    channel = queue_manager.LocalNotificationChannel()
+    manager = queue_manager.QueueManager(token=self.token)
+    hunts = channel.Subscribe(manager.GetAllNotificationShards(queues.HUNTS))
+    flows = channel.Subscribe(manager.GetAllNotificationShards(queues.FLOWS))
+
+    with utils.Stubber(data_store, "notification_listeners", [channel.Notify]):
+      self._QueueNotification(queues.HUNTS)
+
+    self.assertTrue(hunts.Wait(0))
+    self.assertFalse(hunts.Wait(0))
+    self.assertFalse(flows.Wait(0))
+
+  def testLocalChannelUnsubscribe(self):
+    channel = queue_manager.LocalNotificationChannel()
+    subscription = channel.Subscribe([queues.FLOWS])
+    channel.Unsubscribe(subscription)
+    self.assertEqual(channel.subscriptions, {})
+
+    # Unsubscribing wakes up the subscription one last time.
+    self.assertTrue(subscription.Wait(0))
+    channel.Notify([queues.FLOWS])
+    self.assertFalse(subscription.Wait(0))
+
+  def _StartBroker(self):
+    broker = notification_broker.NotificationBroker(("localhost", 0))
+    broker_thread = threading.Thread(target=broker.serve_forever)
+    broker_thread.daemon = True
+    broker_thread.start()
+    return broker
+
+  def _WaitForSubscribers(self, broker, shard, subscribed=True):
+    deadline = time.time() + 10
+    while bool(broker.subscribers.get(shard)) != subscribed:
+      self.assertLess(time.time(), deadline)
+      time.sleep(0.01)
+
+  def testSocketChannel(self):
+    broker = self._StartBroker()
+    try:
+      port = broker.server_address[1]
+      worker_channel = queue_manager.SocketNotificationChannel(
+          "localhost", port)
+      subscription = worker_channel.Subscribe([queues.FLOWS])
+      self._WaitForSubscribers(broker, str(queues.FLOWS))
+
+      frontend_channel = queue_manager.SocketNotificationChannel(
+          "localhost", port)
+      frontend_channel.Notify([queues.HUNTS])
+      frontend_channel.Notify([queues.FLOWS])
+      self.assertTrue(subscription.Wait(10))
+    finally:
+      broker.shutdown()
+      broker.server_close()
+
+  def testSocketChannelWithoutBroker(self):
+    broker = notification_broker.NotificationBroker(("localhost", 0))
+    port = broker.server_address[1]
+    broker.server_close()
+
+    channel = queue_manager.SocketNotificationChannel("localhost", port)
+    # Notifications are dropped, workers fall back to polling.
+    channel.Notify([queues.FLOWS])
+
+  def testSocketChannelDoesNotBlockOnStalledBroker(self):
+    # A broker which accepts connections but never reads from them.
+    server = socket.socket()
+    server.bind(("localhost", 0))
+    server.listen(5)
+    try:
+      channel = queue_manager.SocketNotificationChannel(
+          "localhost", server.getsockname()[1])
+      # Many times more than fits into the socket buffers.
+      shard = "x" * 10000
+      for _ in range(5000):
+        channel.Notify([shard])
+    finally:
+      server.close()
+
+  def testBrokerDropsStalledSubscribers(self):
+    shard = "x" * 10000
+    with utils.Stubber(notification_broker.NotificationBrokerHandler,
+                       "SEND_TIMEOUT", 0.1):
+      broker = self._StartBroker()
+      try:
+        port = broker.server_address[1]
+        # This subscriber never reads its notifications.
+        subscriber = socket.create_connection(("localhost", port))
+        subscriber.sendall("S %s\n" % shard)
+        self._WaitForSubscribers(broker, shard)
+
+        publisher = socket.create_connection(("localhost", port))
+        deadline = time.time() + 30
+        while broker.subscribers.get(shard):
+          self.assertLess(time.time(), deadline)
+          publisher.sendall("N %s\n" % shard * 100)
+
+        # The broker still serves other connections.
+        channel = queue_manager.SocketNotificationChannel("localhost", port)
+        subscription = channel.Subscribe([queues.FLOWS])
+        self._WaitForSubscribers(broker, str(queues.FLOWS))
+        publisher.sendall("N %s\n" % queues.FLOWS)
+        self.assertTrue(subscription.Wait(10))
+      finally:
+        broker.shutdown()
+        broker.server_close()
+
+
 def main(argv):
   test_lib.main(argv)
 
@@ -2,13 +2,16 @@
 """A collection of records stored sequentially.
 """
 
-import collections
+import heapq
+import logging
 import random
 import threading
 import time
 
+from grr import config
 from grr.lib import rdfvalue
 from grr.lib import registry
+from grr.lib import stats
 from grr.lib.rdfvalues import flows as rdf_flows
 from grr.lib.rdfvalues import protodict as rdf_protodict
 
@@ -177,26 +180,84 @@ class SequentialCollection(object):
 
 
 class BackgroundIndexUpdater(object):
-  """Updates IndexedSequentialCollection objects in the background."""
+  """Updates IndexedSequentialCollection objects in the background.
+
+  Requests are kept in a heap ordered by the time they become due so any number
+  of threads can run UpdateLoop. Repeated requests for a collection that is
+  already waiting are coalesced and a collection is never updated by two
+  threads at the same time.
+  """
   INDEX_DELAY = 240
 
   exit_now = False
 
   def __init__(self):
-    self.to_process = collections.deque()
+    # A heap of (due time, sequence number, (collection_cls, collection_urn)).
+    self.to_process = []
+    # Maps keys waiting in to_process to their due time.
+    self.scheduled = {}
+    # Keys currently being updated and keys that became due meanwhile.
+    self.running = set()
+    self.deferred = set()
+    self.sequence = 0
     self.cv = threading.Condition()
 
   def ExitNow(self):
     with self.cv:
       self.exit_now = True
-      self.to_process.append(None)
-      self.cv.notify()
+      self.cv.notify_all()
+
+  def _Schedule(self, key, due):
+    self.sequence += 1
+    heapq.heappush(self.to_process, (due, self.sequence, key))
+    self.scheduled[key] = due
+    stats.STATS.SetGaugeValue("index_updater_queue_depth", len(self.scheduled))
+    self.cv.notify()
 
   def AddIndexToUpdate(self, collection_cls, index_urn):
+    key = (collection_cls, index_urn)
+    with self.cv:
+      if key in self.scheduled:
+        stats.STATS.IncrementCounter("index_updater_coalesced_requests")
+        return
+
+      self._Schedule(key, time.time() + self.INDEX_DELAY)
+
+  def _NextUpdate(self):
+    """Blocks until an update is due, returns its key or None on exit."""
+    with self.cv:
+      while not self.exit_now:
+        if not self.to_process:
+          self.cv.wait()
+          continue
+
+        due, _, key = self.to_process[0]
+        now = time.time()
+        if due > now:
+          self.cv.wait(due - now)
+          continue
+
+        heapq.heappop(self.to_process)
+        del self.scheduled[key]
+        stats.STATS.SetGaugeValue("index_updater_queue_depth",
+                                  len(self.scheduled))
+
+        if key in self.running:
+          # Picked up again once the running update is done.
+          self.deferred.add(key)
+          continue
+
+        self.running.add(key)
+        stats.STATS.RecordEvent("index_updater_lag", now - due)
+        return key
+
+  def _UpdateDone(self, key):
     with self.cv:
-      self.to_process.append((collection_cls, index_urn,
-                              time.time() + self.INDEX_DELAY))
-      self.cv.notify()
+      self.running.discard(key)
+      if key in self.deferred:
+        self.deferred.discard(key)
+        if key not in self.scheduled:
+          self._Schedule(key, time.time())
 
   def ProcessCollection(self, collection_cls, collection_id, token):
     collection_cls(collection_id, token=token).UpdateIndex()
@@ -204,23 +265,18 @@ class BackgroundIndexUpdater(object):
   def UpdateLoop(self):
     token = access_control.ACLToken(
         username="Background Index Updater", reason="Updating An Index")
-    while not self.exit_now:
-      with self.cv:
-        while not self.to_process:
-          self.cv.wait()
-        next_update = self.to_process.popleft()
-        if next_update is None:
-          return
-
-      now = time.time()
-      next_cls = next_update[0]
-      next_urn = next_update[1]
-      next_time = next_update[2]
-      while now < next_time:
-        time.sleep(next_time - now)
-        now = time.time()
+    while True:
+      key = self._NextUpdate()
+      if key is None:
+        return
 
-      self.ProcessCollection(next_cls, next_urn, token)
+      next_cls, next_urn = key
+      try:
+        self.ProcessCollection(next_cls, next_urn, token)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception("Error updating index of %s: %s", next_urn, e)
+      finally:
+        self._UpdateDone(key)
 
 
 BACKGROUND_INDEX_UPDATER = BackgroundIndexUpdater()
@@ -229,12 +285,17 @@ BACKGROUND_INDEX_UPDATER = BackgroundIndexUpdater()
 class UpdaterStartHook(registry.InitHook):
 
   def RunOnce(self):
-    t = threading.Thread(
-        None,
-        BACKGROUND_INDEX_UPDATER.UpdateLoop,
-        name="SequentialCollectionIndexUpdater")
-    t.daemon = True
-    t.start()
+    stats.STATS.RegisterGaugeMetric("index_updater_queue_depth", int)
+    stats.STATS.RegisterEventMetric("index_updater_lag")
+    stats.STATS.RegisterCounterMetric("index_updater_coalesced_requests")
+
+    for i in range(config.CONFIG["Server.index_updater_threads"]):
+      t = threading.Thread(
+          None,
+          BACKGROUND_INDEX_UPDATER.UpdateLoop,
+          name="SequentialCollectionIndexUpdater%d" % i)
+      t.daemon = True
+      t.start()
 
 
 class IndexedSequentialCollection(SequentialCollection):
@@ -244,7 +305,9 @@ class IndexedSequentialCollection(SequentialCollection):
   of records present, and to find a particular record number.
 
   IMPLEMENTATION NOTE: The index is created lazily, and for records older than
-    INDEX_WRITE_DELAY.
+    INDEX_WRITE_DELAY. The number of records is kept in counters which every
+    mutation pool flush adds to and which are reconciled against the index
+    together with the index updates.
   """
 
   # How many records between index entries. Subclasses may change this.  The
@@ -265,6 +328,10 @@ class IndexedSequentialCollection(SequentialCollection):
 
   INDEX_WRITE_DELAY = rdfvalue.Duration("3m")
 
+  # The number of count deltas above which reading the length schedules a
+  # reconciliation of the record counters.
+  MAX_COUNTER_DELTAS = 1000
+
   def __init__(self, *args, **kwargs):
     super(IndexedSequentialCollection, self).__init__(*args, **kwargs)
     self._index = None
@@ -345,13 +412,66 @@ class IndexedSequentialCollection(SequentialCollection):
       return 0
     return highest_index + 1
 
+  def _CountRecords(self, cutoff):
+    """Returns the number of records stored before cutoff and in total."""
+    self._ReadIndex()
+    start = max(i for i, (ts, _) in self._index.iteritems() if ts < cutoff)
+    before_cutoff = total = start
+    for (i, ts, _) in self._IndexedScan(start):
+      total = i + 1
+      if ts[0] < cutoff:
+        before_cutoff = i + 1
+    return before_cutoff, total
+
+  def ReconcileCounters(self):
+    """Recounts the records the counters cover and drops merged deltas.
+
+    The base count is moved up to the start of the last count bucket older
+    than INDEX_WRITE_DELAY. Deltas for older buckets which are read here are
+    replaced by the base count, deltas written later are kept.
+
+    Returns:
+      The number of records in the collection.
+    """
+    _, count_timestamp, deltas = data_store.DB.CollectionReadCounters(
+        self.collection_id, token=self.token)
+
+    bucket_size = data_store.DataStore.COLLECTION_COUNT_BUCKET
+    cutoff = (rdfvalue.RDFDatetime.Now() -
+              self.INDEX_WRITE_DELAY).AsMicroSecondsFromEpoch()
+    cutoff = max(cutoff - cutoff % bucket_size, count_timestamp)
+
+    before_cutoff, total = self._CountRecords(cutoff)
+    merged = set(attr for attr, bucket, _ in deltas if bucket < cutoff)
+
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      mutation_pool.CollectionSetCount(self.collection_id, before_cutoff,
+                                       cutoff)
+      if merged:
+        mutation_pool.DeleteAttributes(self.collection_id, list(merged))
+
+    return total
+
   def __len__(self):
-    return self.CalculateLength()
+    count, _, deltas = data_store.DB.CollectionReadCounters(
+        self.collection_id, token=self.token)
+    if count is None:
+      # Never counted before. Reading the length must not write the counters,
+      # so this is left to the background index updater.
+      BACKGROUND_INDEX_UPDATER.AddIndexToUpdate(self.__class__,
+                                                self.collection_id)
+      return self.CalculateLength()
+
+    if len(deltas) > self.MAX_COUNTER_DELTAS:
+      BACKGROUND_INDEX_UPDATER.AddIndexToUpdate(self.__class__,
+                                                self.collection_id)
+
+    # Deltas of records older than the base count which are still present
+    # were written after the last reconciliation so they are not part of it.
+    return count + sum(delta for _, _, delta in deltas)
 
   def UpdateIndex(self):
-    self._ReadIndex()
-    for _ in self._IndexedScan(self._max_indexed):
-      pass
+    self.ReconcileCounters()
 
   @classmethod
   def StaticAdd(cls,
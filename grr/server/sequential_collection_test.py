@@ -243,6 +243,86 @@ class IndexedSequentialCollectionTest(aff4_test_lib.AFF4ObjectTest):
       # for calculating the length.
       self.assertEqual(scan.call_count, 2)
 
+  def testLengthUsesCounters(self):
+    urn = "aff4:/sequential_collection/testLengthUsesCounters"
+    collection = self._TestCollection(urn)
+    self.assertEqual(len(collection), 0)
+    # Reading the length doesn't write the counters.
+    self.assertEqual(
+        data_store.DB.CollectionReadCounters(
+            collection.collection_id, token=self.token), (None, 0, []))
+
+    collection.UpdateIndex()
+    for _ in range(3):
+      with data_store.DB.GetMutationPool(token=self.token) as pool:
+        for i in range(10):
+          collection.Add(rdfvalue.RDFInteger(i), mutation_pool=pool)
+
+    with test_lib.Instrument(sequential_collection.SequentialCollection,
+                             "Scan") as scan:
+      self.assertEqual(len(collection), 30)
+      self.assertEqual(scan.call_count, 0)
+
+    count, _, deltas = data_store.DB.CollectionReadCounters(
+        collection.collection_id, token=self.token)
+    self.assertEqual(count, 0)
+    self.assertEqual(len(deltas), 3)
+
+  def testReconcileCounters(self):
+    urn = "aff4:/sequential_collection/testReconcileCounters"
+    collection = self._TestCollection(urn)
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for i in range(50):
+        collection.Add(rdfvalue.RDFInteger(i), mutation_pool=pool)
+
+    with test_lib.FakeTime(rdfvalue.RDFDatetime.Now() +
+                           rdfvalue.Duration("10m")):
+      self.assertEqual(collection.ReconcileCounters(), 50)
+
+      count, _, deltas = data_store.DB.CollectionReadCounters(
+          collection.collection_id, token=self.token)
+      self.assertEqual(count, 50)
+      self.assertEqual(deltas, [])
+
+      with data_store.DB.GetMutationPool(token=self.token) as pool:
+        for i in range(20):
+          collection.Add(rdfvalue.RDFInteger(i), mutation_pool=pool)
+      self.assertEqual(len(collection), 70)
+
+  def testLateWritesAreCounted(self):
+    urn = "aff4:/sequential_collection/testLateWritesAreCounted"
+    collection = self._TestCollection(urn)
+    old = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for i in range(10):
+        collection.Add(
+            rdfvalue.RDFInteger(i), timestamp=old, mutation_pool=pool)
+
+    collection.ReconcileCounters()
+
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for i in range(5):
+        collection.Add(
+            rdfvalue.RDFInteger(i), timestamp=old, mutation_pool=pool)
+
+    self.assertEqual(len(collection), 15)
+    self.assertEqual(collection.ReconcileCounters(), 15)
+    self.assertEqual(len(collection), 15)
+
+  def testDeleteRemovesCounters(self):
+    urn = "aff4:/sequential_collection/testDeleteRemovesCounters"
+    collection = self._TestCollection(urn)
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for i in range(10):
+        collection.Add(rdfvalue.RDFInteger(i), mutation_pool=pool)
+    self.assertEqual(len(collection), 10)
+
+    collection.Delete()
+
+    self.assertEqual(
+        data_store.DB.CollectionReadCounters(
+            collection.collection_id, token=self.token), (None, 0, []))
+
   def testAutoIndexing(self):
 
     indexing_done = threading.Event()
@@ -272,6 +352,104 @@ class IndexedSequentialCollectionTest(aff4_test_lib.AFF4ObjectTest):
         self.fail("Indexing did not finish in time.")
 
 
+class BackgroundIndexUpdaterTest(test_lib.GRRBaseTest):
+  """Tests for the BackgroundIndexUpdater scheduling."""
+
+  def setUp(self):
+    super(BackgroundIndexUpdaterTest, self).setUp()
+    self.biu = sequential_collection.BackgroundIndexUpdater()
+    self.biu.INDEX_DELAY = 0
+    self.processed = []
+    self.lock = threading.Lock()
+    self.done = threading.Semaphore(0)
+    self.blocking = {}
+    self.biu.ProcessCollection = self._ProcessCollection
+
+  def tearDown(self):
+    self.biu.ExitNow()
+    for event in self.blocking.values():
+      event.set()
+    super(BackgroundIndexUpdaterTest, self).tearDown()
+
+  def _ProcessCollection(self, collection_cls, collection_id, token):
+    _ = collection_cls, token
+    if collection_id in self.blocking:
+      self.blocking[collection_id].wait()
+    with self.lock:
+      self.processed.append(collection_id)
+    self.done.release()
+
+  def _StartThreads(self, count):
+    for _ in range(count):
+      t = threading.Thread(None, self.biu.UpdateLoop)
+      t.daemon = True
+      t.start()
+
+  def _WaitForUpdates(self, count):
+    deadline = time.time() + 10
+    for _ in range(count):
+      while not self.done.acquire(False):
+        if time.time() > deadline:
+          self.fail("Index updates did not finish in time.")
+        time.sleep(0.01)
+
+  def testRepeatedRequestsAreCoalesced(self):
+    self.biu.INDEX_DELAY = 60
+    for _ in range(10):
+      self.biu.AddIndexToUpdate(TestIndexedSequentialCollection, "aff4:/a")
+    self.biu.AddIndexToUpdate(TestIndexedSequentialCollection, "aff4:/b")
+
+    self.assertEqual(len(self.biu.to_process), 2)
+    self.assertEqual(len(self.biu.scheduled), 2)
+
+  def testUpdatesRunInDueOrder(self):
+    self.biu.INDEX_DELAY = 0.2
+    self.biu.AddIndexToUpdate(TestIndexedSequentialCollection, "aff4:/late")
+    self.biu.INDEX_DELAY = 0
+    self.biu.AddIndexToUpdate(TestIndexedSequentialCollection, "aff4:/early")
+    self._StartThreads(1)
+
+    self._WaitForUpdates(2)
+    self.assertEqual(self.processed, ["aff4:/early", "aff4:/late"])
+
+  def testSlowUpdateDoesNotBlockOtherCollections(self):
+    self.blocking["aff4:/slow"] = threading.Event()
+    self.biu.AddIndexToUpdate(TestIndexedSequentialCollection, "aff4:/slow")
+    self.biu.AddIndexToUpdate(TestIndexedSequentialCollection, "aff4:/fast")
+    self._StartThreads(2)
+
+    self._WaitForUpdates(1)
+    self.assertEqual(self.processed, ["aff4:/fast"])
+
+    self.blocking["aff4:/slow"].set()
+    self._WaitForUpdates(1)
+    self.assertEqual(self.processed, ["aff4:/fast", "aff4:/slow"])
+
+  def testRequestForRunningCollectionIsDeferred(self):
+    self.blocking["aff4:/a"] = threading.Event()
+    self.biu.AddIndexToUpdate(TestIndexedSequentialCollection, "aff4:/a")
+    self._StartThreads(2)
+
+    # Wait until the first update is running, then request another one.
+    deadline = time.time() + 10
+    while not self.biu.running:
+      if time.time() > deadline:
+        self.fail("Index update did not start in time.")
+      time.sleep(0.01)
+    self.biu.AddIndexToUpdate(TestIndexedSequentialCollection, "aff4:/a")
+
+    deadline = time.time() + 10
+    while not self.biu.deferred:
+      if time.time() > deadline:
+        self.fail("Index update was not deferred in time.")
+      time.sleep(0.01)
+    self.assertEqual(self.processed, [])
+
+    self.blocking.pop("aff4:/a").set()
+    self._WaitForUpdates(2)
+    self.assertEqual(self.processed, ["aff4:/a", "aff4:/a"])
+
+
 class GeneralIndexedCollectionTest(aff4_test_lib.AFF4ObjectTest):
 
   def testAddGet(self):
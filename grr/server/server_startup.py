@@ -33,12 +33,13 @@ def DropPrivileges():
 
 # Make sure we do not reinitialize multiple times.
 INIT_RAN = False
+CONFIG_INIT_RAN = False
 
 
-def Init():
-  """Run all required startup routines and initialization hooks."""
-  global INIT_RAN
-  if INIT_RAN:
+def ConfigInit():
+  """Parses the configuration, unless this was already done."""
+  global CONFIG_INIT_RAN
+  if CONFIG_INIT_RAN:
     return
 
   # Set up a temporary syslog handler so we have somewhere to log problems
@@ -58,6 +59,17 @@ def Init():
     syslog_logger.exception("Died during config initialization")
     raise
 
+  CONFIG_INIT_RAN = True
+
+
+def Init():
+  """Run all required startup routines and initialization hooks."""
+  global INIT_RAN
+  if INIT_RAN:
+    return
+
+  ConfigInit()
+
   if hasattr(registry_init, "stats"):
     logging.debug("Using local stats collector.")
     stats.STATS = registry_init.stats.StatsCollector()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Caches shared between the processes of a multi-process server."""
+
+import logging
+import pickle
+from multiprocessing import managers
+
+from grr.lib import utils
+
+
+class SharedCacheManager(managers.BaseManager):
+  """Serves caches to the processes of a server over a local socket.
+
+  The manager runs in its own process. Cache objects created through it, e.g.
+  manager.FastStore(max_size=1000), return proxies which can be handed to
+  processes started with the multiprocessing module.
+  """
+
+
+SharedCacheManager.register(
+    "FastStore", utils.FastStore, exposed=("Get", "Put", "ExpireObject"))
+
+
+class SharedStore(object):
+  """A local FastStore backed by a store shared between processes.
+
+  Lookups are served from the local store if possible and fall back to the
+  shared store. Objects put here are stored in both, so an object one process
+  computed is available to all the others. Values have to be picklable. If
+  the shared store can not be reached, this works like a local FastStore.
+  """
+
+  # Raised by the proxies when the manager is unavailable or a value can not
+  # be transferred.
+  SHARED_STORE_ERRORS = (IOError, EOFError, managers.RemoteError,
+                         pickle.PicklingError)
+
+  def __init__(self, shared, max_size=10000):
+    """Constructor.
+
+    Args:
+      shared: A proxy for a FastStore created by a SharedCacheManager.
+      max_size: The maximum number of objects held in the local store.
+    """
+    self.local = utils.FastStore(max_size=max_size)
+    self.shared = shared
+
+  def __len__(self):
+    return len(self.local)
+
+  def Get(self, key):
+    """Fetches the object stored under key.
+
+    Args:
+      key: The key of the object.
+
+    Returns:
+      The object.
+
+    Raises:
+      KeyError: If neither the local nor the shared store have the object.
+    """
+    try:
+      return self.local.Get(key)
+    except KeyError:
+      pass
+
+    try:
+      value = self.shared.Get(utils.SmartStr(key))
+    except self.SHARED_STORE_ERRORS as e:
+      logging.warning("Shared store unavailable: %s", e)
+      raise KeyError(key)
+
+    self.local.Put(key, value)
+    return value
+
+  def Put(self, key, value):
+    """Stores the object in the local and the shared store."""
+    self.local.Put(key, value)
+    try:
+      self.shared.Put(utils.SmartStr(key), value)
+    except self.SHARED_STORE_ERRORS as e:
+      logging.warning("Shared store unavailable: %s", e)
+
+  def ExpireObject(self, key):
+    """Removes the object from both stores."""
+    try:
+      self.shared.ExpireObject(utils.SmartStr(key))
+    except self.SHARED_STORE_ERRORS as e:
+      logging.warning("Shared store unavailable: %s", e)
+    return self.local.ExpireObject(key)
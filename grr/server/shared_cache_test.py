@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Tests for grr.server.shared_cache."""
+
+from grr import config
+from grr.lib import flags
+from grr.lib import utils
+from grr.server import shared_cache
+from grr.test_lib import test_lib
+
+
+class UnavailableStore(object):
+  """A shared store whose manager went away."""
+
+  def Get(self, key):
+    raise EOFError()
+
+  def Put(self, key, value):
+    raise EOFError()
+
+  def ExpireObject(self, key):
+    raise EOFError()
+
+
+class SharedStoreTest(test_lib.GRRBaseTest):
+  """Tests the SharedStore."""
+
+  def testValuesAreShared(self):
+    shared = utils.FastStore(max_size=10)
+    first = shared_cache.SharedStore(shared)
+    second = shared_cache.SharedStore(shared)
+
+    first.Put("key", "value")
+    self.assertEqual(second.Get("key"), "value")
+    self.assertEqual(len(second), 1)
+
+    second.ExpireObject("key")
+    self.assertRaises(KeyError, shared.Get, "key")
+    self.assertRaises(KeyError, second.Get, "key")
+    # The first store still has its local copy.
+    self.assertEqual(first.Get("key"), "value")
+
+  def testUnavailableSharedStore(self):
+    store = shared_cache.SharedStore(UnavailableStore())
+    self.assertRaises(KeyError, store.Get, "key")
+
+    store.Put("key", "value")
+    self.assertEqual(store.Get("key"), "value")
+
+  def testSharedCacheManager(self):
+    manager = shared_cache.SharedCacheManager()
+    manager.start()
+    try:
+      shared = manager.FastStore(max_size=10)
+      first = shared_cache.SharedStore(shared)
+      second = shared_cache.SharedStore(shared)
+
+      public_key = config.CONFIG["PrivateKeys.server_key"].GetPublicKey()
+      first.Put("key", public_key)
+      self.assertEqual(second.Get("key").AsPEM(), public_key.AsPEM())
+
+      self.assertRaises(KeyError, second.Get, "missing")
+    finally:
+      manager.shutdown()
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -2,8 +2,11 @@
 """Module with GRRWorker implementation."""
 
 
+import heapq
+import itertools
 import logging
 import pdb
+import threading
 import time
 import traceback
 
@@ -33,6 +36,168 @@ class FlowProcessingError(Error):
   """Raised when flow requests/responses can't be processed."""
 
 
+class FlowWorkQueue(object):
+  """A priority queue of flows waiting to be processed.
+
+  The queue holds at most one entry per session. Notifications for a session
+  that is already queued are merged into the queued entry, so the flow is
+  locked and processed only once for all of them. Sessions returned by Get are
+  in flight until Done is called. Newer notifications arriving in the meantime
+  are held back and queued again as soon as the flow is released.
+  """
+
+  def __init__(self):
+    self.cv = threading.Condition()
+    self.heap = []
+    self.counter = itertools.count()
+    # Queued notifications, keyed by session id.
+    self.pending = {}
+    # Notifications being processed and newer ones received meanwhile.
+    self.in_flight = {}
+    self.deferred = {}
+    self.stopped = False
+
+  def __len__(self):
+    with self.cv:
+      return len(self.pending)
+
+  def _Merge(self, notifications, notification):
+    """Stores notification unless a later one is there already."""
+    existing = notifications.get(notification.session_id)
+    if existing is None or notification.timestamp > existing.timestamp:
+      notifications[notification.session_id] = notification
+    return existing
+
+  def _Push(self, notification, existing=None):
+    """Pushes the notification, unless it is already on the heap."""
+    if existing is None or notification.priority > existing.priority:
+      entry = (-int(notification.priority), next(self.counter),
+               notification.session_id)
+      heapq.heappush(self.heap, entry)
+      self.cv.notify()
+
+  def Put(self, notification):
+    """Queues a notification.
+
+    Args:
+      notification: A GrrNotification.
+
+    Returns:
+      True if the session was not queued or in flight before.
+    """
+    session_id = notification.session_id
+    with self.cv:
+      processing = self.in_flight.get(session_id)
+      if processing is not None:
+        # Only hold back notifications the running flow can not have seen.
+        if notification.timestamp > processing.timestamp:
+          self._Merge(self.deferred, notification)
+        return False
+
+      existing = self._Merge(self.pending, notification)
+      self._Push(notification, existing)
+      return existing is None
+
+  def Get(self, timeout=None):
+    """Returns the most urgent notification and marks its session in flight.
+
+    Args:
+      timeout: Seconds to wait for a notification, None waits until Stop is
+        called, 0 does not wait at all.
+
+    Returns:
+      A GrrNotification or None if the queue stayed empty.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with self.cv:
+      while not self.stopped:
+        while self.heap:
+          _, _, session_id = heapq.heappop(self.heap)
+          # Entries superseded by a higher priority one are skipped.
+          notification = self.pending.pop(session_id, None)
+          if notification is not None:
+            self.in_flight[session_id] = notification
+            return notification
+
+        if deadline is None:
+          self.cv.wait()
+        else:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+          self.cv.wait(remaining)
+
+    return None
+
+  def Done(self, session_id):
+    """Releases a session returned by Get."""
+    with self.cv:
+      self.in_flight.pop(session_id, None)
+      notification = self.deferred.pop(session_id, None)
+      if notification is not None:
+        self.pending[session_id] = notification
+        self._Push(notification)
+
+  def Stop(self):
+    with self.cv:
+      self.stopped = True
+      self.cv.notify_all()
+
+
+class LockBackoff(object):
+  """Remembers flows we failed to lock and when to try them again.
+
+  The delay doubles with every consecutive failure, up to max_delay.
+  """
+
+  def __init__(self, max_size=10000, initial_delay=1, max_delay=60):
+    self.max_size = max_size
+    self.initial_delay = initial_delay
+    self.max_delay = max_delay
+    self.lock = threading.Lock()
+    # Maps session ids to (retry time, current delay).
+    self.entries = {}
+
+  def __contains__(self, session_id):
+    with self.lock:
+      entry = self.entries.get(session_id)
+      return entry is not None and time.time() < entry[0]
+
+  def __len__(self):
+    with self.lock:
+      return len(self.entries)
+
+  def _Expire(self, now):
+    """Removes entries which are past their retry time, call with lock held."""
+    for session_id, (retry_time, _) in self.entries.items():
+      if retry_time + self.max_delay < now:
+        del self.entries[session_id]
+
+    if len(self.entries) >= self.max_size:
+      # Still full, drop the entries we will retry soonest.
+      by_retry_time = sorted(self.entries, key=lambda k: self.entries[k][0])
+      for session_id in by_retry_time[:len(self.entries) // 2]:
+        del self.entries[session_id]
+
+  def Failed(self, session_id):
+    """Records a lock failure for session_id."""
+    now = time.time()
+    with self.lock:
+      if session_id in self.entries:
+        delay = min(self.entries[session_id][1] * 2, self.max_delay)
+      else:
+        if len(self.entries) >= self.max_size:
+          self._Expire(now)
+        delay = self.initial_delay
+
+      self.entries[session_id] = (now + delay, delay)
+
+  def Succeeded(self, session_id):
+    """Forgets about past lock failures for session_id."""
+    with self.lock:
+      self.entries.pop(session_id, None)
+
+
 class GRRWorker(object):
   """A GRR worker."""
 
@@ -42,9 +207,20 @@ class GRRWorker(object):
   SHORT_POLLING_INTERVAL = 0.3
   SHORT_POLL_TIME = 30
 
+  # When a cross process notification channel wakes us up, polling is only a
+  # fallback for lost notifications and notifications due in the future.
+  FALLBACK_POLLING_INTERVAL = 10
+
   # target maximum time to spend on RunOnce
   RUN_ONCE_MAX_SECONDS = 300
 
+  # In parallel mode, fetchers stop adding flows to the work queue while this
+  # many are waiting to be processed.
+  MAX_PENDING_FLOWS = 1000
+
+  # Number of flows that failed to lock we remember in parallel mode.
+  LOCK_BACKOFF_SIZE = 10000
+
   # A class global threadpool to be used for all workers.
   thread_pool = None
 
@@ -57,7 +233,8 @@ class GRRWorker(object):
                queues=queues_config.WORKER_LIST,
                threadpool_prefix="grr_threadpool",
                threadpool_size=None,
-               token=None):
+               token=None,
+               parallel=None):
     """Constructor.
 
     Args:
@@ -65,6 +242,9 @@ class GRRWorker(object):
       threadpool_prefix: A name for the thread pool used by this worker.
       threadpool_size: The number of workers to start in this thread pool.
       token: The token to use for the worker.
+      parallel: If set, Run fetches notifications from all queue shards in
+        parallel and feeds them to a pool of processing threads. Defaults to
+        Worker.parallel_processing.
 
     Raises:
       RuntimeError: If the token is not provided.
@@ -77,6 +257,16 @@ class GRRWorker(object):
     # until the timeout.
     self.queued_flows = utils.TimeBasedCache(max_size=10, max_age=60)
 
+    if parallel is None:
+      parallel = config.CONFIG["Worker.parallel_processing"]
+    self.parallel = parallel
+
+    # Used in parallel mode: flows waiting to be processed and flows we
+    # recently failed to lock.
+    self.work_queue = FlowWorkQueue()
+    self.lock_backoff = LockBackoff(max_size=self.LOCK_BACKOFF_SIZE)
+    self.stopped = threading.Event()
+
     if token is None:
       raise RuntimeError("A valid ACLToken is required.")
 
@@ -96,8 +286,23 @@ class GRRWorker(object):
     # Well known flows are just instantiated.
     self.well_known_flows = flow.WellKnownFlow.GetAllWellKnownFlows(token=token)
 
+    self.notification_channel = queue_manager_lib.NOTIFICATION_CHANNEL
+    self.notification_subscription = None
+    # In parallel mode, every fetcher thread subscribes to its own shard.
+    if self.notification_channel and not self.parallel:
+      queue_manager = queue_manager_lib.QueueManager(token=self.token)
+      queue_shards = []
+      for queue in self.queues:
+        queue_shards.extend(queue_manager.GetAllNotificationShards(queue))
+      self.notification_subscription = self.notification_channel.Subscribe(
+          queue_shards)
+
   def Run(self):
     """Event loop."""
+    if self.parallel:
+      self.RunParallel()
+      return
+
     try:
       while 1:
         if master.MASTER_WATCHER.IsMaster():
@@ -110,19 +315,176 @@ class GRRWorker(object):
           for h in logger.handlers:
             h.flush()
 
-          if time.time() - self.last_active > self.SHORT_POLL_TIME:
+          if (self.notification_subscription and
+              self.notification_channel.cross_process):
+            interval = self.FALLBACK_POLLING_INTERVAL
+          elif time.time() - self.last_active > self.SHORT_POLL_TIME:
             interval = self.POLLING_INTERVAL
           else:
             interval = self.SHORT_POLLING_INTERVAL
 
-          time.sleep(interval)
+          self.Wait(interval)
         else:
           self.last_active = time.time()
 
     except KeyboardInterrupt:
       logging.info("Caught interrupt, exiting.")
+      self.Stop()
       self.__class__.thread_pool.Join()
 
+  def Wait(self, interval):
+    """Waits until notifications arrive or interval seconds have passed."""
+    if self.notification_subscription:
+      if self.notification_subscription.Wait(interval):
+        stats.STATS.IncrementCounter("worker_notification_wakeups")
+    else:
+      time.sleep(interval)
+
+  def _PollingInterval(self, subscription):
+    if subscription and self.notification_channel.cross_process:
+      return self.FALLBACK_POLLING_INTERVAL
+    return self.POLLING_INTERVAL
+
+  def RunParallel(self):
+    """Event loop for the parallel mode.
+
+    One fetcher thread per queue shard moves notifications to the work queue,
+    Worker.processor_threads threads take the most urgent flows from it.
+    """
+    threads = []
+    queue_manager = queue_manager_lib.QueueManager(token=self.token)
+    for queue in self.queues:
+      for queue_shard in queue_manager.GetAllNotificationShards(queue):
+        threads.append(
+            threading.Thread(
+                target=self._FetchLoop,
+                args=(queue, queue_shard),
+                name="WorkerFetcher %s" % queue_shard))
+
+    for i in range(config.CONFIG["Worker.processor_threads"]):
+      threads.append(
+          threading.Thread(
+              target=self._ProcessLoop, name="WorkerProcessor %d" % i))
+
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+
+    try:
+      while not self.stopped.is_set():
+        self.stopped.wait(self.POLLING_INTERVAL)
+        stats.STATS.SetGaugeValue("worker_pending_flows", len(self.work_queue))
+    except KeyboardInterrupt:
+      logging.info("Caught interrupt, exiting.")
+      self.Stop()
+      self.__class__.thread_pool.Join()
+
+  def Stop(self):
+    """Stops the threads started by RunParallel and our subscriptions."""
+    self.stopped.set()
+    self.work_queue.Stop()
+
+    if self.notification_subscription:
+      self.notification_channel.Unsubscribe(self.notification_subscription)
+      self.notification_subscription = None
+
+  def _FetchLoop(self, queue, queue_shard):
+    """Keeps the work queue filled with the flows notified on queue_shard."""
+    queue_manager = queue_manager_lib.QueueManager(token=self.token)
+    subscription = None
+    if self.notification_channel:
+      subscription = self.notification_channel.Subscribe([queue_shard])
+    interval = self._PollingInterval(subscription)
+
+    while not self.stopped.is_set():
+      queued = 0
+      if len(self.work_queue) >= self.MAX_PENDING_FLOWS:
+        # The processors are busy, there is no point in fetching more.
+        self.stopped.wait(self.SHORT_POLLING_INTERVAL)
+        continue
+
+      if master.MASTER_WATCHER.IsMaster():
+        try:
+          queued = self.FetchNotifications(queue, queue_shard, queue_manager)
+        except Exception as e:  # pylint: disable=broad-except
+          logging.exception("Error fetching notifications from %s: %s",
+                            queue_shard, e)
+
+      if not queued:
+        if subscription:
+          subscription.Wait(interval)
+        else:
+          self.stopped.wait(interval)
+
+    if subscription:
+      self.notification_channel.Unsubscribe(subscription)
+
+  def _ProcessLoop(self):
+    """Processes flows from the work queue until the worker is stopped."""
+    queue_manager = queue_manager_lib.QueueManager(token=self.token)
+    while not self.stopped.is_set():
+      notification = self.work_queue.Get()
+      if notification is not None:
+        self._ProcessWorkItem(notification, queue_manager)
+
+  def _ProcessWorkItem(self, notification, queue_manager):
+    try:
+      self._ProcessMessages(notification, queue_manager)
+    finally:
+      self.work_queue.Done(notification.session_id)
+
+  def FetchNotifications(self, queue, queue_shard, queue_manager):
+    """Moves the notifications of a queue shard to the work queue.
+
+    Args:
+      queue: The queue the shard belongs to.
+      queue_shard: The queue shard to read.
+      queue_manager: The QueueManager to use.
+
+    Returns:
+      The number of flows added to the work queue.
+    """
+    queue_manager.FreezeTimestamp()
+    try:
+      fetch_messages_start = time.time()
+      notifications_by_priority = (
+          queue_manager.GetNotificationsByPriorityForShard(queue, queue_shard))
+      stats.STATS.RecordEvent("worker_time_to_retrieve_notifications",
+                              time.time() - fetch_messages_start)
+
+      stuck_flows = notifications_by_priority.pop(queue_manager.STUCK_PRIORITY,
+                                                  [])
+      if stuck_flows:
+        self.ProcessStuckFlows(stuck_flows, queue_manager)
+
+      queued = 0
+      for notifications in notifications_by_priority.itervalues():
+        for notification in notifications:
+          if notification.session_id in self.lock_backoff:
+            continue
+          if self.work_queue.Put(notification):
+            queued += 1
+
+      return queued
+    finally:
+      queue_manager.UnfreezeTimestamp()
+
+  def ProcessWorkQueue(self):
+    """Processes all flows in the work queue in the calling thread.
+
+    Returns:
+      The number of processed flows.
+    """
+    processed = 0
+    queue_manager = queue_manager_lib.QueueManager(token=self.token)
+    while True:
+      notification = self.work_queue.Get(timeout=0)
+      if notification is None:
+        return processed
+
+      self._ProcessWorkItem(notification, queue_manager)
+      processed += 1
+
   def RunOnce(self):
     """Processes one set of messages from Task Scheduler.
 
@@ -321,6 +683,7 @@ class GRRWorker(object):
 
       # Everything went well -> session can be run again.
       self.queued_flows.ExpireObject(session_id)
+      self.lock_backoff.Succeeded(session_id)
 
     except aff4.LockError:
       # Another worker is dealing with this flow right now, we just skip it.
@@ -331,6 +694,7 @@ class GRRWorker(object):
       # indicate we are wasting time trying to process work that has already
       # been completed by other workers.
       stats.STATS.IncrementCounter("worker_flow_lock_error")
+      self.lock_backoff.Failed(session_id)
 
     except FlowProcessingError:
       # Do nothing as we expect the error to be correctly logged and accounted
@@ -364,3 +728,5 @@ class WorkerInit(registry.InitHook):
     stats.STATS.RegisterEventMetric(
         "worker_flow_processing_time", fields=[("flow", str)])
     stats.STATS.RegisterEventMetric("worker_time_to_retrieve_notifications")
+    stats.STATS.RegisterCounterMetric("worker_notification_wakeups")
+    stats.STATS.RegisterGaugeMetric("worker_pending_flows", int)
@@ -7,10 +7,13 @@ import BaseHTTPServer
 import cgi
 import cStringIO
 import logging
+import multiprocessing
 import pdb
+import signal
 import socket
 import SocketServer
 import threading
+import time
 
 
 import ipaddr
@@ -33,6 +36,7 @@ from grr.server import front_end
 from grr.server import master
 from grr.server import server_logging
 from grr.server import server_startup
+from grr.server import shared_cache
 
 
 class GRRHTTPServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
@@ -311,6 +315,19 @@ class GRRHTTPServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             "frontend_active_count", self.active_counter, fields=["http"])
 
 
+def CreateFrontEnd(shared_caches=None):
+  """Creates the FrontEndServer as configured."""
+  return front_end.FrontEndServer(
+      certificate=config.CONFIG["Frontend.certificate"],
+      private_key=config.CONFIG["PrivateKeys.server_key"],
+      max_queue_size=config.CONFIG["Frontend.max_queue_size"],
+      message_expiry_time=config.CONFIG["Frontend.message_expiry_time"],
+      max_retransmission_time=config.CONFIG["Frontend.max_retransmission_time"],
+      pipeline_writes=config.CONFIG["Frontend.pipeline_writes"],
+      batch_drains=config.CONFIG["Frontend.batch_drains"],
+      shared_caches=shared_caches)
+
+
 class GRRHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
   """The GRR HTTP frontend server."""
 
@@ -319,20 +336,31 @@ class GRRHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
 
   address_family = socket.AF_INET6
 
-  def __init__(self, server_address, handler, frontend=None, *args, **kwargs):
+  def __init__(self,
+               server_address,
+               handler,
+               frontend=None,
+               listen_socket=None,
+               *args,
+               **kwargs):
+    """Constructor.
+
+    Args:
+      server_address: The (address, port) to listen on.
+      handler: The request handler class.
+      frontend: The FrontEndServer to use, a new one is created if not given.
+      listen_socket: If given, we accept connections on this already bound
+        socket instead of binding server_address.
+      *args: Passed to BaseHTTPServer.HTTPServer when binding.
+      **kwargs: Passed to BaseHTTPServer.HTTPServer when binding.
+    """
     stats.STATS.SetGaugeValue("frontend_max_active_count",
                               self.request_queue_size)
 
     if frontend:
       self.frontend = frontend
     else:
-      self.frontend = front_end.FrontEndServer(
-          certificate=config.CONFIG["Frontend.certificate"],
-          private_key=config.CONFIG["PrivateKeys.server_key"],
-          max_queue_size=config.CONFIG["Frontend.max_queue_size"],
-          message_expiry_time=config.CONFIG["Frontend.message_expiry_time"],
-          max_retransmission_time=config.CONFIG[
-              "Frontend.max_retransmission_time"])
+      self.frontend = CreateFrontEnd()
     self.server_cert = config.CONFIG["Frontend.certificate"]
 
     (address, _) = server_address
@@ -342,47 +370,212 @@ class GRRHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
     elif version == 6:
       self.address_family = socket.AF_INET6
 
-    logging.info("Will attempt to listen on %s", server_address)
-    BaseHTTPServer.HTTPServer.__init__(self, server_address, handler, *args,
-                                       **kwargs)
-
+    if listen_socket is None:
+      logging.info("Will attempt to listen on %s", server_address)
+      BaseHTTPServer.HTTPServer.__init__(self, server_address, handler, *args,
+                                         **kwargs)
+    else:
+      BaseHTTPServer.HTTPServer.__init__(
+          self, server_address, handler, bind_and_activate=False)
+      self.socket.close()
+      self.socket = listen_socket
+      self.server_address = listen_socket.getsockname()[:2]
+      host, self.server_port = self.server_address
+      self.server_name = socket.getfqdn(host)
+
+
+def CreateListeningSocket():
+  """Binds the frontend port for several processes to accept connections on.
+
+  Returns:
+    The listening socket.
+  """
+  address = config.CONFIG["Frontend.bind_address"]
+  if ipaddr.IPAddress(address).version == 4:
+    address_family = socket.AF_INET
+  else:
+    address_family = socket.AF_INET6
 
-def CreateServer(frontend=None):
-  """Start frontend http server."""
   max_port = config.CONFIG.Get("Frontend.port_max",
                                config.CONFIG["Frontend.bind_port"])
 
   for port in range(config.CONFIG["Frontend.bind_port"], max_port + 1):
-
-    server_address = (config.CONFIG["Frontend.bind_address"], port)
+    listen_socket = socket.socket(address_family, socket.SOCK_STREAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
-      httpd = GRRHTTPServer(
-          server_address, GRRHTTPServerHandler, frontend=frontend)
+      listen_socket.bind((address, port))
       break
     except socket.error as e:
+      listen_socket.close()
       if e.errno == socket.errno.EADDRINUSE and port < max_port:
         logging.info("Port %s in use, trying %s", port, port + 1)
       else:
         raise
 
+  listen_socket.listen(GRRHTTPServer.request_queue_size)
+  # All processes are woken up for a new connection but only one of them gets
+  # it. The others must not block in accept().
+  listen_socket.setblocking(False)
+  return listen_socket
+
+
+def CreateServer(frontend=None, listen_socket=None):
+  """Start frontend http server."""
+  if listen_socket is not None:
+    httpd = GRRHTTPServer(
+        listen_socket.getsockname()[:2],
+        GRRHTTPServerHandler,
+        frontend=frontend,
+        listen_socket=listen_socket)
+  else:
+    max_port = config.CONFIG.Get("Frontend.port_max",
+                                 config.CONFIG["Frontend.bind_port"])
+
+    for port in range(config.CONFIG["Frontend.bind_port"], max_port + 1):
+
+      server_address = (config.CONFIG["Frontend.bind_address"], port)
+      try:
+        httpd = GRRHTTPServer(
+            server_address, GRRHTTPServerHandler, frontend=frontend)
+        break
+      except socket.error as e:
+        if e.errno == socket.errno.EADDRINUSE and port < max_port:
+          logging.info("Port %s in use, trying %s", port, port + 1)
+        else:
+          raise
+
   sa = httpd.socket.getsockname()
   logging.info("Serving HTTP on %s port %d ...", sa[0], sa[1])
   return httpd
 
 
+def StartClientKeyPreload(frontend):
+  """Preloads client keys in the background while we serve requests."""
+  preload_thread = threading.Thread(
+      target=frontend.PreloadClientKeys, name="ClientKeyPreload")
+  preload_thread.daemon = True
+  preload_thread.start()
+
+
+def _Interrupt(signum, frame):
+  del signum, frame  # Unused.
+  raise KeyboardInterrupt()
+
+
+def Serve(httpd):
+  """Serves requests until interrupted, then stores the queued messages."""
+  # Frontends are stopped with SIGTERM on restarts, which is handled like an
+  # interrupt so that messages queued for writing are not lost.
+  signal.signal(signal.SIGTERM, _Interrupt)
+  try:
+    httpd.serve_forever()
+  finally:
+    message_writer = httpd.frontend.message_writer
+    if message_writer:
+      logging.info("Writing queued client messages...")
+      message_writer.Flush()
+
+
+def ServeProcess(index, listen_socket, shared_caches):
+  """Runs one process of a multi-process frontend."""
+  monitoring_port = config.CONFIG["Monitoring.http_port"]
+  if monitoring_port:
+    # Every process exports its own stats.
+    config.CONFIG.global_override["Monitoring.http_port"] = str(
+        monitoring_port + index)
+
+  server_startup.Init()
+
+  httpd = CreateServer(
+      frontend=CreateFrontEnd(shared_caches=shared_caches),
+      listen_socket=listen_socket)
+  StartClientKeyPreload(httpd.frontend)
+
+  server_startup.DropPrivileges()
+
+  try:
+    Serve(httpd)
+  except KeyboardInterrupt:
+    pass
+
+
+def RunProcesses(count):
+  """Runs count frontend processes accepting on the same socket.
+
+  The processes are started before the server is initialized, each of them
+  initializes on its own. Processes which die are restarted.
+
+  Args:
+    count: The number of frontend processes.
+  """
+  listen_socket = CreateListeningSocket()
+
+  manager = shared_cache.SharedCacheManager()
+  manager.start()
+  shared_caches = {
+      "pub_keys": manager.FastStore(max_size=50000),
+      "ciphers": manager.FastStore(max_size=50000),
+  }
+
+  processes = [None] * count
+  signal.signal(signal.SIGTERM, _Interrupt)
+  try:
+    while True:
+      for i, process in enumerate(processes):
+        if process is not None and process.is_alive():
+          continue
+
+        if process is not None:
+          logging.warning("Frontend process %d exited with %s, restarting.",
+                          i, process.exitcode)
+
+        process = multiprocessing.Process(
+            target=ServeProcess,
+            args=(i, listen_socket, shared_caches),
+            name="GRRFrontend%d" % i)
+        process.daemon = True
+        process.start()
+        processes[i] = process
+
+      time.sleep(1)
+
+  except KeyboardInterrupt:
+    print "Caught keyboard interrupt, stopping"
+
+  finally:
+    # The processes write their queued messages before they exit.
+    for process in processes:
+      if process is not None:
+        process.terminate()
+    for process in processes:
+      if process is not None:
+        process.join()
+    manager.shutdown()
+
+
 def main(argv):
   """Main."""
   del argv  # Unused.
   config.CONFIG.AddContext("HTTPServer Context")
 
+  # The processes of a multi-process frontend are started before the server
+  # is initialized, so we only parse the configuration at this point. Init()
+  # doesn't parse it again.
+  server_startup.ConfigInit()
+
+  if config.CONFIG["Frontend.processes"] > 1:
+    RunProcesses(config.CONFIG["Frontend.processes"])
+    return
+
   server_startup.Init()
 
   httpd = CreateServer()
+  StartClientKeyPreload(httpd.frontend)
 
   server_startup.DropPrivileges()
 
   try:
-    httpd.serve_forever()
+    Serve(httpd)
   except KeyboardInterrupt:
     print "Caught keyboard interrupt, stopping"
 
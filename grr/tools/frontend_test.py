@@ -86,6 +86,35 @@ class GRRHTTPServerTest(test_lib.GRRBaseTest):
     self.assertEqual(req.status_code, 200)
     self.assertTrue("BEGIN CERTIFICATE" in req.content)
 
+  def testSharedListeningSocket(self):
+    port = portpicker.PickUnusedPort()
+    ip = utils.ResolveHostnameToIP("localhost", port)
+    with test_lib.ConfigOverrider({
+        "Frontend.bind_address": ip,
+        "Frontend.bind_port": port
+    }):
+      listen_socket = frontend.CreateListeningSocket()
+
+    servers = []
+    for _ in range(2):
+      httpd = frontend.CreateServer(
+          frontend=self.httpd.frontend, listen_socket=listen_socket)
+      thread = threading.Thread(target=httpd.serve_forever)
+      thread.daemon = True
+      thread.start()
+      servers.append(httpd)
+
+    try:
+      base_url = self.base_url.replace(":%d/" % self.httpd.server_port,
+                                       ":%d/" % port)
+      for _ in range(10):
+        req = requests.get(base_url + "server.pem")
+        self.assertEqual(req.status_code, 200)
+    finally:
+      for httpd in servers:
+        httpd.shutdown()
+      listen_socket.close()
+
   def _UploadFile(self, args):
     with test_lib.ConfigOverrider({"Client.server_urls": [self.base_url]}):
       client = comms.GRRHTTPClient(
@@ -13,13 +13,15 @@ from grr.lib import server_plugins
 
 from grr.gui import admin_ui
 from grr.lib import flags
+from grr.server import notification_broker
 from grr.server.data_server import data_server
 from grr.tools import frontend
 from grr.worker import worker
 
 flags.DEFINE_string(
     "component", None,
-    "Component to start: [frontend|admin_ui|worker|dataserver].")
+    "Component to start: "
+    "[frontend|admin_ui|worker|dataserver|notification_broker].")
 
 
 def main(argv):
@@ -40,6 +42,10 @@ def main(argv):
   elif flags.FLAGS.component.startswith("admin_ui"):
     admin_ui.main([argv])
 
+  # Start the broker sharing queue notifications between processes.
+  elif flags.FLAGS.component == "notification_broker":
+    notification_broker.main([argv])
+
   # Start as the data server master. There can only be one master
   elif flags.FLAGS.component == "dataserver_master":
     flags.FLAGS.master = True
@@ -342,6 +342,71 @@ class GrrWorkerTest(flow_test_lib.FlowTestsBaseclass):
         flow_obj.context.state == rdf_flows.FlowContext.State.TERMINATED)
     self.assertEqual(flow_obj.context.current_state, "End")
 
+  def testParallelProcessing(self):
+    flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+    session_id_1 = flow_obj.session_id
+    flow_obj.Close()
+
+    flow_obj = self.FlowSetup("WorkerSendingTestFlow2")
+    session_id_2 = flow_obj.session_id
+    flow_obj.Close()
+
+    self.SendResponse(session_id_1, "Hello1")
+    self.SendResponse(session_id_2, "Hello2")
+    self.SendResponse(session_id_1, "Hello1")
+    self.SendResponse(session_id_2, "Hello2")
+
+    worker_obj = worker.GRRWorker(token=self.token, parallel=True)
+
+    manager = queue_manager.QueueManager(token=self.token)
+    queued = 0
+    for queue in worker_obj.queues:
+      for queue_shard in manager.GetAllNotificationShards(queue):
+        queued += worker_obj.FetchNotifications(queue, queue_shard, manager)
+
+    # Notifications for the same flow are merged.
+    self.assertEqual(queued, 2)
+    self.assertEqual(worker_obj.ProcessWorkQueue(), 2)
+    worker_obj.thread_pool.Join()
+
+    RESULTS.sort()
+    self.assertEqual(RESULTS, ["Hello1", "Hello2"])
+
+    flow_obj = aff4.FACTORY.Open(session_id_2, token=self.token)
+    self.assertEqual(flow_obj.context.state,
+                     rdf_flows.FlowContext.State.TERMINATED)
+
+  def testParallelProcessingBacksOffLockedFlows(self):
+    flow_obj = self.FlowSetup("WorkerSendingTestFlow")
+    session_id = flow_obj.session_id
+    flow_obj.Close()
+
+    self.SendResponse(session_id, "Hello1")
+    worker_obj = worker.GRRWorker(token=self.token, parallel=True)
+    manager = queue_manager.QueueManager(token=self.token)
+
+    def FetchAll():
+      queued = 0
+      for queue_shard in manager.GetAllNotificationShards(queues.FLOWS):
+        queued += worker_obj.FetchNotifications(queues.FLOWS, queue_shard,
+                                                manager)
+      return queued
+
+    with aff4.FACTORY.OpenWithLock(session_id, token=self.token):
+      self.assertEqual(FetchAll(), 1)
+      worker_obj.ProcessWorkQueue()
+
+    self.assertIn(session_id, worker_obj.lock_backoff)
+    self.assertEqual(FetchAll(), 0)
+
+    with test_lib.FakeTime(time.time() + worker_obj.lock_backoff.max_delay):
+      self.assertEqual(FetchAll(), 1)
+      worker_obj.ProcessWorkQueue()
+      worker_obj.thread_pool.Join()
+
+    self.assertNotIn(session_id, worker_obj.lock_backoff)
+    self.assertEqual(RESULTS, ["Hello1"])
+
   def testNoNotificationRescheduling(self):
     """Test that no notifications are rescheduled when a flow raises."""
 
@@ -1118,6 +1183,92 @@ class GrrWorkerTest(flow_test_lib.FlowTestsBaseclass):
     self.assertIn("Out of CPU quota", errors[1].backtrace)
 
 
+class FlowWorkQueueTest(test_lib.GRRBaseTest):
+  """Tests the FlowWorkQueue."""
+
+  def _Notification(self, name, timestamp, priority=None):
+    notification = rdf_flows.GrrNotification(
+        session_id=rdfvalue.SessionID(flow_name=name), timestamp=timestamp)
+    if priority is not None:
+      notification.priority = priority
+    return notification
+
+  def testReturnsMostUrgentFirst(self):
+    work_queue = worker.FlowWorkQueue()
+    priority = rdf_flows.GrrMessage.Priority
+    work_queue.Put(self._Notification("low", 1, priority.LOW_PRIORITY))
+    work_queue.Put(self._Notification("medium", 2))
+    work_queue.Put(self._Notification("high", 3, priority.HIGH_PRIORITY))
+
+    names = [work_queue.Get(timeout=0).session_id.FlowName() for _ in range(3)]
+    self.assertEqual(names, ["high", "medium", "low"])
+    self.assertIsNone(work_queue.Get(timeout=0))
+
+  def testMergesNotificationsForTheSameSession(self):
+    work_queue = worker.FlowWorkQueue()
+    self.assertTrue(work_queue.Put(self._Notification("flow", 1)))
+    self.assertFalse(work_queue.Put(self._Notification("flow", 3)))
+    self.assertFalse(work_queue.Put(self._Notification("flow", 2)))
+    self.assertEqual(len(work_queue), 1)
+
+    notification = work_queue.Get(timeout=0)
+    self.assertEqual(notification.timestamp, 3)
+    self.assertIsNone(work_queue.Get(timeout=0))
+
+  def testDefersNotificationsForSessionsInFlight(self):
+    work_queue = worker.FlowWorkQueue()
+    work_queue.Put(self._Notification("flow", 1))
+    notification = work_queue.Get(timeout=0)
+
+    # The running flow has seen this one already.
+    self.assertFalse(work_queue.Put(self._Notification("flow", 1)))
+    self.assertFalse(work_queue.Put(self._Notification("flow", 2)))
+    self.assertIsNone(work_queue.Get(timeout=0))
+
+    work_queue.Done(notification.session_id)
+    notification = work_queue.Get(timeout=0)
+    self.assertEqual(notification.timestamp, 2)
+
+    work_queue.Done(notification.session_id)
+    self.assertIsNone(work_queue.Get(timeout=0))
+
+  def testStopWakesUpGet(self):
+    work_queue = worker.FlowWorkQueue()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(work_queue.Get()))
+    thread.start()
+    work_queue.Stop()
+    thread.join()
+    self.assertEqual(results, [None])
+
+
+class LockBackoffTest(test_lib.GRRBaseTest):
+  """Tests the LockBackoff."""
+
+  def testDelayGrowsWithFailures(self):
+    backoff = worker.LockBackoff(initial_delay=1, max_delay=4)
+    with test_lib.FakeTime(100):
+      backoff.Failed("a")
+      self.assertIn("a", backoff)
+
+    with test_lib.FakeTime(101):
+      self.assertNotIn("a", backoff)
+      backoff.Failed("a")
+
+    with test_lib.FakeTime(102.5):
+      self.assertIn("a", backoff)
+      backoff.Succeeded("a")
+      self.assertNotIn("a", backoff)
+
+  def testSizeIsLimited(self):
+    backoff = worker.LockBackoff(max_size=10)
+    for i in range(100):
+      backoff.Failed(i)
+      self.assertLessEqual(len(backoff), 10)
+
+    self.assertIn(99, backoff)
+
+
 def main(argv):
   test_lib.main(argv)
 